@@ -0,0 +1,111 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional
+
+# Registered benchmarks in definition order
+BENCHMARKS: List[Dict[str, Any]] = []
+
+
+def benchmark(name: str, group: str, sized: bool = False, repeat: int = 5, number: int = 1):
+    """
+    Register an async benchmark function.
+
+    The function receives a context dict (and the table size for sized benchmarks)
+    and returns the number of items processed per call, which is used to report
+    per-item time. `number` calls are timed together and the measurement is
+    repeated `repeat` times.
+    """
+    def decorator(func: Callable):
+        BENCHMARKS.append({
+            "name": name,
+            "group": group,
+            "sized": sized,
+            "repeat": repeat,
+            "number": number,
+            "func": func,
+        })
+        return func
+    return decorator
+
+
+async def measure(func: Callable, args: tuple, repeat: int, number: int) -> Dict[str, Any]:
+    """Time an async callable, with one untimed warm-up call"""
+    items = await func(*args) or 1
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await func(*args)
+        timings.append((time.perf_counter() - start) / number)
+
+    median = statistics.median(timings)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "items_per_call": items,
+        "min_ms": 1000 * min(timings),
+        "median_ms": 1000 * median,
+        "mean_ms": 1000 * statistics.mean(timings),
+        "stdev_ms": 1000 * statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "per_item_us": 1e6 * median / items,
+        "items_per_second": items / median if median > 0 else None,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Machine and code version the results were produced on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        commit = None
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(results: Dict[str, Any], results_dir: str) -> str:
+    """Write results as JSON named after the time and commit, returning the path"""
+    os.makedirs(results_dir, exist_ok=True)
+    env = results["environment"]
+    stamp = datetime.fromisoformat(env["timestamp"]).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(results_dir, f"{stamp}-{env['git_commit'] or 'nogit'}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare median times of benchmarks present in both runs.
+    A benchmark regresses when its median grew by more than `threshold` (0.1 = 10%).
+    """
+    rows = []
+    for key, result in current["benchmarks"].items():
+        previous = baseline["benchmarks"].get(key)
+        if previous is None or "median_ms" not in previous or "median_ms" not in result:
+            continue
+
+        change = (result["median_ms"] - previous["median_ms"]) / previous["median_ms"] if previous["median_ms"] else 0.0
+        rows.append({
+            "benchmark": key,
+            "baseline_ms": previous["median_ms"],
+            "current_ms": result["median_ms"],
+            "change": change,
+            "regression": change > threshold,
+        })
+    return rows
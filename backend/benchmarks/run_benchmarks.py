@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the backend hot paths
+Results are written as JSON to benchmarks/results/ and can be compared with an
+earlier run to catch regressions before deploying
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+# Allow running as a script from the backend directory or from benchmarks/
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.harness import BENCHMARKS, benchmark, measure, environment, save_results, compare_results
+
+PROFILES = {
+    "quick": [10_000],
+    "full": [10_000, 1_000_000, 10_000_000],
+}
+
+SEED_CHUNK = 20_000
+
+
+# Ingestion
+
+@benchmark("store_log_single", group="ingest", repeat=5, number=20)
+async def bench_store_log_single(ctx):
+    async with ctx["session"]() as db:
+        await ctx["collector"].store_log(db, next(ctx["fresh_logs"]))
+    return 1
+
+async def _store_logs_batch(ctx, encrypt: bool):
+    codec = ctx["storage_codec"]
+    previous, codec.encrypt = codec.encrypt, encrypt
+    try:
+        batch = [next(ctx["fresh_logs"]) for _ in range(500)]
+        async with ctx["session"]() as db:
+            await ctx["collector"].store_logs(db, batch)
+        return len(batch)
+    finally:
+        codec.encrypt = previous
+
+@benchmark("store_logs_batch_500", group="ingest", repeat=5)
+async def bench_store_logs_batch(ctx):
+    return await _store_logs_batch(ctx, encrypt=False)
+
+@benchmark("store_logs_batch_500_encrypted", group="ingest", repeat=5)
+async def bench_store_logs_batch_encrypted(ctx):
+    return await _store_logs_batch(ctx, encrypt=True)
+
+
+# Field encryption (Fernet with the database key)
+
+@benchmark("encrypt_logs_1000", group="codec", repeat=5)
+async def bench_encrypt_logs(ctx):
+    await ctx["encrypting_codec"].encode_logs(ctx["sample_logs"][:1000])
+    return 2000
+
+@benchmark("decrypt_1000", group="codec", repeat=5)
+async def bench_decrypt(ctx):
+    codec = ctx["uncached_codec"]
+    for token in ctx["sample_tokens"]:
+        codec.decode(token)
+    return len(ctx["sample_tokens"])
+
+@benchmark("decrypt_1000_cached", group="codec", repeat=7)
+async def bench_decrypt_cached(ctx):
+    codec = ctx["encrypting_codec"]
+    for token in ctx["sample_tokens"]:
+        codec.decode(token)
+    return len(ctx["sample_tokens"])
+
+
+# Network collector (receive-side parsing of queued frames)
+
+@benchmark("parse_syslog_5000", group="collector", repeat=5)
+async def bench_parse_syslog(ctx):
+    return len(ctx["network_collector"].parse_batch(ctx["syslog_frames"]))
+
+@benchmark("parse_json_lines_5000", group="collector", repeat=5)
+async def bench_parse_json_lines(ctx):
+    return len(ctx["network_collector"].parse_batch(ctx["json_line_frames"]))
+
+
+# Blocklist (lookups against a million blocked /24s)
+
+@benchmark("contains_10000", group="blocklist", repeat=7)
+async def bench_blocklist_contains(ctx):
+    contains = ctx["blocklist"].contains
+    for ip in ctx["blocklist_ips"]:
+        contains(ip)
+    return len(ctx["blocklist_ips"])
+
+@benchmark("screen_5000", group="blocklist", repeat=7)
+async def bench_blocklist_screen(ctx):
+    ctx["blocklist"].screen(ctx["sample_logs"])
+    return len(ctx["sample_logs"])
+
+@benchmark("route_10000", group="playbooks", repeat=7)
+async def bench_playbooks_route(ctx):
+    route = ctx["playbooks"].route
+    for threat in ctx["routing_threats"]:
+        route(threat)
+    return len(ctx["routing_threats"])
+
+
+# Detection
+
+@benchmark("extract_features_100", group="detector", repeat=7, number=10)
+async def bench_extract_features_100(ctx):
+    ctx["detector"]._extract_features(ctx["sample_logs"][:100])
+    return 100
+
+@benchmark("extract_features_1000", group="detector", repeat=7)
+async def bench_extract_features_1000(ctx):
+    ctx["detector"]._extract_features(ctx["sample_logs"][:1000])
+    return 1000
+
+@benchmark("event_buffer_recent_1000", group="detector", repeat=7)
+async def bench_event_buffer_recent(ctx):
+    logs, features = ctx["event_buffer"].recent(1000)
+    return len(logs)
+
+@benchmark("train_model_100", group="detector", repeat=5)
+async def bench_train_model(ctx):
+    ctx["detector"]._train_model(ctx["sample_features"])
+    return len(ctx["sample_features"])
+
+@benchmark("detect_anomalies_100", group="detector", repeat=5)
+async def bench_detect_anomalies(ctx):
+    await ctx["detector"].detect_anomalies(ctx["sample_logs"][:100])
+    return 100
+
+
+# Serialization (what FastAPI does for response_model=List[...])
+
+@benchmark("serialize_logs_500", group="serialization", repeat=7, number=5)
+async def bench_serialize_logs(ctx):
+    adapter = ctx["log_adapter"]
+    adapter.dump_json(adapter.validate_python(ctx["sample_logs"][:500]))
+    return 500
+
+@benchmark("serialize_threats_500", group="serialization", repeat=7, number=5)
+async def bench_serialize_threats(ctx):
+    adapter = ctx["threat_adapter"]
+    adapter.dump_json(adapter.validate_python(ctx["sample_threats"][:500]))
+    return 500
+
+
+@benchmark("serialize_log_rows_500_lean", group="serialization", repeat=7, number=5)
+async def bench_serialize_log_rows(ctx):
+    ctx["rows_to_json"](ctx["log_fields"], ctx["sample_log_rows"][:500])
+    return 500
+
+@benchmark("serialize_threat_rows_500_lean", group="serialization", repeat=7, number=5)
+async def bench_serialize_threat_rows(ctx):
+    ctx["rows_to_json"](ctx["threat_fields"], ctx["sample_threat_rows"][:500])
+    return 500
+
+
+# Queries at each table size
+
+@benchmark("get_logs_latest_50", group="query", sized=True, repeat=7)
+async def bench_get_logs_latest(ctx, size):
+    async with ctx["session"]() as db:
+        return len(await ctx["collector"].get_logs(db, limit=50))
+
+@benchmark("get_logs_filtered_500", group="query", sized=True, repeat=5)
+async def bench_get_logs_filtered(ctx, size):
+    async with ctx["session"]() as db:
+        return len(await ctx["collector"].get_logs(db, limit=500, source="Windows", level="error"))
+
+@benchmark("get_threats_latest_50", group="query", sized=True, repeat=7)
+async def bench_get_threats_latest(ctx, size):
+    async with ctx["session"]() as db:
+        return len(await ctx["detector"].get_threats(db, limit=50))
+
+@benchmark("get_threats_filtered_500", group="query", sized=True, repeat=5)
+async def bench_get_threats_filtered(ctx, size):
+    async with ctx["session"]() as db:
+        return len(await ctx["detector"].get_threats(db, limit=500, severity="high", status="active"))
+
+# Full 500-row page as the API returns it: ORM rows -> models -> response_model -> JSON
+# versus column tuples -> JSON bytes (items_per_second is rows/sec)
+
+@benchmark("logs_page_500_models", group="query", sized=True, repeat=5)
+async def bench_logs_page_models(ctx, size):
+    adapter = ctx["log_adapter"]
+    async with ctx["session"]() as db:
+        logs = await ctx["collector"].get_logs(db, limit=500)
+    adapter.dump_json(adapter.validate_python(logs))
+    return len(logs)
+
+@benchmark("logs_page_500_lean", group="query", sized=True, repeat=5)
+async def bench_logs_page_lean(ctx, size):
+    async with ctx["session"]() as db:
+        body = await ctx["collector"].get_logs_json(db, limit=500)
+    return len(ctx["loads"](body))
+
+@benchmark("threats_page_500_models", group="query", sized=True, repeat=5)
+async def bench_threats_page_models(ctx, size):
+    adapter = ctx["threat_adapter"]
+    async with ctx["session"]() as db:
+        threats = await ctx["detector"].get_threats(db, limit=500)
+    adapter.dump_json(adapter.validate_python(threats))
+    return len(threats)
+
+@benchmark("threats_page_500_lean", group="query", sized=True, repeat=5)
+async def bench_threats_page_lean(ctx, size):
+    async with ctx["session"]() as db:
+        body = await ctx["detector"].get_threats_json(db, limit=500)
+    return len(ctx["loads"](body))
+
+@benchmark("threat_detail", group="query", sized=True, repeat=7, number=20)
+async def bench_threat_detail(ctx, size):
+    await ctx["threat_links"].threat_detail(ctx["pivot_threats"][-1]["id"])
+    return 1
+
+@benchmark("threats_for_log", group="query", sized=True, repeat=7, number=20)
+async def bench_threats_for_log(ctx, size):
+    return len(await ctx["threat_links"].threats_for_log(ctx["pivot_threats"][-1]["related_logs"][0]))
+
+@benchmark("threats_for_indicator_100", group="query", sized=True, repeat=5)
+async def bench_threats_for_indicator(ctx, size):
+    return len(await ctx["threat_links"].threats_for_indicator("Level", "error", limit=100))
+
+@benchmark("get_system_stats", group="query", sized=True, repeat=3)
+async def bench_get_system_stats(ctx, size):
+    async with ctx["session"]() as db:
+        await ctx["collector"].get_system_stats(db)
+    return 1
+
+
+def fresh_log_stream(collector):
+    """Endless supply of new simulated logs (new ids) for the ingest benchmarks"""
+    rng = random.Random(7)
+    while True:
+        yield from collector.simulate_logs(1000, rng=rng)
+
+async def seed_tables(ctx, current: int, target: int):
+    """Grow the logs and threats tables to `target` rows with bulk inserts"""
+    from sqlalchemy import insert
+    from models.database import engine
+    from models.models import LogEntryModel, ThreatModel
+    from services.dictionary import dictionary
+    from services.threat_links import threat_links
+
+    rng = random.Random(current)
+    pool = ctx["sample_logs"]
+    await dictionary.ensure_logs(pool)
+    severities = ["low", "medium", "high", "critical"]
+    statuses = ["active", "investigating", "contained", "resolved"]
+    base = datetime.now() - timedelta(days=30)
+    started = time.perf_counter()
+
+    for offset in range(current, target, SEED_CHUNK):
+        count = min(SEED_CHUNK, target - offset)
+        logs, threats = [], []
+        for i in range(count):
+            log = pool[(offset + i) % len(pool)]
+            log_id = str(uuid.uuid4())
+            timestamp = base + timedelta(seconds=rng.randint(0, 30 * 86400))
+            logs.append({
+                "id": log_id, "timestamp": timestamp, "source": log.source, "level": log.level,
+                "message": log.message, "details": log.details, "encrypted": False,
+            })
+            threats.append({
+                "id": str(uuid.uuid4()), "title": f"Anomaly detected in {log.source}",
+                "description": f"Unusual activity detected: {log.message}", "timestamp": timestamp,
+                "severity": rng.choice(severities), "status": rng.choice(statuses), "source": log.source,
+                "type": "anomaly", "indicators": [f"Source: {log.source}", f"Level: {log.level}"],
+                "related_logs": [log_id], "user": (log.details or {}).get("user"),
+                "anomaly_score": rng.random(), "links_migrated": True,
+            })
+
+        async with engine.begin() as conn:
+            await conn.execute(insert(LogEntryModel.__table__), logs)
+            await conn.execute(insert(ThreatModel.__table__), threats)
+            await threat_links.write(conn, threats)
+        ctx["pivot_threats"].append(threats[-1])
+
+    print(f"  seeded {target - current} rows per table in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+async def run_suite(args, sizes: List[int]) -> dict:
+    from pydantic import TypeAdapter
+    from models.database import init_db, SessionLocal
+    from models.schemas import LogEntry, Threat
+    from services.anomaly_detector import AnomalyDetector, THREAT_FIELDS
+    from services.log_collector import LogCollector, LOG_FIELDS
+    from services.serialization import rows_to_json, loads
+    from services.event_buffer import EventBuffer
+    from services.storage_codec import StorageCodec, storage_codec
+    from services.network_collector import NetworkCollector
+    from services.blocklist import Blocklist, _RangeIndex
+    from services.playbooks import PlaybookEngine
+    from services.threat_links import threat_links
+
+    await init_db()
+
+    collector = LogCollector()
+    detector = AnomalyDetector()
+    sample_logs = collector.simulate_logs(5000, rng=random.Random(42))
+    sample_threats = [
+        Threat(
+            title=f"Anomaly detected in {log.source}", description=f"Unusual activity detected: {log.message}",
+            timestamp=log.timestamp, severity="medium", source=log.source, type="anomaly",
+            indicators=detector._generate_indicators(log), related_logs=[log.id], anomaly_score=0.8,
+            user=log.details.get("user")
+        )
+        for log in sample_logs[:500]
+    ]
+
+    event_buffer = EventBuffer(capacity=len(sample_logs))
+    event_buffer.extend(sample_logs)
+
+    encrypting_codec = StorageCodec(algorithm="off", encrypt=True, cache_size=10000)
+
+    # "drop" mode so screening does not tag the shared sample logs
+    blocklist = Blocklist(mode="drop")
+    block_rng = random.Random(7)
+    blocklist._main[4] = _RangeIndex.build(
+        4, ((start, start + 255, float("inf")) for start in sorted(block_rng.getrandbits(24) << 8 for _ in range(1_000_000)))
+    )
+
+    # The shipped playbooks, routing threats of every type, severity and score band
+    route_rng = random.Random(11)
+    routing_threats = [
+        threat.model_copy(update={
+            "type": route_rng.choice(["anomaly", "brute force", "malware", "unauthorized access"]),
+            "severity": route_rng.choice(["low", "medium", "high", "critical"]),
+            "anomaly_score": route_rng.random(),
+        })
+        for threat in sample_threats for _ in range(20)
+    ]
+
+    ctx = {
+        "session": SessionLocal,
+        "event_buffer": event_buffer,
+        "collector": collector,
+        "detector": detector,
+        "sample_logs": sample_logs,
+        "sample_features": detector._extract_features(sample_logs[:100]),
+        "sample_threats": sample_threats,
+        "log_adapter": TypeAdapter(List[LogEntry]),
+        "threat_adapter": TypeAdapter(List[Threat]),
+        "rows_to_json": rows_to_json,
+        "loads": loads,
+        "log_fields": LOG_FIELDS,
+        "threat_fields": THREAT_FIELDS,
+        "sample_log_rows": [tuple(getattr(log, f) for f in LOG_FIELDS) for log in sample_logs[:500]],
+        "sample_threat_rows": [tuple(getattr(t, f) for f in THREAT_FIELDS) for t in sample_threats],
+        "fresh_logs": fresh_log_stream(collector),
+        "storage_codec": storage_codec,
+        "encrypting_codec": encrypting_codec,
+        "uncached_codec": StorageCodec(algorithm="off", encrypt=True, cache_size=0),
+        "sample_tokens": [encrypting_codec.encode(log.message) for log in sample_logs[:1000]],
+        "blocklist": blocklist,
+        "playbooks": PlaybookEngine(),
+        "threat_links": threat_links,
+        # One seeded threat per chunk, for the pivot queries
+        "pivot_threats": [],
+        "routing_threats": routing_threats,
+        "blocklist_ips": [".".join(str(block_rng.randint(0, 255)) for _ in range(4)) for _ in range(10000)],
+        "network_collector": NetworkCollector(),
+        # Alternating RFC 3164 and RFC 5424 lines carrying the sample messages
+        "syslog_frames": [
+            ("syslog_udp", (
+                f"<{8 + i % 8}>{log.timestamp:%b %d %H:%M:%S} host{i % 20} {log.source}[{i}]: {log.message}"
+                if i % 2 else
+                f"<{8 + i % 8}>1 {log.timestamp.isoformat()}Z host{i % 20} {log.source} {i} - - {log.message}"
+            ).encode(), "127.0.0.1")
+            for i, log in enumerate(sample_logs)
+        ],
+        "json_line_frames": [("jsonl_tcp", log.model_dump_json().encode(), None) for log in sample_logs],
+    }
+
+    selected = [b for b in BENCHMARKS if not args.only or any(o in f"{b['group']}.{b['name']}" for o in args.only)]
+    results = {}
+
+    async def run(bench, key, *extra):
+        print(f"{key} ...", file=sys.stderr)
+        try:
+            results[key] = await measure(bench["func"], (ctx, *extra), args.repeat or bench["repeat"], bench["number"])
+            print(f"  median {results[key]['median_ms']:.3f} ms", file=sys.stderr)
+        except Exception as e:
+            results[key] = {"error": str(e)}
+            print(f"  failed: {str(e)}", file=sys.stderr)
+
+    for bench in [b for b in selected if not b["sized"]]:
+        await run(bench, f"{bench['group']}.{bench['name']}")
+
+    sized = [b for b in selected if b["sized"]]
+    seeded = 0
+    for size in sizes if sized else []:
+        print(f"Seeding tables to {size} rows", file=sys.stderr)
+        await seed_tables(ctx, seeded, size)
+        seeded = size
+        for bench in sized:
+            await run(bench, f"{bench['group']}.{bench['name']}[{size}]", size)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Run backend micro-benchmarks")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick",
+                        help="Table sizes for query benchmarks: quick=10K, full=10K/1M/10M (default: quick)")
+    parser.add_argument("--sizes", type=str, help="Comma-separated table sizes, overrides --profile")
+    parser.add_argument("--only", type=str, action="append",
+                        help="Run only benchmarks whose 'group.name' contains this text (repeatable)")
+    parser.add_argument("--repeat", type=int, help="Override the number of timed repetitions")
+    parser.add_argument("--results-dir", type=str, default=str(BACKEND_DIR / "benchmarks" / "results"),
+                        help="Directory for JSON results (default: benchmarks/results)")
+    parser.add_argument("--compare", type=str, metavar="BASELINE_JSON", help="Compare with an earlier results file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Median slowdown counted as a regression (default: 0.10 = 10%%)")
+    parser.add_argument("--log-level", type=str, default="ERROR", help="Application log level during the run")
+
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else PROFILES[args.profile]
+
+    # Benchmarks run against a throwaway database; point the app at it before importing models
+    workdir = tempfile.mkdtemp(prefix="sentinel-bench-")
+    os.environ["SENTINEL_DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/bench.db"
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    try:
+        benchmarks = asyncio.run(run_suite(args, sorted(sizes)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {"environment": environment(), "sizes": sorted(sizes), "benchmarks": benchmarks}
+    path = save_results(results, args.results_dir)
+    print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare_results(baseline, results, args.threshold)
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"{row['benchmark']:<45} {row['baseline_ms']:>10.3f} -> {row['current_ms']:>10.3f} ms "
+                  f"({100 * row['change']:+.1f}%) {flag}")
+        if any(row["regression"] for row in rows):
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,24 +3,46 @@ import os
 import uvicorn
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 import asyncio
+import time
 import uuid
 from loguru import logger
 
-from models.database import init_db, get_db, engine
+from models.database import init_db, get_db, engine, SessionLocal
 from models.schemas import LogEntry, Threat, ActionRequest, SystemStats
 from services.log_collector import LogCollector
 from services.anomaly_detector import AnomalyDetector
 from services.response_manager import ResponseManager
 from services.credentials_manager import credentials_manager
+from services.cluster import cluster_coordinator, INGEST_ROLE, LEADER_ROLE
+from services.metrics import metrics, monitor_event_loop, HTTP_REQUEST_DURATION
+from services.profiler import slow_callback_detector, install_signal_handler
+from services.logging_pipeline import configure_logging, shutdown_logging
+from services.event_buffer import event_buffer
+from services.template_miner import template_miner
+from services.threat_enricher import threat_enricher
+from services.network_collector import network_collector
+from services.azure_collector import azure_collector
+from services.blocklist import blocklist
+from services.dictionary import dictionary
+from services.playbooks import playbook_engine
+from services.threat_links import threat_links
+from services.serialization import JSONBytesResponse
 from routes.credentials import router as credentials_router
+from routes.replay import router as replay_router
+from routes.admin import router as admin_router
+from routes.collectors import router as collectors_router
+from routes.blocklist import router as blocklist_router
+from routes.playbooks import router as playbooks_router
+from routes.threats import router as threats_router
+from routes.reports import router as reports_router
 
-# Configure logger
-logger.add("logs/sentinel.log", rotation="500 MB", retention="10 days", level="INFO")
+# Configure logger (bounded buffer, rate limited and written in batches off the event loop)
+configure_logging("logs/sentinel.log")
 
 app = FastAPI(
     title="SENTINEL AGS - Azure Security System API",
@@ -37,8 +59,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record per-route request latency (route templates keep label cardinality bounded)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not metrics.enabled:
+        return await call_next(request)
+    
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status
+        )
+
 # Include routers
 app.include_router(credentials_router)
+app.include_router(replay_router)
+app.include_router(admin_router)
+app.include_router(collectors_router)
+app.include_router(blocklist_router)
+app.include_router(playbooks_router)
+app.include_router(threats_router)
+app.include_router(reports_router)
 
 # Initialize services
 log_collector = LogCollector()
@@ -51,13 +101,61 @@ async def startup_event():
     await init_db()
     logger.info("Database initialized")
     
-    # Check credentials on startup
+    # Load the newest logs into the in-memory event buffer
+    async with SessionLocal() as db:
+        await event_buffer.warm(db)
+    
+    # Check credentials on startup, then follow changes to the credentials directory
+    credentials_manager.start()
     cred_status = credentials_manager.get_credentials_status()
     logger.info(f"Credentials status: Azure present: {cred_status['azure']['present']}, Gemini present: {cred_status['gemini']['present']}")
     
+    # Blocked networks, checked for every ingested event
+    await blocklist.rebuild()
+    
+    # Response playbooks are loaded at import; follow changes to their files
+    playbook_engine.start()
+    
+    # Register with the other workers before the first cycle so roles are settled,
+    # then keep the registration and leases renewed independently of the cycle
+    await cluster_coordinator.heartbeat()
+    cluster_coordinator.start()
+    
+    # Copy the links of threats stored before the link tables existed (leader only, in batches)
+    threat_links.start()
+    
+    # Syslog and JSON-lines listeners (only when their ports are configured)
+    await network_collector.start(log_collector)
+    
+    # Resume collectors from their committed checkpoints and follow SENTINEL_TAIL_PATHS
+    async with SessionLocal() as db:
+        await log_collector.load_checkpoints(db)
+    if log_collector.file_tailer.enabled:
+        asyncio.create_task(log_collector.tail_files())
+    
     # Start background task for log collection and analysis
     asyncio.create_task(background_analysis_task())
     logger.info("Background analysis task started")
+    
+    # Sample event loop lag for /metrics
+    asyncio.create_task(monitor_event_loop())
+    
+    # Diagnostics: SIGUSR2 writes a profile to logs/, SENTINEL_SLOW_CALLBACK_MS logs blocking callbacks
+    install_signal_handler()
+    slow_callback_ms = float(os.environ.get("SENTINEL_SLOW_CALLBACK_MS", "0"))
+    if slow_callback_ms > 0:
+        slow_callback_detector.install(slow_callback_ms)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await network_collector.stop()
+    await threat_enricher.stop()
+    await credentials_manager.stop()
+    await playbook_engine.stop()
+    await threat_links.stop()
+    await cluster_coordinator.shutdown()
+    await template_miner.flush()
+    shutdown_logging()
 
 # Background task that runs periodically
 async def background_analysis_task():
@@ -65,35 +163,50 @@ async def background_analysis_task():
         try:
             logger.info("Running background analysis task")
             
-            # Check if Azure credentials are available
-            azure_creds = credentials_manager.load_azure_credentials()
+            # Pick up blocks added by other workers and drop expired ones
+            await blocklist.refresh()
+            
+            # Pick up dictionary codes created by other workers
+            await dictionary.refresh()
             
-            if azure_creds:
-                # TODO: Collect real Azure logs using credentials
-                logger.info("Azure credentials found, would collect real logs here")
-            else:
-                # Generate simulated logs for testing
-                sim_logs = await log_collector.generate_simulated_logs(count=5)
-                logger.info(f"Generated {len(sim_logs)} simulated logs")
+            # Only the worker holding the ingest role collects logs
+            if cluster_coordinator.holds(INGEST_ROLE):
+                # Check if Azure credentials are available
+                azure_creds = credentials_manager.load_azure_credentials()
+                
+                if azure_creds:
+                    # Activity Log events since each subscription's checkpoint
+                    stored = await azure_collector.collect(log_collector, azure_creds)
+                    logger.info(f"Collected {stored} Azure activity log events")
+                else:
+                    # Generate simulated logs for testing
+                    sim_logs = await log_collector.generate_simulated_logs(count=5)
+                    logger.info(f"Generated {len(sim_logs)} simulated logs")
+            
+            # Periodic housekeeping runs on the leader only
+            if cluster_coordinator.holds(LEADER_ROLE):
+                await cluster_coordinator.run_periodic_jobs()
             
-            # Get recent logs from database
-            db = next(get_db())
-            recent_logs = await log_collector.get_recent_logs(db, limit=100)
+            # Get recent logs (only the shards this worker analyzes); comes from the
+            # in-memory event buffer, with features precomputed, when it is complete
+            async with SessionLocal() as db:
+                recent_logs, features = await log_collector.get_recent_events(
+                    db, limit=100, shards=cluster_coordinator.owned_shards()
+                )
             
             # Analyze logs for anomalies
             if recent_logs:
-                anomalies = await anomaly_detector.detect_anomalies(recent_logs)
+                anomalies = await anomaly_detector.detect_anomalies(recent_logs, features)
                 logger.info(f"Detected {len(anomalies)} anomalies")
                 
                 # Check if Gemini API is available for enhanced analysis
                 gemini_key = credentials_manager.load_gemini_api_key()
                 if gemini_key and anomalies:
-                    logger.info("Would use Gemini API for enhanced threat analysis here")
+                    threat_enricher.submit(anomalies, gemini_key)
                 
-                # Respond to detected threats
+                # Respond to detected threats; concurrent identical actions share one execution
                 if anomalies:
-                    for anomaly in anomalies:
-                        await response_manager.handle_threat(anomaly)
+                    await asyncio.gather(*[response_manager.handle_threat(anomaly) for anomaly in anomalies])
             
         except Exception as e:
             logger.error(f"Error in background task: {str(e)}")
@@ -120,7 +233,8 @@ async def get_logs(
     Retrieve logs with optional filtering
     """
     try:
-        logs = await log_collector.get_logs(
+        # Encoded straight from column tuples; response_model only documents the schema
+        body = await log_collector.get_logs_json(
             db, 
             limit=limit,
             source=source,
@@ -128,7 +242,7 @@ async def get_logs(
             start_time=start_time,
             end_time=end_time
         )
-        return logs
+        return JSONBytesResponse(body)
     except Exception as e:
         logger.error(f"Error fetching logs: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -139,10 +253,12 @@ async def create_log(
     db = Depends(get_db)
 ):
     """
-    Submit a new log entry
+    Submit a new log entry (202 with status "dropped" when its address is blocked in drop mode)
     """
     try:
         result = await log_collector.store_log(db, log_entry)
+        if result is None:
+            return JSONResponse(status_code=202, content={"id": log_entry.id, "status": "dropped", "reason": "blocked"})
         
         # Analyze this log entry for potential threats
         background_tasks = BackgroundTasks()
@@ -161,22 +277,25 @@ async def get_threats(
     source: Optional[str] = None,
     start_time: Optional[datetime] = None,
     end_time: Optional[datetime] = None,
+    run_id: Optional[str] = None,
     db = Depends(get_db)
 ):
     """
-    Retrieve detected threats with optional filtering
+    Retrieve detected threats with optional filtering (pass run_id for replay results)
     """
     try:
-        threats = await anomaly_detector.get_threats(
+        # Encoded straight from column tuples; response_model only documents the schema
+        body = await anomaly_detector.get_threats_json(
             db,
             limit=limit,
             status=status,
             severity=severity,
             source=source,
             start_time=start_time,
-            end_time=end_time
+            end_time=end_time,
+            run_id=run_id
         )
-        return threats
+        return JSONBytesResponse(body)
     except Exception as e:
         logger.error(f"Error fetching threats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -190,7 +309,7 @@ async def trigger_action(
     Trigger a security action in response to a threat
     """
     try:
-        result = await response_manager.execute_action(db, action)
+        result = await response_manager.execute_action(action)
         return {"message": "Action triggered successfully", "result": result}
     except Exception as e:
         logger.error(f"Error triggering action: {str(e)}")
@@ -210,5 +329,56 @@ async def get_system_stats(
         logger.error(f"Error fetching system stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/detectors/stats", response_model=Dict[str, Any])
+async def get_detector_stats():
+    """
+    Get per-detector fit status, latency, hit rate and CPU budget statistics
+    """
+    try:
+        return anomaly_detector.get_detector_stats()
+    except Exception as e:
+        logger.error(f"Error fetching detector stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/event-buffer", response_model=Dict[str, Any])
+async def get_event_buffer_stats():
+    """
+    Get the size and memory use of the in-memory recent event buffer
+    """
+    return {**event_buffer.get_stats(), "complete": log_collector.buffer_is_complete}
+
+@app.get("/templates", response_model=Dict[str, Any])
+async def get_log_templates(limit: int = Query(100, gt=0, le=5000)):
+    """
+    Get the mined log message templates, most frequent first
+    """
+    return {**template_miner.get_stats(), "items": template_miner.get_templates(limit)}
+
+@app.get("/enrichment", response_model=Dict[str, Any])
+async def get_enrichment_stats():
+    """
+    Get threat enrichment queue, request and cache statistics
+    """
+    return threat_enricher.get_stats()
+
+@app.get("/cluster", response_model=Dict[str, Any])
+async def get_cluster_status():
+    """
+    Get this worker's identity, roles and owned analysis shards
+    """
+    return cluster_coordinator.get_status()
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Expose counters, gauges and histograms in the Prometheus text format
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    workers = int(os.environ.get("SENTINEL_WORKERS", "1"))
+    if workers > 1:
+        # Auto-reload cannot be combined with multiple worker processes
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
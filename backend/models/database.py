@@ -1,6 +1,10 @@
 
+import asyncio
 import os
-from sqlalchemy import create_engine, MetaData
+from typing import Optional
+from sqlalchemy import create_engine, MetaData, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
@@ -10,29 +14,72 @@ import sqlite3
 import contextlib
 from loguru import logger
 
-# Generate encryption key or load existing one
+from services.metrics import instrument_engine
+
+# SQLite database with encryption (SENTINEL_DATABASE_URL points elsewhere, e.g. for benchmarks)
+SQLALCHEMY_DATABASE_URL = os.environ.get("SENTINEL_DATABASE_URL", "sqlite+aiosqlite:///./sentinel_security.db")
+
+def database_path() -> Optional[str]:
+    """File of the SQLite database, or None for in-memory and other databases"""
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+def _has_encrypted_rows(path: Optional[str]) -> bool:
+    if not path or not os.path.exists(path):
+        return False
+    try:
+        with contextlib.closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as conn:
+            return conn.execute("SELECT 1 FROM logs WHERE encrypted = 1 LIMIT 1").fetchone() is not None
+    except sqlite3.Error:
+        # No logs table (or no encrypted column) yet
+        return False
+
+# Fernet key for encrypted columns: SENTINEL_KEY_FILE, or db_key.key next to the
+# database (not the working directory, so starting elsewhere finds the same key)
 def get_encryption_key():
-    key_file = "db_key.key"
+    path = database_path()
+    key_file = os.environ.get("SENTINEL_KEY_FILE") or os.path.join(
+        os.path.dirname(os.path.abspath(path)) if path else os.getcwd(), "db_key.key"
+    )
     if os.path.exists(key_file):
         with open(key_file, "rb") as f:
             return f.read()
-    else:
-        key = Fernet.generate_key()
-        with open(key_file, "wb") as f:
-            f.write(key)
-        return key
+    
+    # A new key could not read a single stored row; refuse instead of generating one
+    if _has_encrypted_rows(path):
+        raise RuntimeError(
+            f"Encryption key {key_file} not found but {path} has encrypted rows; "
+            f"restore the key file or point SENTINEL_KEY_FILE at it"
+        )
+    key = Fernet.generate_key()
+    fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    logger.info(f"Generated encryption key {key_file}")
+    return key
 
 # Create encryption instance
 ENCRYPTION_KEY = get_encryption_key()
 fernet = Fernet(ENCRYPTION_KEY)
 
-# SQLite database with encryption
-SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./sentinel_security.db"
-
 engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL, 
     connect_args={"check_same_thread": False}
 )
+instrument_engine(engine)
+
+_sync_engine = None
+
+# Synchronous engine on the same database, for the rare lookups that happen inside
+# result processing (where the async engine cannot be awaited)
+def get_sync_engine():
+    global _sync_engine
+    if _sync_engine is None:
+        url = make_url(SQLALCHEMY_DATABASE_URL)
+        _sync_engine = create_engine(url.set(drivername=url.get_backend_name()))
+    return _sync_engine
 
 # Create a custom SQLite database with encryption for raw queries if needed
 def get_encrypted_connection():
@@ -54,18 +101,107 @@ SessionLocal = sessionmaker(
 
 Base = declarative_base()
 
-# Dependency for database access
-def get_db():
-    db = SessionLocal()
-    try:
+# Dependency for database access (the session is closed and its connection
+# returned to the pool once the request is done)
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# Add columns and indexes declared on models after their table was first created
+# (create_all only creates missing tables, it never alters existing ones)
+def _add_missing_columns(sync_conn):
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info(f"Added column {table.name}.{column.name}")
+        
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+# Move values out of string columns that are now dictionary-encoded (columns declared
+# with info={"encodes": <old column>}) and drop the old column and its index
+def _encode_legacy_columns(sync_conn):
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            legacy = column.info.get("encodes")
+            if not legacy or legacy not in existing or legacy == column.name:
+                continue
+            
+            params = {"field": column.type.field}
+            sync_conn.execute(text(
+                f"INSERT OR IGNORE INTO dictionary (field, code, value) "
+                f"SELECT :field, (SELECT COALESCE(MAX(code), 0) FROM dictionary WHERE field = :field) "
+                f"+ ROW_NUMBER() OVER (ORDER BY v), v FROM (SELECT DISTINCT {legacy} AS v FROM {table.name} "
+                f"WHERE {legacy} IS NOT NULL AND {legacy} NOT IN (SELECT value FROM dictionary WHERE field = :field))"
+            ), params)
+            result = sync_conn.execute(text(
+                f"UPDATE {table.name} SET {column.name} = (SELECT code FROM dictionary "
+                f"WHERE field = :field AND value = {table.name}.{legacy}) "
+                f"WHERE {legacy} IS NOT NULL AND {column.name} IS NULL"
+            ), params)
+            sync_conn.execute(text(f"DROP INDEX IF EXISTS ix_{table.name}_{legacy}"))
+            try:
+                sync_conn.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {legacy}"))
+            except Exception as e:
+                # SQLite before 3.35 cannot drop columns; the old one just stays unused
+                logger.warning(f"Could not drop {table.name}.{legacy}: {str(e)}")
+            logger.info(f"Dictionary-encoded {result.rowcount} value(s) of {table.name}.{legacy} into {column.name}")
+
+# Seconds a starting worker waits for another worker's schema migration
+MIGRATION_LOCK_TIMEOUT = 600
+
+# Take SQLite's write lock for the connection's transaction, waiting while another
+# worker holds it (each attempt already waits for the driver's busy timeout)
+async def _lock_database(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    
+    deadline = asyncio.get_running_loop().time() + MIGRATION_LOCK_TIMEOUT
+    while True:
+        try:
+            await conn.exec_driver_sql("BEGIN IMMEDIATE")
+            return
+        except OperationalError as e:
+            if "locked" not in str(e) or asyncio.get_running_loop().time() >= deadline:
+                raise
+            await conn.rollback()
+            logger.info("Waiting for another worker to finish migrating the database")
+            await asyncio.sleep(0.5)
 
 # Database initialization
 async def init_db():
-    async with engine.begin() as conn:
+    # Workers start together; the migrations run in one locked transaction, so the
+    # first worker applies them and the others find nothing left to do
+    async with engine.connect() as conn:
+        await _lock_database(conn)
         # Create tables if they don't exist
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_encode_legacy_columns)
+        await conn.commit()
+    
+    # Warm the dictionary-encoding cache
+    from services.dictionary import dictionary
+    await dictionary.load()
+    
+    # Load the trained compression dictionaries
+    from services.storage_codec import storage_codec
+    await storage_codec.load()
+    
+    # Load the known log message templates
+    from services.template_miner import template_miner
+    await template_miner.load()
     
     logger.info("Database tables created")
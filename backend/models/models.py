@@ -1,22 +1,149 @@
 
-from sqlalchemy import Column, String, DateTime, Float, JSON, Text, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, String, DateTime, Float, JSON, Text, Integer, ForeignKey, Boolean, UniqueConstraint, LargeBinary, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.sql import func
 from datetime import datetime
+import json
 import uuid
 
 from .database import Base
+from services.dictionary import dictionary
+from services.storage_codec import storage_codec, EncodedText
+
+class EncodedString(TypeDecorator):
+    """String stored as its integer code from the persistent dictionary table"""
+    impl = Integer
+    cache_ok = True
+    
+    def __init__(self, field: str):
+        super().__init__()
+        self.field = field
+    
+    def process_bind_param(self, value, dialect):
+        # Query filters bind codes (dictionary.encode); strings are values being written
+        if value is None or isinstance(value, int):
+            return value
+        return dictionary.code(self.field, value)
+    
+    def process_result_value(self, value, dialect):
+        # Cache only: readers call dictionary.refresh() first to see other workers' codes
+        return dictionary.decode(self.field, value)
+
+class CompressedText(TypeDecorator):
+    """
+    Text compressed and/or encrypted by the storage codec when enabled.
+    Results carry the stored value; readers decode the rows they use with
+    storage_codec.decode_rows (plain text rows come back unchanged).
+    """
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, bytes):
+            return value
+        return storage_codec.encode(value)
+    
+    def process_result_value(self, value, dialect):
+        # Not decoded here: every selected row would be decrypted whether it is used or not
+        return value
+
+class CompressedJSON(TypeDecorator):
+    """
+    JSON document stored as (optionally compressed and encrypted) text; results carry
+    the stored value, decoded by storage_codec.decode_rows (also rows written by the JSON type)
+    """
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        # Values from StorageCodec.encode_logs are already encoded
+        if value is None or isinstance(value, (bytes, EncodedText)):
+            return value
+        return storage_codec.encode(json.dumps(value))
+    
+    def process_result_value(self, value, dialect):
+        return value
+
+class DictionaryEntryModel(Base):
+    __tablename__ = "dictionary"
+    __table_args__ = (UniqueConstraint("field", "value"),)
+    
+    field = Column(String, primary_key=True)
+    code = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False)
+
+class CodecDictionaryModel(Base):
+    __tablename__ = "codec_dictionaries"
+    
+    id = Column(Integer, primary_key=True)
+    algorithm = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class LogTemplateModel(Base):
+    __tablename__ = "log_templates"
+    
+    id = Column(Integer, primary_key=True)
+    # Indexed so a template evicted from memory is found again by its text
+    template = Column(Text, nullable=False, index=True)
+    count = Column(Integer, default=0)
+    first_seen = Column(DateTime, default=datetime.now)
+    last_seen = Column(DateTime, default=datetime.now, index=True)
+
+class CollectorCheckpointModel(Base):
+    __tablename__ = "collector_checkpoints"
+    
+    # e.g. "file:/var/log/app.log" or "windows:Security"
+    source = Column(String, primary_key=True)
+    # Byte offset (files), last record number (event logs) or high-water mark in epoch seconds (Azure) stored so far
+    position = Column(Integer, default=0)
+    # Files: "device:inode" and a checksum of the first bytes, to recognise rotation and truncation
+    file_id = Column(String, nullable=True)
+    fingerprint = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class EnrichmentCacheModel(Base):
+    __tablename__ = "enrichment_cache"
+    
+    # sha256 of the model and prompt
+    key = Column(String, primary_key=True)
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(DateTime, index=True)
+
+class BlockedNetworkModel(Base):
+    __tablename__ = "blocked_networks"
+    
+    # Normalized CIDR, e.g. "203.0.113.7/32" or "2001:db8::/48"
+    network = Column(String, primary_key=True)
+    family = Column(Integer)
+    # First and last address as 32-digit hex, so string order is address order
+    range_start = Column(String)
+    range_end = Column(String)
+    reason = Column(String, nullable=True)
+    threat_id = Column(String, nullable=True, index=True)
+    updated_at = Column(DateTime, default=datetime.now, index=True)
+    # NULL blocks until removed
+    expires_at = Column(DateTime, nullable=True, index=True)
+    
+    __table_args__ = (Index("ix_blocked_networks_family_start", "family", "range_start"),)
 
 class LogEntryModel(Base):
     __tablename__ = "logs"
     
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     timestamp = Column(DateTime, default=datetime.now, index=True)
-    source = Column(String, index=True)
-    level = Column(String, index=True)
-    message = Column(Text)
-    details = Column(JSON, nullable=True)
+    # Dictionary-encoded; `info` names the string column older databases stored them in
+    source = Column("source_id", EncodedString("source"), key="source", index=True, info={"encodes": "source"})
+    level = Column("level_id", EncodedString("level"), key="level", index=True, info={"encodes": "level"})
+    message = Column(CompressedText)
+    details = Column(CompressedJSON, nullable=True)
+    # Whether message and details were written encrypted (SENTINEL_ENCRYPTION)
     encrypted = Column(Boolean, default=True)
+    shard = Column(Integer, index=True, nullable=True)
+    # Message template assigned at ingest (log_templates.id)
+    template_id = Column(Integer, index=True, nullable=True)
 
 class ThreatModel(Base):
     __tablename__ = "threats"
@@ -35,6 +162,31 @@ class ThreatModel(Base):
     user = Column(String, nullable=True, index=True)
     anomaly_score = Column(Float, nullable=True)
     details = Column(JSON, nullable=True)
+    # Set for threats produced by a replay run; NULL for production detections
+    run_id = Column(String, ForeignKey("replay_runs.id"), nullable=True, index=True)
+    # True once related_logs and indicators are also in threat_logs / threat_indicators;
+    # NULL rows are older ones that the background migration still has to copy
+    links_migrated = Column(Boolean, nullable=True, index=True)
+
+class ThreatLogModel(Base):
+    __tablename__ = "threat_logs"
+    
+    threat_id = Column(String, ForeignKey("threats.id"), primary_key=True)
+    # Not a foreign key: logs can be purged while their threats are kept
+    log_id = Column(String, primary_key=True)
+    
+    # The primary key serves threat -> logs, this index log -> threats
+    __table_args__ = (Index("ix_threat_logs_log_threat", "log_id", "threat_id"),)
+
+class ThreatIndicatorModel(Base):
+    __tablename__ = "threat_indicators"
+    
+    threat_id = Column(String, ForeignKey("threats.id"), primary_key=True)
+    # "IP address: 203.0.113.7" is stored as kind "IP address" and value "203.0.113.7"
+    kind = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    
+    __table_args__ = (Index("ix_threat_indicators_kind_value_threat", "kind", "value", "threat_id"),)
 
 class ActionModel(Base):
     __tablename__ = "actions"
@@ -46,9 +198,52 @@ class ActionModel(Base):
     timestamp = Column(DateTime, default=datetime.now, index=True)
     status = Column(String, index=True)
     result = Column(JSON, nullable=True)
+    # "<action_type>:<target>" (or the caller's key); repeats within the cooldown reuse this action
+    idempotency_key = Column(String, nullable=True)
+    
+    __table_args__ = (Index("ix_actions_idempotency_key_timestamp", "idempotency_key", "timestamp"),)
     
     # Relationship
-    threat = relationship("ThreatModel", back_populates="actions")
+    threat = relationship("ThreatModel", back_populates="action_records")
+
+class ReplayRunModel(Base):
+    __tablename__ = "replay_runs"
+    
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    created_at = Column(DateTime, default=datetime.now, index=True)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+    start_time = Column(DateTime)
+    end_time = Column(DateTime)
+    chunk_size = Column(Integer)
+    workers = Column(Integer)
+    status = Column(String, index=True)
+    total_logs = Column(Integer, nullable=True)
+    logs_processed = Column(Integer, default=0)
+    threats_found = Column(Integer, default=0)
+    # Keyset checkpoint: every log up to and including (timestamp, id) has been scored
+    checkpoint_timestamp = Column(DateTime, nullable=True)
+    checkpoint_log_id = Column(String, nullable=True)
+    elapsed_seconds = Column(Float, default=0.0)
+    error = Column(Text, nullable=True)
+
+class WorkerModel(Base):
+    __tablename__ = "workers"
+    
+    worker_id = Column(String, primary_key=True)
+    hostname = Column(String)
+    pid = Column(Integer)
+    started_at = Column(DateTime, default=datetime.now)
+    heartbeat_at = Column(DateTime, default=datetime.now, index=True)
+
+class LeaseModel(Base):
+    __tablename__ = "leases"
+    
+    role = Column(String, primary_key=True)
+    holder = Column(String, index=True)
+    expires_at = Column(DateTime, index=True)
 
-# Add relationship to ThreatModel
-ThreatModel.actions = relationship("ActionModel", back_populates="threat")
+# Add relationship to ThreatModel (kept apart from the `actions` JSON column it used to shadow)
+ThreatModel.action_records = relationship("ActionModel", back_populates="threat")
+ThreatModel.log_links = relationship("ThreatLogModel", viewonly=True)
+ThreatModel.indicator_links = relationship("ThreatIndicatorModel", viewonly=True)
@@ -4,6 +4,9 @@ from pydantic import BaseModel, Field, validator
 from datetime import datetime
 import uuid
 
+SEVERITIES = ['low', 'medium', 'high', 'critical']
+ACTION_TYPES = ['block_ip', 'quarantine', 'restart_service', 'kill_process', 'custom']
+
 class LogEntry(BaseModel):
     id: Optional[str] = Field(default_factory=lambda: str(uuid.uuid4()))
     timestamp: Optional[datetime] = Field(default_factory=datetime.now)
@@ -11,6 +14,7 @@ class LogEntry(BaseModel):
     level: str
     message: str
     details: Optional[Dict[str, Any]] = None
+    template_id: Optional[int] = None
     
     class Config:
         orm_mode = True
@@ -36,9 +40,8 @@ class Threat(BaseModel):
         
     @validator('severity')
     def severity_must_be_valid(cls, v):
-        allowed = ['low', 'medium', 'high', 'critical']
-        if v.lower() not in allowed:
-            raise ValueError(f'Severity must be one of {allowed}')
+        if v.lower() not in SEVERITIES:
+            raise ValueError(f'Severity must be one of {SEVERITIES}')
         return v.lower()
         
     @validator('status')
@@ -52,12 +55,13 @@ class ActionRequest(BaseModel):
     threat_id: str
     action_type: str
     parameters: Optional[Dict[str, Any]] = None
+    # Defaults to the action type and its target (IP address, file, service, process)
+    idempotency_key: Optional[str] = None
     
     @validator('action_type')
     def action_type_must_be_valid(cls, v):
-        allowed = ['block_ip', 'quarantine', 'restart_service', 'kill_process', 'custom']
-        if v.lower() not in allowed:
-            raise ValueError(f'Action type must be one of {allowed}')
+        if v.lower() not in ACTION_TYPES:
+            raise ValueError(f'Action type must be one of {ACTION_TYPES}')
         return v.lower()
 
 class SystemStats(BaseModel):
@@ -69,3 +73,20 @@ class SystemStats(BaseModel):
     system_health: str
     agent_status: Dict[str, str]
     last_updated: datetime = Field(default_factory=datetime.now)
+
+class ReplayRequest(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    chunk_size: int = Field(100, gt=0, le=10000)
+    workers: Optional[int] = Field(None, gt=0, le=64)
+    
+    @validator('end_time')
+    def end_after_start(cls, v, values):
+        if 'start_time' in values and v <= values['start_time']:
+            raise ValueError('end_time must be after start_time')
+        return v
+
+class BlockRequest(BaseModel):
+    networks: List[str] = Field(..., min_length=1, max_length=100000)
+    ttl_seconds: Optional[float] = Field(None, gt=0)
+    reason: Optional[str] = None
@@ -0,0 +1,63 @@
+import hmac
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any, List, Optional
+
+from services.profiler import profiler, slow_callback_detector, SamplingProfiler
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow the request only with the token from SENTINEL_ADMIN_TOKEN (endpoints are off when unset)"""
+    expected = os.environ.get("SENTINEL_ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Admin endpoints are disabled")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def run_profile(
+    seconds: float = Query(10, gt=0, le=120),
+    interval_ms: float = Query(5, ge=1, le=1000)
+):
+    """Sample every thread for N seconds and return collapsed stacks for a flamegraph"""
+    if profiler.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running")
+
+    profiler.interval = interval_ms / 1000
+    try:
+        result = await profiler.profile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    return PlainTextResponse(
+        SamplingProfiler.collapse(result),
+        headers={"X-Profile-Samples": str(result["samples"]), "X-Profile-Seconds": str(result["seconds"])}
+    )
+
+@router.get("/slow-callbacks", response_model=Dict[str, Any])
+async def get_slow_callbacks():
+    """Recent event loop callbacks that blocked longer than the threshold, newest first"""
+    return {
+        "enabled": slow_callback_detector.installed,
+        "threshold_ms": slow_callback_detector.threshold_ms,
+        "recent": slow_callback_detector.get_recent(),
+    }
+
+@router.post("/slow-callbacks", response_model=Dict[str, Any])
+async def configure_slow_callbacks(
+    enabled: bool = True,
+    threshold_ms: float = Query(100, gt=0)
+):
+    """Turn the slow callback detector on or off at runtime"""
+    if enabled:
+        slow_callback_detector.install(threshold_ms)
+    else:
+        slow_callback_detector.uninstall()
+    return {"enabled": slow_callback_detector.installed, "threshold_ms": slow_callback_detector.threshold_ms}
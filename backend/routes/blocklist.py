@@ -0,0 +1,37 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import Dict, Any, List
+
+from models.schemas import BlockRequest
+from services.blocklist import blocklist
+
+router = APIRouter(
+    prefix="/blocklist",
+    tags=["blocklist"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("", response_model=Dict[str, Any])
+async def list_blocks(limit: int = Query(100, gt=0, le=5000), offset: int = Query(0, ge=0)):
+    """Index statistics and the active blocks, most recently added first"""
+    return {**blocklist.get_stats(), "items": await blocklist.list_blocks(limit=limit, offset=offset)}
+
+@router.get("/check", response_model=Dict[str, Any])
+async def check_address(ip: str):
+    """Whether an address is blocked"""
+    return {"ip": ip, "blocked": blocklist.contains(ip)}
+
+@router.post("", response_model=List[Dict[str, Any]])
+async def block_networks(request: BlockRequest):
+    """Block addresses or CIDR networks, optionally for ttl_seconds"""
+    try:
+        return await blocklist.block(request.networks, ttl_seconds=request.ttl_seconds, reason=request.reason)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.delete("", response_model=Dict[str, Any])
+async def unblock_networks(networks: List[str] = Query(...)):
+    """Remove blocks"""
+    try:
+        return {"removed": await blocklist.unblock(networks)}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from typing import Dict, Any
+
+from services.network_collector import network_collector
+from services.file_tailer import file_tailer
+from services.azure_collector import azure_collector
+
+router = APIRouter(
+    prefix="/collectors",
+    tags=["collectors"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("/network", response_model=Dict[str, Any])
+async def get_network_collector_stats():
+    """Listeners, received/stored events, parse errors and drops of the syslog/JSON-lines collector"""
+    return network_collector.get_stats()
+
+@router.get("/files", response_model=Dict[str, Any])
+async def get_file_tailer_stats():
+    """Tailed files with their read offsets and lag, and rotations/truncations seen"""
+    return file_tailer.get_stats()
+
+@router.get("/azure", response_model=Dict[str, Any])
+async def get_azure_collector_stats():
+    """Current request limit and the requests, pages, throttling and high-water marks of the last Azure run"""
+    return azure_collector.get_stats()
@@ -16,14 +16,25 @@ router = APIRouter(
 async def get_credentials_status(db: AsyncSession = Depends(get_db)):
     """Get the status of Azure and Gemini credentials"""
     try:
-        status = credentials_manager.get_credentials_status()
-        return status
+        return credentials_manager.get_credentials_status()
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error checking credentials: {str(e)}"
         )
 
+@router.post("/validate", response_model=Dict[str, Any])
+async def validate_credentials():
+    """Re-check the credentials against Azure and the Gemini API now and return the new status"""
+    try:
+        await credentials_manager.revalidate(force=True)
+        return credentials_manager.get_credentials_status()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error validating credentials: {str(e)}"
+        )
+
 @router.get("/azure", response_model=Dict[str, Any])
 async def get_azure_credentials(db: AsyncSession = Depends(get_db)):
     """Get the Azure credentials (metadata only, not the actual secrets)"""
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, status
+from typing import Dict, Any
+
+from models.schemas import Threat
+from services.playbooks import playbook_engine
+
+router = APIRouter(
+    prefix="/playbooks",
+    tags=["playbooks"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("", response_model=Dict[str, Any])
+async def list_playbooks():
+    """Loaded playbooks in routing order, with their compiled stages and execution statistics"""
+    return playbook_engine.get_stats()
+
+@router.post("/reload", response_model=Dict[str, Any])
+async def reload_playbooks():
+    """Re-read the playbook files now instead of waiting for the next poll"""
+    reloaded = playbook_engine.reload(force=True)
+    if not reloaded:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=playbook_engine.last_error)
+    return {"reloaded": True, "playbooks": len(playbook_engine.playbooks)}
+
+@router.post("/route", response_model=Dict[str, Any])
+async def route_threat(threat: Threat):
+    """Which playbook a threat would run, without running it"""
+    playbook = playbook_engine.route(threat)
+    return {"playbook": playbook_engine.describe(playbook) if playbook else None}
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import Dict, Any, List
+
+from models.schemas import ReplayRequest
+from services.replay import replay_engine
+
+router = APIRouter(
+    prefix="/replay",
+    tags=["replay"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.post("", response_model=Dict[str, Any])
+async def create_replay(request: ReplayRequest):
+    """Re-score stored logs in a time range as a new replay run (runs in the background)"""
+    run = await replay_engine.create_run(
+        request.start_time,
+        request.end_time,
+        chunk_size=request.chunk_size,
+        workers=request.workers
+    )
+    replay_engine.start(run["id"])
+    return run
+
+@router.get("", response_model=List[Dict[str, Any]])
+async def list_replays(limit: int = Query(50, gt=0, le=500)):
+    """List replay runs with their progress, newest first"""
+    return await replay_engine.list_runs(limit=limit)
+
+@router.get("/{run_id}", response_model=Dict[str, Any])
+async def get_replay(run_id: str):
+    """Get the progress and throughput of a replay run"""
+    run = await replay_engine.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Replay run not found")
+    return run
+
+@router.post("/{run_id}/resume", response_model=Dict[str, Any])
+async def resume_replay(run_id: str):
+    """Resume a paused, failed or interrupted replay run from its checkpoint"""
+    run = await replay_engine.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Replay run not found")
+    replay_engine.start(run_id)
+    return run
+
+@router.post("/{run_id}/stop", response_model=Dict[str, Any])
+async def stop_replay(run_id: str):
+    """Pause a replay run after the chunk it is currently committing"""
+    run = await replay_engine.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Replay run not found")
+    replay_engine.stop(run_id)
+    return run
+
+@router.get("/{run_id}/compare", response_model=Dict[str, Any])
+async def compare_replay(run_id: str):
+    """Compare a replay run's threats with production threats over the same range"""
+    run = await replay_engine.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Replay run not found")
+    return await replay_engine.compare(run_id)
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from datetime import datetime
+from typing import Optional
+
+from services.reports import report_generator, REPORTS_SERVED
+
+router = APIRouter(
+    prefix="/reports",
+    tags=["reports"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("")
+async def get_report(
+    request: Request,
+    format: str = Query("html", pattern="^(html|csv|json)$"),
+    content: str = Query("all", pattern="^(all|threats|logs)$"),
+    time_range: str = Query("24h", pattern="^(24h|7d|30d|all)$"),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    include_resolved: bool = True,
+    severity: Optional[str] = None,
+    level: Optional[str] = None,
+    source: Optional[str] = None,
+    log_limit: int = Query(50000, gt=0, le=1000000)
+):
+    """
+    Security report with a summary and the threat and log tables, streamed as it is generated
+    (start_time/end_time override time_range; repeat requests for unchanged data come from a cache)
+    """
+    if start_time and end_time and end_time <= start_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_time must be after start_time")
+    
+    report = await report_generator.prepare(
+        report_format=format,
+        content=content,
+        time_range=time_range,
+        start_time=start_time,
+        end_time=end_time,
+        include_resolved=include_resolved,
+        severity=severity,
+        level=level,
+        source=source,
+        log_limit=log_limit
+    )
+    etag = f'"{report.key}"'
+    if request.headers.get("if-none-match") == etag:
+        REPORTS_SERVED.inc(format=format, cache="not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
+    headers = {
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{report.filename}"',
+        "X-Report-Cache": "hit" if report.body is not None else "miss",
+    }
+    if report.body is not None:
+        return Response(report.body, media_type=report.media_type, headers=headers)
+    return StreamingResponse(report_generator.stream(report), media_type=report.media_type, headers=headers)
+
+@router.get("/stats")
+async def report_stats():
+    """Reports generated and served from the cache"""
+    return report_generator.get_stats()
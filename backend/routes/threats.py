@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import Dict, Any, Optional
+
+from services.serialization import dumps, JSONBytesResponse
+from services.threat_links import threat_links
+
+router = APIRouter(
+    prefix="/threats",
+    tags=["threats"],
+    responses={404: {"description": "Not found"}},
+)
+
+# Fixed paths are declared before /{threat_id} so they are not taken for threat ids
+
+@router.get("/links/status", response_model=Dict[str, Any])
+async def links_status():
+    """Progress of the migration of existing threats into the link tables"""
+    return await threat_links.get_status()
+
+@router.get("/by-log/{log_id}", response_model=Dict[str, Any])
+async def threats_for_log(log_id: str, limit: int = Query(100, gt=0, le=1000), run_id: Optional[str] = None):
+    """Threats raised on a log, newest first (pass run_id for replay results)"""
+    items = await threat_links.threats_for_log(log_id, limit=limit, run_id=run_id)
+    return JSONBytesResponse(dumps({"complete": threat_links.complete, "items": items}))
+
+@router.get("/by-indicator", response_model=Dict[str, Any])
+async def threats_for_indicator(
+    value: str,
+    kind: str = "IP address",
+    limit: int = Query(100, gt=0, le=1000),
+    run_id: Optional[str] = None
+):
+    """Threats with an indicator (by default an IP address), newest first"""
+    items = await threat_links.threats_for_indicator(kind, value, limit=limit, run_id=run_id)
+    return JSONBytesResponse(dumps({"complete": threat_links.complete, "items": items}))
+
+@router.get("/by-indicator/logs", response_model=Dict[str, Any])
+async def logs_for_indicator(
+    value: str,
+    kind: str = "IP address",
+    limit: int = Query(100, gt=0, le=1000),
+    run_id: Optional[str] = None
+):
+    """Logs of the threats with an indicator, newest first"""
+    items = await threat_links.logs_for_indicator(kind, value, limit=limit, run_id=run_id)
+    return JSONBytesResponse(dumps({"complete": threat_links.complete, "items": items}))
+
+@router.get("/{threat_id}", response_model=Dict[str, Any])
+async def get_threat(threat_id: str):
+    """A threat with its related logs"""
+    threat = await threat_links.threat_detail(threat_id)
+    if threat is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Threat not found")
+    return JSONBytesResponse(dumps(threat))
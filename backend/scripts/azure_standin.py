@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Azure token and Activity Log APIs
+Serves recorded (or generated) Activity Log events with nextLink paging, $filter
+time windows, $select and optional throttling, so the Azure collector's
+throughput and resume behaviour can be measured offline.
+
+  serve    run the stand-in; point the credentials' login_endpoint and
+           management_endpoint at it
+  measure  start it in-process and run the collector against the configured
+           database (set SENTINEL_DATABASE_URL to a scratch database)
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+# Allow running from the backend directory or from scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+OPERATIONS = [
+    ("Microsoft.Compute/virtualMachines/write", "Create or Update Virtual Machine", "Administrative"),
+    ("Microsoft.Compute/virtualMachines/delete", "Delete Virtual Machine", "Administrative"),
+    ("Microsoft.Storage/storageAccounts/listKeys/action", "List Storage Account Keys", "Administrative"),
+    ("Microsoft.Authorization/roleAssignments/write", "Create role assignment", "Administrative"),
+    ("Microsoft.Network/networkSecurityGroups/securityRules/write", "Create or Update Security Rule", "Administrative"),
+    ("Microsoft.Security/locations/alerts/activate/action", "Activate Security Alert", "Security"),
+    ("Microsoft.Authorization/policies/audit/action", "Audit Policy action", "Policy"),
+    ("Microsoft.Insights/AlertRules/Activated/Action", "Alert rule activated", "Alert"),
+]
+
+def _timestamp(epoch: float) -> str:
+    """Azure style: UTC with 7 fractional digits"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "0Z"
+
+def generate_events(subscription: str, count: int, hours: float, rng: random.Random):
+    """Activity Log events shaped like the real API's (claims included, as the full payload has them)"""
+    now = time.time()
+    events = []
+    for _ in range(count):
+        operation, name, category = rng.choice(OPERATIONS)
+        caller = f"user{rng.randint(1, 40)}@contoso.com"
+        resource_group = f"rg-{rng.choice(['prod', 'dev', 'shared'])}"
+        status = rng.choices(["Succeeded", "Failed", "Started"], weights=[8, 1, 1])[0]
+        events.append({
+            "authorization": {"action": operation, "scope": f"/subscriptions/{subscription}/resourceGroups/{resource_group}"},
+            "caller": caller,
+            "channels": "Operation",
+            "claims": {
+                "aud": "https://management.core.windows.net/", "iss": "https://sts.windows.net/tenant/",
+                "appid": str(uuid.uuid4()), "name": caller, "ipaddr": f"198.51.100.{rng.randint(1, 254)}",
+                "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/upn": caller,
+                "http://schemas.microsoft.com/identity/claims/objectidentifier": str(uuid.uuid4()),
+            },
+            "correlationId": str(uuid.uuid4()),
+            "description": "",
+            "eventDataId": str(uuid.uuid4()),
+            "eventName": {"value": "EndRequest", "localizedValue": "End request"},
+            "category": {"value": category, "localizedValue": category},
+            "httpRequest": {"clientRequestId": str(uuid.uuid4()), "clientIpAddress": f"198.51.100.{rng.randint(1, 254)}", "method": "PUT"},
+            "id": f"/subscriptions/{subscription}/resourceGroups/{resource_group}/events/{uuid.uuid4()}",
+            "level": rng.choices(["Informational", "Warning", "Error"], weights=[8, 1, 1])[0],
+            "resourceGroupName": resource_group,
+            "resourceProviderName": {"value": operation.split("/")[0]},
+            "resourceId": f"/subscriptions/{subscription}/resourceGroups/{resource_group}/providers/{operation.rsplit('/', 1)[0]}/res{rng.randint(1, 50)}",
+            "operationName": {"value": operation, "localizedValue": name},
+            "status": {"value": status, "localizedValue": status},
+            "subStatus": {"value": "", "localizedValue": ""},
+            "eventTimestamp": _timestamp(now - rng.random() * hours * 3600),
+            "submissionTimestamp": _timestamp(now),
+            "subscriptionId": subscription,
+            "tenantId": "tenant",
+        })
+    return events
+
+def load_recording(path: str):
+    """Events from recorded responses: a list of events, one response ({"value": [...]}) or a list of responses"""
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    events = []
+    for item in data:
+        events.extend(item["value"] if isinstance(item, dict) and "value" in item else [item])
+    return events
+
+def _epoch(value: str) -> float:
+    value = value[:26].rstrip("Z") if "." in value else value.rstrip("Z")
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+class StandIn:
+    """Events per subscription sorted by time, plus request/throttle counters"""
+
+    def __init__(self, events, page_size: int, max_concurrent: int, throttle_rate: float, error_rate: float, latency: float):
+        self.subscriptions = {}
+        self.times = {}
+        self.add(events)
+        self.page_size = page_size
+        self.max_concurrent = max_concurrent
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "pages": 0, "events": 0, "throttled": 0, "errors": 0, "tokens": 0, "max_in_flight": 0}
+
+    def add(self, events):
+        """Serve more events (e.g. ones that happened since the last collection)"""
+        for event in events:
+            self.subscriptions.setdefault(event["subscriptionId"], []).append(event)
+        for subscription, subscription_events in self.subscriptions.items():
+            subscription_events.sort(key=lambda e: e["eventTimestamp"])
+            self.times[subscription] = [_epoch(e["eventTimestamp"]) for e in subscription_events]
+
+    def page(self, subscription: str, query):
+        """Events of one page for a $filter time window, and the skip token of the next page"""
+        window = query["$filter"][0]
+        bounds = [_epoch(part.split("'")[1]) for part in window.split(" and ") if part.startswith("eventTimestamp")]
+        start, end = min(bounds), max(bounds)
+        times = self.times.get(subscription, [])
+        low, high = bisect.bisect_left(times, start), bisect.bisect_right(times, end)
+        offset = low + int(query.get("$skiptoken", ["0"])[0])
+        events = self.subscriptions.get(subscription, [])[offset:min(offset + self.page_size, high)]
+        if "$select" in query:
+            fields = query["$select"][0].split(",")
+            events = [{field: event[field] for field in fields if field in event} for event in events]
+        next_skip = offset + self.page_size - low if offset + self.page_size < high else None
+        return events, next_skip
+
+def make_handler(standin: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.path.endswith("/oauth2/v2.0/token"):
+                return self._send(404, {"error": "not found"})
+            with standin.lock:
+                standin.stats["tokens"] += 1
+            self._send(200, {"token_type": "Bearer", "expires_in": 3600, "access_token": f"standin-{uuid.uuid4().hex}"})
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/_standin/stats":
+                return self._send(200, standin.stats)
+            parts = url.path.strip("/").split("/")
+            if len(parts) < 2 or parts[0] != "subscriptions" or not url.path.endswith("/eventtypes/management/values"):
+                return self._send(404, {"error": {"code": "NotFound"}})
+            if not self.headers.get("Authorization", "").startswith("Bearer standin-"):
+                return self._send(401, {"error": {"code": "AuthenticationFailed"}})
+
+            with standin.lock:
+                standin.stats["requests"] += 1
+                standin.in_flight += 1
+                standin.stats["max_in_flight"] = max(standin.stats["max_in_flight"], standin.in_flight)
+                busy = standin.max_concurrent and standin.in_flight > standin.max_concurrent
+            try:
+                if busy or random.random() < standin.throttle_rate:
+                    with standin.lock:
+                        standin.stats["throttled"] += 1
+                    return self._send(429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": "1"})
+                if random.random() < standin.error_rate:
+                    with standin.lock:
+                        standin.stats["errors"] += 1
+                    return self._send(503, {"error": {"code": "ServiceUnavailable"}})
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+                query = parse_qs(url.query)
+                events, next_skip = standin.page(parts[1], query)
+                body = {"value": events}
+                if next_skip is not None:
+                    next_query = {k: v[0] for k, v in query.items() if k != "$skiptoken"}
+                    next_query["$skiptoken"] = str(next_skip)
+                    body["nextLink"] = f"http://{self.headers['Host']}{url.path}?{urlencode(next_query)}"
+                with standin.lock:
+                    standin.stats["pages"] += 1
+                    standin.stats["events"] += len(events)
+                self._send(200, body, {"x-ms-ratelimit-remaining-subscription-reads": "11999"})
+            finally:
+                with standin.lock:
+                    standin.in_flight -= 1
+    return Handler
+
+def build_standin(args) -> StandIn:
+    if args.recording:
+        events = load_recording(args.recording)
+    else:
+        rng = random.Random(args.seed)
+        events = []
+        for i in range(args.subscriptions):
+            events.extend(generate_events(f"00000000-0000-0000-0000-{i:012d}", args.events, args.hours, rng))
+    return StandIn(events, args.page_size, args.max_concurrent, args.throttle_rate, args.error_rate, args.latency_ms / 1000)
+
+def start_server(standin: StandIn, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(standin))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+async def _stored(ids) -> int:
+    from sqlalchemy import text, bindparam
+    from models.database import engine
+    found = 0
+    async with engine.connect() as conn:
+        for i in range(0, len(ids), 500):
+            found += await conn.scalar(
+                text("SELECT COUNT(*) FROM logs WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": ids[i:i + 500]}
+            )
+    return found
+
+async def run_measure(args, standin: StandIn, base_url: str) -> int:
+    from models.database import init_db
+    from services.log_collector import LogCollector
+    from services.azure_collector import AzureActivityCollector
+
+    await init_db()
+    credentials = {
+        "tenant_id": "tenant", "client_id": "client", "client_secret": "secret",
+        "subscription_ids": sorted(standin.subscriptions),
+        "login_endpoint": base_url, "management_endpoint": base_url,
+    }
+    collector = LogCollector()
+    azure = AzureActivityCollector(
+        max_concurrency=args.concurrency, slice_minutes=args.slice_minutes, lookback_hours=int(args.hours) + 1
+    )
+    ids = [event["eventDataId"] for events in standin.subscriptions.values() for event in events]
+    report = {"events": len(ids), "subscriptions": len(standin.subscriptions)}
+
+    if args.interrupt_after:
+        # First run is cancelled part way, like a restart in the middle of a backfill
+        task = asyncio.create_task(azure.collect(collector, credentials))
+        await asyncio.sleep(args.interrupt_after)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        report["interrupted_run"] = dict(azure.last_run, stored_so_far=await _stored(ids))
+
+    for name in ("full_run", "incremental_run"):
+        start = time.perf_counter()
+        await azure.collect(collector, credentials)
+        elapsed = time.perf_counter() - start
+        run = dict(azure.last_run)
+        run["events_per_second"] = round(run["stored"] / elapsed) if elapsed else 0
+        report[name] = run
+
+    report["stored"] = await _stored(ids)
+    report["missing"] = len(ids) - report["stored"]
+    report["server"] = dict(standin.stats)
+    print(json.dumps(report, indent=2, default=str))
+    return 0 if report["missing"] == 0 else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure Activity Log API")
+    parser.add_argument("command", choices=["serve", "measure"])
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    parser.add_argument("--recording", type=str, help="Recorded Activity Log responses or events (JSON) to serve")
+    parser.add_argument("--subscriptions", type=int, default=3, help="Generated subscriptions (default: 3)")
+    parser.add_argument("--events", type=int, default=20000, help="Generated events per subscription (default: 20000)")
+    parser.add_argument("--hours", type=float, default=24, help="Time span of generated events (default: 24)")
+    parser.add_argument("--page-size", type=int, default=200, help="Events per page (default: 200)")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="Answer 429 above this many concurrent requests (default: 0 = no limit)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Added latency per page (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Collector request concurrency (measure)")
+    parser.add_argument("--slice-minutes", type=int, default=60, help="Collector time slice (measure)")
+    parser.add_argument("--interrupt-after", type=float, default=0,
+                        help="Cancel a first run after this many seconds to measure resuming (measure)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    args = parser.parse_args()
+
+    standin = build_standin(args)
+    server = start_server(standin, args.port)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    if args.command == "serve":
+        print(f"Serving {sum(len(e) for e in standin.subscriptions.values())} events for "
+              f"{len(standin.subscriptions)} subscription(s) at {base_url}")
+        print(f'Set "login_endpoint" and "management_endpoint" to {base_url} in azure_credentials.json')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return 0
+
+    return asyncio.run(run_measure(args, standin, base_url))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Measure the storage codec on stored logs
+Reports the compression ratio and the per-row read/write overhead of message and
+details for each available algorithm, with and without a trained dictionary
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# Allow running from the backend directory or from scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import text
+
+from models.database import init_db, engine
+from services.storage_codec import StorageCodec, storage_codec, train_dictionary, available_algorithms
+
+async def load_samples(limit: int):
+    """Plain message and details text of the newest logs (decoded if already compressed)"""
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            text("SELECT message, details FROM logs ORDER BY timestamp DESC LIMIT :limit"), {"limit": limit}
+        )).all()
+    messages = [storage_codec.decode(message) for message, _ in rows if message is not None]
+    details = [storage_codec.decode(detail) for _, detail in rows if detail is not None]
+    return {"message": messages, "details": details}
+
+def measure(codec: StorageCodec, values):
+    """Stored bytes and microseconds per value to write and read, against plain text"""
+    plain_bytes = sum(len(value.encode()) for value in values)
+
+    start = time.perf_counter()
+    stored = [codec.compress(value) for value in values]
+    write_us = (time.perf_counter() - start) / len(values) * 1e6
+
+    start = time.perf_counter()
+    for payload in stored:
+        codec.decompress(payload)
+    read_us = (time.perf_counter() - start) / len(values) * 1e6
+
+    stored_bytes = sum(len(p) if isinstance(p, bytes) else len(p.encode()) for p in stored)
+    return {
+        "plain_bytes": plain_bytes,
+        "stored_bytes": stored_bytes,
+        "ratio": round(plain_bytes / stored_bytes, 2) if stored_bytes else 0,
+        "compressed_rows": sum(isinstance(p, bytes) for p in stored),
+        "write_us": round(write_us, 2),
+        "read_us": round(read_us, 2),
+    }
+
+def plain_baseline(values):
+    """Cost of the plain text path (UTF-8 encode and decode)"""
+    start = time.perf_counter()
+    encoded = [value.encode() for value in values]
+    write_us = (time.perf_counter() - start) / len(values) * 1e6
+    start = time.perf_counter()
+    for value in encoded:
+        value.decode()
+    read_us = (time.perf_counter() - start) / len(values) * 1e6
+    return {"write_us": round(write_us, 2), "read_us": round(read_us, 2)}
+
+def build_report(samples, dictionary_size: int):
+    report = {}
+    for field, values in samples.items():
+        if len(values) < 10:
+            continue
+        # Samples are newest first: train on the older 80% and measure on the newest rows
+        split = len(values) // 5
+        training = [value.encode() for value in values[split:]]
+        evaluation = values[:split]
+
+        field_report = {"rows": len(evaluation), "plain": plain_baseline(evaluation)}
+        for algorithm in available_algorithms():
+            codec = StorageCodec(algorithm)
+            field_report[algorithm] = measure(codec, evaluation)
+
+            data = train_dictionary(algorithm, training, dictionary_size)
+            codec.add_dictionary(1, algorithm, data)
+            field_report[f"{algorithm}+dictionary"] = dict(measure(codec, evaluation), dictionary_bytes=len(data))
+        report[field] = field_report
+    return report
+
+async def rewrite_logs(batch_size: int) -> int:
+    """Re-encode stored rows with the current codec settings (plain text when compression and encryption are off)"""
+    rewritten, last_id = 0, ""
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                text("SELECT id, message, details FROM logs WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size}
+            )).all()
+            if not rows:
+                return rewritten
+            await conn.execute(
+                text("UPDATE logs SET message = :message, details = :details, encrypted = :encrypted WHERE id = :id"),
+                [
+                    {
+                        "id": log_id,
+                        "message": storage_codec.encode(storage_codec.decode(message)),
+                        "details": storage_codec.encode(storage_codec.decode(details)),
+                        "encrypted": storage_codec.encrypt,
+                    }
+                    for log_id, message, details in rows
+                ]
+            )
+        rewritten += len(rows)
+        last_id = rows[-1][0]
+        print(f"Rewrote {rewritten} logs")
+
+async def run_report(args) -> int:
+    await init_db()
+
+    samples = await load_samples(args.sample)
+    if not samples["message"]:
+        print("Error: no stored logs to sample")
+        return 1
+
+    report = build_report(samples, args.dictionary_size)
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        if not storage_codec.enabled:
+            print("Error: set SENTINEL_COMPRESSION=zstd or zlib to save a dictionary")
+            return 1
+        training = [value.encode() for values in samples.values() for value in values]
+        data = train_dictionary(storage_codec.algorithm, training, args.dictionary_size)
+        dictionary_id = await storage_codec.save_dictionary(storage_codec.algorithm, data)
+        print(f"Saved {storage_codec.algorithm} dictionary {dictionary_id} ({len(data)} bytes)")
+
+    if args.rewrite:
+        print(f"Rewrote {await rewrite_logs(args.batch_size)} logs in total")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Report storage codec compression ratio and overhead")
+    parser.add_argument("--sample", type=int, default=5000, help="Newest logs to sample (default: 5000)")
+    parser.add_argument("--dictionary-size", type=int, default=16 * 1024,
+                        help="Trained dictionary size in bytes (default: 16384)")
+    parser.add_argument("--save", action="store_true",
+                        help="Train a dictionary for SENTINEL_COMPRESSION on the sample and use it for new writes")
+    parser.add_argument("--rewrite", action="store_true",
+                        help="Re-encode all stored logs with the current settings")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per rewrite transaction (default: 1000)")
+
+    args = parser.parse_args()
+    return asyncio.run(run_report(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Local stub of the Gemini generateContent API
+Answers every prompt with a canned JSON analysis after a configurable delay
+(and optional error rate), so the threat enricher's batching, caching and
+concurrency can be checked offline without an API key.
+
+  serve    run the stub; set SENTINEL_GEMINI_ENDPOINT to its address
+  measure  start it in-process, feed the enricher generated threats and check
+           that each pattern costs one request and repeats are served from the
+           cache (set SENTINEL_DATABASE_URL to a scratch database)
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+# Allow running from the backend directory or from scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+MESSAGES = [
+    "Failed login for user {user} from {ip}",
+    "Privilege escalation attempt by {user} on host srv-{n}",
+    "Outbound connection from {ip} to port {n} blocked",
+    "Password reset requested for {user} from {ip}",
+    "Service account {user} created scheduled task job-{n}",
+]
+
+class Stub:
+    """Request counters and the in-flight high-water mark"""
+
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "errors": 0, "max_in_flight": 0}
+
+def make_handler(stub: Stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/_stub/stats":
+                return self._send(200, stub.stats)
+            if self.path.startswith("/v1beta/models/"):
+                # Model lookup, used to validate API keys; keys starting with "invalid" are rejected
+                if self.headers.get("x-goog-api-key", "invalid").startswith("invalid"):
+                    return self._send(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+                return self._send(200, {"name": self.path[len("/v1beta/"):]})
+            self._send(404, {"error": {"code": 404}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not self.path.endswith(":generateContent"):
+                return self._send(404, {"error": {"code": 404}})
+            if not self.headers.get("x-goog-api-key"):
+                return self._send(403, {"error": {"code": 403, "status": "PERMISSION_DENIED"}})
+            with stub.lock:
+                stub.stats["requests"] += 1
+                stub.in_flight += 1
+                stub.stats["max_in_flight"] = max(stub.stats["max_in_flight"], stub.in_flight)
+            try:
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if random.random() < stub.error_rate:
+                    with stub.lock:
+                        stub.stats["errors"] += 1
+                    return self._send(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+                prompt = body["contents"][0]["parts"][0]["text"]
+                answer = {
+                    "summary": f"Stub analysis of a {len(prompt)} character prompt.",
+                    "tactic": "Credential Access",
+                    "recommended_actions": ["Review the account's recent activity", "Block the source address"],
+                    "confidence": 0.7,
+                }
+                self._send(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": json.dumps(answer)}]}}]})
+            finally:
+                with stub.lock:
+                    stub.in_flight -= 1
+    return Handler
+
+def start_server(stub: Stub, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def generate_threats(count: int, patterns: int, rng: random.Random):
+    """Threats spread over `patterns` distinct patterns with varying users, addresses and numbers"""
+    from models.schemas import Threat
+    threats = []
+    for i in range(count):
+        p = i % patterns
+        message = MESSAGES[p % len(MESSAGES)].format(
+            user=f"user{rng.randint(1, 500)}", ip=f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            n=rng.randint(1, 9999)
+        )
+        threats.append(Threat(
+            title=f"Anomaly detected in {message.split()[0]}",
+            description=f"Unusual activity detected: {message}",
+            severity=rng.choice(["low", "medium", "high"]),
+            source=f"Source-{p // len(MESSAGES)}",
+            type="Anomaly",
+            indicators=[f"IP address: 10.0.0.{rng.randint(1, 254)}", f"User: user{rng.randint(1, 500)}"],
+            anomaly_score=rng.random(),
+        ))
+    return threats
+
+async def run_measure(args, stub: Stub, base_url: str) -> int:
+    from sqlalchemy import select, func
+    from models.database import init_db, SessionLocal
+    from models.models import ThreatModel, EnrichmentCacheModel
+    from services.threat_enricher import ThreatEnricher
+
+    await init_db()
+    rng = random.Random(args.seed)
+    enricher = ThreatEnricher(
+        endpoint=base_url, max_concurrency=args.concurrency, timeout=args.timeout, batch_window=0.2
+    )
+    report = {"patterns": args.patterns, "threats_per_round": args.threats}
+
+    for round_number in range(args.rounds):
+        threats = generate_threats(args.threats, args.patterns, rng)
+        async with SessionLocal() as db:
+            db.add_all([ThreatModel(**threat.model_dump()) for threat in threats])
+            await db.commit()
+        requests_before = stub.stats["requests"]
+
+        start = time.perf_counter()
+        enricher.submit(threats, "stub-key")
+        submit_us = (time.perf_counter() - start) * 1e6
+        while enricher.stats["enriched"] + enricher.stats["unenriched"] < (round_number + 1) * args.threats and (
+            time.perf_counter() - start < args.timeout * 3
+        ):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        async with SessionLocal() as db:
+            ids = [threat.id for threat in threats]
+            details = (await db.execute(select(ThreatModel.details).where(ThreatModel.id.in_(ids)))).scalars().all()
+        report[f"round_{round_number + 1}"] = {
+            "submit_us": round(submit_us, 1),
+            "seconds": round(elapsed, 3),
+            "api_requests": stub.stats["requests"] - requests_before,
+            "enriched": sum(1 for d in details if d and "enrichment" in d),
+            "from_cache": sum(1 for d in details if d and d.get("enrichment", {}).get("cached")),
+        }
+
+    await enricher.stop()
+    async with SessionLocal() as db:
+        report["cache_rows"] = await db.scalar(select(func.count()).select_from(EnrichmentCacheModel))
+    report["enricher"] = enricher.get_stats()
+    report["server"] = dict(stub.stats)
+    print(json.dumps(report, indent=2))
+
+    first = report["round_1"]
+    repeats = [report[f"round_{n}"] for n in range(2, args.rounds + 1)]
+    ok = (
+        args.error_rate > 0
+        or (first["api_requests"] == args.patterns and all(r["api_requests"] == 0 for r in repeats))
+    )
+    return 0 if ok and stub.stats["max_in_flight"] <= args.concurrency else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the Gemini generateContent API")
+    parser.add_argument("command", choices=["serve", "measure"])
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Delay per answer (default: 300)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--threats", type=int, default=500, help="Threats per round (measure, default: 500)")
+    parser.add_argument("--patterns", type=int, default=10, help="Distinct threat patterns (measure, default: 10)")
+    parser.add_argument("--rounds", type=int, default=3, help="Detection rounds to submit (measure, default: 3)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Enricher request concurrency (measure)")
+    parser.add_argument("--timeout", type=float, default=20, help="Enricher request timeout in seconds (measure)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    args = parser.parse_args()
+
+    stub = Stub(args.latency_ms / 1000, args.error_rate)
+    server = start_server(stub, args.port)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    if args.command == "serve":
+        print(f"Serving a Gemini stub at {base_url}")
+        print(f"Set SENTINEL_GEMINI_ENDPOINT={base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return 0
+
+    return asyncio.run(run_measure(args, stub, base_url))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Load generator for capacity planning
+Produces simulated log traffic with injected attack patterns, drives either the
+service layer or the HTTP API, and reports throughput, latency, detection recall
+and database growth
+
+The database is the one the server uses (SENTINEL_DATABASE_URL, default
+./sentinel_security.db); recall is measured from the threats stored in it
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Set
+
+import numpy as np
+
+# Allow running from the backend directory or from scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import select
+
+from models.database import database_path, engine
+from models.models import ThreatLogModel
+from models.schemas import LogEntry
+from services.log_collector import LogCollector
+
+def _night_time(rng: random.Random, now: datetime) -> datetime:
+    """A timestamp between 01:00 and 04:59 today"""
+    return now.replace(hour=rng.randint(1, 4), minute=rng.randint(0, 59), second=rng.randint(0, 59))
+
+def brute_force(rng: random.Random, now: datetime):
+    """Burst of failed logins against one account from one address"""
+    ip_address = f"203.0.113.{rng.randint(1, 254)}"
+    timestamp = _night_time(rng, now)
+    return [
+        LogEntry(
+            timestamp=timestamp + timedelta(seconds=i),
+            source="Windows-Security",
+            level="error",
+            message="ERROR: Failed authentication for user admin, password rejected",
+            details={"ip_address": ip_address, "user": "admin", "event_id": 4625}
+        )
+        for i in range(rng.randint(5, 20))
+    ]
+
+def malware(rng: random.Random, now: datetime):
+    """Malware detection on a host"""
+    return [LogEntry(
+        timestamp=_night_time(rng, now),
+        source="AWS-GuardDuty",
+        level="error",
+        message="ERROR: Security threat detected, malware virus signature in file write",
+        details={"ip_address": f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+                 "user": f"user{rng.randint(1, 20)}", "file_path": "/tmp/payload.bin"}
+    )]
+
+def privilege_escalation(rng: random.Random, now: datetime):
+    """Unexpected privilege change outside working hours"""
+    return [LogEntry(
+        timestamp=_night_time(rng, now),
+        source="Windows-Security",
+        level="warning",
+        message="WARNING: Unauthorized sudo privilege escalation to root admin permission",
+        details={"ip_address": f"192.168.1.{rng.randint(2, 254)}", "user": f"user{rng.randint(1, 20)}",
+                 "process_id": rng.randint(1000, 50000)}
+    )]
+
+def exfiltration(rng: random.Random, now: datetime):
+    """Bulk database read shipped out over the network"""
+    return [LogEntry(
+        timestamp=_night_time(rng, now),
+        source="Database-PostgreSQL",
+        level="warning",
+        message="WARNING: Unusual database query read of all table records over network connection",
+        details={"ip_address": f"198.51.100.{rng.randint(1, 254)}", "user": f"user{rng.randint(1, 20)}",
+                 "query_type": "SELECT", "table": "users", "duration_ms": rng.randint(20000, 90000)}
+    )]
+
+ATTACK_PATTERNS = {
+    "brute_force": brute_force,
+    "malware": malware,
+    "privilege_escalation": privilege_escalation,
+    "exfiltration": exfiltration,
+}
+
+def parse_mix(value: str):
+    """Parse 'name=weight,name=weight' into a dict"""
+    if not value:
+        return None
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+class EventStream:
+    """Simulated events in batches, with attack patterns injected at a given rate"""
+
+    def __init__(self, collector: LogCollector, args):
+        self.collector = collector
+        self.rng = random.Random(args.seed)
+        self.source_weights = parse_mix(args.source_mix)
+        self.level_weights = parse_mix(args.level_mix)
+        self.attack_rate = args.attack_rate
+        self.attack_patterns = [ATTACK_PATTERNS[name] for name in args.attacks.split(",") if name]
+        self.injected_ids = set()
+        self.attack_counts = {}
+        self.pending_attack = []
+
+    def next_batch(self, size: int):
+        now = datetime.now()
+        batch = []
+        while len(batch) < size:
+            if self.pending_attack:
+                batch.append(self.pending_attack.pop())
+                continue
+
+            if self.attack_patterns and self.rng.random() < self.attack_rate:
+                pattern = self.rng.choice(self.attack_patterns)
+                events = pattern(self.rng, now)
+                for event in events:
+                    event.details["injected_attack"] = pattern.__name__
+                    self.injected_ids.add(event.id)
+                self.attack_counts[pattern.__name__] = self.attack_counts.get(pattern.__name__, 0) + 1
+                self.pending_attack = events[::-1]
+                continue
+
+            batch.extend(self.collector.simulate_logs(
+                1, self.source_weights, self.level_weights, rng=self.rng, now=now
+            ))
+        return batch
+
+def db_size(path: Optional[str]) -> int:
+    """Size of an SQLite database including its journal/WAL files"""
+    if not path:
+        return 0
+    return sum(os.path.getsize(p) for p in (path, path + "-wal", path + "-journal") if os.path.exists(p))
+
+async def drive_service(collector: LogCollector, batch, db):
+    """Ingest one batch through the service layer, returning per-call latencies"""
+    start = time.perf_counter()
+    if len(batch) == 1:
+        await collector.store_log(db, batch[0])
+    else:
+        await collector.store_logs(db, batch)
+    return [time.perf_counter() - start]
+
+def _post(url: str, log_entry: LogEntry) -> float:
+    body = log_entry.model_dump_json().encode()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+    return time.perf_counter() - start
+
+async def drive_http(url: str, batch, executor: ThreadPoolExecutor):
+    """Post every event of a batch concurrently, returning (latencies, failed request count)"""
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *[loop.run_in_executor(executor, _post, url, event) for event in batch],
+        return_exceptions=True
+    )
+    latencies = [r for r in results if not isinstance(r, BaseException)]
+    return latencies, len(results) - len(latencies)
+
+async def flagged_log_ids(log_ids: List[str]) -> Set[str]:
+    """The given logs that a stored threat links to"""
+    flagged = set()
+    async with engine.connect() as conn:
+        for i in range(0, len(log_ids), 500):
+            result = await conn.execute(
+                select(ThreatLogModel.log_id).where(ThreatLogModel.log_id.in_(log_ids[i:i + 500])).distinct()
+            )
+            flagged.update(result.scalars())
+    return flagged
+
+async def evaluate_detection(windows, injected_ids, analyze: bool):
+    """
+    Recall over the sampled windows, from the threats stored in the database. With
+    `analyze` (service mode) the windows are first run through the detector the way
+    the background task does, which stores its threats; in http mode the threats are
+    the ones the server stored while the run was going.
+    """
+    if analyze:
+        from services.anomaly_detector import AnomalyDetector
+        detector = AnomalyDetector()
+        for window in windows:
+            await detector.detect_anomalies(window)
+
+    flagged = await flagged_log_ids([event.id for window in windows for event in window])
+    evaluated = injected = detected = false_positives = 0
+    for window in windows:
+        window_flagged = {event.id for event in window if event.id in flagged}
+        window_injected = {event.id for event in window if event.id in injected_ids}
+        evaluated += len(window)
+        injected += len(window_injected)
+        detected += len(window_injected & window_flagged)
+        false_positives += len(window_flagged - window_injected)
+
+    return {
+        "events_evaluated": evaluated,
+        "injected_events": injected,
+        "detected_injected_events": detected,
+        "recall": detected / injected if injected else None,
+        "false_positive_rate": false_positives / (evaluated - injected) if evaluated > injected else None,
+    }
+
+async def run_load(args) -> dict:
+    collector = LogCollector()
+    stream = EventStream(collector, args)
+
+    db = None
+    executor = None
+    if args.mode == "service":
+        from models.database import init_db, SessionLocal
+        await init_db()
+        db = SessionLocal()
+    else:
+        executor = ThreadPoolExecutor(max_workers=args.concurrency)
+        url = args.url.rstrip("/") + "/logs"
+
+    db_path = args.db_path or database_path()
+    size_before = db_size(db_path)
+    latencies = []
+    errors = 0
+    sent = 0
+    windows = []
+    detect_buffer = []
+    eval_rng = random.Random(args.seed + 1)
+    next_report = time.perf_counter() + args.report_interval
+    start = time.perf_counter()
+
+    while sent < args.events:
+        batch = stream.next_batch(min(args.batch_size, args.events - sent))
+
+        # Pace to the target rate
+        if args.rate > 0:
+            delay = start + sent / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        try:
+            if args.mode == "service":
+                latencies.extend(await drive_service(collector, batch, db))
+            else:
+                batch_latencies, failed = await drive_http(url, batch, executor)
+                latencies.extend(batch_latencies)
+                errors += failed
+        except Exception as e:
+            # Errors are counted per event, like failed requests in http mode
+            errors += len(batch)
+            print(f"Error ingesting batch: {str(e)}", file=sys.stderr)
+        sent += len(batch)
+
+        # Keep a sample of analysis windows for the recall measurement afterwards
+        if sum(len(w) for w in windows) < args.detect_limit:
+            detect_buffer.extend(batch)
+            while len(detect_buffer) >= args.detect_batch:
+                window, detect_buffer = detect_buffer[:args.detect_batch], detect_buffer[args.detect_batch:]
+                if eval_rng.random() < args.detect_sample:
+                    windows.append(window)
+
+        if time.perf_counter() >= next_report:
+            elapsed = time.perf_counter() - start
+            print(f"{sent}/{args.events} events, {sent / elapsed:.0f} events/s", file=sys.stderr)
+            next_report += args.report_interval
+
+    elapsed = time.perf_counter() - start
+    if db is not None:
+        from services.template_miner import template_miner
+        await template_miner.flush()
+        await db.close()
+    if executor is not None:
+        executor.shutdown()
+    size_after = db_size(db_path)
+
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "config": vars(args),
+        "ingest": {
+            "events": sent,
+            "calls": len(latencies),
+            "errors": errors,
+            "elapsed_seconds": elapsed,
+            "events_per_second": sent / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "p50": float(np.percentile(latencies_ms, 50)),
+                "p95": float(np.percentile(latencies_ms, 95)),
+                "p99": float(np.percentile(latencies_ms, 99)),
+                "max": float(np.max(latencies_ms)),
+            },
+        },
+        "attacks": {
+            "patterns_injected": stream.attack_counts,
+            "events_injected": len(stream.injected_ids),
+        },
+        "database": {
+            "path": db_path,
+            "bytes_before": size_before,
+            "bytes_after": size_after,
+            "growth_bytes": size_after - size_before,
+            "bytes_per_event": (size_after - size_before) / sent if sent else 0.0,
+        },
+    }
+
+    if not args.no_detect:
+        if args.mode == "http" and args.detect_wait > 0:
+            # Give the server's background analysis a cycle to store its threats
+            await asyncio.sleep(args.detect_wait)
+        report["detection"] = await evaluate_detection(windows, stream.injected_ids, analyze=args.mode == "service")
+    await engine.dispose()
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against the log ingestion path")
+    parser.add_argument("--events", type=int, default=100000, help="Total events to send (default: 100000)")
+    parser.add_argument("--rate", type=float, default=0, help="Target events/second (default: 0 = unlimited)")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Events per store call in service mode (1 uses store_log); events per concurrent wave in http mode")
+    parser.add_argument("--mode", choices=["service", "http"], default="service",
+                        help="Drive LogCollector directly or POST to the API (default: service)")
+    parser.add_argument("--url", type=str, default="http://localhost:8000", help="API base URL for http mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent HTTP requests (default: 16)")
+    parser.add_argument("--source-mix", type=str, default="",
+                        help="Source weights, e.g. 'Windows-Security=3,Network-IDS=1' (default: uniform)")
+    parser.add_argument("--level-mix", type=str, default="",
+                        help="Level weights, e.g. 'info=6,warning=3,error=1' (default: simulator mix)")
+    parser.add_argument("--attack-rate", type=float, default=0.005,
+                        help="Probability that the next event starts an attack pattern (default: 0.005)")
+    parser.add_argument("--attacks", type=str, default=",".join(ATTACK_PATTERNS),
+                        help=f"Comma-separated attack patterns (default: all of {', '.join(ATTACK_PATTERNS)})")
+    parser.add_argument("--detect-batch", type=int, default=100,
+                        help="Window size used for detection, like the background task (default: 100)")
+    parser.add_argument("--detect-sample", type=float, default=0.1,
+                        help="Fraction of windows scored for the recall measurement (default: 0.1)")
+    parser.add_argument("--detect-limit", type=int, default=20000,
+                        help="Maximum events scored for the recall measurement (default: 20000)")
+    parser.add_argument("--detect-wait", type=float, default=35,
+                        help="Seconds to wait in http mode for the server's analysis before reading threats (default: 35)")
+    parser.add_argument("--no-detect", action="store_true", help="Skip the detection recall measurement")
+    parser.add_argument("--db-path", type=str, default=None,
+                        help="Database file used to measure growth (default: the SENTINEL_DATABASE_URL file, as the server resolves it)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between progress lines")
+    parser.add_argument("--output", type=str, help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+
+    unknown = [name for name in args.attacks.split(",") if name and name not in ATTACK_PATTERNS]
+    if unknown:
+        print(f"Error: unknown attack patterns {unknown}; available: {', '.join(ATTACK_PATTERNS)}")
+        return 1
+
+    report = asyncio.run(run_load(args))
+    output = json.dumps(report, indent=2, default=str)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
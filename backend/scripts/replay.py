@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Replay stored logs through the current detection logic
+Results are written as a separate threat run that can be compared with production
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Allow running from the backend directory or from scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models.database import init_db
+from services.replay import replay_engine
+
+def print_run(run):
+    print(json.dumps(run, indent=2, default=str))
+
+async def run_replay(args) -> int:
+    await init_db()
+
+    if args.list:
+        for run in await replay_engine.list_runs():
+            print(f"{run['id']}  {run['status']:<10} {run['logs_processed']}/{run['total_logs']} logs  "
+                  f"{run['threats_found']} threats  {run['start_time']} - {run['end_time']}")
+        return 0
+
+    if args.compare:
+        if await replay_engine.get_run(args.compare) is None:
+            print(f"Error: replay run {args.compare} not found")
+            return 1
+        print_run(await replay_engine.compare(args.compare))
+        return 0
+
+    if args.resume:
+        run_id = args.resume
+        if await replay_engine.get_run(run_id) is None:
+            print(f"Error: replay run {run_id} not found")
+            return 1
+    else:
+        if not args.start or not args.end:
+            print("Error: --start and --end are required for a new run")
+            return 1
+        run = await replay_engine.create_run(
+            datetime.fromisoformat(args.start),
+            datetime.fromisoformat(args.end),
+            chunk_size=args.chunk_size,
+            workers=args.workers
+        )
+        run_id = run["id"]
+        print(f"Created replay run {run_id} over {run['total_logs']} logs")
+
+    print(f"Resume later with: python scripts/replay.py --resume {run_id}")
+    run = await replay_engine.run(run_id)
+    print_run(run)
+    return 0 if run["status"] == "completed" else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored logs with the current detection logic")
+    parser.add_argument("--start", type=str, help="Start of the time range (ISO format)")
+    parser.add_argument("--end", type=str, help="End of the time range (ISO format)")
+    parser.add_argument("--chunk-size", type=int, default=100,
+                        help="Logs scored together as one batch (default: 100)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Scoring processes (default: number of CPUs)")
+    parser.add_argument("--resume", type=str, metavar="RUN_ID", help="Resume an interrupted run from its checkpoint")
+    parser.add_argument("--compare", type=str, metavar="RUN_ID", help="Compare a run with production threats")
+    parser.add_argument("--list", action="store_true", help="List replay runs")
+
+    args = parser.parse_args()
+
+    try:
+        return asyncio.run(run_replay(args))
+    except KeyboardInterrupt:
+        print("\nInterrupted; progress up to the last committed chunk is checkpointed.")
+        return 130
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,19 @@ import argparse
 import sys
 from pathlib import Path
 
+def write_private(target_path: Path, content: str):
+    """
+    Write a file readable by the owner only, atomically: a running backend
+    reloads credentials on change and must never see a half-written file
+    """
+    tmp_path = target_path.with_name(f".{target_path.name}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, target_path)
+
 def main():
     parser = argparse.ArgumentParser(description="Set up credentials for the security system")
     parser.add_argument("--azure-creds", type=str, help="Path to Azure credentials JSON file")
@@ -51,11 +64,7 @@ def main():
             
             # Copy to credentials directory
             target_path = credentials_dir / 'azure_credentials.json'
-            with open(target_path, 'w') as f:
-                json.dump(azure_creds, f, indent=2)
-                
-            # Set restricted permissions (owner read/write only)
-            os.chmod(target_path, 0o600)
+            write_private(target_path, json.dumps(azure_creds, indent=2))
             
             print(f"Azure credentials installed at {target_path}")
             
@@ -82,7 +91,7 @@ def main():
     
     if gemini_key:
         # Validate key format (basic check)
-        if not gemini_key.startswith('Gemini-') and len(gemini_key) < 20:
+        if len(gemini_key) < 20 or any(c.isspace() for c in gemini_key):
             print("Warning: Gemini API key doesn't match expected format")
             response = input("Continue anyway? (y/n): ")
             if response.lower() != 'y':
@@ -90,11 +99,7 @@ def main():
         
         # Save the key
         target_path = credentials_dir / 'gemini_api_key.txt'
-        with open(target_path, 'w') as f:
-            f.write(gemini_key)
-            
-        # Set restricted permissions (owner read/write only)
-        os.chmod(target_path, 0o600)
+        write_private(target_path, gemini_key)
         
         print(f"Gemini API key installed at {target_path}")
     
@@ -6,111 +6,60 @@ from typing import List, Dict, Any, Optional
 import json
 import uuid
 from loguru import logger
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
+from sqlalchemy import select
 
+from models.database import SessionLocal
 from models.models import LogEntryModel, ThreatModel
 from models.schemas import LogEntry, Threat
+from services.detectors import build_ensemble
+from services.event_buffer import FLAG_NAMES, FEATURE_NAMES, message_flags
+from services.template_miner import template_miner
+from services.metrics import metrics, THREATS_DETECTED, DB_COMMIT_DURATION
+from services.serialization import rows_to_json
+from services.threat_links import threat_links
+
+# Columns returned by threat queries, in Threat field order
+THREAT_FIELDS = [
+    "id", "title", "description", "timestamp", "severity", "status", "source", "type",
+    "indicators", "actions", "related_logs", "user", "anomaly_score", "details"
+]
+
+# Cheap detectors first; the expensive ones only see events the cheap ones flag
+DEFAULT_DETECTORS = ["rules", "zscore", "rare_template", "isolation_forest", "lof"]
 
 class AnomalyDetector:
-    def __init__(self):
-        """Initialize the anomaly detector with an Isolation Forest model"""
-        self.model = IsolationForest(
-            n_estimators=100,
-            max_samples='auto',
-            contamination=0.1,  # Assume 10% of data points are anomalies
-            random_state=42
+    def __init__(
+        self,
+        detectors: Optional[List[str]] = None,
+        contamination: float = 0.1,  # Assume 10% of data points are anomalies
+        cpu_budget_ms: Optional[float] = 250.0
+    ):
+        """Initialize the anomaly detector with an ensemble of registered detectors"""
+        # Time of day and weekday, the level and message keyword flags, then the message template's rarity
+        self.features = FEATURE_NAMES
+        self.ensemble = build_ensemble(
+            detectors or DEFAULT_DETECTORS,
+            self.features,
+            cpu_budget_ms=cpu_budget_ms,
+            contamination=contamination
         )
-        self.scaler = StandardScaler()
-        self.is_model_fitted = False
-        self.features = [
-            'hour_of_day', 
-            'day_of_week',
-            'is_error',
-            'is_warning',
-            'is_security_related',
-            'is_authentication',
-            'is_network_related',
-            'is_database_related',
-            'is_file_access',
-            'is_admin_action'
-        ]
         logger.info("Anomaly detector initialized")
     
-    async def detect_anomalies(self, logs: List[LogEntry]) -> List[Threat]:
-        """Detect anomalies in logs using Isolation Forest"""
+    @property
+    def is_model_fitted(self) -> bool:
+        return self.ensemble.is_fitted
+    
+    async def detect_anomalies(self, logs: List[LogEntry], features: Optional[np.ndarray] = None) -> List[Threat]:
+        """Detect anomalies in logs using the detector ensemble"""
         if not logs:
             return []
         
         try:
-            # Convert logs to features for model
-            features = self._extract_features(logs)
-            
-            if not self.is_model_fitted or len(logs) >= 20:
-                # Train model with current batch if we have enough data
-                self._train_model(features)
-            
-            if not self.is_model_fitted:
-                # Can't predict without a fitted model
-                return []
-            
-            # Normalize features
-            scaled_features = self.scaler.transform(features)
-            
-            # Predict anomalies (returns -1 for anomalies, 1 for normal points)
-            predictions = self.model.predict(scaled_features)
+            threats = self.score_logs(logs, features)
             
-            # Get anomaly scores (-1 to 1, lower is more anomalous)
-            raw_scores = self.model.decision_function(scaled_features)
-            
-            # Convert scores to 0-1 range (0 = normal, 1 = anomaly)
-            anomaly_scores = 1 - (raw_scores - np.min(raw_scores)) / (np.max(raw_scores) - np.min(raw_scores) + 1e-10)
-            
-            threats = []
-            for i, (pred, score) in enumerate(zip(predictions, anomaly_scores)):
-                if pred == -1 or score > 0.75:  # High anomaly score
-                    log = logs[i]
-                    
-                    # Determine severity based on anomaly score
-                    severity = "low"
-                    if score > 0.95:
-                        severity = "critical"
-                    elif score > 0.9:
-                        severity = "high"
-                    elif score > 0.8:
-                        severity = "medium"
-                    
-                    # Determine threat type based on log characteristics
-                    threat_type = "anomaly"
-                    if "login" in log.message.lower() or "authentication" in log.message.lower():
-                        threat_type = "brute force"
-                    elif "malware" in log.message.lower() or "virus" in log.message.lower():
-                        threat_type = "malware"
-                    elif "access" in log.message.lower() and ("unauthorized" in log.message.lower() or "denied" in log.message.lower()):
-                        threat_type = "unauthorized access"
-                    
-                    # Generate indicators
-                    indicators = self._generate_indicators(log)
-                    
-                    # Create threat
-                    threat = Threat(
-                        title=f"Anomaly detected in {log.source}",
-                        description=f"Unusual activity detected: {log.message}",
-                        timestamp=log.timestamp,
-                        severity=severity,
-                        status="active",
-                        source=log.source,
-                        type=threat_type,
-                        indicators=indicators,
-                        related_logs=[log.id],
-                        anomaly_score=float(score),
-                        user=log.details.get("user") if log.details else None
-                    )
-                    
-                    threats.append(threat)
-                    
-                    # Store the threat in the database
-                    await self._store_threat(threat)
+            # Store the threats in the database
+            for threat in threats:
+                await self._store_threat(threat)
             
             logger.info(f"Detected {len(threats)} anomalies from {len(logs)} logs")
             return threats
@@ -119,64 +68,113 @@ class AnomalyDetector:
             logger.error(f"Error detecting anomalies: {str(e)}")
             return []
     
+    def score_logs(self, logs: List[LogEntry], features: Optional[np.ndarray] = None) -> List[Threat]:
+        """
+        Train on and score a batch of logs, returning threats without storing them
+        Pass precomputed features (e.g. from the event buffer) to skip feature extraction
+        """
+        if not logs:
+            return []
+        
+        # Convert logs to features for model
+        if features is None:
+            features = self._extract_features(logs)
+        
+        if not self.is_model_fitted or len(logs) >= 20:
+            # Train model with current batch if we have enough data
+            self._train_model(features)
+        
+        if not self.ensemble.can_score:
+            # Can't predict without a fitted detector
+            return []
+        
+        # Anomaly scores are in 0-1 range (0 = normal, 1 = anomaly)
+        anomaly_scores, anomaly_flags = self.ensemble.score(features)
+        
+        threats = []
+        for i, (flagged, score) in enumerate(zip(anomaly_flags, anomaly_scores)):
+            if flagged:
+                log = logs[i]
+                
+                # Determine severity based on anomaly score
+                severity = "low"
+                if score > 0.95:
+                    severity = "critical"
+                elif score > 0.9:
+                    severity = "high"
+                elif score > 0.8:
+                    severity = "medium"
+                
+                # Determine threat type based on log characteristics
+                threat_type = "anomaly"
+                if "login" in log.message.lower() or "authentication" in log.message.lower():
+                    threat_type = "brute force"
+                elif "malware" in log.message.lower() or "virus" in log.message.lower():
+                    threat_type = "malware"
+                elif "access" in log.message.lower() and ("unauthorized" in log.message.lower() or "denied" in log.message.lower()):
+                    threat_type = "unauthorized access"
+                
+                # Generate indicators
+                indicators = self._generate_indicators(log)
+                
+                # Create threat
+                threat = Threat(
+                    title=f"Anomaly detected in {log.source}",
+                    description=f"Unusual activity detected: {log.message}",
+                    timestamp=log.timestamp,
+                    severity=severity,
+                    status="active",
+                    source=log.source,
+                    type=threat_type,
+                    indicators=indicators,
+                    related_logs=[log.id],
+                    anomaly_score=float(score),
+                    user=log.details.get("user") if log.details else None
+                )
+                
+                threats.append(threat)
+        
+        return threats
+    
     def _extract_features(self, logs: List[LogEntry]) -> np.ndarray:
         """Extract numerical features from logs for anomaly detection"""
         features_list = []
+        template_ids = []
         
         for log in logs:
             # Time-based features
             timestamp = log.timestamp
-            hour_of_day = timestamp.hour
-            day_of_week = timestamp.weekday()
-            
-            # Log level features
-            is_error = 1 if log.level.lower() == "error" else 0
-            is_warning = 1 if log.level.lower() == "warning" else 0
             
-            # Content-based features
-            msg = log.message.lower()
-            is_security_related = 1 if any(term in msg for term in ["security", "secure", "attack", "threat", "vulnerability"]) else 0
-            is_authentication = 1 if any(term in msg for term in ["login", "password", "credential", "auth", "user"]) else 0
-            is_network_related = 1 if any(term in msg for term in ["network", "connection", "ip", "tcp", "udp", "dns", "http"]) else 0
-            is_database_related = 1 if any(term in msg for term in ["database", "sql", "query", "table", "record"]) else 0
-            is_file_access = 1 if any(term in msg for term in ["file", "directory", "folder", "path", "read", "write"]) else 0
-            is_admin_action = 1 if any(term in msg for term in ["admin", "root", "sudo", "permission", "privilege"]) else 0
+            # Level and content-based features, shared with the event buffer
+            flags = message_flags(log.level, log.message)
             
-            features = [
-                hour_of_day, 
-                day_of_week,
-                is_error,
-                is_warning,
-                is_security_related,
-                is_authentication,
-                is_network_related,
-                is_database_related,
-                is_file_access,
-                is_admin_action
-            ]
+            features_list.append(
+                [timestamp.hour, timestamp.weekday()] + [(flags >> bit) & 1 for bit in range(len(FLAG_NAMES))]
+            )
             
-            features_list.append(features)
+            # Template assigned at ingest, or looked up for logs stored before templates existed
+            template_ids.append(log.template_id if log.template_id is not None else template_miner.template_id(log.message))
         
-        return np.array(features_list)
+        if not features_list:
+            return np.empty((0, len(self.features)), dtype=np.int64)
+        return np.column_stack([np.array(features_list), template_miner.rarity(template_ids)])
     
     def _train_model(self, features: np.ndarray):
-        """Train the Isolation Forest model"""
+        """Train the detector ensemble"""
         if len(features) < 10:
             logger.warning("Not enough data to train the model")
             return
         
         try:
-            # Scale the features
-            self.scaler.fit(features)
-            scaled_features = self.scaler.transform(features)
-            
-            # Train the model
-            self.model.fit(scaled_features)
-            self.is_model_fitted = True
+            self.ensemble.fit(features)
             logger.info(f"Trained anomaly detection model on {len(features)} samples")
         except Exception as e:
             logger.error(f"Error training anomaly model: {str(e)}")
     
+    def get_detector_stats(self) -> Dict[str, Any]:
+        """Per-detector fit status, latency, hit rate and budget statistics"""
+        return self.ensemble.get_stats()
+    
     def _generate_indicators(self, log: LogEntry) -> List[str]:
         """Generate indicators of compromise based on log data"""
         indicators = []
@@ -209,8 +207,6 @@ class AnomalyDetector:
     async def _store_threat(self, threat: Threat):
         """Store a detected threat in the database"""
         try:
-            db = next(get_db())
-            
             # Convert Pydantic model to SQLAlchemy model
             db_threat = ThreatModel(
                 id=threat.id,
@@ -226,11 +222,17 @@ class AnomalyDetector:
                 related_logs=threat.related_logs,
                 user=threat.user,
                 anomaly_score=threat.anomaly_score,
-                details=threat.details
+                details=threat.details,
+                links_migrated=True
             )
             
-            db.add(db_threat)
-            await db.commit()
+            async with SessionLocal() as db:
+                db.add(db_threat)
+                await db.flush()
+                await threat_links.write(db, [{"id": threat.id, "related_logs": threat.related_logs, "indicators": threat.indicators}])
+                with metrics.time(DB_COMMIT_DURATION, operation="store_threat"):
+                    await db.commit()
+            THREATS_DETECTED.inc(severity=threat.severity, type=threat.type)
             logger.info(f"Stored new threat: {threat.title}")
         except Exception as e:
             logger.error(f"Error storing threat: {str(e)}")
@@ -239,7 +241,7 @@ class AnomalyDetector:
         """Analyze a single log entry for potential threats"""
         await self.detect_anomalies([log])
     
-    async def get_threats(
+    async def _query_threats(
         self,
         db,
         limit: int = 50,
@@ -247,56 +249,77 @@ class AnomalyDetector:
         severity: Optional[str] = None,
         source: Optional[str] = None,
         start_time: Optional[datetime] = None,
-        end_time: Optional[datetime] = None
-    ) -> List[Threat]:
-        """Retrieve threats with optional filtering"""
-        try:
-            query = db.query(ThreatModel)
-            
-            if status:
-                query = query.filter(ThreatModel.status == status)
-            
-            if severity:
-                query = query.filter(ThreatModel.severity == severity)
-                
-            if source:
-                query = query.filter(ThreatModel.source.contains(source))
-                
-            if start_time:
-                query = query.filter(ThreatModel.timestamp >= start_time)
-                
-            if end_time:
-                query = query.filter(ThreatModel.timestamp <= end_time)
+        end_time: Optional[datetime] = None,
+        run_id: Optional[str] = None
+    ) -> List[tuple]:
+        """Select the THREAT_FIELDS columns of matching threats as plain tuples, newest first"""
+        query = select(*[getattr(ThreatModel, field) for field in THREAT_FIELDS])
+        
+        if run_id:
+            query = query.filter(ThreatModel.run_id == run_id)
+        else:
+            query = query.filter(ThreatModel.run_id.is_(None))
+        
+        if status:
+            query = query.filter(ThreatModel.status == status)
+        
+        if severity:
+            query = query.filter(ThreatModel.severity == severity)
             
-            # Order by timestamp descending (newest first)
-            query = query.order_by(ThreatModel.timestamp.desc()).limit(limit)
+        if source:
+            query = query.filter(ThreatModel.source.contains(source))
             
-            result = await query.all()
+        if start_time:
+            query = query.filter(ThreatModel.timestamp >= start_time)
             
-            # Convert SQLAlchemy models to Pydantic models
-            threats = [
-                Threat(
-                    id=t.id,
-                    title=t.title,
-                    description=t.description,
-                    timestamp=t.timestamp,
-                    severity=t.severity,
-                    status=t.status,
-                    source=t.source,
-                    type=t.type,
-                    indicators=t.indicators,
-                    actions=t.actions,
-                    related_logs=t.related_logs,
-                    user=t.user,
-                    anomaly_score=t.anomaly_score,
-                    details=t.details
-                )
-                for t in result
-            ]
+        if end_time:
+            query = query.filter(ThreatModel.timestamp <= end_time)
+        
+        # Order by timestamp descending (newest first)
+        query = query.order_by(ThreatModel.timestamp.desc()).limit(limit)
+        
+        return (await db.execute(query)).all()
+    
+    async def get_threats(
+        self,
+        db,
+        limit: int = 50,
+        status: Optional[str] = None,
+        severity: Optional[str] = None,
+        source: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        run_id: Optional[str] = None
+    ) -> List[Threat]:
+        """Retrieve threats with optional filtering (production threats unless a replay run_id is given)"""
+        try:
+            rows = await self._query_threats(db, limit, status, severity, source, start_time, end_time, run_id)
             
-            return threats
+            # Convert column tuples to Pydantic models
+            return [Threat(**dict(zip(THREAT_FIELDS, row))) for row in rows]
         except Exception as e:
             logger.error(f"Error retrieving threats: {str(e)}")
             
             # If database query fails, return empty list
             return []
+    
+    async def get_threats_json(
+        self,
+        db,
+        limit: int = 50,
+        status: Optional[str] = None,
+        severity: Optional[str] = None,
+        source: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        run_id: Optional[str] = None
+    ) -> bytes:
+        """Retrieve threats as encoded JSON, straight from column tuples (no model objects)"""
+        try:
+            rows = await self._query_threats(db, limit, status, severity, source, start_time, end_time, run_id)
+            return rows_to_json(THREAT_FIELDS, rows)
+        except Exception as e:
+            logger.error(f"Error retrieving threats: {str(e)}")
+            
+            # If database query fails, return empty list
+            return rows_to_json(THREAT_FIELDS, [])
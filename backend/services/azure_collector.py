@@ -0,0 +1,401 @@
+import asyncio
+import os
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+import httpx
+from loguru import logger
+from sqlalchemy import select
+
+from models.database import SessionLocal
+from models.models import LogEntryModel
+from models.schemas import LogEntry
+from services.metrics import metrics
+from services.serialization import loads
+
+# Public cloud endpoints; credentials may name others (sovereign clouds, the local stand-in)
+LOGIN_ENDPOINT = "https://login.microsoftonline.com"
+MANAGEMENT_ENDPOINT = "https://management.azure.com"
+ACTIVITY_LOG_API_VERSION = "2015-04-01"
+ACTIVITY_LOG_PATH = "/subscriptions/{subscription}/providers/Microsoft.Insights/eventtypes/management/values"
+
+# Only the fields we store are requested ($select); `claims` alone is most of a full event
+SELECT_FIELDS = ",".join([
+    "eventDataId", "eventTimestamp", "category", "level", "operationName", "status", "subStatus",
+    "caller", "httpRequest", "resourceId", "resourceGroupName", "correlationId",
+])
+
+AZURE_REQUESTS = metrics.counter("azure_requests_total", "Azure API requests", ["status"])
+AZURE_EVENTS = metrics.counter("azure_events_total", "Azure activity log events stored", ["subscription"])
+
+_LEVELS = {"Critical": "error", "Error": "error", "Warning": "warning"}
+# Azure timestamps carry 7 fractional digits; datetime takes at most 6
+_EXTRA_DIGITS = re.compile(r"(\.\d{6})\d+")
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """Naive local time of an Azure ISO 8601 timestamp"""
+    timestamp = datetime.fromisoformat(_EXTRA_DIGITS.sub(r"\1", value).replace("Z", "+00:00"))
+    return datetime.fromtimestamp(timestamp.timestamp()) if timestamp.tzinfo else timestamp
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_activity_event(event: Dict[str, Any], subscription: str) -> LogEntry:
+    """Log entry for one Activity Log event; its eventDataId is the log id, so re-reads are recognised"""
+    category = (event.get("category") or {}).get("value") or "Activity"
+    operation = event.get("operationName") or {}
+    status = (event.get("status") or {}).get("value")
+    message = operation.get("localizedValue") or operation.get("value") or "Azure activity"
+    if status:
+        message = f"{message}: {status}"
+
+    details = {
+        "subscription_id": subscription,
+        "category": category,
+        "operation": operation.get("value"),
+        "status": status,
+        "sub_status": (event.get("subStatus") or {}).get("value"),
+        "user": event.get("caller"),
+        "ip_address": (event.get("httpRequest") or {}).get("clientIpAddress"),
+        "resource_id": event.get("resourceId"),
+        "resource_group": event.get("resourceGroupName"),
+        "correlation_id": event.get("correlationId"),
+    }
+    return LogEntry(
+        id=event.get("eventDataId") or str(uuid.uuid4()),
+        timestamp=_parse_timestamp(event["eventTimestamp"]) if event.get("eventTimestamp") else datetime.now(),
+        source=f"Azure-{category}",
+        level=_LEVELS.get(event.get("level"), "info"),
+        message=message,
+        details={key: value for key, value in details.items() if value},
+    )
+
+
+class AzureRequestError(Exception):
+    """An Azure API request that failed for good (after retries, or with a client error)"""
+
+
+class AdaptiveLimiter:
+    """
+    Limit on concurrent requests with additive increase / multiplicative decrease:
+    throttling halves the limit and holds back new requests for the Retry-After time,
+    and every success adds 1/limit, i.e. one per limit's worth of successful requests
+    """
+
+    def __init__(self, maximum: int, limit: Optional[float] = None):
+        self.maximum = maximum
+        self.limit = float(min(limit or maximum, maximum))
+        self.active = 0
+        self._condition = asyncio.Condition()
+        self._resume_at = 0.0
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def throttled(self, pause: float = 0.0):
+        self.limit = max(1.0, self.limit / 2)
+        self._resume_at = max(self._resume_at, time.monotonic() + pause)
+
+    def succeeded(self):
+        self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+
+
+class AzureActivityCollector:
+    """
+    Collects Azure Activity Log events for every configured subscription.
+
+    A collection run reads each subscription from its high-water mark, minus
+    `overlap_minutes` to pick up late events, up to now. The range is cut into
+    `slice_minutes` slices, which are fetched concurrently; each slice follows
+    its nextLink continuation pages in order. All requests share an adaptive
+    concurrency limit of at most `max_concurrency`. On 429 responses (or when
+    the remaining-reads header runs low) the limit is halved and new requests
+    wait for Retry-After. Server errors are retried with exponential backoff.
+
+    Pages are queued to a single writer, which stores them in batches of
+    `batch_size` events. Events already stored are skipped by their
+    eventDataId. A subscription's high-water mark is the end of the last slice
+    such that it and every slice before it have been stored. It is committed
+    as the checkpoint `azure:<subscription>`, together with the batch that
+    completes it.
+
+    Credentials are those of credentials_manager, optionally with
+    `subscription_ids` (several subscriptions), `categories` (only keep these
+    event categories), and `login_endpoint` / `management_endpoint` (other
+    clouds, or a local stand-in server).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        slice_minutes: int = 60,
+        lookback_hours: int = 24,
+        overlap_minutes: int = 15,
+        batch_size: int = 2000,
+        max_retries: int = 5,
+        timeout: float = 30.0
+    ):
+        """Initialize the collector; max_concurrency defaults to SENTINEL_AZURE_CONCURRENCY or 8"""
+        self.max_concurrency = max_concurrency or int(os.environ.get("SENTINEL_AZURE_CONCURRENCY", "8"))
+        self.slice_seconds = slice_minutes * 60
+        self.lookback_seconds = lookback_hours * 3600
+        self.overlap_seconds = overlap_minutes * 60
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter: Optional[AdaptiveLimiter] = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._credentials: Optional[Dict[str, Any]] = None
+        self.last_run: Dict[str, Any] = {}
+
+    @staticmethod
+    def subscriptions(credentials: Dict[str, Any]) -> List[str]:
+        return list(credentials.get("subscription_ids") or [credentials["subscription_id"]])
+
+    async def _access_token(self, client: httpx.AsyncClient, credentials: Dict[str, Any], refresh: bool = False) -> str:
+        """Client-credentials token for the management API, cached until shortly before it expires"""
+        async with self._token_lock:
+            if self._token and not refresh and time.monotonic() < self._token_expires:
+                return self._token
+            login = credentials.get("login_endpoint", LOGIN_ENDPOINT).rstrip("/")
+            management = credentials.get("management_endpoint", MANAGEMENT_ENDPOINT).rstrip("/")
+            response = await client.post(
+                f"{login}/{credentials['tenant_id']}/oauth2/v2.0/token",
+                data={
+                    "grant_type": "client_credentials",
+                    "client_id": credentials["client_id"],
+                    "client_secret": credentials["client_secret"],
+                    "scope": f"{management}/.default",
+                },
+            )
+            if response.status_code != 200:
+                raise AzureRequestError(f"Token request failed with HTTP {response.status_code}")
+            token = loads(response.content)
+            self._token = token["access_token"]
+            self._token_expires = time.monotonic() + int(token.get("expires_in", 3600)) - 300
+            return self._token
+
+    async def _get(
+        self,
+        client: httpx.AsyncClient,
+        credentials: Dict[str, Any],
+        url: str,
+        params: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Any]:
+        """GET a management API page, retrying throttled, failed and unauthorized requests"""
+        run = self.last_run
+        refresh = False
+        for attempt in range(self.max_retries + 1):
+            token = await self._access_token(client, credentials, refresh)
+            refresh = False
+            try:
+                async with self.limiter:
+                    response = await client.get(url, params=params, headers={"Authorization": f"Bearer {token}"})
+            except httpx.TransportError as e:
+                AZURE_REQUESTS.inc(status="error")
+                run["retries"] += 1
+                logger.warning(f"Azure request failed ({str(e) or type(e).__name__}), retrying")
+                await asyncio.sleep(min(60, 2 ** attempt) * (0.5 + random.random()))
+                continue
+
+            AZURE_REQUESTS.inc(status=str(response.status_code))
+            run["requests"] += 1
+            if response.status_code == 200:
+                self.limiter.succeeded()
+                remaining = response.headers.get("x-ms-ratelimit-remaining-subscription-reads")
+                if remaining is not None and int(remaining) < self.max_concurrency:
+                    self.limiter.throttled()
+                return loads(response.content)
+            if response.status_code == 429:
+                run["throttled"] += 1
+                retry_after = float(response.headers.get("Retry-After", 2 ** attempt))
+                self.limiter.throttled(retry_after)
+                continue
+            if response.status_code == 401 and attempt == 0:
+                refresh = True
+                continue
+            if response.status_code >= 500:
+                run["retries"] += 1
+                await asyncio.sleep(min(60, 2 ** attempt) * (0.5 + random.random()))
+                continue
+            raise AzureRequestError(f"HTTP {response.status_code} from {url}")
+        raise AzureRequestError(f"Giving up on {url} after {self.max_retries + 1} attempts")
+
+    async def _fetch_slice(
+        self,
+        client: httpx.AsyncClient,
+        credentials: Dict[str, Any],
+        subscription: str,
+        window: Tuple[float, float],
+        queue: asyncio.Queue
+    ):
+        """Queue every page of one subscription's time slice, then a marker saying whether it completed"""
+        management = credentials.get("management_endpoint", MANAGEMENT_ENDPOINT).rstrip("/")
+        url = management + ACTIVITY_LOG_PATH.format(subscription=subscription)
+        params = {
+            "api-version": ACTIVITY_LOG_API_VERSION,
+            "$filter": f"eventTimestamp ge '{_iso(window[0])}' and eventTimestamp le '{_iso(window[1])}'",
+            "$select": SELECT_FIELDS,
+        }
+        try:
+            while url:
+                page = await self._get(client, credentials, url, params)
+                if page.get("value"):
+                    await queue.put(("page", subscription, page["value"]))
+                # nextLink carries the query and the continuation token
+                url, params = page.get("nextLink"), None
+            await queue.put(("done", subscription, window))
+        except Exception as e:
+            logger.error(f"Error collecting Azure activity logs for {subscription} from {_iso(window[0])}: {str(e)}")
+            await queue.put(("failed", subscription, window))
+
+    async def _store(self, collector, logs: List[LogEntry], checkpoints: Dict[str, Dict[str, Any]]) -> int:
+        """Store the events not stored yet, committing the checkpoints with them"""
+        unique = {log.id: log for log in logs}
+        async with SessionLocal() as db:
+            ids, existing = list(unique), set()
+            for i in range(0, len(ids), 500):
+                result = await db.execute(select(LogEntryModel.id).where(LogEntryModel.id.in_(ids[i:i + 500])))
+                existing.update(result.scalars())
+            fresh = [log for log_id, log in unique.items() if log_id not in existing]
+            if fresh:
+                await collector.store_logs(db, fresh, checkpoints)
+            elif checkpoints:
+                await collector.save_checkpoints(db, checkpoints)
+        self.last_run["duplicates"] += len(logs) - len(fresh)
+        return len(fresh)
+
+    async def _write(self, collector, queue: asyncio.Queue, slices: Dict[str, List[Tuple[float, float]]], categories):
+        """Batch queued pages into commits and advance each subscription's high-water mark"""
+        run = self.last_run
+        pending: List[LogEntry] = []
+        checkpoints: Dict[str, Dict[str, Any]] = {}
+        completed = {subscription: set() for subscription in slices}
+        next_slice = {subscription: 0 for subscription in slices}
+        failed = False
+
+        async def flush():
+            nonlocal pending, checkpoints, failed
+            if not pending and not checkpoints:
+                return
+            try:
+                # Once a batch is lost, no later high-water mark may be committed past it
+                stored = await self._store(collector, pending, {} if failed else checkpoints)
+                run["stored"] += stored
+            except Exception as e:
+                failed = True
+                run["errors"] += 1
+                logger.error(f"Error storing Azure activity logs: {str(e)}")
+            pending, checkpoints = [], {}
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            kind, subscription, payload = item
+            if kind == "page":
+                run["pages"] += 1
+                for event in payload:
+                    try:
+                        log = parse_activity_event(event, subscription)
+                    except Exception:
+                        run["parse_errors"] += 1
+                        continue
+                    if categories is None or log.details["category"] in categories:
+                        pending.append(log)
+                AZURE_EVENTS.inc(len(payload), subscription=subscription)
+                if len(pending) >= self.batch_size:
+                    await flush()
+            elif kind == "done":
+                completed[subscription].add(payload)
+                ordered = slices[subscription]
+                advanced = False
+                while next_slice[subscription] < len(ordered) and ordered[next_slice[subscription]] in completed[subscription]:
+                    run["watermarks"][subscription] = _iso(ordered[next_slice[subscription]][1])
+                    next_slice[subscription] += 1
+                    advanced = True
+                if advanced:
+                    position = int(ordered[next_slice[subscription] - 1][1])
+                    checkpoints[f"azure:{subscription}"] = {"position": position}
+            else:
+                run["errors"] += 1
+        await flush()
+
+    async def collect(self, collector, credentials: Dict[str, Any]) -> int:
+        """Run one collection for all subscriptions; returns the number of new events stored"""
+        started = time.monotonic()
+        now = time.time()
+        self.last_run = {
+            "started_at": datetime.now(), "requests": 0, "pages": 0, "stored": 0, "duplicates": 0,
+            "throttled": 0, "retries": 0, "errors": 0, "parse_errors": 0, "watermarks": {},
+        }
+        # Asyncio primitives belong to the running loop; the limit carries over between runs
+        self.limiter = AdaptiveLimiter(self.max_concurrency, self.limiter.limit if self.limiter else None)
+        self._token_lock = asyncio.Lock()
+        if credentials is not self._credentials:
+            # Reloaded credentials may be for another app or tenant
+            self._credentials = credentials
+            self._token = None
+
+        # Another worker may have held the ingest role before
+        async with SessionLocal() as db:
+            await collector.load_checkpoints(db, prefix="azure:")
+
+        slices: Dict[str, List[Tuple[float, float]]] = {}
+        for subscription in self.subscriptions(credentials):
+            checkpoint = collector.checkpoints.get(f"azure:{subscription}")
+            start = checkpoint["position"] - self.overlap_seconds if checkpoint else now - self.lookback_seconds
+            bounds = list(range(int(start), int(now), self.slice_seconds)) + [now]
+            slices[subscription] = list(zip(bounds, bounds[1:]))
+
+        categories = set(credentials["categories"]) if credentials.get("categories") else None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=4 * self.max_concurrency)
+        writer = asyncio.create_task(self._write(collector, queue, slices, categories))
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+                await asyncio.gather(*[
+                    self._fetch_slice(client, credentials, subscription, window, queue)
+                    for subscription, windows in slices.items()
+                    for window in windows
+                ])
+        finally:
+            await queue.put(None)
+            await writer
+
+        self.last_run["duration_seconds"] = round(time.monotonic() - started, 3)
+        self.last_run["request_limit"] = round(self.limiter.limit, 2)
+        logger.info(
+            f"Azure collection stored {self.last_run['stored']} new events from {self.last_run['pages']} pages "
+            f"in {self.last_run['duration_seconds']}s ({self.last_run['throttled']} throttled)"
+        )
+        return self.last_run["stored"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "request_limit": round(self.limiter.limit, 2) if self.limiter else self.max_concurrency,
+            "last_run": self.last_run,
+        }
+
+
+# Create a singleton instance
+azure_collector = AzureActivityCollector()
@@ -0,0 +1,342 @@
+import asyncio
+import math
+import os
+import socket
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from loguru import logger
+from sqlalchemy import select, delete, func
+
+from models.database import SessionLocal, get_sync_engine
+from models.models import BlockedNetworkModel
+from models.schemas import LogEntry
+from services.metrics import metrics
+
+BLOCKLIST_HITS = metrics.counter("blocklist_hits_total", "Ingested events from blocked addresses", ["action"])
+BLOCKLIST_SIZE = metrics.gauge("blocklist_ranges", "Merged address ranges in the blocklist index", ["family"])
+
+_FAMILIES = (4, 6)
+
+def parse_address(value: str) -> Optional[Tuple[int, int]]:
+    """(family, integer) of an IP address string, or None when it is not one"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, value), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, value.split("%", 1)[0]), "big")
+    except (OSError, TypeError, AttributeError):
+        return None
+    # IPv4-mapped addresses (::ffff:a.b.c.d) are checked against the IPv4 blocks
+    if value >> 32 == 0xFFFF:
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+_COLUMNS = ("network", "family", "range_start", "range_end", "reason", "threat_id", "updated_at", "expires_at")
+_UPSERT = (
+    f"INSERT INTO blocked_networks ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT (network) DO UPDATE SET reason = excluded.reason, threat_id = excluded.threat_id, "
+    "updated_at = excluded.updated_at, "
+    # Re-blocking never shortens a block: the later expiry wins and no expiry (NULL) beats both
+    "expires_at = CASE WHEN blocked_networks.expires_at IS NULL OR excluded.expires_at IS NULL THEN NULL "
+    "ELSE MAX(blocked_networks.expires_at, excluded.expires_at) END"
+)
+
+def _sql_value(value):
+    # The format SQLAlchemy's SQLite DateTime type reads back
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f") if isinstance(value, datetime) else value
+
+def parse_network(value: str) -> Tuple[str, int, int, int]:
+    """(normalized CIDR, family, first, last address) of an address or CIDR; host bits are cleared"""
+    address, _, prefix = value.strip().partition("/")
+    parsed = parse_address(address)
+    if parsed is None:
+        raise ValueError(f"{value!r} is not an IP address or network")
+    family, number = parsed
+    bits = 32 if family == 4 else 128
+    try:
+        length = int(prefix) if prefix else bits
+    except ValueError:
+        raise ValueError(f"{value!r} has an invalid prefix length")
+    if prefix and family == 4 and ":" in address:
+        # ::ffff:a.b.c.d/120 is a.b.c.d/24
+        length -= 96
+    if not 0 <= length <= bits:
+        raise ValueError(f"{value!r} has an invalid prefix length")
+    host = (1 << (bits - length)) - 1
+    start = number & ~host
+    name = socket.inet_ntop(socket.AF_INET if family == 4 else socket.AF_INET6, start.to_bytes(bits // 8, "big"))
+    return f"{name}/{length}", family, start, start | host
+
+def _hex(value: int) -> str:
+    return f"{value:032x}"
+
+
+class _RangeIndex:
+    """
+    Sorted, non-overlapping address ranges of one family with the latest
+    expiry (epoch seconds, inf for none) of the blocks merged into each.
+    IPv4 bounds are kept in compact arrays (16 bytes per range).
+    """
+
+    def __init__(self, family: int):
+        self.family = family
+        self.starts = array("I") if family == 4 else []
+        self.ends = array("I") if family == 4 else []
+        self.expires = array("d")
+
+    @classmethod
+    def build(cls, family: int, ranges: Iterable[Tuple[int, int, float]]) -> "_RangeIndex":
+        """Index (start, end, expires) ranges given in start order; overlapping and adjacent ones are merged"""
+        index = cls(family)
+        starts, ends, expires = index.starts, index.ends, index.expires
+        for start, end, expiry in ranges:
+            if ends and start <= ends[-1] + 1:
+                if end > ends[-1]:
+                    ends[-1] = end
+                if expiry > expires[-1]:
+                    expires[-1] = expiry
+            else:
+                starts.append(start)
+                ends.append(end)
+                expires.append(expiry)
+        return index
+
+    def find(self, value: int, now: float) -> bool:
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i] and self.expires[i] > now
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def ranges(self) -> Iterable[Tuple[int, int, float]]:
+        return zip(self.starts, self.ends, self.expires)
+
+
+class Blocklist:
+    """
+    Blocked IPv4/IPv6 addresses and CIDR networks with optional expiry
+
+    Blocks are stored in the `blocked_networks` table. Each worker keeps an
+    index in memory: per family, the blocked networks are merged into
+    sorted, non-overlapping ranges, so `contains` is one binary search
+    (O(log n)) whatever the number of blocks. A million IPv4 ranges take
+    about 16 MB.
+
+    New blocks go into a small delta index that is checked as well. Once
+    `delta_limit` blocks have accumulated, or blocks have expired, or
+    another worker changed the table (`refresh`), the index is rebuilt
+    from the table in a thread and swapped in. An expired block stops
+    matching straight away unless it was merged with a longer-lived
+    neighbour; the next rebuild separates them.
+    """
+
+    def __init__(self, mode: Optional[str] = None, delta_limit: int = 4096):
+        """Initialize the blocklist; SENTINEL_BLOCKLIST_MODE ("tag" or "drop") sets what ingest does with blocked events"""
+        self.mode = mode or os.environ.get("SENTINEL_BLOCKLIST_MODE", "tag")
+        self.delta_limit = delta_limit
+        self._main = {family: _RangeIndex(family) for family in _FAMILIES}
+        self._delta = {family: _RangeIndex(family) for family in _FAMILIES}
+        # Blocks added since the last rebuild began: (sequence, family, start, end, expires)
+        self._recent: List[Tuple[int, int, int, int, float]] = []
+        self._sequence = 0
+        self._next_expiry = math.inf
+        self._signature = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.stats = {"blocked": 0, "unblocked": 0, "rebuilds": 0, "last_rebuild_ms": 0.0}
+        for family in _FAMILIES:
+            BLOCKLIST_SIZE.set_function(lambda family=family: len(self._main[family]) + len(self._delta[family]), family=f"ipv{family}")
+
+    @property
+    def active(self) -> bool:
+        return any(self._main.values()) or any(self._delta.values())
+
+    def contains(self, address: str, now: Optional[float] = None) -> bool:
+        """Whether an address is blocked now; False for anything that is not an IP address"""
+        parsed = parse_address(address)
+        if parsed is None:
+            return False
+        family, value = parsed
+        now = now or time.time()
+        return self._main[family].find(value, now) or self._delta[family].find(value, now)
+
+    def screen(self, log_entries: List[LogEntry]) -> List[LogEntry]:
+        """
+        Check the `ip_address` of each log entry at ingest: entries from blocked addresses are
+        tagged (`details.blocked`), or left out when `mode` is "drop"; returns the entries to store
+        """
+        if not self.active:
+            return log_entries
+        now = time.time()
+        kept, blocked = [], 0
+        for log_entry in log_entries:
+            address = log_entry.details.get("ip_address") if log_entry.details else None
+            if address and self.contains(address, now):
+                blocked += 1
+                if self.mode == "drop":
+                    continue
+                log_entry.details["blocked"] = True
+            kept.append(log_entry)
+        if blocked:
+            BLOCKLIST_HITS.inc(blocked, action=self.mode)
+        return kept
+
+    async def block(
+        self,
+        networks: List[str],
+        ttl_seconds: Optional[float] = None,
+        reason: Optional[str] = None,
+        threat_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Block addresses or CIDR networks (for `ttl_seconds`, or until removed); re-blocking keeps the later expiry"""
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl_seconds) if ttl_seconds else None
+        rows = []
+        for network in networks:
+            name, family, start, end = parse_network(network)
+            rows.append({
+                "network": name,
+                "family": family,
+                "range_start": _hex(start),
+                "range_end": _hex(end),
+                "reason": reason,
+                "threat_id": threat_id,
+                "updated_at": now,
+                "expires_at": expires_at,
+            })
+
+        # Feeds can hold millions of networks: one executemany on the sync driver, off the event loop
+        await asyncio.to_thread(self._store, rows)
+
+        expiry = expires_at.timestamp() if expires_at else math.inf
+        for row in rows:
+            self._sequence += 1
+            self._recent.append((self._sequence, row["family"], int(row["range_start"], 16), int(row["range_end"], 16), expiry))
+        self._next_expiry = min(self._next_expiry, expiry)
+        self.stats["blocked"] += len(rows)
+
+        if len(self._recent) > self.delta_limit:
+            await self.rebuild()
+        else:
+            self._delta = self._build_delta(self._recent)
+        return [{k: row[k] for k in ("network", "reason", "threat_id", "expires_at")} for row in rows]
+
+    def _store(self, rows: List[Dict[str, Any]]):
+        # Plain driver executemany; SQLAlchemy's per-row parameter processing would be 4x slower
+        with get_sync_engine().begin() as conn:
+            conn.exec_driver_sql(_UPSERT, [
+                tuple(_sql_value(row[column]) for column in _COLUMNS) for row in rows
+            ])
+
+    async def unblock(self, networks: List[str]) -> int:
+        """Remove blocks; returns how many existed"""
+        names = [parse_network(network)[0] for network in networks]
+        async with SessionLocal() as db:
+            result = await db.execute(delete(BlockedNetworkModel).where(BlockedNetworkModel.network.in_(names)))
+            await db.commit()
+        if result.rowcount:
+            self.stats["unblocked"] += result.rowcount
+            await self.rebuild()
+        return result.rowcount
+
+    def _build_delta(self, recent) -> Dict[int, _RangeIndex]:
+        return {
+            family: _RangeIndex.build(family, sorted((start, end, expiry) for _, f, start, end, expiry in recent if f == family))
+            for family in _FAMILIES
+        }
+
+    def _load(self, now: datetime):
+        """Build both families' indexes from the table (runs in a thread)"""
+        indexes, next_expiry = {}, math.inf
+        engine = get_sync_engine()
+        with engine.connect() as conn:
+            for family in _FAMILIES:
+                result = conn.execution_options(stream_results=True).execute(
+                    select(BlockedNetworkModel.range_start, BlockedNetworkModel.range_end, BlockedNetworkModel.expires_at)
+                    .where(BlockedNetworkModel.family == family)
+                    .where((BlockedNetworkModel.expires_at.is_(None)) | (BlockedNetworkModel.expires_at > now))
+                    .order_by(BlockedNetworkModel.range_start)
+                )
+                soonest = [next_expiry]
+
+                def ranges():
+                    for start, end, expires_at in result:
+                        expiry = expires_at.timestamp() if expires_at else math.inf
+                        if expiry < soonest[0]:
+                            soonest[0] = expiry
+                        yield int(start, 16), int(end, 16), expiry
+
+                indexes[family] = _RangeIndex.build(family, ranges())
+                next_expiry = soonest[0]
+        return indexes, next_expiry
+
+    async def rebuild(self):
+        """Reload the index from the table and drop expired blocks"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            started = time.perf_counter()
+            sequence = self._sequence
+            now = datetime.now()
+            try:
+                async with SessionLocal() as db:
+                    await db.execute(delete(BlockedNetworkModel).where(BlockedNetworkModel.expires_at <= now))
+                    await db.commit()
+                    self._signature = await self._table_signature(db)
+                indexes, next_expiry = await asyncio.to_thread(self._load, now)
+            except Exception as e:
+                logger.error(f"Error rebuilding blocklist: {str(e)}")
+                return
+            # Blocks added while loading may be missing from the table snapshot; keep them in the delta
+            self._recent = [entry for entry in self._recent if entry[0] > sequence]
+            self._main = indexes
+            self._delta = self._build_delta(self._recent)
+            self._next_expiry = min([next_expiry] + [entry[4] for entry in self._recent])
+            self.stats["rebuilds"] += 1
+            self.stats["last_rebuild_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def _table_signature(self, db):
+        return tuple((await db.execute(
+            select(func.count(), func.max(BlockedNetworkModel.updated_at)).select_from(BlockedNetworkModel)
+        )).one())
+
+    async def refresh(self):
+        """Rebuild when blocks expired or the table changed (e.g. another worker blocked something)"""
+        try:
+            if time.time() >= self._next_expiry:
+                await self.rebuild()
+                return
+            async with SessionLocal() as db:
+                signature = await self._table_signature(db)
+            if signature != self._signature:
+                await self.rebuild()
+        except Exception as e:
+            logger.error(f"Error refreshing blocklist: {str(e)}")
+
+    async def list_blocks(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(
+                    BlockedNetworkModel.network, BlockedNetworkModel.reason, BlockedNetworkModel.threat_id,
+                    BlockedNetworkModel.updated_at, BlockedNetworkModel.expires_at
+                )
+                .where((BlockedNetworkModel.expires_at.is_(None)) | (BlockedNetworkModel.expires_at > datetime.now()))
+                .order_by(BlockedNetworkModel.updated_at.desc())
+                .offset(offset).limit(limit)
+            )
+            return [dict(row._mapping) for row in result]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "ranges": {f"ipv{family}": len(self._main[family]) + len(self._delta[family]) for family in _FAMILIES},
+            "pending": len(self._recent),
+            "next_expiry": None if self._next_expiry == math.inf else datetime.fromtimestamp(self._next_expiry),
+        }
+
+
+# Create a singleton instance
+blocklist = Blocklist()
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+from loguru import logger
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from models.database import engine
+from models.models import WorkerModel, LeaseModel
+from models.schemas import LogEntry
+
+# Roles that exactly one worker holds at a time
+INGEST_ROLE = "ingest"
+LEADER_ROLE = "leader"
+
+# Log fields that can be used as the shard key
+SHARD_KEYS = ["source", "user", "ip_address"]
+
+
+class ClusterCoordinator:
+    """
+    Coordinate several API worker processes on one host through the database.
+
+    Every worker heartbeats into the `workers` table and derives its position among
+    the live workers, which decides the analysis shards it owns. Singleton roles
+    (ingestion and the leader that runs periodic jobs) are time-limited leases in
+    the `leases` table that the holder keeps renewing. With a single worker all of
+    this is skipped and the process owns every shard and every role.
+
+    Heartbeats run in their own task (`start`) every third of the lease, so a lease
+    is renewed twice before it can expire however long the analysis cycle takes.
+    A worker stops using a role as soon as its own lease has run out locally or a
+    renewal fails, before any other worker can take it over in the database.
+    """
+
+    def __init__(
+        self,
+        worker_count: Optional[int] = None,
+        num_shards: int = 64,
+        shard_key: Optional[str] = None,
+        lease_seconds: float = 30
+    ):
+        """Initialize the coordinator from arguments or SENTINEL_* environment variables"""
+        self.worker_count = worker_count or int(os.environ.get("SENTINEL_WORKERS", "1"))
+        self.num_shards = num_shards
+        self.shard_key = shard_key or os.environ.get("SENTINEL_SHARD_KEY", "source")
+        if self.shard_key not in SHARD_KEYS:
+            raise ValueError(f"Shard key must be one of {SHARD_KEYS}")
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = lease_seconds / 3
+
+        self.hostname = socket.gethostname()
+        self.pid = os.getpid()
+        self.worker_id = f"{self.hostname}-{self.pid}-{uuid.uuid4().hex[:6]}"
+
+        self.live_workers: List[str] = [self.worker_id]
+        self.roles = set()
+        if not self.enabled:
+            self.roles = {INGEST_ROLE, LEADER_ROLE}
+        # role -> monotonic time the lease this worker last wrote runs out
+        self._held_until: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+        logger.info(f"Cluster coordinator initialized (worker {self.worker_id}, {self.worker_count} worker(s))")
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_count > 1
+
+    def shard_for(self, key: Optional[str]) -> int:
+        """Stable shard number for a key (crc32 so every process agrees)"""
+        return zlib.crc32((key or "").encode()) % self.num_shards
+
+    def shard_for_log(self, log_entry: LogEntry) -> int:
+        """Shard number for a log entry based on the configured shard key"""
+        if self.shard_key == "source":
+            return self.shard_for(log_entry.source)
+
+        details = log_entry.details or {}
+        return self.shard_for(str(details.get(self.shard_key, "")))
+
+    def owned_shards(self) -> Optional[List[int]]:
+        """Shards this worker analyzes, or None when it owns all of them"""
+        if not self.enabled:
+            return None
+
+        if self.worker_id not in self.live_workers:
+            return []
+
+        index = self.live_workers.index(self.worker_id)
+        return [shard for shard in range(self.num_shards) if shard % len(self.live_workers) == index]
+
+    def holds(self, role: str) -> bool:
+        """Whether this worker holds a role; an expired lease is dropped here, not at the next heartbeat"""
+        if role not in self.roles:
+            return False
+        if self.enabled and time.monotonic() >= self._held_until.get(role, 0.0):
+            logger.warning(f"Worker {self.worker_id} lease on role {role} expired before it was renewed")
+            self.roles.discard(role)
+            return False
+        return True
+
+    async def heartbeat(self):
+        """Refresh this worker's registration, the live worker list and role leases"""
+        if not self.enabled:
+            return
+
+        now = datetime.now()
+        # Taken before the writes, so the local deadline never outlasts the stored one
+        started = time.monotonic()
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    insert(WorkerModel)
+                    .values(worker_id=self.worker_id, hostname=self.hostname, pid=self.pid, started_at=now, heartbeat_at=now)
+                    .on_conflict_do_update(index_elements=["worker_id"], set_={"heartbeat_at": now})
+                )
+
+                result = await conn.execute(
+                    select(WorkerModel.worker_id)
+                    .where(WorkerModel.heartbeat_at >= now - timedelta(seconds=self.lease_seconds))
+                    .order_by(WorkerModel.worker_id)
+                )
+                live_workers = [row[0] for row in result]
+
+            if live_workers != self.live_workers:
+                logger.info(f"Cluster membership changed: {len(live_workers)} live worker(s)")
+            self.live_workers = live_workers
+
+            for role in (INGEST_ROLE, LEADER_ROLE):
+                await self._acquire(role, now, started)
+        except Exception as e:
+            logger.error(f"Error in cluster heartbeat: {str(e)}")
+            # A lease that could not be renewed may be taken over; stop acting on it now
+            if self.roles:
+                logger.warning(f"Worker {self.worker_id} dropped role(s) {sorted(self.roles)} after a failed renewal")
+                self.roles.clear()
+
+    async def _acquire(self, role: str, now: datetime, started: float) -> bool:
+        """Take or renew a role lease; succeeds only if it is free, expired or already ours"""
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                update(LeaseModel)
+                .where(LeaseModel.role == role)
+                .where((LeaseModel.holder == self.worker_id) | (LeaseModel.expires_at < now))
+                .values(holder=self.worker_id, expires_at=expires_at)
+            )
+            acquired = result.rowcount > 0
+
+            if not acquired:
+                result = await conn.execute(
+                    insert(LeaseModel)
+                    .values(role=role, holder=self.worker_id, expires_at=expires_at)
+                    .on_conflict_do_nothing(index_elements=["role"])
+                )
+                acquired = result.rowcount > 0
+
+        if acquired:
+            self._held_until[role] = started + self.lease_seconds
+        if acquired and role not in self.roles:
+            logger.info(f"Worker {self.worker_id} acquired role {role}")
+            self.roles.add(role)
+        elif not acquired and role in self.roles:
+            logger.warning(f"Worker {self.worker_id} lost role {role}")
+            self.roles.discard(role)
+
+        return acquired
+
+    async def run(self):
+        """Heartbeat every `heartbeat_interval` seconds"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self.heartbeat()
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def run_periodic_jobs(self):
+        """Housekeeping that only the leader runs"""
+        if not self.enabled:
+            return
+
+        try:
+            # Forget workers that stopped heartbeating long ago
+            cutoff = datetime.now() - timedelta(seconds=10 * self.lease_seconds)
+            async with engine.begin() as conn:
+                await conn.execute(delete(WorkerModel).where(WorkerModel.heartbeat_at < cutoff))
+        except Exception as e:
+            logger.error(f"Error running leader jobs: {str(e)}")
+
+    async def shutdown(self):
+        """Release leases and deregister so other workers take over immediately"""
+        if not self.enabled:
+            return
+
+        await self.stop()
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(delete(LeaseModel).where(LeaseModel.holder == self.worker_id))
+                await conn.execute(delete(WorkerModel).where(WorkerModel.worker_id == self.worker_id))
+            self.roles.clear()
+        except Exception as e:
+            logger.error(f"Error leaving cluster: {str(e)}")
+
+    def get_status(self) -> Dict[str, Any]:
+        shards = self.owned_shards()
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "worker_count": self.worker_count,
+            "live_workers": self.live_workers,
+            "roles": sorted(self.roles),
+            "shard_key": self.shard_key,
+            "num_shards": self.num_shards,
+            "owned_shards": list(range(self.num_shards)) if shards is None else shards,
+        }
+
+
+# Create a singleton instance (one per worker process)
+cluster_coordinator = ClusterCoordinator()
@@ -1,114 +1,287 @@
-
+import asyncio
 import os
 import json
-import logging
+import time
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
+import httpx
+from loguru import logger
+
+from services.azure_collector import LOGIN_ENDPOINT, MANAGEMENT_ENDPOINT
+from services.threat_enricher import threat_enricher
+
+AZURE_FILE = 'azure_credentials.json'
+GEMINI_FILE = 'gemini_api_key.txt'
+
+class _Snapshot:
+    """Credentials read from the directory at one point; replaced as a whole, never modified"""
 
-logger = logging.getLogger(__name__)
+    def __init__(self, version: int, azure: Optional[Dict[str, Any]], gemini: Optional[str], signatures: Dict[str, Any]):
+        self.version = version
+        self.azure = azure
+        self.gemini = gemini
+        self.signatures = signatures
+        self.loaded_at = time.time()
 
 class CredentialsManager:
-    """Manage secure access to Azure and Gemini credentials"""
-    
-    def __init__(self, credentials_dir: str = None):
-        """Initialize the credentials manager with the directory location"""
+    """
+    Manage secure access to Azure and Gemini credentials
+
+    The credentials are held in memory. They are reloaded when the files in
+    the credentials directory change: `watch` polls their mtime, size and
+    inode every `poll_interval` seconds. A reload reads both files and then
+    swaps in a new snapshot. A file caught half-written keeps the previous
+    credentials until the next poll. Readers therefore never do file I/O
+    and never see a mix of old and new credentials.
+
+    Validation checks the format in memory. `revalidate` adds a network
+    check: an Azure token request and a Gemini model lookup. It runs in the
+    background, and its result is cached until `validation_ttl` expires or
+    the credentials change.
+    """
+
+    def __init__(self, credentials_dir: str = None, poll_interval: Optional[float] = None,
+                 validation_ttl: Optional[float] = None):
+        """
+        Initialize the credentials manager with the directory location; SENTINEL_CREDENTIALS_POLL
+        sets the poll interval (default 5 seconds), SENTINEL_CREDENTIALS_VALIDATION_TTL how long
+        network validation results are kept (default 600 seconds)
+        """
         self.credentials_dir = credentials_dir or os.environ.get('CREDENTIALS_DIR', './credentials')
-        self._azure_credentials = None
-        self._gemini_api_key = None
-        
+        self.poll_interval = poll_interval or float(os.environ.get('SENTINEL_CREDENTIALS_POLL', '5'))
+        self.validation_ttl = validation_ttl or float(os.environ.get('SENTINEL_CREDENTIALS_VALIDATION_TTL', '600'))
+        self.reloads = 0
+        # kind -> (credentials checked, checked_at, valid, error) of the last network validation
+        self._validation: Dict[str, Tuple[Any, float, bool, Optional[str]]] = {}
+        # Signature of each file that last failed to load, so the error is logged once
+        self._failed: Dict[str, Any] = {}
+        self._validating: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+
         # Ensure the credentials directory exists
         Path(self.credentials_dir).mkdir(parents=True, exist_ok=True)
-    
+        self._snapshot = _Snapshot(0, None, None, {})
+        self.reload()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.credentials_dir, name)
+
+    def _signatures(self) -> Dict[str, Any]:
+        """(mtime, size, inode) of each credentials file, None when it is missing"""
+        signatures = {}
+        for name in (AZURE_FILE, GEMINI_FILE):
+            try:
+                st = os.stat(self._path(name))
+                signatures[name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+            except FileNotFoundError:
+                signatures[name] = None
+        return signatures
+
+    def _read(self, name: str) -> Any:
+        with open(self._path(name), 'r') as f:
+            if name == GEMINI_FILE:
+                return f.read().strip() or None
+            value = json.load(f)
+        if not isinstance(value, dict):
+            raise ValueError(f"{name} does not hold a JSON object")
+        return value
+
+    def reload(self, force: bool = False) -> bool:
+        """Re-read the credentials files that changed; returns whether the credentials were replaced"""
+        current = self._snapshot
+        values = {AZURE_FILE: current.azure, GEMINI_FILE: current.gemini}
+        signatures = dict(current.signatures)
+        for name, signature in self._signatures().items():
+            if not force and signature == current.signatures.get(name, ()):
+                continue
+            try:
+                values[name] = None if signature is None else self._read(name)
+                signatures[name] = signature
+            except Exception as e:
+                # Most likely caught mid-write: keep the previous value and try again on the next poll
+                if self._failed.get(name) != signature:
+                    logger.error(f"Error loading {name}: {str(e)}")
+                    self._failed[name] = signature
+        if signatures == current.signatures:
+            return False
+
+        azure, gemini = values[AZURE_FILE], values[GEMINI_FILE]
+        changed = azure != current.azure or gemini != current.gemini
+        # Build the new snapshot completely, then publish it with a single assignment
+        self._snapshot = _Snapshot(current.version + changed, azure, gemini, signatures)
+        if changed:
+            self.reloads += 1
+            logger.info(
+                f"Credentials loaded: Azure {'present' if azure else 'missing'}, Gemini {'present' if gemini else 'missing'}"
+            )
+        return changed
+
+    async def watch(self):
+        """Poll the credentials files and reload them when they change"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await asyncio.to_thread(self.reload):
+                    self.schedule_validation()
+            except Exception as e:
+                logger.error(f"Error watching credentials: {str(e)}")
+
+    def start(self):
+        """Start watching the credentials directory and validate what is there"""
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self.watch())
+        self.schedule_validation()
+
+    async def stop(self):
+        for task in (self._watcher, self._validating):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._watcher = self._validating = None
+
     def load_azure_credentials(self) -> Optional[Dict[str, Any]]:
-        """Load Azure credentials from file"""
-        if self._azure_credentials is not None:
-            return self._azure_credentials
-            
-        credentials_path = os.path.join(self.credentials_dir, 'azure_credentials.json')
-        
-        if not os.path.exists(credentials_path):
-            logger.warning(f"Azure credentials file not found at {credentials_path}")
-            return None
-            
-        try:
-            with open(credentials_path, 'r') as f:
-                self._azure_credentials = json.load(f)
-            logger.info("Azure credentials loaded successfully")
-            return self._azure_credentials
-        except Exception as e:
-            logger.error(f"Error loading Azure credentials: {str(e)}")
-            return None
-    
+        """Current Azure credentials, or None when there are none"""
+        return self._snapshot.azure
+
     def load_gemini_api_key(self) -> Optional[str]:
-        """Load Gemini API key from file"""
-        if self._gemini_api_key is not None:
-            return self._gemini_api_key
-            
-        key_path = os.path.join(self.credentials_dir, 'gemini_api_key.txt')
-        
-        if not os.path.exists(key_path):
-            logger.warning(f"Gemini API key file not found at {key_path}")
-            return None
-            
-        try:
-            with open(key_path, 'r') as f:
-                self._gemini_api_key = f.read().strip()
-            logger.info("Gemini API key loaded successfully")
-            return self._gemini_api_key
-        except Exception as e:
-            logger.error(f"Error loading Gemini API key: {str(e)}")
-            return None
-    
-    def validate_azure_credentials(self) -> bool:
-        """Validate Azure credentials by attempting to connect"""
-        credentials = self.load_azure_credentials()
+        """Current Gemini API key, or None when there is none"""
+        return self._snapshot.gemini
+
+    def _azure_format_valid(self, credentials: Optional[Dict[str, Any]]) -> bool:
         if not credentials:
             return False
-            
-        # TODO: Implement actual validation with Azure SDK
-        # For now, just check if required fields exist
-        required_fields = ['client_id', 'client_secret', 'tenant_id', 'subscription_id']
-        has_required_fields = all(field in credentials for field in required_fields)
-        
-        if has_required_fields:
-            logger.info("Azure credentials validation passed")
-            return True
-        else:
-            logger.warning("Azure credentials missing required fields")
+        required_fields = ['client_id', 'client_secret', 'tenant_id']
+        has_subscription = bool(credentials.get('subscription_id') or credentials.get('subscription_ids'))
+        return has_subscription and all(credentials.get(field) for field in required_fields)
+
+    def _gemini_format_valid(self, api_key: Optional[str]) -> bool:
+        # Google API keys are 39 characters; only reject what clearly cannot be a key
+        return bool(api_key) and len(api_key) >= 20 and not any(c.isspace() for c in api_key)
+
+    def _current(self, kind: str) -> Any:
+        return self._snapshot.azure if kind == 'azure' else self._snapshot.gemini
+
+    def _format_valid(self, kind: str) -> bool:
+        if kind == 'azure':
+            return self._azure_format_valid(self._snapshot.azure)
+        return self._gemini_format_valid(self._snapshot.gemini)
+
+    def _network_result(self, kind: str) -> Optional[Tuple[Any, float, bool, Optional[str]]]:
+        """The cached network validation result, if it is for the current credentials and not expired"""
+        result = self._validation.get(kind)
+        if result is None or result[0] != self._current(kind) or time.time() - result[1] > self.validation_ttl:
+            return None
+        return result
+
+    def _valid(self, kind: str) -> bool:
+        if not self._format_valid(kind):
             return False
-    
+        result = self._network_result(kind)
+        return result[2] if result else True
+
+    def validate_azure_credentials(self) -> bool:
+        """Whether the Azure credentials are well-formed and were not rejected by Azure"""
+        return self._valid('azure')
+
     def validate_gemini_api_key(self) -> bool:
-        """Validate Gemini API key by checking format"""
-        api_key = self.load_gemini_api_key()
-        if not api_key:
-            return False
-            
-        # Check if key has the proper format
-        # This is a simple check - in reality, a test API call would be better
-        if api_key.startswith('Gemini-') and len(api_key) > 20:
-            logger.info("Gemini API key validation passed")
-            return True
-        else:
-            logger.warning("Gemini API key format validation failed")
-            return False
-    
+        """Whether the Gemini API key is well-formed and was not rejected by the API"""
+        return self._valid('gemini')
+
+    async def _check_azure(self, client: httpx.AsyncClient, credentials: Dict[str, Any]) -> Tuple[Optional[bool], Optional[str]]:
+        login = credentials.get("login_endpoint", LOGIN_ENDPOINT).rstrip("/")
+        management = credentials.get("management_endpoint", MANAGEMENT_ENDPOINT).rstrip("/")
+        response = await client.post(
+            f"{login}/{credentials['tenant_id']}/oauth2/v2.0/token",
+            data={
+                "grant_type": "client_credentials",
+                "client_id": credentials["client_id"],
+                "client_secret": credentials["client_secret"],
+                "scope": f"{management}/.default",
+            },
+        )
+        if response.status_code == 200:
+            return True, None
+        if response.status_code in (400, 401, 403):
+            return False, f"Token request rejected with HTTP {response.status_code}"
+        return None, f"Token request failed with HTTP {response.status_code}"
+
+    async def _check_gemini(self, client: httpx.AsyncClient, api_key: str) -> Tuple[Optional[bool], Optional[str]]:
+        response = await client.get(
+            f"{threat_enricher.endpoint}/v1beta/models/{threat_enricher.model}",
+            headers={"x-goog-api-key": api_key},
+        )
+        if response.status_code == 200:
+            return True, None
+        if response.status_code in (400, 401, 403):
+            return False, f"API key rejected with HTTP {response.status_code}"
+        return None, f"Model lookup failed with HTTP {response.status_code}"
+
+    async def revalidate(self, force: bool = False):
+        """Check the credentials against Azure and the Gemini API where the cached result is missing or stale"""
+        kinds = [kind for kind in ('azure', 'gemini') if self._needs_check(kind, force)]
+        if not kinds:
+            return
+        checked = {kind: self._current(kind) for kind in kinds}
+        checks = {'azure': self._check_azure, 'gemini': self._check_gemini}
+
+        async with httpx.AsyncClient(timeout=10) as client:
+            results = await asyncio.gather(
+                *[checks[kind](client, checked[kind]) for kind in kinds], return_exceptions=True
+            )
+        for kind, result in zip(kinds, results):
+            if isinstance(result, Exception):
+                valid, error = None, f"{type(result).__name__}: {str(result)}"
+            else:
+                valid, error = result
+            if valid is None:
+                # The service could not be reached or failed; that says nothing about the credentials
+                logger.warning(f"Could not validate {kind} credentials: {error}")
+                previous = self._validation.get(kind)
+                valid = previous[2] if previous and previous[0] == checked[kind] else True
+            elif not valid:
+                logger.warning(f"{kind.capitalize()} credentials validation failed: {error}")
+            else:
+                logger.info(f"{kind.capitalize()} credentials validation passed")
+            self._validation[kind] = (checked[kind], time.time(), valid, error)
+
+    def _needs_check(self, kind: str, force: bool = False) -> bool:
+        return self._format_valid(kind) and (force or self._network_result(kind) is None)
+
+    def schedule_validation(self, force: bool = False):
+        """Run `revalidate` in the background unless it is already running"""
+        if self._validating is not None and not self._validating.done():
+            return
+        try:
+            self._validating = asyncio.get_running_loop().create_task(self.revalidate(force))
+        except RuntimeError:
+            # No event loop (e.g. a script); format validation only
+            pass
+
+    def _status(self, kind: str, present: bool, valid: bool) -> Dict[str, Any]:
+        status = {"present": present, "valid": valid}
+        result = self._validation.get(kind)
+        if present and result is not None and result[0] == self._current(kind):
+            status["checked_at"] = result[1]
+            if result[3]:
+                status["error"] = result[3]
+        return status
+
     def get_credentials_status(self) -> Dict[str, Any]:
-        """Get status of both credentials"""
-        azure_present = self.load_azure_credentials() is not None
-        gemini_present = self.load_gemini_api_key() is not None
-        
-        azure_valid = self.validate_azure_credentials() if azure_present else False
-        gemini_valid = self.validate_gemini_api_key() if gemini_present else False
-        
+        """Get status of both credentials from memory; stale validation results are refreshed in the background"""
+        snapshot = self._snapshot
+        azure_present = snapshot.azure is not None
+        gemini_present = snapshot.gemini is not None
+        if self._needs_check('azure') or self._needs_check('gemini'):
+            self.schedule_validation()
+
         return {
-            "azure": {
-                "present": azure_present,
-                "valid": azure_valid
-            },
-            "gemini": {
-                "present": gemini_present,
-                "valid": gemini_valid
-            }
+            "azure": self._status('azure', azure_present, self._valid('azure')),
+            "gemini": self._status('gemini', gemini_present, self._valid('gemini')),
+            "version": snapshot.version,
+            "loaded_at": snapshot.loaded_at,
         }
 
 # Create a singleton instance
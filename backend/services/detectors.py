@@ -0,0 +1,381 @@
+import abc
+import time
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple, Type
+from loguru import logger
+from sklearn.ensemble import IsolationForest
+from sklearn.neighbors import LocalOutlierFactor
+from sklearn.preprocessing import StandardScaler
+
+from services.forest_scorer import CompiledIsolationForest
+from services.metrics import DETECTOR_DURATION
+
+# Registry of available detectors, keyed by name
+DETECTOR_REGISTRY: Dict[str, Type["BaseDetector"]] = {}
+
+
+def register_detector(cls):
+    """Class decorator that makes a detector available to build_ensemble by name"""
+    DETECTOR_REGISTRY[cls.name] = cls
+    return cls
+
+
+class DetectorStats:
+    """Running cost and hit counters for a single detector"""
+
+    def __init__(self):
+        self.batches = 0
+        self.events_scored = 0
+        self.hits = 0
+        self.skipped_batches = 0
+        self.total_seconds = 0.0
+        self.last_batch_seconds = 0.0
+        self.fit_count = 0
+        self.fit_seconds = 0.0
+
+    def record_batch(self, events: int, hits: int, seconds: float):
+        self.batches += 1
+        self.events_scored += events
+        self.hits += hits
+        self.total_seconds += seconds
+        self.last_batch_seconds = seconds
+
+    def record_fit(self, seconds: float):
+        self.fit_count += 1
+        self.fit_seconds += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "skipped_batches": self.skipped_batches,
+            "events_scored": self.events_scored,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.events_scored if self.events_scored else 0.0,
+            "avg_batch_ms": 1000 * self.total_seconds / self.batches if self.batches else 0.0,
+            "last_batch_ms": 1000 * self.last_batch_seconds,
+            "fit_count": self.fit_count,
+            "avg_fit_ms": 1000 * self.fit_seconds / self.fit_count if self.fit_count else 0.0,
+        }
+
+
+class BaseDetector(abc.ABC):
+    """
+    Common interface for anomaly detectors.
+
+    A detector works on the numeric feature matrix produced by AnomalyDetector and
+    returns, for every row, an anomaly score in the 0-1 range (1 = most anomalous)
+    and a boolean flag saying whether it considers the row an anomaly.
+    Cheap detectors run on every event; expensive ones only see events a cheap
+    detector has flagged.
+    """
+
+    name = "base"
+    expensive = False
+
+    def __init__(self, feature_names: List[str]):
+        self.feature_names = feature_names
+        self.is_fitted = False
+        # Message of the last failed fit (None once a fit succeeds)
+        self.fit_error: Optional[str] = None
+        self.stats = DetectorStats()
+
+    def fit(self, features: np.ndarray):
+        """Fit the detector on a batch of features (no-op for stateless detectors)"""
+        self.is_fitted = True
+
+    @abc.abstractmethod
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (scores, flags) for every row of features"""
+
+
+@register_detector
+class RuleDetector(BaseDetector):
+    """Stateless rules over the extracted log features"""
+
+    name = "rules"
+
+    def __init__(self, feature_names: List[str], **kwargs):
+        super().__init__(feature_names)
+        self.is_fitted = True
+        self.rules = {
+            "error_security": lambda f: (f["is_error"] == 1) & (f["is_security_related"] == 1),
+            "auth_failure": lambda f: (f["is_authentication"] == 1) & ((f["is_error"] == 1) | (f["is_warning"] == 1)),
+            "off_hours_admin": lambda f: (f["is_admin_action"] == 1) & ((f["hour_of_day"] < 5) | (f["hour_of_day"] > 22)),
+        }
+
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        columns = {name: features[:, i] for i, name in enumerate(self.feature_names)}
+        hits = np.zeros(len(features), dtype=np.int64)
+        for rule in self.rules.values():
+            hits += rule(columns)
+
+        return hits / len(self.rules), hits > 0
+
+
+@register_detector
+class ZScoreDetector(BaseDetector):
+    """Flags events whose features sit far from the mean of the training batch"""
+
+    name = "zscore"
+
+    def __init__(self, feature_names: List[str], z_threshold: float = 3.0, **kwargs):
+        super().__init__(feature_names)
+        self.z_threshold = z_threshold
+        self.mean = None
+        self.std = None
+
+    def fit(self, features: np.ndarray):
+        self.mean = features.mean(axis=0)
+        std = features.std(axis=0)
+        # Constant features would divide by zero; treat them as never deviating
+        self.std = np.where(std > 0, std, np.inf)
+        self.is_fitted = True
+
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        max_z = np.max(np.abs(features - self.mean) / self.std, axis=1)
+        return np.clip(max_z / (2 * self.z_threshold), 0, 1), max_z >= self.z_threshold
+
+
+@register_detector
+class RareTemplateDetector(BaseDetector):
+    """Flags events whose message template makes up a tiny share of all events seen"""
+
+    name = "rare_template"
+
+    def __init__(self, feature_names: List[str], rarity_threshold: float = 2.5, **kwargs):
+        super().__init__(feature_names)
+        self.is_fitted = True
+        # -log10 of the template's share of events: 2.5 flags templates rarer than about 1 in 300
+        self.rarity_threshold = rarity_threshold
+        self.column = feature_names.index("template_rarity") if "template_rarity" in feature_names else None
+
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.column is None:
+            return np.zeros(len(features)), np.zeros(len(features), dtype=bool)
+
+        rarity = features[:, self.column]
+        return np.clip(rarity / (2 * self.rarity_threshold), 0, 1), rarity >= self.rarity_threshold
+
+
+@register_detector
+class IsolationForestDetector(BaseDetector):
+    """Isolation Forest scored through the compiled flat-array forest"""
+
+    name = "isolation_forest"
+    expensive = True
+
+    def __init__(self, feature_names: List[str], contamination: float = 0.1, score_threshold: float = 0.75, **kwargs):
+        super().__init__(feature_names)
+        self.model = IsolationForest(
+            n_estimators=100,
+            max_samples='auto',
+            contamination=contamination,
+            random_state=42
+        )
+        self.scaler = StandardScaler()
+        self.score_threshold = score_threshold
+        # Flat-array copy of the fitted forest used for scoring (None falls back to sklearn)
+        self.compiled_model = None
+        # Decision score range on the training batch, used to map scores to 0-1
+        self.raw_min = 0.0
+        self.raw_max = 0.0
+
+    def fit(self, features: np.ndarray):
+        self.scaler.fit(features)
+        scaled_features = self.scaler.transform(features)
+        self.model.fit(scaled_features)
+        self.is_fitted = True
+
+        # Compile the forest for fast scoring, keeping it only if it reproduces sklearn
+        compiled_model = CompiledIsolationForest(self.model)
+        self.compiled_model = compiled_model if compiled_model.matches(self.model, scaled_features) else None
+
+        _, raw_scores = self._predict(scaled_features)
+        self.raw_min = float(np.min(raw_scores))
+        self.raw_max = float(np.max(raw_scores))
+
+    def _predict(self, scaled_features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.compiled_model is not None:
+            return self.compiled_model.predict_with_scores(scaled_features)
+
+        return self.model.predict(scaled_features), self.model.decision_function(scaled_features)
+
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Predictions are -1 for anomalies; raw scores are lower for more anomalous points
+        predictions, raw_scores = self._predict(self.scaler.transform(features))
+
+        # Convert scores to 0-1 range (0 = normal, 1 = anomaly) relative to the training batch
+        scores = np.clip(1 - (raw_scores - self.raw_min) / (self.raw_max - self.raw_min + 1e-10), 0, 1)
+        return scores, (predictions == -1) | (scores > self.score_threshold)
+
+
+@register_detector
+class LocalOutlierFactorDetector(BaseDetector):
+    """Local Outlier Factor fitted on a random sample of the training batch"""
+
+    name = "lof"
+    expensive = True
+
+    def __init__(self, feature_names: List[str], contamination: float = 0.1, sample_size: int = 500, n_neighbors: int = 20, **kwargs):
+        super().__init__(feature_names)
+        self.contamination = contamination
+        self.sample_size = sample_size
+        self.n_neighbors = n_neighbors
+        self.scaler = StandardScaler()
+        self.model = None
+        self.rng = np.random.default_rng(42)
+
+    def fit(self, features: np.ndarray):
+        if len(features) > self.sample_size:
+            features = features[self.rng.choice(len(features), self.sample_size, replace=False)]
+
+        self.scaler.fit(features)
+        self.model = LocalOutlierFactor(
+            n_neighbors=min(self.n_neighbors, len(features) - 1),
+            contamination=self.contamination,
+            novelty=True
+        )
+        self.model.fit(self.scaler.transform(features))
+        self.is_fitted = True
+
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        scaled_features = self.scaler.transform(features)
+
+        # score_samples is the negated LOF (about -1 for inliers, much lower for outliers)
+        lof = -self.model.score_samples(scaled_features)
+        scores = np.clip(1 - 1 / np.maximum(lof, 1e-10), 0, 1)
+        return scores, self.model.predict(scaled_features) == -1
+
+
+class DetectorEnsemble:
+    """
+    Runs a set of detectors as a cost-ordered cascade.
+
+    Cheap detectors score every event; only events flagged by at least one cheap
+    detector are passed on to the expensive detectors, whose verdict is final.
+    Expensive detectors are skipped once the batch has used up its CPU budget,
+    in which case the cheap verdict stands for the events they would have seen.
+    A detector whose fit fails is left unfitted and skipped while the others
+    keep scoring.
+    """
+
+    def __init__(self, detectors: List[BaseDetector], cpu_budget_ms: Optional[float] = 250.0):
+        self.cheap = [d for d in detectors if not d.expensive]
+        self.expensive = [d for d in detectors if d.expensive]
+        self.cpu_budget_ms = cpu_budget_ms
+        self.budget_exceeded_batches = 0
+
+    @property
+    def detectors(self) -> List[BaseDetector]:
+        return self.cheap + self.expensive
+
+    @property
+    def is_fitted(self) -> bool:
+        """Whether every detector is fitted"""
+        return all(d.is_fitted for d in self.detectors)
+
+    @property
+    def can_score(self) -> bool:
+        """Whether at least one detector is fitted"""
+        return any(d.is_fitted for d in self.detectors)
+
+    @property
+    def fit_status(self) -> Dict[str, bool]:
+        """Whether each detector is fitted, by name"""
+        return {d.name: d.is_fitted for d in self.detectors}
+
+    def fit(self, features: np.ndarray):
+        """Fit every detector on the same batch, recording fit cost; a failed fit leaves that detector unfitted"""
+        for detector in self.detectors:
+            start = time.perf_counter()
+            try:
+                detector.fit(features)
+                detector.fit_error = None
+            except Exception as e:
+                # Its model may be half-updated, so it sits out until a fit succeeds
+                detector.is_fitted = False
+                detector.fit_error = str(e)
+                logger.error(f"Error fitting detector {detector.name}: {str(e)}")
+            elapsed = time.perf_counter() - start
+            detector.stats.record_fit(elapsed)
+            DETECTOR_DURATION.observe(elapsed, detector=detector.name, phase="fit")
+
+    def _run(self, detector: BaseDetector, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        start = time.perf_counter()
+        scores, flags = detector.score(features)
+        elapsed = time.perf_counter() - start
+        detector.stats.record_batch(len(features), int(np.count_nonzero(flags)), elapsed)
+        DETECTOR_DURATION.observe(elapsed, detector=detector.name, phase="score")
+        return scores, flags
+
+    def score(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the combined (scores, flags) for every row of features"""
+        cpu_start = time.process_time()
+        n_events = len(features)
+        scores = np.zeros(n_events)
+        flags = np.zeros(n_events, dtype=bool)
+
+        cheap = [d for d in self.cheap if d.is_fitted]
+        expensive = [d for d in self.expensive if d.is_fitted]
+
+        # Stage 1: cheap detectors see everything
+        for detector in cheap:
+            detector_scores, detector_flags = self._run(detector, features)
+            scores = np.maximum(scores, detector_scores)
+            flags |= detector_flags
+
+        if not expensive:
+            return scores, flags
+
+        # Stage 2: expensive detectors only see events escalated by the cheap stage
+        escalated = np.flatnonzero(flags) if cheap else np.arange(n_events)
+        if len(escalated) == 0:
+            return scores, flags
+
+        verdict_scores = np.zeros(len(escalated))
+        verdict_flags = np.zeros(len(escalated), dtype=bool)
+        confirmed = False
+        for detector in expensive:
+            cpu_used_ms = 1000 * (time.process_time() - cpu_start)
+            if self.cpu_budget_ms is not None and cpu_used_ms >= self.cpu_budget_ms:
+                detector.stats.skipped_batches += 1
+                self.budget_exceeded_batches += 1
+                logger.warning(f"CPU budget exhausted ({cpu_used_ms:.1f} ms), skipping detector {detector.name}")
+                continue
+
+            detector_scores, detector_flags = self._run(detector, features[escalated])
+            verdict_scores = np.maximum(verdict_scores, detector_scores)
+            verdict_flags |= detector_flags
+            confirmed = True
+
+        if confirmed:
+            scores[escalated] = verdict_scores
+            flags[escalated] = verdict_flags
+
+        return scores, flags
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "cpu_budget_ms": self.cpu_budget_ms,
+            "budget_exceeded_batches": self.budget_exceeded_batches,
+            "detectors": {
+                d.name: {"expensive": d.expensive, "fitted": d.is_fitted, "fit_error": d.fit_error, **d.stats.to_dict()}
+                for d in self.detectors
+            }
+        }
+
+
+def build_ensemble(
+    names: List[str],
+    feature_names: List[str],
+    cpu_budget_ms: Optional[float] = 250.0,
+    **params
+) -> DetectorEnsemble:
+    """Instantiate registered detectors by name and wrap them in an ensemble"""
+    detectors = []
+    for name in names:
+        if name not in DETECTOR_REGISTRY:
+            raise ValueError(f"Unknown detector '{name}', available: {sorted(DETECTOR_REGISTRY)}")
+        detectors.append(DETECTOR_REGISTRY[name](feature_names, **params))
+
+    return DetectorEnsemble(detectors, cpu_budget_ms=cpu_budget_ms)
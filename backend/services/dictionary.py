@@ -0,0 +1,125 @@
+from typing import List, Dict, Iterable, Optional
+from loguru import logger
+from sqlalchemy import text, bindparam
+
+from models.database import engine
+
+# Log fields stored as dictionary codes, in their source_id and level_id columns
+LOG_FIELDS = ["source", "level"]
+
+# One statement so the next code is taken under SQLite's write lock (safe across processes)
+_INSERT_VALUE = text(
+    "INSERT OR IGNORE INTO dictionary (field, code, value) "
+    "SELECT :field, COALESCE(MAX(code), 0) + 1, :value FROM dictionary WHERE field = :field"
+)
+
+
+class DictionaryEncoder:
+    """
+    Maps repeated categorical values to small per-field integer codes.
+
+    Codes live in the `dictionary` table and are never reused, so they are stable
+    across restarts and worker processes. Lookups are served from an in-process
+    intern cache and never touch the database: `ensure` must run before new
+    values are written, and `refresh` before reads, to pick up codes created by
+    other processes.
+    """
+
+    def __init__(self):
+        self._codes: Dict[str, Dict[str, int]] = {}
+        self._values: Dict[str, Dict[int, str]] = {}
+        # Rows of the table already in the cache
+        self._rows = 0
+
+    def _remember(self, field: str, code: int, value: str):
+        codes = self._codes.setdefault(field, {})
+        if value not in codes:
+            self._rows += 1
+        codes[value] = code
+        self._values.setdefault(field, {})[code] = value
+
+    def size(self, field: str) -> int:
+        return len(self._codes.get(field, ()))
+
+    def lookup(self, field: str, value) -> Optional[int]:
+        """Code of a value from the cache, or None when it has none yet"""
+        if value is None:
+            return None
+        return self._codes.get(field, {}).get(str(value))
+
+    def code(self, field: str, value) -> int:
+        """Code of a value being written; it must have been `ensure`d"""
+        code = self.lookup(field, value)
+        if code is None:
+            raise ValueError(f"No dictionary code for {field} {value!r}; ensure it before writing")
+        return code
+
+    def encode(self, field: str, value) -> int:
+        """Code used in query filters; unknown values get -1, which matches no row"""
+        code = self.lookup(field, value)
+        return -1 if code is None else code
+
+    def decode(self, field: str, code: Optional[int]) -> Optional[str]:
+        """Value of a code from the cache; a code not loaded yet is returned as text"""
+        if code is None:
+            return None
+        value = self._values.get(field, {}).get(code)
+        return str(code) if value is None else value
+
+    def matching(self, field: str, substring: str) -> List[int]:
+        """Codes of all known values containing `substring` (for LIKE-style filters)"""
+        return [code for value, code in self._codes.get(field, {}).items() if substring in value]
+
+    async def load(self, conn=None, field: Optional[str] = None):
+        """Load every code (or those of one field) into the cache"""
+        query, params = "SELECT field, code, value FROM dictionary", {}
+        if field:
+            query, params = query + " WHERE field = :field", {"field": field}
+
+        if conn is None:
+            async with engine.connect() as conn:
+                rows = (await conn.execute(text(query), params)).all()
+        else:
+            rows = (await conn.execute(text(query), params)).all()
+
+        for row_field, code, value in rows:
+            self._remember(row_field, code, value)
+
+    async def refresh(self):
+        """Load codes created by other processes since the cache was filled (one COUNT when there are none)"""
+        try:
+            async with engine.connect() as conn:
+                if await conn.scalar(text("SELECT COUNT(*) FROM dictionary")) != self._rows:
+                    await self.load(conn)
+        except Exception as e:
+            logger.error(f"Error refreshing dictionary codes: {str(e)}")
+
+    async def ensure(self, field: str, values: Iterable) -> Dict[str, int]:
+        """Make sure every value has a code, creating missing ones in their own transaction"""
+        values = {str(v) for v in values if v is not None}
+        known = self._codes.get(field, {})
+        missing = [v for v in values if v not in known]
+        if missing:
+            async with engine.begin() as conn:
+                for value in missing:
+                    await conn.execute(_INSERT_VALUE, {"field": field, "value": value})
+                for i in range(0, len(missing), 500):
+                    rows = (await conn.execute(
+                        text("SELECT code, value FROM dictionary WHERE field = :field AND value IN :values")
+                        .bindparams(bindparam("values", expanding=True)),
+                        {"field": field, "values": missing[i:i + 500]}
+                    )).all()
+                    for code, value in rows:
+                        self._remember(field, code, value)
+            logger.debug(f"Added {len(missing)} {field} value(s) to the dictionary")
+        known = self._codes.get(field, {})
+        return {v: known[v] for v in values if v in known}
+
+    async def ensure_logs(self, logs: List) -> None:
+        """Ensure codes for every dictionary-encoded field of a batch of log entries"""
+        for field in LOG_FIELDS:
+            await self.ensure(field, (getattr(log, field) for log in logs))
+
+
+# Create a singleton instance
+dictionary = DictionaryEncoder()
@@ -0,0 +1,224 @@
+import os
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from loguru import logger
+from sqlalchemy import select, func
+
+from models.models import LogEntryModel
+from models.schemas import LogEntry
+from services.dictionary import dictionary
+from services.storage_codec import storage_codec
+from services.template_miner import template_miner, TEMPLATE_FEATURES
+
+# Message keyword categories used as detector features, in feature order
+MESSAGE_CATEGORIES = [
+    ("is_security_related", ["security", "secure", "attack", "threat", "vulnerability"]),
+    ("is_authentication", ["login", "password", "credential", "auth", "user"]),
+    ("is_network_related", ["network", "connection", "ip", "tcp", "udp", "dns", "http"]),
+    ("is_database_related", ["database", "sql", "query", "table", "record"]),
+    ("is_file_access", ["file", "directory", "folder", "path", "read", "write"]),
+    ("is_admin_action", ["admin", "root", "sudo", "permission", "privilege"]),
+]
+
+# Bits of the per-event flags column: the two level flags, then the message categories
+FLAG_NAMES = ["is_error", "is_warning"] + [name for name, _ in MESSAGE_CATEGORIES]
+
+# Detector feature columns: time of day and weekday, the flags, then the message template
+FEATURE_NAMES = ["hour_of_day", "day_of_week"] + FLAG_NAMES + TEMPLATE_FEATURES
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_US_PER_HOUR = 3600 * 1_000_000
+_US_PER_DAY = 24 * _US_PER_HOUR
+
+
+def message_flags(level: str, message: str) -> int:
+    """Bitmask of FLAG_NAMES for one event"""
+    level = level.lower()
+    flags = 1 if level == "error" else 2 if level == "warning" else 0
+    msg = message.lower()
+    for bit, (_, terms) in enumerate(MESSAGE_CATEGORIES, start=2):
+        if any(term in msg for term in terms):
+            flags |= 1 << bit
+    return flags
+
+
+def to_microseconds(timestamp: datetime) -> int:
+    """Naive microseconds since the epoch (aware timestamps are stored without their offset, as in SQLite)"""
+    return (timestamp.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+
+
+class EventBuffer:
+    """
+    Ring buffer of the most recent events stored column-wise in NumPy arrays.
+
+    Each event costs 18 bytes of columns (int64 timestamp, uint16 source and level
+    codes, uint16 flag bitmask, uint32 template id) instead
+    of a LogEntry with its details dict. The full LogEntry is kept only for the
+    newest `detail_capacity` events, enough to build threats and answer recent-log
+    queries. User and IP are not interned into columns: nothing reads them from
+    the buffer, and the interning table would grow with every distinct address.
+
+    Arrays are allocated on first use. Codes come from the persistent
+    dictionary, so values must have been `ensure`d (as ingestion does) before they
+    are appended; unknown values are stored as 0.
+
+    The buffer only sees events stored by this process, so it is the source of
+    truth only after `warm` and while a single worker handles ingestion.
+    """
+
+    def __init__(self, capacity: Optional[int] = None, detail_capacity: int = 10_000):
+        """Initialize the buffer; capacity defaults to SENTINEL_EVENT_BUFFER_SIZE or 1M events"""
+        self.capacity = capacity or int(os.environ.get("SENTINEL_EVENT_BUFFER_SIZE", "1000000"))
+        self.detail_capacity = min(detail_capacity, self.capacity)
+        self.warmed = False
+        # Events ever appended (the ring position is seq % capacity)
+        self.seq = 0
+        # Stored events that were never appended (already in the DB at warm-up)
+        self._base_total = 0
+        # Event count per calendar day (days since the epoch) by event timestamp
+        self._day_counts: Dict[int, int] = {}
+        self._allocated = False
+
+    def _allocate(self):
+        self.timestamps = np.zeros(self.capacity, dtype=np.int64)
+        self.source_ids = np.zeros(self.capacity, dtype=np.uint16)
+        self.level_ids = np.zeros(self.capacity, dtype=np.uint16)
+        self.flags = np.zeros(self.capacity, dtype=np.uint16)
+        self.template_ids = np.zeros(self.capacity, dtype=np.uint32)
+        self.details = np.empty(self.detail_capacity, dtype=object)
+        self._allocated = True
+
+    @property
+    def size(self) -> int:
+        return min(self.seq, self.capacity)
+
+    @property
+    def total_events(self) -> int:
+        return self._base_total + self.seq
+
+    @property
+    def memory_bytes(self) -> int:
+        if not self._allocated:
+            return 0
+        return sum(a.nbytes for a in (
+            self.timestamps, self.source_ids, self.level_ids, self.flags, self.template_ids, self.details
+        ))
+
+    def extend(self, logs: List[LogEntry]):
+        """Append events in ingestion order, overwriting the oldest when full"""
+        if not logs:
+            return
+        if not self._allocated:
+            self._allocate()
+
+        count = len(logs)
+        timestamps = [to_microseconds(log.timestamp) for log in logs]
+        code = lambda field, value: dictionary.lookup(field, value) or 0
+        columns = (
+            timestamps,
+            [code("source", log.source) for log in logs],
+            [code("level", log.level) for log in logs],
+            [message_flags(log.level, log.message) for log in logs],
+            [log.template_id or 0 for log in logs],
+        )
+        arrays = (self.timestamps, self.source_ids, self.level_ids, self.flags, self.template_ids)
+
+        # Only the last `capacity` events of an oversized batch survive
+        skip = max(0, count - self.capacity)
+        positions = (self.seq + skip + np.arange(count - skip)) % self.capacity
+        for array, values in zip(arrays, columns):
+            array[positions] = values[skip:]
+
+        keep = min(count, self.detail_capacity)
+        detail_positions = (self.seq + count - keep + np.arange(keep)) % self.detail_capacity
+        for position, log in zip(detail_positions, logs[count - keep:]):
+            self.details[position] = log
+
+        for timestamp in timestamps:
+            day = timestamp // _US_PER_DAY
+            self._day_counts[day] = self._day_counts.get(day, 0) + 1
+
+        self.seq += count
+
+    def append(self, log: LogEntry):
+        self.extend([log])
+
+    def _newest_positions(self, limit: int) -> np.ndarray:
+        """Ring positions of the newest `limit` events, newest first"""
+        count = min(limit, self.size)
+        return (self.seq - 1 - np.arange(count)) % self.capacity
+
+    def features(self, positions: np.ndarray) -> np.ndarray:
+        """Detector feature matrix (FEATURE_NAMES columns) for events at `positions`"""
+        timestamps = self.timestamps[positions]
+        hour_of_day = (timestamps // _US_PER_HOUR) % 24
+        # 1970-01-01 was a Thursday (weekday 3)
+        day_of_week = (timestamps // _US_PER_DAY + 3) % 7
+        flags = self.flags[positions].astype(np.int64)
+        bits = [(flags >> bit) & 1 for bit in range(len(FLAG_NAMES))]
+        rarity = template_miner.rarity(self.template_ids[positions].astype(np.int64))
+        return np.column_stack([hour_of_day, day_of_week] + bits + [rarity])
+
+    def recent(self, limit: int = 100) -> Tuple[List[LogEntry], np.ndarray]:
+        """
+        Newest events by timestamp (newest first, as the DB path orders them) with
+        their detector features. Events that arrive out of order are placed by their
+        timestamp among the `detail_capacity` most recently ingested events.
+        """
+        if not self._allocated:
+            return [], np.empty((0, len(FEATURE_NAMES)), dtype=np.int64)
+
+        positions = self._newest_positions(self.detail_capacity)
+        seqs = self.seq - 1 - np.arange(len(positions))
+        timestamps = self.timestamps[positions]
+        if np.any(timestamps[1:] > timestamps[:-1]):
+            # Stable, so events with equal timestamps stay newest ingested first
+            order = np.argsort(-timestamps, kind="stable")
+            positions, seqs = positions[order], seqs[order]
+        positions, seqs = positions[:limit], seqs[:limit]
+        logs = [self.details[s % self.detail_capacity] for s in seqs]
+        return logs, self.features(positions)
+
+    def count_day(self, day: datetime) -> int:
+        """Events stored with a timestamp on the given calendar day"""
+        return self._day_counts.get(to_microseconds(day) // _US_PER_DAY, 0)
+
+    async def warm(self, db, limit: Optional[int] = None):
+        """Load the newest stored logs and seed the total and today's counters from the DB"""
+        try:
+            limit = limit or self.detail_capacity
+            await dictionary.refresh()
+            fields = ["id", "timestamp", "source", "level", "message", "details", "template_id"]
+            rows = (await db.execute(
+                select(*[getattr(LogEntryModel, f) for f in fields])
+                .order_by(LogEntryModel.timestamp.desc()).limit(limit)
+            )).all()
+            rows = await storage_codec.decode_rows(fields, rows)
+            logs = [LogEntry(**dict(zip(fields, row))) for row in reversed(rows)]
+            await dictionary.ensure_logs(logs)
+            self.extend(logs)
+
+            today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            total = await db.scalar(select(func.count(LogEntryModel.id)))
+            today = await db.scalar(select(func.count(LogEntryModel.id)).where(LogEntryModel.timestamp >= today_start))
+            today_key = to_microseconds(today_start) // _US_PER_DAY
+            self._base_total = total - self.seq
+            self._day_counts = {today_key: today}
+            self.warmed = True
+            logger.info(f"Event buffer warmed with {len(logs)} of {total} stored logs")
+        except Exception as e:
+            logger.error(f"Error warming event buffer: {str(e)}")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "capacity": self.capacity,
+            "size": self.size,
+            "total_events": self.total_events,
+            "memory_bytes": self.memory_bytes,
+        }
+
+
+# Create a singleton instance
+event_buffer = EventBuffer()
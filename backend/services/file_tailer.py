@@ -0,0 +1,373 @@
+import glob
+import os
+import re
+import zlib
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+
+from models.schemas import LogEntry
+from services.metrics import metrics
+from services.network_collector import parse_syslog, new_log_ids
+from services.serialization import loads
+
+TAIL_LINES = metrics.counter("file_tail_lines_total", "Lines read from tailed log files", ["source"])
+TAIL_RESETS = metrics.counter("file_tail_resets_total", "Tailed files that were rotated or truncated", ["reason"])
+
+# Checksum of up to this many leading bytes identifies a file's content
+FINGERPRINT_BYTES = 1024
+
+# Lines that start with a syslog PRI or an RFC 3164 timestamp ("Oct 11 22:14:15 ")
+_SYSLOG_LINE = re.compile(rb"<\d{1,3}>|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d ")
+# Level words looked for at the start of plain text lines
+_PLAIN_LEVEL = re.compile(rb"\b(fatal|crit|critical|err|error|warn|warning)\b", re.IGNORECASE)
+_LEVELS = {
+    "warn": "warning", "warning": "warning",
+    "err": "error", "error": "error", "fatal": "error", "crit": "error", "critical": "error",
+    "alert": "error", "emerg": "error",
+}
+# JSON record keys mapped to LogEntry fields, first match wins
+_JSON_MESSAGE = ("message", "msg", "log")
+_JSON_LEVEL = ("level", "severity", "levelname")
+_JSON_TIMESTAMP = ("timestamp", "@timestamp", "time", "ts")
+
+
+def _file_id(stat_result) -> str:
+    return f"{stat_result.st_dev}:{stat_result.st_ino}"
+
+
+def _fingerprint(fd: int, length: int) -> Optional[str]:
+    """'<length>:<crc32>' of the first `length` bytes (at most FINGERPRINT_BYTES)"""
+    head = os.pread(fd, min(length, FINGERPRINT_BYTES), 0)
+    return f"{len(head)}:{zlib.crc32(head):08x}" if head else None
+
+
+def _matches(fd: int, fingerprint: Optional[str]) -> bool:
+    """Whether the file still starts with the bytes a fingerprint was taken of"""
+    if not fingerprint:
+        return True
+    return _fingerprint(fd, int(fingerprint.split(":", 1)[0])) == fingerprint
+
+
+def _pop_first(record: Dict[str, Any], keys: Tuple[str, ...]):
+    for key in keys:
+        if key in record:
+            return record.pop(key)
+    return None
+
+
+def _level(value) -> str:
+    return _LEVELS.get(str(value).lower(), "info") if value is not None else "info"
+
+
+def _json_entry(record, line: bytes, source: str, log_id: str, now: datetime) -> LogEntry:
+    """LogEntry from a JSON log record; common field names are mapped and the rest kept as details"""
+    if not isinstance(record, dict):
+        raise ValueError("Not a JSON object")
+    message = _pop_first(record, _JSON_MESSAGE)
+    level = _pop_first(record, _JSON_LEVEL)
+    timestamp = _pop_first(record, _JSON_TIMESTAMP)
+    source = record.pop("source", None) or source
+    details = record.pop("details", None)
+    if isinstance(details, dict):
+        record.update(details)
+
+    entry = LogEntry(
+        id=log_id,
+        timestamp=timestamp or now,
+        source=str(source),
+        level=_level(level),
+        message=str(message) if message is not None else line.decode("utf-8", "replace"),
+        details=record,
+    )
+    # Stored timestamps are naive local time
+    if entry.timestamp.tzinfo is not None:
+        entry.timestamp = datetime.fromtimestamp(entry.timestamp.timestamp())
+    return entry
+
+
+def _plain_entry(line: bytes, source: str, log_id: str, now: datetime) -> LogEntry:
+    match = _PLAIN_LEVEL.search(line, 0, 256)
+    return LogEntry(
+        id=log_id,
+        timestamp=now,
+        source=source,
+        level=_level(match.group(1).decode()) if match else "info",
+        message=line.decode("utf-8", "replace"),
+        details={},
+    )
+
+
+class TailedFile:
+    """A followed path and the file currently open for it"""
+
+    __slots__ = ("path", "source", "fd", "file_id", "offset", "fingerprint", "rotated")
+
+    def __init__(self, path: str, source: str):
+        self.path = path
+        self.source = source
+        self.fd: Optional[int] = None
+        self.file_id: Optional[str] = None
+        # Byte offset after the last complete line read
+        self.offset = 0
+        self.fingerprint: Optional[str] = None
+        # The path now names another file; the open one is read to its end first
+        self.rotated = False
+
+    @property
+    def key(self) -> str:
+        """Checkpoint source name"""
+        return f"file:{self.path}"
+
+    def checkpoint(self) -> Dict[str, Any]:
+        return {"position": self.offset, "file_id": self.file_id, "fingerprint": self.fingerprint}
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+        self.rotated = False
+
+
+class FileTailer:
+    """
+    Follows local log files for the log collector.
+
+    SENTINEL_TAIL_PATHS lists files or glob patterns, comma-separated. Each entry may
+    be prefixed with a source name, as in `nginx=/var/log/nginx/*.log`; by default
+    the source is the file name up to its first dot. Patterns are expanded again on
+    every poll, so new files are picked up and read from their start. Patterns
+    should match the live files only, not their rotated copies.
+
+    Files are read with large positional reads of `read_size` bytes. Only complete
+    lines are consumed, and each batch is parsed as JSON objects, syslog lines or
+    plain text. A file's position is kept as a checkpoint: the byte offset, the
+    file's device and inode, and a checksum of its first bytes. The collector
+    commits checkpoints together with the logs read up to them, so a restart
+    resumes exactly after the last stored line.
+
+    Rotation means the path now names a different file. The old file is read to
+    its end before the new one is started. After a restart, the old file is found
+    next to the path by its device and inode. A file that shrank, or whose first
+    bytes changed (copytruncate), is read again from the start.
+
+    Plain positional reads are used rather than mmap, which raises SIGBUS when a
+    mapped file is truncated underneath it.
+    """
+
+    def __init__(
+        self,
+        patterns: Optional[List[str]] = None,
+        read_size: int = 1024 * 1024,
+        batch_size: int = 5000,
+        max_line_size: int = 64 * 1024,
+        poll_interval: Optional[float] = None
+    ):
+        """Initialize the tailer; patterns default to SENTINEL_TAIL_PATHS and the poll interval to SENTINEL_TAIL_INTERVAL or 1s"""
+        if patterns is None:
+            patterns = [p.strip() for p in os.environ.get("SENTINEL_TAIL_PATHS", "").split(",") if p.strip()]
+        # (source or None, pattern)
+        self.patterns: List[Tuple[Optional[str], str]] = []
+        for pattern in patterns:
+            source, separator, path = pattern.partition("=")
+            self.patterns.append((source, path) if separator else (None, pattern))
+        self.read_size = read_size
+        self.batch_size = batch_size
+        self.max_line_size = max_line_size
+        self.poll_interval = poll_interval or float(os.environ.get("SENTINEL_TAIL_INTERVAL", "1"))
+        self.files: Dict[str, TailedFile] = {}
+        # Files are read round-robin from a rotating start so a busy one cannot starve the rest
+        self._start = 0
+        self.lines_read = 0
+        self.parse_errors = 0
+        self.resets: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.patterns)
+
+    def discover(self):
+        """Start following files that newly match a pattern"""
+        for source, pattern in self.patterns:
+            for path in sorted(glob.glob(os.path.expanduser(pattern))):
+                path = os.path.abspath(path)
+                if path not in self.files and os.path.isfile(path):
+                    self.files[path] = TailedFile(path, source or os.path.basename(path).split(".")[0] or "file")
+
+    def reset(self):
+        """Close every file so the next read reopens them from the committed checkpoints"""
+        for tailed in self.files.values():
+            tailed.close()
+
+    def _count_reset(self, reason: str, tailed: TailedFile):
+        self.resets[reason] = self.resets.get(reason, 0) + 1
+        TAIL_RESETS.inc(reason=reason)
+        logger.info(f"Tailed file {tailed.path} was {reason}")
+
+    def _find_rotated(self, path: str, file_id: str) -> Optional[int]:
+        """Open the rotated copy of a path (app.log.1, app.log-20240101, ...) with the given identity"""
+        directory, name = os.path.split(path)
+        with os.scandir(directory or ".") as entries:
+            for entry in entries:
+                if entry.name != name and entry.name.startswith(name) and entry.is_file() \
+                        and _file_id(entry.stat()) == file_id:
+                    return os.open(entry.path, os.O_RDONLY)
+        return None
+
+    def _open(self, tailed: TailedFile, checkpoint: Optional[Dict[str, Any]]) -> bool:
+        """Open the file for a path, resuming from its checkpoint when that still describes it"""
+        try:
+            fd = os.open(tailed.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        stat_result = os.fstat(fd)
+        tailed.fd, tailed.file_id, tailed.offset, tailed.fingerprint = fd, _file_id(stat_result), 0, None
+        tailed.rotated = False
+        if not checkpoint or not checkpoint.get("file_id"):
+            return True
+
+        position, fingerprint = checkpoint.get("position") or 0, checkpoint.get("fingerprint")
+        if checkpoint["file_id"] == tailed.file_id:
+            if position <= stat_result.st_size and _matches(fd, fingerprint):
+                tailed.offset, tailed.fingerprint = position, fingerprint
+            else:
+                self._count_reset("truncated", tailed)
+            return True
+
+        # Rotated since the checkpoint: finish the old file first if it is still there
+        rotated = self._find_rotated(tailed.path, checkpoint["file_id"])
+        if rotated is not None:
+            if position <= os.fstat(rotated).st_size and _matches(rotated, fingerprint):
+                os.close(fd)
+                tailed.fd, tailed.file_id, tailed.offset, tailed.fingerprint = rotated, checkpoint["file_id"], position, fingerprint
+                tailed.rotated = True
+            else:
+                os.close(rotated)
+        self._count_reset("rotated", tailed)
+        return True
+
+    def _check(self, tailed: TailedFile):
+        """Notice rotation and truncation of the open file"""
+        if tailed.rotated:
+            return
+        try:
+            stat_result = os.stat(tailed.path)
+        except FileNotFoundError:
+            stat_result = None
+        if stat_result is None or _file_id(stat_result) != tailed.file_id:
+            tailed.rotated = True
+            self._count_reset("rotated" if stat_result else "removed", tailed)
+        elif stat_result.st_size < tailed.offset or not _matches(tailed.fd, tailed.fingerprint):
+            tailed.offset, tailed.fingerprint = 0, None
+            self._count_reset("truncated", tailed)
+
+    def _read_lines(self, tailed: TailedFile, limit: int) -> List[Tuple[bytes, int]]:
+        """Complete lines after the file's offset with the offset of each, advancing it"""
+        lines = []
+        while len(lines) < limit:
+            chunk = os.pread(tailed.fd, self.read_size, tailed.offset)
+            if not chunk:
+                break
+            end = chunk.rfind(b"\n") + 1
+            if end == 0:
+                # No newline: wait for the rest of the line, unless it is overlong or the
+                # file was rotated away and will not grow any more
+                if len(chunk) < self.max_line_size and not tailed.rotated:
+                    break
+                end = len(chunk)
+
+            position = tailed.offset
+            for line in chunk[:end].split(b"\n"):
+                if line.strip():
+                    lines.append((line.rstrip(b"\r")[:self.max_line_size], position))
+                position += len(line) + 1
+            tailed.offset += end
+            if len(chunk) < self.read_size:
+                break
+
+        if tailed.offset and (tailed.fingerprint is None or int(tailed.fingerprint.split(":", 1)[0]) < FINGERPRINT_BYTES):
+            tailed.fingerprint = _fingerprint(tailed.fd, tailed.offset)
+        return lines
+
+    def parse_lines(self, tailed: TailedFile, lines: List[Tuple[bytes, int]]) -> List[LogEntry]:
+        """Log entries for a batch of lines; lines that fail to parse are kept as plain text"""
+        now = datetime.now()
+        logs = []
+        for (line, offset), log_id in zip(lines, new_log_ids(len(lines))):
+            try:
+                if line[:1] == b"{":
+                    log = _json_entry(loads(line), line, tailed.source, log_id, now)
+                elif _SYSLOG_LINE.match(line):
+                    log = parse_syslog(line, now=now, log_id=log_id)
+                else:
+                    log = _plain_entry(line, tailed.source, log_id, now)
+            except Exception:
+                self.parse_errors += 1
+                log = _plain_entry(line, tailed.source, log_id, now)
+            log.details["file"] = tailed.path
+            log.details["offset"] = offset
+            logs.append(log)
+        return logs
+
+    def read_batch(self, checkpoints: Dict[str, Dict[str, Any]]) -> Tuple[List[LogEntry], Dict[str, Dict[str, Any]]]:
+        """
+        Read and parse up to about `batch_size` new lines across all files, returning
+        them with the checkpoints to commit alongside. Files are opened from the
+        committed `checkpoints`. Blocking: run it in a thread.
+        """
+        self.discover()
+        logs, positions = [], {}
+        tailed_files = list(self.files.values())
+        if not tailed_files:
+            return logs, positions
+        self._start = (self._start + 1) % len(tailed_files)
+
+        for tailed in tailed_files[self._start:] + tailed_files[:self._start]:
+            if len(logs) >= self.batch_size:
+                break
+            try:
+                if tailed.fd is None and not self._open(tailed, checkpoints.get(tailed.key)):
+                    continue
+                self._check(tailed)
+                lines = self._read_lines(tailed, self.batch_size - len(logs))
+                if lines:
+                    positions[tailed.key] = tailed.checkpoint()
+                    logs.extend(self.parse_lines(tailed, lines))
+                    TAIL_LINES.inc(len(lines), source=tailed.source)
+                    self.lines_read += len(lines)
+                elif tailed.rotated:
+                    # The old file is done: continue from the start of the file now at the path
+                    tailed.close()
+                    if not self._open(tailed, None):
+                        del self.files[tailed.path]
+            except OSError as e:
+                logger.error(f"Error reading {tailed.path}: {str(e)}")
+                tailed.close()
+        return logs, positions
+
+    def get_stats(self) -> Dict[str, Any]:
+        files = []
+        for tailed in self.files.values():
+            try:
+                size = os.fstat(tailed.fd).st_size if tailed.fd is not None else os.stat(tailed.path).st_size
+            except OSError:
+                size = None
+            files.append({
+                "path": tailed.path,
+                "source": tailed.source,
+                "offset": tailed.offset,
+                "size": size,
+                "lag_bytes": size - tailed.offset if size is not None and tailed.fd is not None else None,
+                "rotated": tailed.rotated,
+            })
+        return {
+            "patterns": [f"{source}={pattern}" if source else pattern for source, pattern in self.patterns],
+            "files": files,
+            "lines_read": self.lines_read,
+            "parse_errors": self.parse_errors,
+            "resets": dict(self.resets),
+        }
+
+
+# Create a singleton instance
+file_tailer = FileTailer()
@@ -0,0 +1,126 @@
+import numpy as np
+from typing import Tuple
+from loguru import logger
+from sklearn.ensemble import IsolationForest
+
+
+def _average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Average path length of an unsuccessful BST search over n samples (same formula as sklearn)"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros(n_samples.shape, dtype=np.float64)
+
+    mask_2 = n_samples == 2
+    not_mask = n_samples > 2
+
+    result[mask_2] = 1.0
+    result[not_mask] = (
+        2.0 * (np.log(n_samples[not_mask] - 1.0) + np.euler_gamma)
+        - 2.0 * (n_samples[not_mask] - 1.0) / n_samples[not_mask]
+    )
+    return result
+
+
+class CompiledIsolationForest:
+    """
+    Flat NumPy representation of a fitted IsolationForest.
+
+    All trees are concatenated into one set of node arrays so a whole batch can be
+    pushed through the forest with a handful of vectorized steps, producing both the
+    decision scores and the predicted labels from a single traversal.
+    """
+
+    def __init__(self, model: IsolationForest):
+        """Compile the fitted trees of an IsolationForest into flat node arrays"""
+        features, thresholds, left, right, path_values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        for estimator, estimator_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            is_leaf = tree.children_left == -1
+            node_ids = np.arange(n_nodes)
+
+            # Depth of every node, computed top-down (children always follow their parent)
+            depth = np.zeros(n_nodes, dtype=np.int64)
+            for node in range(n_nodes):
+                if not is_leaf[node]:
+                    depth[tree.children_left[node]] = depth[node] + 1
+                    depth[tree.children_right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            # Map tree-local feature indices to columns of the full feature matrix;
+            # leaves point at themselves so extra traversal steps are no-ops
+            features.append(np.where(is_leaf, 0, np.asarray(estimator_features)[np.maximum(tree.feature, 0)]))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            right.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+
+            # Path length contributed by a sample ending in this node (only read for leaves):
+            # nodes on the decision path plus the expected depth of the unbuilt subtree
+            path_values.append((depth + 1.0) + _average_path_length(tree.n_node_samples) - 1.0)
+
+            roots.append(offset)
+            offset += n_nodes
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float64)
+        self.children_left = np.concatenate(left).astype(np.intp)
+        self.children_right = np.concatenate(right).astype(np.intp)
+        self.path_value = np.concatenate(path_values)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+        self.n_trees = len(roots)
+        self.offset = float(model.offset_)
+        self.denominator = self.n_trees * float(_average_path_length(np.array([model.max_samples_]))[0])
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """Equivalent of IsolationForest.decision_function (lower is more anomalous)"""
+        # sklearn trees compare float32 feature values against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        n_samples = X.shape[0]
+        rows = np.arange(n_samples)[:, None]
+
+        # One column per tree; every sample walks all trees at once
+        nodes = np.broadcast_to(self.roots, (n_samples, self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[nodes]]
+            nodes = np.where(
+                values <= self.threshold[nodes],
+                self.children_left[nodes],
+                self.children_right[nodes]
+            )
+
+        # Accumulate tree by tree to keep the same summation order as sklearn
+        leaf_values = self.path_value[nodes]
+        depths = np.zeros(n_samples, dtype=np.float64)
+        for tree_idx in range(self.n_trees):
+            depths += leaf_values[:, tree_idx]
+
+        if self.denominator != 0:
+            scores = 2 ** (-depths / self.denominator)
+        else:
+            scores = np.ones_like(depths)
+
+        return -scores - self.offset
+
+    def predict_with_scores(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (labels, decision scores) from a single pass; labels are -1 for anomalies, 1 otherwise"""
+        scores = self.decision_function(X)
+        labels = np.where(scores < 0, -1, 1)
+        return labels, scores
+
+    def matches(self, model: IsolationForest, X: np.ndarray) -> bool:
+        """Check that this compiled forest reproduces the sklearn model's output on X"""
+        labels, scores = self.predict_with_scores(X)
+        expected_scores = model.decision_function(X)
+        expected_labels = model.predict(X)
+
+        same_labels = np.array_equal(labels, expected_labels)
+        same_scores = np.allclose(scores, expected_scores, rtol=0, atol=1e-12)
+        if not (same_labels and same_scores):
+            logger.warning(
+                f"Compiled forest diverges from sklearn: labels equal={same_labels}, "
+                f"max score diff={np.max(np.abs(scores - expected_scores)):.3e}"
+            )
+        return same_labels and same_scores
@@ -0,0 +1,313 @@
+import atexit
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import List, Dict, Any, Optional, TextIO
+from loguru import logger
+
+from services.metrics import metrics, QUEUE_DEPTH
+
+LOG_RECORDS_DROPPED = metrics.counter("log_records_dropped_total", "Application log records not written", ["reason"])
+
+ERROR_LEVEL = 40
+
+
+class RateLimit:
+    """Token bucket for log lines from `module` whose message starts with `prefix`"""
+
+    def __init__(self, module: str, prefix: str = "", per_second: float = 5.0, burst: int = 20):
+        self.module = module
+        self.prefix = prefix
+        self.per_second = per_second
+        self.burst = burst
+
+
+# Lines that repeat for every stored threat, action and cycle under attack bursts
+DEFAULT_RATE_LIMITS = [
+    RateLimit("services.anomaly_detector", "Stored new threat", per_second=5, burst=20),
+    RateLimit("services.response_manager", "SIMULATED:", per_second=5, burst=20),
+    RateLimit("services.response_manager", "Executed action", per_second=5, burst=20),
+]
+
+
+class LogRateLimiter:
+    """
+    Loguru filter that rate limits noisy log lines.
+
+    Only lines matching a configured (module, prefix) rule are limited, each rule
+    with its own token bucket; every other line, and anything at ERROR or above,
+    passes. The next line let through by a rule reports how many were suppressed.
+    """
+
+    def __init__(self, rate_limits: Optional[List[RateLimit]] = None):
+        self.rate_limits = rate_limits if rate_limits is not None else DEFAULT_RATE_LIMITS
+        self._by_module: Dict[str, List[RateLimit]] = {}
+        for rule in self.rate_limits:
+            self._by_module.setdefault(rule.module, []).append(rule)
+        # rule -> [tokens, last refill, suppressed since last emitted line]
+        self._buckets: Dict[RateLimit, list] = {}
+        # Every sink calls the filter with the same record; it is decided (and counted) once
+        self._last_record = None
+        self._last_result = True
+        self._lock = threading.Lock()
+
+    def __call__(self, record) -> bool:
+        rules = self._by_module.get(record["name"])
+        if not rules or record["level"].no >= ERROR_LEVEL:
+            return True
+
+        rule = None
+        for candidate in rules:
+            if record["message"].startswith(candidate.prefix):
+                rule = candidate
+                break
+        if rule is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            if record is self._last_record:
+                return self._last_result
+            self._last_record = record
+            bucket = self._buckets.get(rule)
+            if bucket is None:
+                bucket = self._buckets[rule] = [float(rule.burst), now, 0]
+            bucket[0] = min(rule.burst, bucket[0] + (now - bucket[1]) * rule.per_second)
+            bucket[1] = now
+
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self._last_result = False
+                LOG_RECORDS_DROPPED.inc(reason="rate_limited")
+                return False
+
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            self._last_result = True
+            if suppressed:
+                record["message"] += f" [{suppressed} similar messages suppressed]"
+        return True
+
+
+class _LogFile:
+    """Append-only log file with size-based rotation and age-based retention"""
+
+    def __init__(self, path: str, rotation_bytes: int, retention_days: float):
+        self.path = path
+        self.rotation_bytes = rotation_bytes
+        self.retention_days = retention_days
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, text: str):
+        self._file.write(text)
+        self._file.flush()
+        if self.rotation_bytes and self._file.tell() >= self.rotation_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        base, ext = os.path.splitext(self.path)
+        os.replace(self.path, f"{base}.{datetime.now().strftime('%Y-%m-%d_%H-%M-%S_%f')}{ext}")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+        cutoff = time.time() - self.retention_days * 86400
+        for old in glob.glob(f"{glob.escape(base)}.*{ext}"):
+            try:
+                if os.path.getmtime(old) < cutoff:
+                    os.remove(old)
+            except OSError:
+                pass
+
+    def close(self):
+        self._file.close()
+
+
+class AsyncLogPipeline:
+    """
+    Non-blocking loguru sink.
+
+    The sink only appends a small record tuple to a bounded buffer; one writer thread
+    formats them (text or JSON lines) and writes each batch with a single write to
+    the log file and the console. Once the buffer is `sample_above` full, records
+    below ERROR are sampled (1 in `sample_every` kept); when it is full they are
+    dropped. ERROR and above may use a small reserve beyond the bound. Every record
+    not written is counted in log_records_dropped_total.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = "logs/sentinel.log",
+        console: Optional[TextIO] = sys.stderr,
+        json_format: bool = False,
+        buffer_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        sample_above: float = 0.8,
+        sample_every: int = 10,
+        error_reserve: Optional[int] = None,
+        rotation_bytes: int = 500 * 1024 * 1024,
+        retention_days: float = 10
+    ):
+        self.json_format = json_format
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_from = int(buffer_size * sample_above)
+        self.sample_every = sample_every
+        self.error_reserve = error_reserve if error_reserve is not None else max(1, buffer_size // 10)
+        self.file = _LogFile(path, rotation_bytes, retention_days) if path else None
+        self.console = console
+        self.dropped = 0
+        self._sampled = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._writer = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._writer.start()
+        QUEUE_DEPTH.set_function(lambda: len(self._buffer), queue="log_buffer")
+
+    def _admit(self, level_no: int) -> bool:
+        depth = len(self._buffer)
+        if level_no >= ERROR_LEVEL:
+            reason = None if depth < self.buffer_size + self.error_reserve else "buffer_full"
+        elif depth >= self.buffer_size:
+            reason = "buffer_full"
+        elif depth >= self.sample_from:
+            self._sampled += 1
+            reason = None if self._sampled % self.sample_every == 0 else "sampled"
+        else:
+            reason = None
+
+        if reason is not None:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc(reason=reason)
+            return False
+        return True
+
+    def sink(self, message):
+        """Loguru sink: enqueue without formatting or I/O on the caller's thread"""
+        record = message.record
+        level = record["level"]
+        exception = record["exception"]
+        entry = (
+            record["time"], level.name, record["name"], record["function"], record["line"],
+            record["message"], record["extra"] or None,
+            str(message)[len(record["message"]):].strip() if exception else None
+        )
+        with self._lock:
+            if not self._admit(level.no):
+                return
+            self._buffer.append(entry)
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def _format(self, entry) -> str:
+        timestamp, level, name, function, line, text, extra, exception = entry
+        if self.json_format:
+            data = {
+                "time": timestamp.isoformat(), "level": level, "module": name,
+                "function": function, "line": line, "message": text,
+            }
+            if extra:
+                data["extra"] = extra
+            if exception:
+                data["exception"] = exception
+            return json.dumps(data, default=str) + "\n"
+
+        formatted = f"{timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]} | {level:<8} | {name}:{function}:{line} - {text}\n"
+        if exception:
+            formatted += exception + "\n"
+        return formatted
+
+    def _drain(self):
+        while self._buffer:
+            batch = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popleft())
+
+            text = "".join(self._format(entry) for entry in batch)
+            try:
+                if self.file:
+                    self.file.write(text)
+                if self.console:
+                    self.console.write(text)
+                    self.console.flush()
+            except Exception as e:
+                # Logging about logging failures would recurse into this sink
+                print(f"Error writing log batch: {str(e)}", file=sys.__stderr__)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+
+    def shutdown(self):
+        """Flush everything buffered and stop the writer thread"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._writer.join(timeout=5)
+        self._drain()
+        if self.file:
+            self.file.close()
+
+
+_pipeline: Optional[AsyncLogPipeline] = None
+_handler: Optional[int] = None
+
+
+def configure_logging(
+    path: Optional[str] = "logs/sentinel.log",
+    level: Optional[str] = None,
+    json_format: Optional[bool] = None,
+    rate_limits: Optional[List[RateLimit]] = None,
+    **pipeline_options
+) -> AsyncLogPipeline:
+    """
+    Replace loguru's default handlers with the asynchronous pipeline.
+
+    With several workers (SENTINEL_WORKERS) each process writes its own timestamped
+    file, so no two processes rotate the same one. SENTINEL_LOG_LEVEL (default INFO)
+    and SENTINEL_LOG_JSON=1 are used when level/json_format are not given.
+    """
+    global _pipeline, _handler
+    if level is None:
+        level = os.environ.get("SENTINEL_LOG_LEVEL", "INFO")
+    if json_format is None:
+        json_format = os.environ.get("SENTINEL_LOG_JSON", "0").lower() in ("1", "true", "yes")
+    if path and int(os.environ.get("SENTINEL_WORKERS", "1")) > 1:
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}{ext}"
+
+    if _pipeline is not None:
+        shutdown_logging()
+    else:
+        atexit.register(shutdown_logging)
+
+    logger.remove()
+    _pipeline = AsyncLogPipeline(path=path, json_format=json_format, **pipeline_options)
+    _handler = logger.add(_pipeline.sink, level=level, format="{message}", filter=LogRateLimiter(rate_limits), catch=True)
+    return _pipeline
+
+
+def shutdown_logging():
+    """Flush buffered log records and stop the writer (call on application shutdown)"""
+    global _handler
+    if _handler is not None:
+        try:
+            logger.remove(_handler)
+        except ValueError:
+            # Already removed (e.g. by logger.remove() elsewhere)
+            pass
+        _handler = None
+    if _pipeline is not None:
+        _pipeline.shutdown()
@@ -0,0 +1,463 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+
+from models.database import SessionLocal
+from models.schemas import LogEntry
+from services.cluster import cluster_coordinator, INGEST_ROLE
+from services.metrics import metrics, QUEUE_DEPTH
+from services.serialization import loads
+
+COLLECTOR_EVENTS = metrics.counter("collector_events_total", "Events received by the network collector", ["protocol"])
+COLLECTOR_DROPPED = metrics.counter("collector_events_dropped_total", "Network events not stored", ["reason"])
+COLLECTOR_PARSE_ERRORS = metrics.counter("collector_parse_errors_total", "Network events that could not be parsed", ["protocol"])
+
+# Syslog severities 0-3 (emergency..error) and 4 (warning); everything else is info
+_SEVERITY_LEVELS = ["error", "error", "error", "error", "warning", "info", "info", "info"]
+_MONTHS = {m: i for i, m in enumerate(
+    [b"Jan", b"Feb", b"Mar", b"Apr", b"May", b"Jun", b"Jul", b"Aug", b"Sep", b"Oct", b"Nov", b"Dec"], start=1
+)}
+_NIL = b"-"
+_BOM = b"\xef\xbb\xbf"
+# PRI assumed for messages without one (user.notice, RFC 3164 section 4.3.3)
+_DEFAULT_PRI = 13
+
+
+def new_log_ids(count: int) -> List[str]:
+    """Random (version 4) UUID strings from a single urandom call, several times faster than uuid.uuid4()"""
+    data = os.urandom(16 * count).hex()
+    ids = []
+    for i in range(0, 32 * count, 32):
+        h = data[i:i + 32]
+        ids.append(f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}")
+    return ids
+
+
+def _text(value: bytes) -> Optional[str]:
+    return None if value == _NIL else value.decode("utf-8", "replace")
+
+
+def _parse_rfc5424_timestamp(value: bytes) -> datetime:
+    if value == _NIL:
+        return datetime.now()
+    timestamp = datetime.fromisoformat(value.decode().replace("Z", "+00:00"))
+    # Stored timestamps are naive local time (fromtimestamp is much cheaper than astimezone)
+    return datetime.fromtimestamp(timestamp.timestamp()) if timestamp.tzinfo else timestamp
+
+
+def _parse_rfc3164_timestamp(value: bytes, now: datetime) -> Optional[datetime]:
+    """'Mmm dd hh:mm:ss' in the current year (or the last one for dates in the future)"""
+    month = _MONTHS.get(value[:3])
+    if month is None or value[3:4] != b" " or value[6:7] != b" ":
+        return None
+    try:
+        timestamp = datetime(now.year, month, int(value[4:6]), int(value[7:9]), int(value[10:12]), int(value[13:15]))
+    except ValueError:
+        return None
+    if (timestamp - now).days > 0:
+        timestamp = timestamp.replace(year=now.year - 1)
+    return timestamp
+
+
+def _split_structured_data(rest: bytes) -> Tuple[Optional[str], bytes]:
+    """Split RFC 5424 STRUCTURED-DATA ('-' or [..][..]) from the message"""
+    if rest[:1] != b"[":
+        return None, rest[2:]
+    i, end = 0, len(rest)
+    while i < end and rest[i] == 0x5B:
+        # The element ends at the first "]" outside a quoted PARAM-VALUE; inside one,
+        # a backslash escapes the next byte (so '\\]' is an escaped backslash, then "]")
+        i += 1
+        quoted = False
+        while i < end:
+            byte = rest[i]
+            if quoted:
+                if byte == 0x5C:
+                    i += 1
+                elif byte == 0x22:
+                    quoted = False
+            elif byte == 0x22:
+                quoted = True
+            elif byte == 0x5D:
+                break
+            i += 1
+        i += 1
+    return rest[:i].decode("utf-8", "replace"), rest[i + 1:]
+
+
+def parse_syslog(
+    data: bytes,
+    peer: Optional[str] = None,
+    now: Optional[datetime] = None,
+    log_id: Optional[str] = None
+) -> LogEntry:
+    """Parse one RFC 5424 or RFC 3164 syslog message (raises ValueError when malformed)"""
+    now = now or datetime.now()
+    pri = _DEFAULT_PRI
+    if data[:1] == b"<":
+        end = data.find(b">", 1, 5)
+        if end < 0:
+            raise ValueError("Invalid PRI")
+        pri = int(data[1:end])
+        data = data[end + 1:]
+
+    details: Dict[str, Any] = {"facility": pri >> 3, "severity": pri & 7}
+    if peer:
+        details["peer"] = peer
+
+    if data[:2] == b"1 ":
+        # RFC 5424: VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID SD [MSG]
+        fields = data.split(b" ", 6)
+        if len(fields) < 7:
+            raise ValueError("Truncated RFC 5424 header")
+        _, timestamp, host, app, procid, msgid, rest = fields
+        structured_data, message = _split_structured_data(rest)
+        if message.startswith(_BOM):
+            message = message[3:]
+        timestamp = _parse_rfc5424_timestamp(timestamp)
+        host, app = _text(host), _text(app)
+        for key, value in (("procid", _text(procid)), ("msgid", _text(msgid)), ("structured_data", structured_data)):
+            if value is not None:
+                details[key] = value
+    else:
+        # RFC 3164: TIMESTAMP HOSTNAME TAG[pid]: MSG (anything else is all message)
+        timestamp = _parse_rfc3164_timestamp(data[:15], now)
+        host = app = None
+        message = data
+        if timestamp is not None:
+            host_end = data.find(b" ", 16)
+            if host_end > 0:
+                host = data[16:host_end].decode("utf-8", "replace")
+                message = data[host_end + 1:]
+                tag_end = message.find(b":")
+                if 0 < tag_end <= 48 and b" " not in message[:tag_end]:
+                    tag = message[:tag_end]
+                    bracket = tag.find(b"[")
+                    if bracket > 0:
+                        details["procid"] = tag[bracket + 1:].rstrip(b"]").decode("utf-8", "replace")
+                        tag = tag[:bracket]
+                    app = tag.decode("utf-8", "replace")
+                    message = message[tag_end + 1:].lstrip(b" ")
+        else:
+            timestamp = now
+
+    if host:
+        details["host"] = host
+    # Validating is cheaper than model_construct with pydantic-core
+    return LogEntry(
+        id=log_id or str(uuid.uuid4()),
+        timestamp=timestamp,
+        source=app or host or "syslog",
+        level=_SEVERITY_LEVELS[pri & 7],
+        message=message.rstrip(b"\r\n").decode("utf-8", "replace"),
+        details=details,
+    )
+
+
+def parse_json_line(data: bytes) -> LogEntry:
+    """Parse one JSON-lines event (a LogEntry object; raises ValueError when invalid)"""
+    return LogEntry.model_validate(loads(data))
+
+
+class _TCPProtocol(asyncio.Protocol):
+    """
+    Stream framing for syslog (RFC 6587 octet counting or newline delimited) and JSON lines.
+    Frames are sliced out of the receive buffer through a memoryview and queued as bytes.
+    """
+
+    def __init__(self, collector: "NetworkCollector", protocol: str, octet_counting: bool):
+        self.collector = collector
+        self.protocol = protocol
+        self.octet_counting = octet_counting
+        self.buffer = bytearray()
+        self.transport = None
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peername = transport.get_extra_info("peername")
+        self.peer = peername[0] if peername else None
+
+    def connection_lost(self, exc):
+        self.collector._paused.discard(self.transport)
+
+    def data_received(self, data: bytes):
+        self.buffer += data
+        view = memoryview(self.buffer)
+        frames = []
+        position, end = 0, len(view)
+        max_size = self.collector.max_message_size
+        try:
+            while position < end:
+                # Octet counting: "<length> <message>", recognised by a leading digit
+                if self.octet_counting and 0x30 <= view[position] <= 0x39:
+                    space = self.buffer.find(b" ", position, position + 8)
+                    if space < 0:
+                        if end - position >= 8:
+                            raise ValueError("Invalid octet count")
+                        break
+                    length = int(self.buffer[position:space])
+                    if length > max_size:
+                        raise ValueError("Frame too large")
+                    if space + 1 + length > end:
+                        break
+                    frames.append(bytes(view[space + 1:space + 1 + length]))
+                    position = space + 1 + length
+                else:
+                    newline = self.buffer.find(b"\n", position)
+                    if newline < 0:
+                        if end - position > max_size:
+                            raise ValueError("Frame too large")
+                        break
+                    if newline > position:
+                        frames.append(bytes(view[position:newline]))
+                    position = newline + 1
+        except ValueError as e:
+            # Framing is lost; drop the connection rather than guess
+            self.collector.parse_errors[self.protocol] = self.collector.parse_errors.get(self.protocol, 0) + 1
+            logger.warning(f"Closing {self.protocol} connection from {self.peer}: {str(e)}")
+            view.release()
+            self.transport.close()
+            return
+        view.release()
+        del self.buffer[:position]
+
+        if frames and self.collector.enqueue(self.protocol, frames, self.peer):
+            # Queue is full: stop reading until the writer catches up (TCP applies backpressure)
+            self.transport.pause_reading()
+            self.collector._paused.add(self.transport)
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, collector: "NetworkCollector"):
+        self.collector = collector
+
+    def connection_made(self, transport):
+        # The loop reads one datagram per wakeup; a large kernel buffer absorbs bursts meanwhile
+        sock = transport.get_extra_info("socket")
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.collector.receive_buffer)
+        except OSError as e:
+            logger.warning(f"Could not set the syslog UDP receive buffer: {str(e)}")
+
+    def datagram_received(self, data: bytes, addr):
+        self.collector.enqueue("syslog_udp", [data], addr[0], drop_when_full=True)
+
+
+class NetworkCollector:
+    """
+    Asyncio network listeners feeding the batched log write path.
+
+    Accepts syslog (RFC 5424 and RFC 3164) over UDP and TCP and JSON lines over
+    TCP. Receiving only queues raw frames; a single writer task parses everything
+    queued in one go and stores it with `LogCollector.store_logs`, so batches grow
+    with load while a commit is in progress. When the queue is full, UDP
+    datagrams are dropped and counted and TCP connections stop being read.
+
+    Ports come from SENTINEL_SYSLOG_UDP_PORT, SENTINEL_SYSLOG_TCP_PORT and
+    SENTINEL_JSONL_TCP_PORT (unset: listener disabled). Like the other
+    collectors, listeners are bound only while this worker holds the ingest
+    role, checked every `poll_interval` seconds; a worker that loses the role
+    closes them and stores what it has queued. SO_REUSEPORT lets the new
+    holder bind while the previous one is still closing.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        max_queue: int = 100_000,
+        batch_size: int = 5000,
+        max_message_size: int = 64 * 1024,
+        receive_buffer: int = 4 * 1024 * 1024,
+        poll_interval: float = 5.0
+    ):
+        """Initialize the collector; host defaults to SENTINEL_COLLECTOR_HOST or 0.0.0.0"""
+        self.host = host or os.environ.get("SENTINEL_COLLECTOR_HOST", "0.0.0.0")
+        self.ports = {
+            protocol: int(os.environ[variable])
+            for protocol, variable in (
+                ("syslog_udp", "SENTINEL_SYSLOG_UDP_PORT"),
+                ("syslog_tcp", "SENTINEL_SYSLOG_TCP_PORT"),
+                ("jsonl_tcp", "SENTINEL_JSONL_TCP_PORT"),
+            )
+            if os.environ.get(variable)
+        }
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_message_size = max_message_size
+        self.receive_buffer = receive_buffer
+        self.poll_interval = poll_interval
+        self.collector = None
+        # (protocol, raw frame, peer address)
+        self._queue = deque()
+        self._wake = asyncio.Event()
+        self._paused = set()
+        # protocol -> bound server (TCP) or transport (UDP)
+        self._servers: Dict[str, Any] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+        # Plain counters on the receive path; pushed to metrics once per batch
+        self.received: Dict[str, int] = {}
+        self.parse_errors: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self._reported: Dict[Tuple[str, str, int], int] = {}
+        self.stored = 0
+        QUEUE_DEPTH.set_function(lambda: len(self._queue), queue="network_collector")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ports)
+
+    def enqueue(self, protocol: str, frames: List[bytes], peer: Optional[str], drop_when_full: bool = False) -> bool:
+        """Queue raw frames; returns True when the queue is (now) full"""
+        self.received[protocol] = self.received.get(protocol, 0) + len(frames)
+        if drop_when_full and len(self._queue) >= self.max_queue:
+            self.dropped["queue_full"] = self.dropped.get("queue_full", 0) + len(frames)
+            return True
+        for frame in frames:
+            self._queue.append((protocol, frame, peer))
+        if not self._wake.is_set():
+            self._wake.set()
+        return len(self._queue) >= self.max_queue
+
+    def parse_batch(self, items: List[Tuple[str, bytes, Optional[str]]]) -> List[LogEntry]:
+        """Parse queued frames, counting the ones that fail"""
+        now = datetime.now()
+        logs = []
+        for (protocol, frame, peer), log_id in zip(items, new_log_ids(len(items))):
+            try:
+                if protocol == "jsonl_tcp":
+                    logs.append(parse_json_line(frame))
+                else:
+                    logs.append(parse_syslog(frame, peer, now, log_id))
+            except Exception:
+                self.parse_errors[protocol] = self.parse_errors.get(protocol, 0) + 1
+        return logs
+
+    def _report(self):
+        for counter, values, label in (
+            (COLLECTOR_EVENTS, self.received, "protocol"),
+            (COLLECTOR_PARSE_ERRORS, self.parse_errors, "protocol"),
+            (COLLECTOR_DROPPED, self.dropped, "reason"),
+        ):
+            for key, value in values.items():
+                delta = value - self._reported.get((label, key, id(counter)), 0)
+                if delta:
+                    counter.inc(delta, **{label: key})
+                    self._reported[(label, key, id(counter))] = value
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._queue:
+                count = min(self.batch_size, len(self._queue))
+                items = [self._queue.popleft() for _ in range(count)]
+                if self._paused and len(self._queue) < self.max_queue // 2:
+                    for transport in self._paused:
+                        transport.resume_reading()
+                    self._paused.clear()
+
+                logs = self.parse_batch(items)
+                if logs:
+                    try:
+                        async with SessionLocal() as db:
+                            await self.collector.store_logs(db, logs)
+                        self.stored += len(logs)
+                    except Exception as e:
+                        self.dropped["store_failed"] = self.dropped.get("store_failed", 0) + len(logs)
+                        logger.error(f"Error storing {len(logs)} network events: {str(e)}")
+                self._report()
+
+    async def _listen(self):
+        """Bind the configured listeners that are not bound yet"""
+        loop = asyncio.get_running_loop()
+        reuse_port = hasattr(socket, "SO_REUSEPORT")
+
+        for protocol, port in self.ports.items():
+            if protocol in self._servers:
+                continue
+            try:
+                if protocol == "syslog_udp":
+                    transport, _ = await loop.create_datagram_endpoint(
+                        lambda: _UDPProtocol(self), local_addr=(self.host, port), reuse_port=reuse_port
+                    )
+                    self._servers[protocol] = transport
+                else:
+                    server = await loop.create_server(
+                        lambda protocol=protocol: _TCPProtocol(self, protocol, octet_counting=protocol == "syslog_tcp"),
+                        self.host, port, reuse_port=reuse_port
+                    )
+                    self._servers[protocol] = server
+                logger.info(f"Network collector listening for {protocol} on {self.host}:{port}")
+            except OSError as e:
+                logger.error(f"Error starting {protocol} listener on port {port}: {str(e)}")
+
+    def _close(self):
+        for server in self._servers.values():
+            server.close()
+        if self._servers:
+            logger.info("Network collector listeners closed")
+        self._servers = {}
+
+    async def update_listeners(self):
+        """Bind the listeners while this worker holds the ingest role, close them otherwise"""
+        if cluster_coordinator.holds(INGEST_ROLE):
+            await self._listen()
+        else:
+            self._close()
+
+    async def _watch(self):
+        # start() has made the first check
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.update_listeners()
+            except Exception as e:
+                logger.error(f"Error updating network listeners: {str(e)}")
+
+    async def start(self, collector):
+        """Start the writer task and follow the ingest role, binding the listeners while it is held"""
+        if not self.enabled or self._writer is not None:
+            return
+        self.collector = collector
+        self._writer = asyncio.create_task(self._run())
+        await self.update_listeners()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        """Close the listeners and store what is still queued"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        self._close()
+        if self._writer is not None:
+            self._wake.set()
+            # Let the writer drain the queue before cancelling it
+            deadline = time.monotonic() + 5
+            while self._queue and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            self._writer.cancel()
+            self._writer = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "listeners": {protocol: f"{self.host}:{port}" for protocol, port in self.ports.items()},
+            "listening": sorted(self._servers),
+            "queued": len(self._queue),
+            "received": dict(self.received),
+            "stored": self.stored,
+            "parse_errors": dict(self.parse_errors),
+            "dropped": dict(self.dropped),
+            "paused_connections": len(self._paused),
+        }
+
+
+# Create a singleton instance
+network_collector = NetworkCollector()
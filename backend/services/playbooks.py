@@ -0,0 +1,386 @@
+import asyncio
+import fnmatch
+import json
+import os
+import re
+import time
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+from loguru import logger
+
+from models.schemas import Threat, ActionRequest, ACTION_TYPES, SEVERITIES
+from services.metrics import metrics
+
+PLAYBOOK_RUNS = metrics.counter("playbook_runs_total", "Playbook executions", ["playbook", "status"])
+PLAYBOOK_DURATION = metrics.histogram("playbook_duration_seconds", "Playbook execution durations", ["playbook"])
+
+_SEVERITY_RANK = {severity: rank for rank, severity in enumerate(SEVERITIES)}
+_WHEN = ("success", "failure", "always")
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {"runs": 0, "failed": 0, "total_seconds": 0.0, "last_run": None}
+
+
+class PlaybookError(ValueError):
+    """A playbook definition that cannot be compiled"""
+
+
+class Playbook:
+    """
+    One compiled playbook: its match conditions reduced to sets, a regex and
+    score bounds, and its steps ordered into stages of independent steps.
+    """
+
+    def __init__(self, definition: Dict[str, Any], origin: str, order: int):
+        self.name = definition.get("name")
+        if not self.name or not isinstance(self.name, str):
+            raise PlaybookError(f"{origin}: playbook #{order + 1} has no name")
+        self.origin = origin
+        self.definition = definition
+        self.priority = int(definition.get("priority", 0))
+        self.order = order
+        unknown = set(definition) - {"name", "description", "priority", "match", "steps"}
+        if unknown:
+            raise PlaybookError(f"{self.name}: unknown keys {sorted(unknown)}")
+
+        match = definition.get("match") or {}
+        unknown = set(match) - {"type", "severity", "source", "score", "indicators"}
+        if unknown:
+            raise PlaybookError(f"{self.name}: unknown match keys {sorted(unknown)}")
+        self.types = self._lower_set(match.get("type"))
+        self.severities = self._severities(match.get("severity"))
+        self.source_exact, self.source_pattern = self._sources(match.get("source"))
+        score = match.get("score") or {}
+        self.score_min = float(score["min"]) if "min" in score else None
+        self.score_max = float(score["max"]) if "max" in score else None
+        # Indicator kinds ("IP address", "User", ...) that must all be present
+        self.indicators = frozenset(self._as_list(match.get("indicators")))
+
+        self.stages = self._compile_steps(definition.get("steps") or [])
+        self.steps = [step for stage in self.stages for step in stage]
+
+    @staticmethod
+    def _as_list(value) -> List[str]:
+        if value is None:
+            return []
+        return [value] if isinstance(value, str) else list(value)
+
+    def _lower_set(self, value) -> Optional[frozenset]:
+        values = self._as_list(value)
+        return frozenset(v.lower() for v in values) if values else None
+
+    def _severities(self, value) -> Optional[frozenset]:
+        """{"min": "high"} or a list of severities, as the set of allowed severities"""
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            low = _SEVERITY_RANK.get(str(value.get("min", SEVERITIES[0])).lower())
+            high = _SEVERITY_RANK.get(str(value.get("max", SEVERITIES[-1])).lower())
+            if low is None or high is None:
+                raise PlaybookError(f"{self.name}: severity bounds must be one of {SEVERITIES}")
+            return frozenset(SEVERITIES[low:high + 1])
+        severities = self._lower_set(value)
+        if not severities <= set(SEVERITIES):
+            raise PlaybookError(f"{self.name}: severity must be one of {SEVERITIES}")
+        return severities
+
+    def _sources(self, value) -> Tuple[Optional[frozenset], Optional[re.Pattern]]:
+        """Exact sources as a set, glob patterns ("Azure-*") as one compiled regex"""
+        sources = self._as_list(value)
+        if not sources:
+            return None, None
+        exact = frozenset(s for s in sources if not any(c in s for c in "*?["))
+        globs = [s for s in sources if s not in exact]
+        pattern = re.compile("|".join(fnmatch.translate(g) for g in globs)) if globs else None
+        return exact, pattern
+
+    def _compile_steps(self, steps: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Steps grouped into stages: every step runs after the stages holding the steps it is `after`"""
+        if not steps:
+            raise PlaybookError(f"{self.name}: no steps")
+        by_id = {}
+        for i, step in enumerate(steps):
+            step = dict(step)
+            step.setdefault("id", f"step{i + 1}")
+            if step["id"] in by_id:
+                raise PlaybookError(f"{self.name}: duplicate step id {step['id']!r}")
+            if step.get("action") not in ACTION_TYPES:
+                raise PlaybookError(f"{self.name}: step {step['id']!r} action must be one of {ACTION_TYPES}")
+            step["after"] = self._as_list(step.get("after"))
+            step["when"] = step.get("when", "success")
+            if step["when"] not in _WHEN:
+                raise PlaybookError(f"{self.name}: step {step['id']!r} when must be one of {_WHEN}")
+            step["parameters"] = dict(step.get("parameters") or {})
+            by_id[step["id"]] = step
+
+        depth: Dict[str, int] = {}
+
+        def stage_of(step_id: str, path: Tuple[str, ...]) -> int:
+            if step_id in path:
+                raise PlaybookError(f"{self.name}: steps form a cycle through {step_id!r}")
+            if step_id not in depth:
+                step = by_id[step_id]
+                for dependency in step["after"]:
+                    if dependency not in by_id:
+                        raise PlaybookError(f"{self.name}: step {step_id!r} is after unknown step {dependency!r}")
+                depth[step_id] = 1 + max((stage_of(d, path + (step_id,)) for d in step["after"]), default=-1)
+            return depth[step_id]
+
+        stages: List[List[Dict[str, Any]]] = []
+        for step_id in by_id:
+            level = stage_of(step_id, ())
+            while len(stages) <= level:
+                stages.append([])
+            stages[level].append(by_id[step_id])
+        return stages
+
+    def thresholds(self) -> List[float]:
+        return [bound for bound in (self.score_min, self.score_max) if bound is not None]
+
+    def matches(self, severity: str, source: str, score: Optional[float], kinds: frozenset) -> bool:
+        """Everything but the type, which the engine's dispatch table has already checked"""
+        if self.severities is not None and severity not in self.severities:
+            return False
+        if self.source_exact is not None and source not in self.source_exact and not (
+            self.source_pattern is not None and self.source_pattern.match(source)
+        ):
+            return False
+        if self.score_min is not None and (score is None or score < self.score_min):
+            return False
+        if self.score_max is not None and (score is None or score > self.score_max):
+            return False
+        return self.indicators <= kinds
+
+
+class _RoutingTable:
+    """Compiled playbooks indexed by threat type, with the score thresholds and decision cache that go with them"""
+
+    def __init__(self, playbooks: List[Playbook]):
+        self.playbooks = playbooks
+        # Playbooks without a type condition apply to every type
+        self.any_type = [p for p in playbooks if p.types is None]
+        types = {threat_type for p in playbooks for threat_type in p.types or ()}
+        self.by_type = {t: [p for p in playbooks if p.types is None or t in p.types] for t in types}
+        self.thresholds = sorted({bound for p in playbooks for bound in p.thresholds()})
+        # Sources are open-ended; only make them part of the decision key when a playbook looks at them
+        self.keyed_by_source = any(p.source_exact is not None for p in playbooks)
+        self.decisions: Dict[Tuple, Optional[Playbook]] = {}
+
+
+class PlaybookEngine:
+    """
+    Routes threats to response playbooks loaded from JSON files
+
+    Every `*.json` file in `playbooks_dir` holds a list of playbooks. A
+    playbook has a name, a priority, `match` conditions and `steps`:
+
+    - Conditions can be threat types, severities (a list or min/max),
+      sources (globs allowed), score bounds and required indicator kinds.
+    - Each step names an action. It may run `after` other steps and only
+      on their `success` (the default), `failure`, or `always`.
+    - Steps that do not depend on each other run concurrently.
+
+    The highest-priority playbook whose conditions all hold is run.
+
+    Playbooks are compiled once per load. Each type gets the list of
+    playbooks that can match it, highest priority first. Score bounds
+    become thresholds, so a threat's score reduces to a bucket. Decisions
+    are cached by (type, severity, source, score bucket, indicator kinds),
+    so a recurring threat shape costs one dictionary lookup. The directory
+    is polled for changes (`watch`). A load that fails to compile keeps the
+    previous playbooks.
+    """
+
+    def __init__(self, playbooks_dir: Optional[str] = None, poll_interval: Optional[float] = None, cache_size: int = 65536):
+        """Initialize the engine; SENTINEL_PLAYBOOKS_DIR and SENTINEL_PLAYBOOKS_POLL override the location and poll interval"""
+        self.playbooks_dir = playbooks_dir or os.environ.get(
+            "SENTINEL_PLAYBOOKS_DIR", str(Path(__file__).resolve().parent.parent / "playbooks")
+        )
+        self.poll_interval = poll_interval or float(os.environ.get("SENTINEL_PLAYBOOKS_POLL", "5"))
+        self.cache_size = cache_size
+        self._table = _RoutingTable([])
+        self._signature = None
+        self._watcher: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self.reload()
+
+    def _files(self) -> List[Path]:
+        directory = Path(self.playbooks_dir)
+        return sorted(directory.glob("*.json")) if directory.is_dir() else []
+
+    def _files_signature(self):
+        signature = []
+        for path in self._files():
+            try:
+                st = path.stat()
+                signature.append((path.name, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                continue
+        return tuple(signature)
+
+    @property
+    def playbooks(self) -> List[Playbook]:
+        return self._table.playbooks
+
+    def compile(self, definitions: List[Tuple[str, Dict[str, Any]]]) -> List[Playbook]:
+        playbooks, names = [], set()
+        for order, (origin, definition) in enumerate(definitions):
+            playbook = Playbook(definition, origin, order)
+            if playbook.name in names:
+                raise PlaybookError(f"{origin}: duplicate playbook name {playbook.name!r}")
+            names.add(playbook.name)
+            playbooks.append(playbook)
+        # Highest priority first; file order breaks ties
+        playbooks.sort(key=lambda p: (-p.priority, p.order))
+        return playbooks
+
+    def reload(self, force: bool = False) -> bool:
+        """Load and compile the playbooks if their files changed; returns whether new playbooks are in use"""
+        signature = self._files_signature()
+        if not force and signature == self._signature:
+            return False
+        try:
+            definitions = []
+            for path in self._files():
+                with open(path) as f:
+                    content = json.load(f)
+                for definition in content if isinstance(content, list) else content.get("playbooks", []):
+                    definitions.append((path.name, definition))
+            playbooks = self.compile(definitions)
+        except Exception as e:
+            # Keep routing with the previous playbooks until the files are fixed
+            self._signature = signature
+            self.last_error = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"Error loading playbooks: {self.last_error}")
+            return False
+
+        # Published with one assignment, so routing never sees half of a reload
+        self._table = _RoutingTable(playbooks)
+        self._signature = signature
+        self.loaded_at = datetime.now()
+        self.last_error = None
+        for playbook in playbooks:
+            self.stats.setdefault(playbook.name, _empty_stats())
+        logger.info(f"Loaded {len(playbooks)} playbook(s) from {self.playbooks_dir}")
+        return True
+
+    async def watch(self):
+        """Poll the playbooks directory and reload on change"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                logger.error(f"Error watching playbooks: {str(e)}")
+
+    def start(self):
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    def route(self, threat: Threat) -> Optional[Playbook]:
+        """The playbook for a threat, or None when none matches"""
+        table = self._table
+        score = threat.anomaly_score
+        kinds = frozenset(indicator.split(":", 1)[0] for indicator in threat.indicators or ())
+        # Threats on the same side of every score threshold route the same way
+        bucket = None if score is None else bisect_right(table.thresholds, score)
+        # Boundaries are inclusive (min <= score <= max); exact hits get their own bucket
+        if bucket and table.thresholds[bucket - 1] == score:
+            bucket = -bucket
+        threat_type = threat.type.lower()
+        key = (threat_type, threat.severity, threat.source if table.keyed_by_source else None, bucket, kinds)
+        try:
+            return table.decisions[key]
+        except KeyError:
+            pass
+
+        playbook = None
+        for candidate in table.by_type.get(threat_type, table.any_type):
+            if candidate.matches(threat.severity, threat.source, score, kinds):
+                playbook = candidate
+                break
+        if len(table.decisions) >= self.cache_size:
+            table.decisions.clear()
+        table.decisions[key] = playbook
+        return playbook
+
+    async def run(
+        self,
+        playbook: Playbook,
+        threat: Threat,
+        execute: Callable[[ActionRequest], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Run a playbook's steps for a threat, stage by stage; returns each step's result (or skip reason)"""
+        started = time.perf_counter()
+        stats = self.stats.setdefault(playbook.name, _empty_stats())
+        base = {"severity": threat.severity, "source": threat.source, "indicators": threat.indicators, "user": threat.user}
+        results: Dict[str, Dict[str, Any]] = {}
+
+        def should_run(step) -> bool:
+            outcomes = [results[d] for d in step["after"]]
+            if step["when"] == "always":
+                return True
+            if any(o.get("skipped") for o in outcomes):
+                return False
+            failed = any("error" in o for o in outcomes)
+            return failed if step["when"] == "failure" else not failed
+
+        async def run_step(step) -> Dict[str, Any]:
+            if not should_run(step):
+                return {"skipped": True, "reason": f"after steps did not meet when={step['when']}"}
+            request = ActionRequest(threat_id=threat.id, action_type=step["action"], parameters={**base, **step["parameters"]})
+            try:
+                return await execute(request)
+            except Exception as e:
+                return {"error": str(e)}
+
+        for stage in playbook.stages:
+            outcomes = await asyncio.gather(*[run_step(step) for step in stage])
+            results.update({step["id"]: outcome for step, outcome in zip(stage, outcomes)})
+
+        elapsed = time.perf_counter() - started
+        status = "failed" if any("error" in r for r in results.values()) else "completed"
+        stats["runs"] += 1
+        stats["failed"] += status == "failed"
+        stats["total_seconds"] += elapsed
+        stats["last_run"] = datetime.now()
+        PLAYBOOK_RUNS.inc(playbook=playbook.name, status=status)
+        PLAYBOOK_DURATION.observe(elapsed, playbook=playbook.name)
+        return results
+
+    def describe(self, playbook: Playbook) -> Dict[str, Any]:
+        return {
+            "name": playbook.name,
+            "origin": playbook.origin,
+            "priority": playbook.priority,
+            "match": playbook.definition.get("match") or {},
+            "stages": [[{k: step[k] for k in ("id", "action", "after", "when")} for step in stage] for stage in playbook.stages],
+            "stats": self.stats.get(playbook.name),
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.playbooks_dir,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+            "cached_decisions": len(self._table.decisions),
+            "playbooks": [self.describe(playbook) for playbook in self.playbooks],
+        }
+
+
+# Create a singleton instance
+playbook_engine = PlaybookEngine()
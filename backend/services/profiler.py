@@ -0,0 +1,206 @@
+import asyncio
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from loguru import logger
+
+from services.metrics import metrics
+
+SLOW_CALLBACKS = metrics.counter("slow_callbacks_total", "Event loop callbacks that blocked longer than the threshold")
+
+# Pool threads are named like ThreadPoolExecutor-0_3; fold them into one root per pool
+_POOL_THREAD_SUFFIX = re.compile(r"_\d+$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread in the process at a fixed interval.
+
+    The event loop thread shows which coroutine step is running (or the selector
+    when idle); executor threads show work handed off with run_in_executor/to_thread.
+    Results are collapsed stacks ("root;caller;callee count") that flamegraph.pl,
+    speedscope and similar tools read directly.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def _sample(self, counts: Counter, own_ident: int, names: Dict[int, str]):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            counts[";".join(reversed(stack))] += 1
+
+    def run(self, seconds: float) -> Dict[str, Any]:
+        """Profile the process for `seconds` (blocking; call from a separate thread)"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+
+        try:
+            counts = Counter()
+            own_ident = threading.get_ident()
+            samples = 0
+            started = time.perf_counter()
+            deadline = started + seconds
+            while time.perf_counter() < deadline:
+                # Refresh names each round so threads started mid-profile are labelled
+                names = {t.ident: _POOL_THREAD_SUFFIX.sub("", t.name) for t in threading.enumerate()}
+                self._sample(counts, own_ident, names)
+                samples += 1
+                time.sleep(self.interval)
+
+            return {
+                "seconds": round(time.perf_counter() - started, 3),
+                "interval_ms": self.interval * 1000,
+                "samples": samples,
+                "stacks": counts,
+            }
+        finally:
+            self._lock.release()
+
+    async def profile(self, seconds: float) -> Dict[str, Any]:
+        """Profile the process without blocking the event loop"""
+        return await asyncio.to_thread(self.run, seconds)
+
+    @staticmethod
+    def collapse(result: Dict[str, Any]) -> str:
+        """Render a profile as collapsed stacks, heaviest first"""
+        return "".join(f"{stack} {count}\n" for stack, count in result["stacks"].most_common())
+
+
+class SlowCallbackDetector:
+    """
+    Logs every event loop callback (a coroutine step between two awaits, or a
+    plain call_soon/call_later callback) that runs longer than a threshold.
+
+    Works by timing asyncio's Handle._run, so it only sees the standard asyncio
+    loop (not uvloop). The cost is two clock reads per callback.
+    """
+
+    def __init__(self, threshold_ms: float = 100.0, history: int = 100):
+        self.threshold_ms = threshold_ms
+        self.recent = deque(maxlen=history)
+        self._original_run = None
+
+    @property
+    def installed(self) -> bool:
+        return self._original_run is not None
+
+    def install(self, threshold_ms: Optional[float] = None):
+        """Start timing callbacks (idempotent; updates the threshold if given)"""
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        if self.installed:
+            return
+
+        original_run = asyncio.events.Handle._run
+        detector = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            try:
+                return original_run(handle)
+            finally:
+                elapsed_ms = 1000 * (time.perf_counter() - start)
+                if elapsed_ms >= detector.threshold_ms:
+                    detector._record(handle, elapsed_ms)
+
+        self._original_run = original_run
+        asyncio.events.Handle._run = _run
+        logger.info(f"Slow callback detector installed (threshold {self.threshold_ms:.0f} ms)")
+
+    def uninstall(self):
+        if not self.installed:
+            return
+        asyncio.events.Handle._run = self._original_run
+        self._original_run = None
+        logger.info("Slow callback detector removed")
+
+    @staticmethod
+    def _describe(handle) -> Dict[str, Any]:
+        callback = handle._callback
+        task = getattr(callback, "__self__", None)
+        if isinstance(task, asyncio.Task):
+            coro = task.get_coro()
+            # The step that blocked ended at the coroutine's current await point
+            frame = getattr(coro, "cr_frame", None)
+            location = f"{frame.f_code.co_filename}:{frame.f_lineno}" if frame is not None else None
+            return {
+                "callback": f"Task {task.get_name()} {getattr(coro, '__qualname__', repr(coro))}",
+                "suspended_at": location,
+            }
+        return {"callback": getattr(callback, "__qualname__", repr(callback)), "suspended_at": None}
+
+    def _record(self, handle, elapsed_ms: float):
+        try:
+            entry = {"timestamp": datetime.now().isoformat(), "duration_ms": round(elapsed_ms, 1)}
+            entry.update(self._describe(handle))
+            self.recent.append(entry)
+            SLOW_CALLBACKS.inc()
+            where = f" before {entry['suspended_at']}" if entry["suspended_at"] else ""
+            logger.warning(f"Event loop blocked for {elapsed_ms:.0f} ms by {entry['callback']}{where}")
+        except Exception as e:
+            logger.error(f"Error recording slow callback: {str(e)}")
+
+    def get_recent(self) -> List[Dict[str, Any]]:
+        return list(reversed(self.recent))
+
+
+async def dump_profile(seconds: float, directory: str = "logs") -> Optional[str]:
+    """Profile the process and write collapsed stacks to a .folded file"""
+    try:
+        result = await profiler.profile(seconds)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"profile-{os.getpid()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w") as f:
+            f.write(SamplingProfiler.collapse(result))
+        logger.info(f"Wrote profile with {result['samples']} samples to {path}")
+        return path
+    except Exception as e:
+        logger.error(f"Error writing profile: {str(e)}")
+        return None
+
+
+def install_signal_handler(seconds: Optional[float] = None):
+    """Profile for `seconds` (env SENTINEL_PROFILE_SECONDS, default 10) on SIGUSR2"""
+    if not hasattr(signal, "SIGUSR2"):
+        return
+    if seconds is None:
+        seconds = float(os.environ.get("SENTINEL_PROFILE_SECONDS", "10"))
+
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR2, lambda: asyncio.ensure_future(dump_profile(seconds)))
+    except (RuntimeError, NotImplementedError) as e:
+        # Signal handlers need the main thread and a Unix event loop
+        logger.warning(f"Profiling signal handler not installed: {str(e)}")
+        return
+    logger.info(f"Send SIGUSR2 to process {os.getpid()} for a {seconds:.0f}s profile")
+
+
+# Create singleton instances
+profiler = SamplingProfiler()
+slow_callback_detector = SlowCallbackDetector()
@@ -0,0 +1,339 @@
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+from sqlalchemy import select, update, insert, func, and_, or_
+
+from models.database import engine
+from models.models import LogEntryModel, ThreatModel, ReplayRunModel
+from models.schemas import LogEntry
+from services.dictionary import dictionary
+from services.log_collector import LOG_FIELDS
+from services.metrics import QUEUE_DEPTH
+from services.storage_codec import storage_codec
+from services.threat_links import threat_links
+
+# Detector used inside each replay worker process (created lazily on first chunk)
+_process_detector = None
+
+
+def _score_chunk(rows: List[Tuple]) -> List[Dict[str, Any]]:
+    """Score one chunk of log rows in a worker process and return threat dicts"""
+    global _process_detector
+    if _process_detector is None:
+        from services.anomaly_detector import AnomalyDetector
+        from services.template_miner import template_miner
+        # Template counts drive the rarity feature
+        template_miner.load_sync()
+        _process_detector = AnomalyDetector()
+
+    logs = [
+        LogEntry(
+            id=log_id, timestamp=timestamp, source=source, level=level,
+            message=message, details=details, template_id=template_id
+        )
+        for log_id, timestamp, source, level, message, details, template_id in rows
+    ]
+    return [threat.model_dump() for threat in _process_detector.score_logs(logs)]
+
+
+class ReplayEngine:
+    """
+    Re-score a stored time range of logs with the current detection logic.
+
+    Logs are streamed out of the `logs` table in (timestamp, id) order with keyset
+    pagination and scored chunk by chunk in a process pool. Results are consumed in
+    submission order, so threats and the checkpoint are always written for a
+    contiguous prefix of the range and an interrupted run resumes exactly after
+    the last committed chunk. Threats are tagged with the run id, keeping them
+    apart from production detections.
+    """
+
+    def __init__(self):
+        """Initialize the replay engine"""
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.stop_requested = set()
+        logger.info("Replay engine initialized")
+
+    async def create_run(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        chunk_size: int = 100,
+        workers: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Register a new replay run over [start_time, end_time]"""
+        async with engine.begin() as conn:
+            total_logs = await conn.scalar(
+                select(func.count(LogEntryModel.id))
+                .where(LogEntryModel.timestamp >= start_time)
+                .where(LogEntryModel.timestamp <= end_time)
+            )
+            run_id = str(uuid.uuid4())
+            await conn.execute(
+                insert(ReplayRunModel.__table__)
+                .values(
+                    id=run_id,
+                    start_time=start_time,
+                    end_time=end_time,
+                    chunk_size=chunk_size,
+                    workers=workers or os.cpu_count() or 1,
+                    status="pending",
+                    total_logs=total_logs,
+                    logs_processed=0,
+                    threats_found=0,
+                    elapsed_seconds=0.0,
+                    created_at=datetime.now(),
+                    updated_at=datetime.now()
+                )
+            )
+
+        logger.info(f"Created replay run {run_id} over {total_logs} logs ({start_time} - {end_time})")
+        return await self.get_run(run_id)
+
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Get a run's configuration and progress"""
+        async with engine.connect() as conn:
+            result = await conn.execute(select(ReplayRunModel.__table__).where(ReplayRunModel.id == run_id))
+            row = result.mappings().first()
+
+        if row is None:
+            return None
+
+        run = dict(row)
+        elapsed = run["elapsed_seconds"] or 0.0
+        processed = run["logs_processed"] or 0
+        total = run["total_logs"] or 0
+        throughput = processed / elapsed if elapsed > 0 else 0.0
+        run["progress"] = processed / total if total else 1.0
+        run["logs_per_second"] = throughput
+        run["eta_seconds"] = (total - processed) / throughput if throughput > 0 else None
+        return run
+
+    async def list_runs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """List recent replay runs, newest first"""
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(ReplayRunModel.id).order_by(ReplayRunModel.created_at.desc()).limit(limit)
+            )
+            run_ids = [row[0] for row in result]
+
+        return [await self.get_run(run_id) for run_id in run_ids]
+
+    def start(self, run_id: str) -> asyncio.Task:
+        """Run (or resume) a replay in the background of the current event loop"""
+        if run_id in self.tasks and not self.tasks[run_id].done():
+            return self.tasks[run_id]
+
+        self.stop_requested.discard(run_id)
+        task = asyncio.create_task(self.run(run_id))
+        self.tasks[run_id] = task
+        return task
+
+    def stop(self, run_id: str):
+        """Ask a running replay to pause after the chunk it is currently committing"""
+        self.stop_requested.add(run_id)
+
+    async def _fetch_chunk(
+        self,
+        run: Dict[str, Any],
+        after: Optional[Tuple[datetime, str]]
+    ) -> List[Tuple]:
+        """Next chunk of log rows (LOG_FIELDS, decoded) in (timestamp, id) order after the given key"""
+        query = (
+            select(
+                LogEntryModel.id,
+                LogEntryModel.timestamp,
+                LogEntryModel.source,
+                LogEntryModel.level,
+                LogEntryModel.message,
+                LogEntryModel.details,
+                LogEntryModel.template_id
+            )
+            .where(LogEntryModel.timestamp >= run["start_time"])
+            .where(LogEntryModel.timestamp <= run["end_time"])
+        )
+
+        if after is not None:
+            after_timestamp, after_id = after
+            query = query.where(or_(
+                LogEntryModel.timestamp > after_timestamp,
+                and_(LogEntryModel.timestamp == after_timestamp, LogEntryModel.id > after_id)
+            ))
+
+        query = query.order_by(LogEntryModel.timestamp, LogEntryModel.id).limit(run["chunk_size"])
+
+        await dictionary.refresh()
+        async with engine.connect() as conn:
+            result = await conn.execute(query)
+            return await storage_codec.decode_rows(LOG_FIELDS, result)
+
+    async def _commit_chunk(
+        self,
+        run_id: str,
+        threats: List[Dict[str, Any]],
+        last_key: Tuple[datetime, str],
+        n_logs: int,
+        elapsed_seconds: float
+    ):
+        """Write a chunk's threats and advance the checkpoint in one transaction"""
+        async with engine.begin() as conn:
+            if threats:
+                threat_columns = set(ThreatModel.__table__.c.keys())
+                rows = [
+                    {**{k: v for k, v in threat.items() if k in threat_columns and k != "actions"},
+                     "run_id": run_id, "links_migrated": True}
+                    for threat in threats
+                ]
+                await conn.execute(insert(ThreatModel.__table__), rows)
+                await threat_links.write(conn, threats)
+
+            await conn.execute(
+                update(ReplayRunModel.__table__)
+                .where(ReplayRunModel.id == run_id)
+                .values(
+                    checkpoint_timestamp=last_key[0],
+                    checkpoint_log_id=last_key[1],
+                    logs_processed=ReplayRunModel.logs_processed + n_logs,
+                    threats_found=ReplayRunModel.threats_found + len(threats),
+                    elapsed_seconds=elapsed_seconds,
+                    updated_at=datetime.now()
+                )
+            )
+
+    async def _set_status(self, run_id: str, status: str, error: Optional[str] = None):
+        values = {"status": status, "updated_at": datetime.now(), "error": error}
+        if status == "completed":
+            values["finished_at"] = datetime.now()
+
+        async with engine.begin() as conn:
+            await conn.execute(update(ReplayRunModel.__table__).where(ReplayRunModel.id == run_id).values(**values))
+
+    async def run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Run a replay from its checkpoint until the range is exhausted or it is stopped"""
+        run = await self.get_run(run_id)
+        if run is None:
+            raise ValueError(f"Replay run {run_id} not found")
+
+        if run["status"] == "completed":
+            return run
+
+        after = None
+        if run["checkpoint_timestamp"] is not None:
+            after = (run["checkpoint_timestamp"], run["checkpoint_log_id"])
+            logger.info(f"Resuming replay run {run_id} after {after[0]} ({run['logs_processed']} logs done)")
+
+        await self._set_status(run_id, "running")
+
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(max_workers=run["workers"], mp_context=multiprocessing.get_context("spawn"))
+        pending = deque()
+        exhausted = False
+        processed = run["logs_processed"] or 0
+        total = run["total_logs"] or 0
+        base_elapsed = run["elapsed_seconds"] or 0.0
+        started = time.perf_counter()
+
+        try:
+            while True:
+                # Keep every worker busy with a chunk in flight plus one queued
+                while not exhausted and len(pending) < 2 * run["workers"]:
+                    rows = await self._fetch_chunk(run, after)
+                    if not rows:
+                        exhausted = True
+                        break
+
+                    after = (rows[-1][1], rows[-1][0])
+                    pending.append((loop.run_in_executor(executor, _score_chunk, rows), after, len(rows)))
+
+                if not pending:
+                    break
+
+                # Commit strictly in submission order so the checkpoint never skips a chunk
+                future, last_key, n_logs = pending.popleft()
+                QUEUE_DEPTH.set(len(pending), queue="replay_chunks")
+                threats = await future
+                elapsed = base_elapsed + time.perf_counter() - started
+                await self._commit_chunk(run_id, threats, last_key, n_logs, elapsed)
+
+                processed += n_logs
+                rate = processed / elapsed if elapsed > 0 else 0.0
+                logger.info(
+                    f"Replay {run_id}: {processed}/{total} logs ({100 * processed / max(total, 1):.1f}%), "
+                    f"{len(threats)} threats in chunk, {rate:.0f} logs/s"
+                )
+
+                if run_id in self.stop_requested:
+                    await self._set_status(run_id, "paused")
+                    logger.info(f"Replay run {run_id} paused at {last_key[0]}")
+                    return await self.get_run(run_id)
+
+            await self._set_status(run_id, "completed")
+            logger.info(f"Replay run {run_id} completed")
+        except asyncio.CancelledError:
+            await asyncio.shield(self._set_status(run_id, "paused"))
+            raise
+        except Exception as e:
+            logger.error(f"Error in replay run {run_id}: {str(e)}")
+            await self._set_status(run_id, "failed", error=str(e))
+        finally:
+            # Drop chunks scored after the last commit; they are re-read on resume
+            for future, _, _ in pending:
+                if not future.cancel() and not future.cancelled():
+                    future.exception()
+            executor.shutdown(wait=False, cancel_futures=True)
+            QUEUE_DEPTH.set(0, queue="replay_chunks")
+            self.stop_requested.discard(run_id)
+
+        return await self.get_run(run_id)
+
+    async def compare(self, run_id: str) -> Dict[str, Any]:
+        """Compare a run's threats with production threats over the same time range"""
+        run = await self.get_run(run_id)
+        if run is None:
+            raise ValueError(f"Replay run {run_id} not found")
+
+        async def summarize(conn, run_filter) -> Dict[str, Any]:
+            base = (
+                select(ThreatModel.severity, ThreatModel.type, ThreatModel.related_logs)
+                .where(run_filter)
+                .where(ThreatModel.timestamp >= run["start_time"])
+                .where(ThreatModel.timestamp <= run["end_time"])
+            )
+            by_severity, by_type, log_ids = {}, {}, set()
+            total = 0
+            for severity, threat_type, related_logs in await conn.execute(base):
+                total += 1
+                by_severity[severity] = by_severity.get(severity, 0) + 1
+                by_type[threat_type] = by_type.get(threat_type, 0) + 1
+                log_ids.update(related_logs or [])
+            return {"total": total, "by_severity": by_severity, "by_type": by_type, "log_ids": log_ids}
+
+        async with engine.connect() as conn:
+            production = await summarize(conn, ThreatModel.run_id.is_(None))
+            replay = await summarize(conn, ThreatModel.run_id == run_id)
+
+        production_logs = production.pop("log_ids")
+        replay_logs = replay.pop("log_ids")
+        return {
+            "run_id": run_id,
+            "start_time": run["start_time"],
+            "end_time": run["end_time"],
+            "production": production,
+            "replay": replay,
+            "flagged_logs": {
+                "both": len(production_logs & replay_logs),
+                "only_production": len(production_logs - replay_logs),
+                "only_replay": len(replay_logs - production_logs),
+            }
+        }
+
+
+# Create a singleton instance
+replay_engine = ReplayEngine()
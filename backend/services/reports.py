@@ -0,0 +1,386 @@
+import csv
+import hashlib
+import html
+import io
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Sequence
+from loguru import logger
+from sqlalchemy import select, func
+
+from models.database import engine
+from models.models import ThreatModel, LogEntryModel
+from services.dictionary import dictionary
+from services.metrics import metrics
+from services.serialization import dumps
+from services.storage_codec import storage_codec
+
+REPORTS_SERVED = metrics.counter("reports_total", "Reports served", ["format", "cache"])
+
+MEDIA_TYPES = {
+    "html": "text/html; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+}
+TIME_RANGES = {
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+    "all": None,
+}
+PERIOD_NAMES = {"24h": "Last 24 hours", "7d": "Last 7 days", "30d": "Last 30 days", "all": "All time"}
+
+# Columns of the report tables, as in the dashboard's client-side reports
+THREAT_COLUMNS = ["timestamp", "title", "type", "severity", "status", "source"]
+LOG_COLUMNS = ["timestamp", "level", "source", "message"]
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    return str(value)
+
+class Report:
+    """One requested report: its parameters, summary, cache key and, when cached, its body"""
+
+    def __init__(self, params: Dict[str, Any], start: Optional[datetime], end: Optional[datetime], summary: Dict[str, Any]):
+        self.params = params
+        self.start = start
+        self.end = end
+        self.summary = summary
+        self.generated_at = datetime.now()
+        # The summary's counts and latest timestamps stand in for the data version
+        self.key = hashlib.sha256(dumps([params, start, end, summary])).hexdigest()
+        self.body: Optional[bytes] = None
+
+    @property
+    def format(self) -> str:
+        return self.params["format"]
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    @property
+    def filename(self) -> str:
+        return f"security_report_{self.generated_at:%Y%m%d-%H%M%S}.{self.format}"
+
+    @property
+    def period(self) -> str:
+        if self.params["time_range"] is None:
+            return f"{_text(self.start) or 'beginning'} to {_text(self.end) or 'now'}"
+        return PERIOD_NAMES[self.params["time_range"]]
+
+    def sections(self) -> List[str]:
+        content = self.params["content"]
+        return [s for s in ("threats", "logs") if content in (s, "all")]
+
+class _HTMLRenderer:
+    def __init__(self, report: Report):
+        self.report = report
+
+    @staticmethod
+    def _table(headers: Sequence[str], rows: Sequence[Sequence[Any]]) -> str:
+        head = "".join(f"<th>{html.escape(h)}</th>" for h in headers)
+        body = "".join("<tr>" + "".join(f"<td>{html.escape(_text(v))}</td>" for v in row) + "</tr>" for row in rows)
+        return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>\n"
+
+    def header(self) -> str:
+        report = self.report
+        parts = [
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>SENTINEL AGS - Security Report</title>",
+            "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin-bottom:1.5em}"
+            "th,td{border:1px solid #ccc;padding:4px 8px;text-align:left}th{background:#282d3c;color:#fff}</style>",
+            "</head><body>\n<h1>SENTINEL AGS - Security Report</h1>\n",
+            f"<p>Generated on: {html.escape(_text(report.generated_at))}<br>Report period: {html.escape(report.period)}</p>\n",
+            "<h2>Summary</h2>\n",
+        ]
+        for section, counts in report.summary.items():
+            parts.append(f"<p>{section.capitalize()}: {counts['total']} (latest {html.escape(_text(counts['latest']) or '-')})</p>\n")
+            for name, values in counts.items():
+                if isinstance(values, dict):
+                    group = name[len("by_"):]
+                    title = f"{section.capitalize()} by {group}"
+                    parts.append(f"<h3>{html.escape(title)}</h3>\n" + self._table([group, "count"], list(values.items())))
+        return "".join(parts)
+
+    def begin_section(self, section: str, columns: List[str]) -> str:
+        title = "Detected Threats" if section == "threats" else "Logs"
+        head = "".join(f"<th>{html.escape(c.capitalize())}</th>" for c in columns)
+        return f"<h2>{title}</h2>\n<table><thead><tr>{head}</tr></thead><tbody>\n"
+
+    def rows(self, rows: Sequence[Sequence[Any]]) -> str:
+        return "".join("<tr>" + "".join(f"<td>{html.escape(_text(v))}</td>" for v in row) + "</tr>\n" for row in rows)
+
+    def end_section(self, section: str, empty: bool) -> str:
+        note = f"<tr><td colspan=\"99\">No {section} found in the selected time period.</td></tr>\n" if empty else ""
+        return f"{note}</tbody></table>\n"
+
+    def footer(self) -> str:
+        return "<p><small>SENTINEL AGS Security Report - CONFIDENTIAL</small></p>\n</body></html>\n"
+
+class _CSVRenderer:
+    def __init__(self, report: Report):
+        self.report = report
+
+    @staticmethod
+    def _lines(rows: Sequence[Sequence[Any]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows([[_text(v) for v in row] for row in rows])
+        return buffer.getvalue()
+
+    def header(self) -> str:
+        report = self.report
+        rows = [["SUMMARY"], ["Generated on", _text(report.generated_at)], ["Report period", report.period]]
+        for section, counts in report.summary.items():
+            for name, values in counts.items():
+                if isinstance(values, dict):
+                    rows.extend([f"{section} by {name[len('by_'):]}", key, count] for key, count in values.items())
+                else:
+                    rows.append([f"{section} {name}", _text(values)])
+        return self._lines(rows) + "\n"
+
+    def begin_section(self, section: str, columns: List[str]) -> str:
+        title = "DETECTED THREATS" if section == "threats" else "LOGS"
+        return self._lines([[title], [c.capitalize() for c in columns]])
+
+    def rows(self, rows: Sequence[Sequence[Any]]) -> str:
+        return self._lines(rows)
+
+    def end_section(self, section: str, empty: bool) -> str:
+        return "\n"
+
+    def footer(self) -> str:
+        return ""
+
+class _JSONRenderer:
+    def __init__(self, report: Report):
+        self.report = report
+        self.columns: List[str] = []
+        self.first = True
+
+    def header(self) -> str:
+        report = self.report
+        head = dumps({"generated_at": report.generated_at, "period": report.period, "summary": report.summary}).decode()
+        # Leave the object open; the sections are appended as arrays
+        return head[:-1]
+
+    def begin_section(self, section: str, columns: List[str]) -> str:
+        self.columns, self.first = columns, True
+        return f',"{section}":['
+
+    def rows(self, rows: Sequence[Sequence[Any]]) -> str:
+        text = ",".join(dumps(dict(zip(self.columns, row))).decode() for row in rows)
+        if self.first:
+            self.first = False
+            return text
+        return "," + text
+
+    def end_section(self, section: str, empty: bool) -> str:
+        return "]"
+
+    def footer(self) -> str:
+        return "}"
+
+RENDERERS = {"html": _HTMLRenderer, "csv": _CSVRenderer, "json": _JSONRenderer}
+
+class ReportGenerator:
+    """
+    Security reports computed and rendered on the server
+
+    The summary comes from aggregate queries: counts by severity, status,
+    type, level and source. The threat and log tables are streamed from a
+    server-side cursor, `chunk_rows` rows per chunk. Memory use therefore
+    does not grow with the size of the report, and the first bytes go out
+    before the last row is read.
+
+    Finished reports are cached in memory by their parameters, time window
+    and data version (the summary aggregates, which change when matching
+    rows are added or change status). The cache holds up to `cache_bytes`
+    (SENTINEL_REPORT_CACHE_MB), and reports over `max_cached_bytes` are not
+    cached. Relative ranges ("24h", ...) start on a whole minute, so
+    repeated downloads within a minute are served from the cache unless
+    the data changed.
+    """
+
+    def __init__(self, cache_bytes: Optional[int] = None, max_cached_bytes: Optional[int] = None, chunk_rows: int = 1000):
+        self.cache_bytes = cache_bytes or int(float(os.environ.get("SENTINEL_REPORT_CACHE_MB", "64")) * 1024 * 1024)
+        self.max_cached_bytes = max_cached_bytes or self.cache_bytes // 4
+        self.chunk_rows = chunk_rows
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self.stats = {"generated": 0, "cache_hits": 0, "rows_streamed": 0}
+
+    @staticmethod
+    def window(
+        time_range: Optional[str], start_time: Optional[datetime], end_time: Optional[datetime]
+    ) -> Tuple[Optional[datetime], Optional[datetime]]:
+        """Explicit start and end times, or the start of a relative range rounded down to the minute"""
+        if start_time or end_time or time_range is None:
+            return start_time, end_time
+        span = TIME_RANGES[time_range]
+        if span is None:
+            return None, None
+        return (datetime.now() - span).replace(second=0, microsecond=0), None
+
+    def _threats_query(self, columns, report_params: Dict[str, Any], start, end):
+        query = select(*columns).where(ThreatModel.run_id.is_(None))
+        if start:
+            query = query.where(ThreatModel.timestamp >= start)
+        if end:
+            query = query.where(ThreatModel.timestamp <= end)
+        if not report_params["include_resolved"]:
+            query = query.where(ThreatModel.status != "resolved")
+        if report_params["severity"]:
+            query = query.where(ThreatModel.severity == report_params["severity"])
+        if report_params["source"]:
+            query = query.where(ThreatModel.source.contains(report_params["source"]))
+        return query
+
+    async def _logs_query(self, columns, report_params: Dict[str, Any], start, end):
+        # Sources and levels are decoded from the cache: pick up codes other workers created
+        await dictionary.refresh()
+        query = select(*columns)
+        if start:
+            query = query.where(LogEntryModel.timestamp >= start)
+        if end:
+            query = query.where(LogEntryModel.timestamp <= end)
+        if report_params["level"]:
+            query = query.where(LogEntryModel.level == dictionary.encode("level", report_params["level"]))
+        if report_params["source"]:
+            # Sources are dictionary codes: match the codes of every source containing the text
+            query = query.where(LogEntryModel.source.in_(dictionary.matching("source", report_params["source"])))
+        return query
+
+    @staticmethod
+    def _fold(rows, names: List[str]) -> Dict[str, Any]:
+        """{"total", "latest", "by_<name>": {...}} from (group values..., count, latest) rows"""
+        summary = {"total": 0, "latest": None, **{f"by_{name}": {} for name in names}}
+        for row in rows:
+            *keys, count, latest = row
+            summary["total"] += count
+            if latest is not None and (summary["latest"] is None or latest > summary["latest"]):
+                summary["latest"] = latest
+            for name, key in zip(names, keys):
+                bucket = summary[f"by_{name}"]
+                key = _text(key) or "unknown"
+                bucket[key] = bucket.get(key, 0) + count
+        for name in names:
+            summary[f"by_{name}"] = dict(sorted(summary[f"by_{name}"].items(), key=lambda item: -item[1]))
+        return summary
+
+    async def summarize(self, report_params: Dict[str, Any], start, end) -> Dict[str, Any]:
+        """Counts per severity, status, type and source of threats, per level and source of logs"""
+        summary = {}
+        async with engine.connect() as conn:
+            if report_params["content"] in ("threats", "all"):
+                groups = [ThreatModel.severity, ThreatModel.status, ThreatModel.type, ThreatModel.source]
+                query = self._threats_query(
+                    [*groups, func.count(), func.max(ThreatModel.timestamp)], report_params, start, end
+                ).group_by(*groups)
+                summary["threats"] = self._fold((await conn.execute(query)).all(), ["severity", "status", "type", "source"])
+            if report_params["content"] in ("logs", "all"):
+                groups = [LogEntryModel.level, LogEntryModel.source]
+                query = (await self._logs_query(
+                    [*groups, func.count(), func.max(LogEntryModel.timestamp)], report_params, start, end
+                )).group_by(*groups)
+                summary["logs"] = self._fold((await conn.execute(query)).all(), ["level", "source"])
+        return summary
+
+    async def prepare(
+        self,
+        report_format: str = "html",
+        content: str = "all",
+        time_range: Optional[str] = "24h",
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        include_resolved: bool = True,
+        severity: Optional[str] = None,
+        level: Optional[str] = None,
+        source: Optional[str] = None,
+        log_limit: int = 50000
+    ) -> Report:
+        """Compute a report's summary and cache key; `body` is set when the report is cached"""
+        if start_time or end_time:
+            time_range = None
+        params = {
+            "format": report_format, "content": content, "time_range": time_range,
+            "include_resolved": include_resolved, "severity": severity, "level": level,
+            "source": source, "log_limit": log_limit,
+        }
+        start, end = self.window(time_range, start_time, end_time)
+        report = Report(params, start, end, await self.summarize(params, start, end))
+        report.body = self._cache.get(report.key)
+        if report.body is not None:
+            self._cache.move_to_end(report.key)
+            self.stats["cache_hits"] += 1
+            REPORTS_SERVED.inc(format=report_format, cache="hit")
+        return report
+
+    def _store(self, key: str, body: bytes):
+        if len(body) > self.max_cached_bytes:
+            return
+        self._cache[key] = body
+        self._cached_bytes += len(body)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    async def stream(self, report: Report) -> AsyncIterator[bytes]:
+        """Render a report chunk by chunk while reading its rows; the finished report is cached"""
+        renderer = RENDERERS[report.format](report)
+        kept: Optional[List[bytes]] = []
+        size = 0
+
+        def emit(text: str) -> bytes:
+            nonlocal kept, size
+            chunk = text.encode()
+            if kept is not None:
+                size += len(chunk)
+                if size > self.max_cached_bytes:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            return chunk
+
+        try:
+            yield emit(renderer.header())
+            async with engine.connect() as conn:
+                for section in report.sections():
+                    if section == "threats":
+                        columns = THREAT_COLUMNS
+                        query = self._threats_query(
+                            [getattr(ThreatModel, c) for c in columns], report.params, report.start, report.end
+                        ).order_by(ThreatModel.timestamp.desc())
+                    else:
+                        columns = LOG_COLUMNS
+                        query = (await self._logs_query(
+                            [getattr(LogEntryModel, c) for c in columns], report.params, report.start, report.end
+                        )).order_by(LogEntryModel.timestamp.desc()).limit(report.params["log_limit"])
+
+                    yield emit(renderer.begin_section(section, columns))
+                    empty = True
+                    result = await conn.stream(query)
+                    async for rows in result.partitions(self.chunk_rows):
+                        empty = False
+                        self.stats["rows_streamed"] += len(rows)
+                        yield emit(renderer.rows(await storage_codec.decode_rows(columns, rows)))
+                    yield emit(renderer.end_section(section, empty))
+            yield emit(renderer.footer())
+        except Exception as e:
+            # Headers are already sent; end the stream early so the client sees a truncated download
+            logger.error(f"Error generating report: {str(e)}")
+            raise
+
+        self.stats["generated"] += 1
+        REPORTS_SERVED.inc(format=report.format, cache="miss")
+        if kept is not None:
+            self._store(report.key, b"".join(kept))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "cached_reports": len(self._cache), "cached_bytes": self._cached_bytes}
+
+# Create a singleton instance
+report_generator = ReportGenerator()
@@ -3,132 +3,297 @@ import asyncio
 import os
 import json
 import subprocess
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
 from loguru import logger
+from sqlalchemy import select
 
+from models.database import SessionLocal
 from models.models import ThreatModel, ActionModel
 from models.schemas import Threat, ActionRequest
+from services.metrics import metrics, ACTION_DURATION
+from services.blocklist import blocklist
+from services.playbooks import playbook_engine
+
+ACTIONS_DEDUPLICATED = metrics.counter(
+    "actions_deduplicated_total", "Action requests answered by an identical recent or in-flight action", ["action_type", "via"]
+)
+
+def _indicator(parameters: Dict[str, Any], name: str) -> Optional[str]:
+    """Value of a "<name>: <value>" threat indicator (values may contain colons, e.g. IPv6)"""
+    for indicator in parameters.get("indicators") or []:
+        if indicator.startswith(f"{name}:"):
+            return indicator.split(":", 1)[1].strip()
+    return None
 
 class ResponseManager:
-    def __init__(self):
-        """Initialize the response manager for automated security actions"""
-        self.response_rules = {
-            "brute force": "block_ip",
-            "malware": "quarantine",
-            "unauthorized access": "kill_process",
-            "anomaly": "custom"
+    """
+    Executes response actions for threats, at most once per target within a cooldown
+
+    Each action gets an idempotency key, "<action_type>:<target>" (the IP
+    address, file, service, process or user it acts on), unless the caller
+    supplies one. An action without a known target is keyed by its threat, so
+    unrelated threats never share an outcome. A successful outcome is kept for `cooldown` in memory, and
+    the actions table has it for other workers and after restarts. An
+    identical request within the cooldown returns that outcome with
+    `deduplicated` set. It does not run the action again or write another
+    row. An identical request made while the first is still running waits
+    for the same result. Failed actions are not kept, so they can be retried
+    straight away.
+    """
+    
+    def __init__(self, cooldown_seconds: Optional[float] = None, cache_size: int = 10000):
+        """Initialize the response manager; SENTINEL_ACTION_COOLDOWN_SECONDS sets the cooldown (default 900)"""
+        # Which actions run for which threats is decided by the playbooks (services/playbooks.py)
+        self.handlers = {
+            "block_ip": self._block_ip,
+            "quarantine": self._quarantine_file,
+            "restart_service": self._restart_service,
+            "kill_process": self._kill_process,
+            "custom": self._custom_action
         }
+        self.block_ttl_hours = float(os.environ.get("SENTINEL_BLOCK_TTL_HOURS", "24"))
+        self.cooldown = timedelta(seconds=cooldown_seconds or float(os.environ.get("SENTINEL_ACTION_COOLDOWN_SECONDS", "900")))
+        # An in_progress row older than this is from a worker that died mid-action
+        self.stale_after = timedelta(minutes=5)
+        self.cache_size = cache_size
+        # idempotency key -> (finished_at, outcome) of recent successful actions, oldest first
+        self._recent: "OrderedDict[str, Tuple[datetime, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
         logger.info("Response manager initialized")
     
     async def handle_threat(self, threat: Threat) -> Dict[str, Any]:
-        """Handle a detected threat with appropriate response"""
+        """Handle a detected threat by running the playbook it routes to"""
         try:
-            # Determine appropriate action based on threat type
-            action_type = self.response_rules.get(threat.type.lower(), "custom")
-            
-            # Create action request
-            action_request = ActionRequest(
-                threat_id=threat.id,
-                action_type=action_type,
-                parameters={
-                    "severity": threat.severity,
-                    "source": threat.source,
-                    "indicators": threat.indicators
-                }
-            )
+            playbook = playbook_engine.route(threat)
+            if playbook is None:
+                return {"message": "No playbook matched", "playbook": None}
             
-            # Execute the action
-            result = await self.execute_action(action_request)
+            # Run the playbook's steps (identical recent actions are reused, not repeated)
+            results = await playbook_engine.run(playbook, threat, self.execute_action)
             
             # Update threat with action information
             if threat.actions is None:
                 threat.actions = []
             
-            threat.actions.append(f"{action_type} executed at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            contained = False
+            for step in playbook.steps:
+                result = results[step["id"]]
+                action_type = step["action"]
+                if result.get("skipped"):
+                    continue
+                if result.get("deduplicated"):
+                    threat.actions.append(f"{action_type} already done by action {result.get('action_id')} ({timestamp})")
+                elif "error" in result:
+                    threat.actions.append(f"{action_type} failed at {timestamp}")
+                else:
+                    threat.actions.append(f"{action_type} executed at {timestamp}")
+                contained = contained or (action_type in ("quarantine", "block_ip") and "error" not in result)
             
             # Store updated threat information
-            db = next(get_db())
-            db_threat = await db.query(ThreatModel).filter(ThreatModel.id == threat.id).first()
-            if db_threat:
-                db_threat.actions = threat.actions
-                if action_type == "quarantine" or action_type == "block_ip":
-                    db_threat.status = "contained"
-                await db.commit()
+            async with SessionLocal() as db:
+                db_threat = await db.get(ThreatModel, threat.id)
+                if db_threat:
+                    db_threat.actions = threat.actions
+                    if contained:
+                        db_threat.status = "contained"
+                    await db.commit()
             
-            return {"message": "Threat handled", "action": action_type, "result": result}
+            return {"message": "Threat handled", "playbook": playbook.name, "results": results}
         except Exception as e:
             logger.error(f"Error handling threat: {str(e)}")
             return {"message": "Error handling threat", "error": str(e)}
     
+    def idempotency_key(self, action: ActionRequest) -> Optional[str]:
+        """
+        The caller's key, or "<action_type>:<target>" for the thing the action changes.
+        Without a known target the action is only deduplicated for its own threat
+        ("<action_type>:threat:<threat id>"), and not at all without a threat.
+        """
+        if action.idempotency_key:
+            return action.idempotency_key
+        parameters = action.parameters or {}
+        target = None
+        if action.action_type == "block_ip":
+            target = self._ip_address(parameters)
+        elif action.action_type == "quarantine":
+            target = parameters.get("file_path")
+        elif action.action_type == "restart_service":
+            target = parameters.get("service_name")
+        elif action.action_type == "kill_process":
+            process_id = self._process_id(parameters)
+            if process_id is not None:
+                target = f"{parameters.get('source', '')}/{process_id}"
+        else:  # custom: the same investigation of the same user or address
+            subject = parameters.get("user") or _indicator(parameters, "User") or _indicator(parameters, "IP address")
+            if subject:
+                target = f"{parameters.get('action_name', 'custom_investigation')}/{subject}"
+        if target:
+            return f"{action.action_type}:{target}"
+        if action.threat_id:
+            return f"{action.action_type}:threat:{action.threat_id}"
+        return None
+    
+    def _remember(self, key: str, outcome: Dict[str, Any], finished_at: datetime):
+        self._recent[key] = (finished_at, outcome)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+    
+    def _recent_outcome(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        if datetime.now() - entry[0] > self.cooldown:
+            del self._recent[key]
+            return None
+        return entry[1]
+    
     async def execute_action(self, action: ActionRequest) -> Dict[str, Any]:
-        """Execute a security action"""
+        """Execute a security action unless an identical one succeeded within the cooldown or is running"""
+        key = self.idempotency_key(action)
+        if key is None:
+            return await self._run(action, key)
+        
+        outcome = self._recent_outcome(key)
+        if outcome is not None:
+            ACTIONS_DEDUPLICATED.inc(action_type=action.action_type, via="memory")
+            return dict(outcome, deduplicated=True)
+        
+        future = self._inflight.get(key)
+        if future is not None:
+            ACTIONS_DEDUPLICATED.inc(action_type=action.action_type, via="in_flight")
+            return dict(await asyncio.shield(future), deduplicated=True)
+        
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        outcome = {"error": "Action was cancelled"}
+        try:
+            outcome = await self._execute_once(action, key)
+            return outcome
+        finally:
+            future.set_result(outcome)
+            del self._inflight[key]
+    
+    async def _execute_once(self, action: ActionRequest, key: str) -> Dict[str, Any]:
+        # Another worker (or this one before a restart) may have done it already
         try:
-            # Record the action in the database
-            db = next(get_db())
-            db_action = ActionModel(
-                threat_id=action.threat_id,
-                action_type=action.action_type,
-                parameters=action.parameters,
-                status="in_progress",
-                result=None
-            )
-            db.add(db_action)
-            await db.commit()
-            await db.refresh(db_action)
-            
-            # Execute different actions based on type
-            result = None
-            if action.action_type == "block_ip":
-                result = await self._block_ip(action.parameters)
-            elif action.action_type == "quarantine":
-                result = await self._quarantine_file(action.parameters)
-            elif action.action_type == "restart_service":
-                result = await self._restart_service(action.parameters)
-            elif action.action_type == "kill_process":
-                result = await self._kill_process(action.parameters)
-            else:  # custom
-                result = await self._custom_action(action.parameters)
-            
-            # Update the action status in the database
-            db_action.status = "completed"
-            db_action.result = result
-            await db.commit()
-            
-            logger.info(f"Executed action {action.action_type} for threat {action.threat_id}")
-            return result
+            async with SessionLocal() as db:
+                row = (await db.execute(
+                    select(ActionModel.id, ActionModel.status, ActionModel.result, ActionModel.timestamp)
+                    .where(
+                        ActionModel.idempotency_key == key,
+                        ActionModel.timestamp >= datetime.now() - self.cooldown,
+                        ActionModel.status.in_(["completed", "in_progress"])
+                    )
+                    .order_by(ActionModel.timestamp.desc())
+                    .limit(1)
+                )).first()
         except Exception as e:
-            logger.error(f"Error executing action: {str(e)}")
-            
-            # Update action status on error
+            logger.error(f"Error looking up earlier actions: {str(e)}")
+            row = None
+        
+        if row is not None and row.status == "completed":
+            outcome = dict(row.result or {}, action_id=row.id, idempotency_key=key)
+            self._remember(key, outcome, row.timestamp)
+            ACTIONS_DEDUPLICATED.inc(action_type=action.action_type, via="database")
+            return dict(outcome, deduplicated=True)
+        if row is not None and datetime.now() - row.timestamp < self.stale_after:
+            ACTIONS_DEDUPLICATED.inc(action_type=action.action_type, via="database")
+            return {"status": "in_progress", "action_id": row.id, "idempotency_key": key, "deduplicated": True}
+        
+        outcome = await self._run(action, key)
+        if "error" not in outcome:
+            self._remember(key, outcome, datetime.now())
+        return outcome
+    
+    async def _run(self, action: ActionRequest, key: Optional[str]) -> Dict[str, Any]:
+        """Execute a security action and record it in the actions table"""
+        start = time.perf_counter()
+        db_action = None
+        # Set here: attributes expire on commit and cannot be lazily reloaded in an async session
+        action_id = str(uuid.uuid4())
+        async with SessionLocal() as db:
             try:
-                db_action.status = "failed"
-                db_action.result = {"error": str(e)}
+                # Record the action in the database
+                db_action = ActionModel(
+                    id=action_id,
+                    threat_id=action.threat_id,
+                    action_type=action.action_type,
+                    parameters=action.parameters,
+                    status="in_progress",
+                    result=None,
+                    idempotency_key=key
+                )
+                db.add(db_action)
                 await db.commit()
-            except Exception as db_err:
-                logger.error(f"Error updating action status: {str(db_err)}")
-            
-            return {"error": str(e)}
+                
+                # Execute the handler for the action type
+                result = await self.handlers[action.action_type](action.parameters or {}, action.threat_id)
+                
+                # Update the action status in the database
+                db_action.status = "completed"
+                db_action.result = result
+                await db.commit()
+                
+                logger.info(f"Executed action {action.action_type} for threat {action.threat_id}")
+                ACTION_DURATION.observe(time.perf_counter() - start, action_type=action.action_type, status="completed")
+                return dict(result, action_id=action_id, idempotency_key=key)
+            except Exception as e:
+                logger.error(f"Error executing action: {str(e)}")
+                ACTION_DURATION.observe(time.perf_counter() - start, action_type=action.action_type, status="failed")
+                
+                # Update action status on error
+                if db_action is not None:
+                    try:
+                        await db.rollback()
+                        db_action.status = "failed"
+                        db_action.result = {"error": str(e)}
+                        await db.commit()
+                    except Exception as db_err:
+                        logger.error(f"Error updating action status: {str(db_err)}")
+                
+                return {"error": str(e), "idempotency_key": key}
+    
+    @staticmethod
+    def _ip_address(parameters: Dict[str, Any]) -> Optional[str]:
+        return _indicator(parameters, "IP address") or parameters.get("ip_address")
     
-    async def _block_ip(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    @staticmethod
+    def _process_id(parameters: Dict[str, Any]) -> Optional[Any]:
+        return parameters.get("process_id") or _indicator(parameters, "Process ID")
+    
+    async def _block_ip(self, parameters: Dict[str, Any], threat_id: Optional[str] = None) -> Dict[str, Any]:
         """
-        Simulate blocking an IP address
-        In a real system, this would interact with firewall or security appliances
+        Add the threat's IP address to the blocklist (for `ttl_seconds`, default
+        SENTINEL_BLOCK_TTL_HOURS) and simulate pushing it to the firewall
+        Addresses that are already blocked are not pushed again
         """
         try:
-            # Extract IP from indicators if present
-            ip_address = None
-            if "indicators" in parameters and parameters["indicators"]:
-                for indicator in parameters["indicators"]:
-                    if indicator.startswith("IP address:"):
-                        ip_address = indicator.split(":")[1].strip()
-            
-            if not ip_address and "ip_address" in parameters:
-                ip_address = parameters["ip_address"]
+            ip_address = self._ip_address(parameters)
             
             if not ip_address:
-                # Use a placeholder IP if not found
-                ip_address = "192.168.1.100"
+                return {
+                    "status": "skipped",
+                    "action": "block_ip",
+                    "message": "No IP address to block",
+                    "timestamp": datetime.now().isoformat()
+                }
+            
+            if blocklist.contains(ip_address):
+                return {
+                    "status": "already_blocked",
+                    "action": "block_ip",
+                    "ip_address": ip_address,
+                    "message": f"IP address {ip_address} is already blocked",
+                    "timestamp": datetime.now().isoformat()
+                }
+            
+            ttl_seconds = parameters.get("ttl_seconds") or self.block_ttl_hours * 3600
+            entry = (await blocklist.block([ip_address], ttl_seconds=ttl_seconds, reason="block_ip", threat_id=threat_id))[0]
             
             # Simulate action - in production would call actual firewall APIs or run firewall commands
             logger.info(f"SIMULATED: Blocking IP {ip_address}")
@@ -140,6 +305,8 @@ class ResponseManager:
                 "status": "success",
                 "action": "block_ip",
                 "ip_address": ip_address,
+                "network": entry["network"],
+                "expires_at": entry["expires_at"].isoformat(),
                 "message": f"IP address {ip_address} has been blocked",
                 "timestamp": datetime.now().isoformat()
             }
@@ -147,7 +314,7 @@ class ResponseManager:
             logger.error(f"Error in block_ip action: {str(e)}")
             raise
     
-    async def _quarantine_file(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    async def _quarantine_file(self, parameters: Dict[str, Any], threat_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Simulate quarantining a suspicious file
         In a real system, this would move the file to a secure location or container
@@ -174,7 +341,7 @@ class ResponseManager:
             logger.error(f"Error in quarantine_file action: {str(e)}")
             raise
     
-    async def _restart_service(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    async def _restart_service(self, parameters: Dict[str, Any], threat_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Simulate restarting a service
         In a real system, this would use system commands to restart services
@@ -200,14 +367,14 @@ class ResponseManager:
             logger.error(f"Error in restart_service action: {str(e)}")
             raise
     
-    async def _kill_process(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    async def _kill_process(self, parameters: Dict[str, Any], threat_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Simulate killing a suspicious process
         In a real system, this would use OS commands to terminate processes
         """
         try:
             # Extract process ID from parameters
-            process_id = parameters.get("process_id", 12345)
+            process_id = self._process_id(parameters) or 12345
             
             # Simulate action
             logger.info(f"SIMULATED: Killing process {process_id}")
@@ -226,7 +393,7 @@ class ResponseManager:
             logger.error(f"Error in kill_process action: {str(e)}")
             raise
     
-    async def _custom_action(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    async def _custom_action(self, parameters: Dict[str, Any], threat_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Execute a custom action based on parameters
         This is a flexible function for handling various response types
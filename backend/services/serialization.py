@@ -0,0 +1,40 @@
+import json
+from datetime import datetime, date
+from typing import Any, Iterable, Sequence
+from fastapi.responses import Response
+
+# orjson is several times faster than the standard library; fall back when it is missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to compact JSON bytes (datetimes as ISO 8601, like the Pydantic models)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def loads(data: bytes) -> Any:
+    """Decode JSON bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def rows_to_json(keys: Sequence[str], rows: Iterable[Sequence[Any]]) -> bytes:
+    """Encode column tuples as a JSON array of objects without building model instances"""
+    return dumps([dict(zip(keys, row)) for row in rows])
+
+
+class JSONBytesResponse(Response):
+    """Response for bodies that are already encoded JSON (skips response_model validation)"""
+    media_type = "application/json"
@@ -0,0 +1,319 @@
+import asyncio
+import base64
+import functools
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Union
+from loguru import logger
+from sqlalchemy import text
+
+from models.database import engine, fernet
+
+# zstandard is optional; zlib with a preset dictionary is used when it is missing
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed payloads start with this byte, then the algorithm and the dictionary id
+_MAGIC = 0x01
+_HEADER = struct.Struct(">BcH")
+_ALGORITHM_CODES = {"zlib": b"z", "zstd": b"s"}
+_ALGORITHM_NAMES = {code: name for name, code in _ALGORITHM_CODES.items()}
+
+# zlib only looks back 32 KB, so larger dictionaries are wasted
+MAX_ZLIB_DICTIONARY = 32 * 1024
+
+# Encrypted payloads are raw Fernet tokens, which start with the version byte;
+# inside the token, uncompressed text is prefixed with _PLAIN
+_FERNET_VERSION = 0x80
+_PLAIN = b"\x00"
+
+# Values per chunk handed to a worker thread by `encode_batch`
+ENCODE_CHUNK = 256
+
+
+class EncodedText(str):
+    """Text that has already been through the codec and is stored as-is"""
+
+
+class UnknownDictionaryError(LookupError):
+    """A payload was compressed with a dictionary this process has not loaded"""
+
+
+def available_algorithms() -> List[str]:
+    return ["zlib", "zstd"] if zstandard is not None else ["zlib"]
+
+
+def train_dictionary(algorithm: str, samples: List[bytes], size: int = 16 * 1024) -> bytes:
+    """Build a compression dictionary from sample payloads"""
+    if algorithm == "zstd":
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    # zlib: the fragments between numbers (templates, JSON keys) that save the most
+    # bytes, least valuable first since zlib matches nearer the end more cheaply
+    fragments = Counter()
+    for sample in samples:
+        for fragment in re.split(rb"\d+", sample):
+            if len(fragment) >= 4:
+                fragments[fragment] += 1
+
+    chosen, total = [], 0
+    for fragment, count in sorted(fragments.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2 or total + len(fragment) > min(size, MAX_ZLIB_DICTIONARY):
+            continue
+        chosen.append(fragment)
+        total += len(fragment)
+    return b"".join(reversed(chosen))
+
+
+class StorageCodec:
+    """
+    Optional compression and encryption for large text columns (log message and details).
+
+    Compressed payloads are stored as BLOBs with a small header naming the algorithm
+    and the trained dictionary (kept in the `codec_dictionaries` table), and only when
+    that is smaller than the plain text. With encryption on, the (compressed) payload
+    is sealed in a Fernet token with the database key and stored as raw token bytes.
+    Plain text values, including rows written before either was enabled, are read
+    back unchanged. Query results carry the stored values; readers decode the rows
+    they return with `decode_rows`, which loads dictionaries saved by other
+    processes on demand instead of doing I/O inside result processing.
+
+    Batches (`encode_logs`) are encoded in worker threads, a chunk per thread, so
+    ingestion does not block the event loop while it compresses and encrypts.
+
+    Decrypted values are only cached when a cache size is given
+    (SENTINEL_DECRYPT_CACHE_SIZE), since the cache holds plaintext in memory.
+    """
+
+    def __init__(
+        self,
+        algorithm: Optional[str] = None,
+        level: int = 3,
+        encrypt: Optional[bool] = None,
+        cache_size: Optional[int] = None
+    ):
+        """
+        Initialize the codec; SENTINEL_COMPRESSION selects zstd, zlib or off (default),
+        SENTINEL_ENCRYPTION=0 disables encryption (on by default) and
+        SENTINEL_DECRYPT_CACHE_SIZE bounds the decrypted value cache (default 0, off)
+        """
+        if encrypt is None:
+            encrypt = os.environ.get("SENTINEL_ENCRYPTION", "1").lower() in ("1", "true", "yes")
+        self.encrypt = encrypt
+        if cache_size is None:
+            cache_size = int(os.environ.get("SENTINEL_DECRYPT_CACHE_SIZE", "0"))
+        self.cache_size = cache_size
+        self._decode_token = self._decode_token_uncached
+        if cache_size > 0:
+            self._decode_token = functools.lru_cache(maxsize=cache_size)(self._decode_token_uncached)
+
+        algorithm = (algorithm or os.environ.get("SENTINEL_COMPRESSION", "off")).lower()
+        if algorithm not in ("off", "zlib", "zstd"):
+            raise ValueError("Compression must be one of off, zlib, zstd")
+        if algorithm == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, falling back to zlib compression")
+            algorithm = "zlib"
+        self.algorithm = None if algorithm == "off" else algorithm
+        self.level = level
+        # id -> (algorithm, dictionary bytes); id 0 means no dictionary
+        self.dictionaries: Dict[int, Tuple[str, bytes]] = {}
+        self.active_dictionary_id = 0
+        # zstd (de)compressors must not be shared between threads
+        self._local = threading.local()
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Whether values are compressed"""
+        return self.algorithm is not None
+
+    @property
+    def active(self) -> bool:
+        """Whether values are transformed at all (compressed or encrypted)"""
+        return self.enabled or self.encrypt
+
+    def _cache(self, name: str) -> dict:
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.generation = self._generation
+            local.compressors, local.decompressors = {}, {}
+        return getattr(local, name)
+
+    def _compressor(self, dictionary_id: int):
+        compressors = self._cache("compressors")
+        compressor = compressors.get(dictionary_id)
+        if compressor is None:
+            data = self.dictionaries[dictionary_id][1] if dictionary_id else None
+            if self.algorithm == "zstd":
+                dict_data = zstandard.ZstdCompressionDict(data) if data else None
+                compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dict_data, write_content_size=True)
+            else:
+                # Primed once; each value compresses with a cheap copy
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=data) if data else \
+                    zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            compressors[dictionary_id] = compressor
+        return compressor
+
+    def compress(self, value: str) -> Union[str, bytes]:
+        """Compressed payload, or the text itself when compression would not make it smaller"""
+        if not self.enabled or value is None:
+            return value
+
+        raw = value.encode()
+        dictionary_id = self.active_dictionary_id
+        compressor = self._compressor(dictionary_id)
+        if self.algorithm == "zstd":
+            body = compressor.compress(raw)
+        else:
+            stream = compressor.copy()
+            body = stream.compress(raw) + stream.flush()
+
+        payload = _HEADER.pack(_MAGIC, _ALGORITHM_CODES[self.algorithm], dictionary_id) + body
+        return payload if len(payload) < len(raw) else value
+
+    def decompress(self, value: Union[str, bytes, None]) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if len(value) < _HEADER.size or value[0] != _MAGIC:
+            return value.decode()
+
+        _, code, dictionary_id = _HEADER.unpack_from(value)
+        algorithm = _ALGORITHM_NAMES[code]
+        if dictionary_id and dictionary_id not in self.dictionaries:
+            raise UnknownDictionaryError(f"Compression dictionary {dictionary_id} is not loaded")
+
+        body = memoryview(value)[_HEADER.size:]
+        data = self.dictionaries[dictionary_id][1] if dictionary_id else None
+        if algorithm == "zstd":
+            decompressors = self._cache("decompressors")
+            decompressor = decompressors.get(dictionary_id)
+            if decompressor is None:
+                dict_data = zstandard.ZstdCompressionDict(data) if data else None
+                decompressor = decompressors[dictionary_id] = zstandard.ZstdDecompressor(dict_data=dict_data)
+            return decompressor.decompress(body).decode()
+
+        stream = zlib.decompressobj(-15, zdict=data) if data else zlib.decompressobj(-15)
+        return (stream.decompress(body) + stream.flush()).decode()
+
+    def encode(self, value: Optional[str]) -> Union[str, bytes, None]:
+        """Stored form of a text value: compressed and/or encrypted as configured"""
+        if value is None or isinstance(value, EncodedText):
+            return value
+        payload = self.compress(value)
+        if not self.encrypt:
+            return payload
+        inner = payload if isinstance(payload, bytes) else _PLAIN + payload.encode()
+        return base64.urlsafe_b64decode(fernet.encrypt(inner))
+
+    def decode(self, value: Union[str, bytes, None]) -> Optional[str]:
+        """Text of a stored value in any of the forms `encode` produces"""
+        if value is None or isinstance(value, str):
+            return value
+        if value[0] == _FERNET_VERSION:
+            return self._decode_token(bytes(value))
+        return self.decompress(value)
+
+    def _decode_token_uncached(self, token: bytes) -> str:
+        inner = fernet.decrypt(base64.urlsafe_b64encode(token))
+        if inner[:1] == _PLAIN:
+            return inner[1:].decode()
+        return self.decompress(inner)
+
+    def decode_json(self, value: Union[str, bytes, None]) -> Any:
+        """Document of a stored JSON value"""
+        if value is None:
+            return None
+        return json.loads(self.decode(value))
+
+    def _decode_chunk(self, rows: List[tuple], decoders: List) -> List[tuple]:
+        return [
+            tuple(value if decode is None else decode(value) for value, decode in zip(row, decoders))
+            for row in rows
+        ]
+
+    async def decode_rows(self, keys: List[str], rows) -> List[tuple]:
+        """
+        Selected rows with their codec columns (`message` text, `details` JSON) decoded,
+        in chunks spread over worker threads; the column types return stored values as-is
+        """
+        decoders = [{"message": self.decode, "details": self.decode_json}.get(key) for key in keys]
+        rows = [tuple(row) for row in rows]
+        if not any(decoders) or not rows:
+            return rows
+
+        for attempt in range(2):
+            try:
+                chunks = await asyncio.gather(*[
+                    asyncio.to_thread(self._decode_chunk, rows[i:i + ENCODE_CHUNK], decoders)
+                    for i in range(0, len(rows), ENCODE_CHUNK)
+                ])
+                return [row for chunk in chunks for row in chunk]
+            except UnknownDictionaryError:
+                # Written with a dictionary another process trained since we loaded
+                if attempt:
+                    raise
+                await self.load()
+
+    def _encode_chunk(self, values: List[Optional[str]]) -> List:
+        return [self.encode(value) for value in values]
+
+    async def encode_batch(self, values: List[Optional[str]]) -> List:
+        """Encode many values off the event loop, in chunks spread over worker threads"""
+        if not self.active:
+            return list(values)
+        chunks = await asyncio.gather(*[
+            asyncio.to_thread(self._encode_chunk, values[i:i + ENCODE_CHUNK])
+            for i in range(0, len(values), ENCODE_CHUNK)
+        ])
+        return [value for chunk in chunks for value in chunk]
+
+    async def encode_logs(self, logs: List) -> Tuple[List, List]:
+        """
+        Stored message and details values for a batch of log entries, to be assigned
+        to the model columns (which store pre-encoded values unchanged)
+        """
+        documents = [None if log.details is None else json.dumps(log.details) for log in logs]
+        encoded = await self.encode_batch([log.message for log in logs] + documents)
+        encoded = [EncodedText(value) if isinstance(value, str) else value for value in encoded]
+        return encoded[:len(logs)], encoded[len(logs):]
+
+    def _remember(self, rows):
+        for dictionary_id, algorithm, data in rows:
+            self.dictionaries[dictionary_id] = (algorithm, bytes(data))
+        # The newest dictionary for the configured algorithm is used for writing
+        candidates = [i for i, (algorithm, _) in self.dictionaries.items() if algorithm == self.algorithm]
+        self.active_dictionary_id = max(candidates, default=0)
+
+    def add_dictionary(self, dictionary_id: int, algorithm: str, data: bytes):
+        """Register a dictionary; the newest one for the configured algorithm is used for writes"""
+        self._remember([(dictionary_id, algorithm, data)])
+        self._generation += 1
+
+    async def load(self):
+        """Load the saved dictionaries (including those saved by other processes since)"""
+        async with engine.connect() as conn:
+            self._remember((await conn.execute(text("SELECT id, algorithm, data FROM codec_dictionaries"))).all())
+
+    async def save_dictionary(self, algorithm: str, data: bytes) -> int:
+        """Store a trained dictionary; it becomes active for writes with that algorithm"""
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text("INSERT INTO codec_dictionaries (algorithm, data, created_at) VALUES (:algorithm, :data, CURRENT_TIMESTAMP)"),
+                {"algorithm": algorithm, "data": data}
+            )
+            dictionary_id = result.lastrowid
+        self.add_dictionary(dictionary_id, algorithm, data)
+        logger.info(f"Saved {len(data)} byte {algorithm} dictionary {dictionary_id}")
+        return dictionary_id
+
+
+# Create a singleton instance
+storage_codec = StorageCodec()
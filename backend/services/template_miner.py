@@ -0,0 +1,391 @@
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import numpy as np
+from loguru import logger
+from sqlalchemy import select, insert, update, func, bindparam
+
+from models.database import engine, get_sync_engine
+from models.models import LogTemplateModel
+from services.metrics import metrics
+
+# Wildcard for the variable parts of a template
+PARAM = "<*>"
+
+# Detector features derived from the template, in feature order (the id itself is a
+# label, not a magnitude, so detectors only see how rare the template is)
+TEMPLATE_FEATURES = ["template_rarity"]
+
+# Tokens that are (or contain) numbers, addresses or ids are parameters before any merging
+_VARIABLE_TOKEN = re.compile(r"\d")
+
+
+class LogTemplate:
+    """One message template: tokens with PARAM in the variable positions"""
+
+    __slots__ = ("id", "tokens", "count", "pending", "first_seen", "last_seen", "dirty", "leaf")
+
+    def __init__(self, tokens: List[str]):
+        self.id: Optional[int] = None
+        self.tokens = tokens
+        # Tree leaf holding the template (for eviction)
+        self.leaf: Optional[list] = None
+        self.count = 0
+        # Matches not yet added to the stored count
+        self.pending = 0
+        self.first_seen = self.last_seen = datetime.now()
+        self.dirty = True
+
+    @property
+    def template(self) -> str:
+        return " ".join(self.tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "template": self.template,
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+        }
+
+
+class TemplateMiner:
+    """
+    Online log template miner (Drain).
+
+    Messages are tokenized on whitespace and routed through a fixed-depth tree by
+    token count and their first `depth - 3` tokens (the depth also counts the
+    root, token count and leaf levels); the leaf holds candidate
+    templates, and the message joins the most similar one if at least
+    `similarity` of its tokens match (positions that differ become PARAM) or
+    starts a new template otherwise.
+
+    Templates are stored in the `log_templates` table, whose ids are the template
+    ids stored on logs; counts are written back in batches by `flush`. At most
+    `max_templates` templates are kept in memory, evicting the least recently
+    matched (their rows and counts stay in the table). Evicted templates keep
+    their count in a count-only map, so they still score as rare, and a message
+    of an evicted shape takes up its stored row again instead of adding another.
+    """
+
+    def __init__(
+        self,
+        depth: int = 4,
+        similarity: float = 0.5,
+        max_children: int = 100,
+        max_templates: Optional[int] = None,
+        warmup_events: int = 1000,
+        flush_interval: float = 10.0
+    ):
+        """Initialize the miner; max_templates defaults to SENTINEL_MAX_TEMPLATES or 5000"""
+        self.depth = depth
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_templates = max_templates or int(os.environ.get("SENTINEL_MAX_TEMPLATES", "5000"))
+        # Count-only entries kept for templates not held in memory
+        self.max_counts = 10 * self.max_templates
+        self.warmup_events = warmup_events
+        self.flush_interval = flush_interval
+        # token count -> nested dicts of prefix tokens -> list of templates
+        self._tree: Dict[int, Any] = {}
+        # id -> template, least recently matched first
+        self.templates: "OrderedDict[int, LogTemplate]" = OrderedDict()
+        # id -> count of templates evicted (or not loaded), least recently seen first
+        self.counts: "OrderedDict[int, int]" = OrderedDict()
+        # Events seen by every template ever stored (including evicted ones)
+        self.total = 0
+        self.evicted = 0
+        # Evicted templates whose counts still have to be written
+        self._evicted_unflushed: List[LogTemplate] = []
+        self.loaded = False
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        # Serializes storing new templates, so concurrent batches store each one once
+        self._store_lock = asyncio.Lock()
+        metrics.gauge("log_templates", "Log templates held in memory").set_function(lambda: len(self.templates))
+
+    def _tokenize(self, message: str) -> List[str]:
+        return [PARAM if _VARIABLE_TOKEN.search(token) else token for token in message.split()]
+
+    def _leaf(self, tokens: List[str], create: bool) -> Optional[list]:
+        """Candidate templates for a token sequence (the path is created when `create`)"""
+        node = self._tree.get(len(tokens))
+        if node is None:
+            if not create:
+                return None
+            node = self._tree[len(tokens)] = {}
+
+        prefix = tokens[:self.depth - 3]
+        for i, token in enumerate(prefix):
+            child = node.get(token)
+            # Unknown tokens go down the wildcard branch, and so do new ones once a node is full
+            if child is None and (not create or len(node) >= self.max_children):
+                token, child = PARAM, node.get(PARAM)
+            if child is None:
+                if not create:
+                    return None
+                child = node[token] = [] if i == len(prefix) - 1 else {}
+            node = child
+
+        # Messages shorter than the prefix have one leaf per token count
+        if isinstance(node, dict):
+            node = node.setdefault(None, []) if create else node.get(None)
+        return node
+
+    def _best_match(self, leaf: list, tokens: List[str]) -> Optional[LogTemplate]:
+        best, best_key = None, None
+        for template in leaf:
+            same = params = 0
+            for template_token, token in zip(template.tokens, tokens):
+                if template_token == PARAM:
+                    params += 1
+                elif template_token == token:
+                    same += 1
+            key = (same, params)
+            if best_key is None or key > best_key:
+                best, best_key = template, key
+        if best is None or not tokens:
+            return best
+        return best if best_key[0] / len(tokens) >= self.similarity else None
+
+    def match(self, message: str) -> Optional[LogTemplate]:
+        """Template a message belongs to, without changing the miner"""
+        tokens = self._tokenize(message)
+        leaf = self._leaf(tokens, create=False)
+        if not leaf:
+            return None
+        template = self._best_match(leaf, tokens)
+        # Only an exact fit counts when nothing may be merged
+        if template is not None and any(t != PARAM and t != m for t, m in zip(template.tokens, tokens)):
+            return None
+        return template
+
+    def mask(self, message: str) -> str:
+        """The message's template text, or the message with its variable tokens masked when it has none"""
+        template = self.match(message)
+        return template.template if template is not None else " ".join(self._tokenize(message))
+
+    def template_id(self, message: str) -> int:
+        """Id of the message's template, or 0 when it has none yet"""
+        template = self.match(message)
+        if template is None or template.id is None:
+            return 0
+        return template.id
+
+    def parameters(self, template: LogTemplate, message: str) -> List[str]:
+        """Values of a message in the template's PARAM positions"""
+        return [token for template_token, token in zip(template.tokens, message.split()) if template_token == PARAM]
+
+    def add(self, message: str) -> LogTemplate:
+        """Assign a message to a template, merging or creating one as needed"""
+        tokens = self._tokenize(message)
+        with self._lock:
+            leaf = self._leaf(tokens, create=False)
+            template = self._best_match(leaf, tokens) if leaf else None
+            if template is None:
+                template = LogTemplate(tokens)
+                template.leaf = self._leaf(tokens, create=True)
+                template.leaf.append(template)
+            else:
+                merged = [t if t == m else PARAM for t, m in zip(template.tokens, tokens)]
+                if merged != template.tokens:
+                    template.tokens = merged
+                    template.dirty = True
+                if template.id is not None:
+                    self.templates.move_to_end(template.id)
+
+            template.count += 1
+            template.pending += 1
+            template.last_seen = datetime.now()
+            self.total += 1
+        return template
+
+    def _evict(self):
+        """Forget the least recently matched templates beyond max_templates (call with the lock held)"""
+        while len(self.templates) > self.max_templates:
+            template_id, template = self.templates.popitem(last=False)
+            template.leaf.remove(template)
+            if template.pending or template.dirty:
+                self._evicted_unflushed.append(template)
+            self._remember_count(template_id, template.count)
+            self.evicted += 1
+
+    def _remember_count(self, template_id: int, count: int):
+        self.counts[template_id] = count
+        self.counts.move_to_end(template_id)
+        while len(self.counts) > self.max_counts:
+            self.counts.popitem(last=False)
+
+    def rarity(self, template_ids: np.ndarray) -> np.ndarray:
+        """
+        -log10 of each template's share of all events (3 = one in a thousand)
+        Ids the miner has no count for are as rare as a single event; 0 (no template)
+        and everything before the miner has seen `warmup_events` score 0
+        """
+        template_ids = np.asarray(template_ids)
+        if self.total < self.warmup_events or len(template_ids) == 0:
+            return np.zeros(len(template_ids))
+
+        unique, inverse = np.unique(template_ids, return_inverse=True)
+        values = np.array([0.0 if i == 0 else math.log10(self.total / max(1, self._count(i))) for i in unique.tolist()])
+        return values[inverse]
+
+    def _count(self, template_id: int) -> int:
+        template = self.templates.get(template_id)
+        if template is not None:
+            return template.count
+        return self.counts.get(template_id, 1)
+
+    async def _revive(self, conn, new: List[LogTemplate]) -> List[LogTemplate]:
+        """Give new templates the id of a stored row with the same text (an evicted template); returns the rest"""
+        table = LogTemplateModel.__table__
+        rows = (await conn.execute(
+            select(table.c.template, func.min(table.c.id), table.c.count)
+            .where(table.c.template.in_({t.template for t in new}))
+            .group_by(table.c.template)
+        )).all()
+        stored = {text: (template_id, count) for text, template_id, count in rows}
+
+        remaining = []
+        with self._lock:
+            for template in new:
+                if template.template not in stored:
+                    remaining.append(template)
+                    continue
+                template_id, count = stored[template.template]
+                # The count-only entry includes matches not flushed yet at eviction
+                template.id = template_id
+                template.count += self.counts.pop(template_id, count or 0)
+                template.dirty = True
+        return remaining
+
+    async def assign(self, logs: List) -> None:
+        """Set `template_id` on a batch of log entries, storing new templates first"""
+        templates = [self.add(log.message) for log in logs]
+        if any(t.id is None for t in templates):
+            async with self._store_lock:
+                # Another batch may have stored some of them while this one waited
+                new = list({id(t): t for t in templates if t.id is None}.values())
+                if new:
+                    async with engine.begin() as conn:
+                        for template in await self._revive(conn, new):
+                            result = await conn.execute(insert(LogTemplateModel.__table__).values(
+                                template=template.template, count=0,
+                                first_seen=template.first_seen, last_seen=template.last_seen
+                            ))
+                            template.id = result.inserted_primary_key[0]
+                            template.dirty = False
+                    with self._lock:
+                        for template in new:
+                            self.templates[template.id] = template
+                        self._evict()
+                    logger.debug(f"Added {len(new)} log template(s)")
+
+        for log, template in zip(logs, templates):
+            log.template_id = template.id
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        """Write pending counts and changed templates to the table"""
+        self._last_flush = time.monotonic()
+        with self._lock:
+            changed = [t for t in self.templates.values() if t.pending or t.dirty] + self._evicted_unflushed
+            self._evicted_unflushed = []
+            rows = [
+                {"template_id": t.id, "template_text": t.template, "delta": t.pending, "seen": t.last_seen}
+                for t in changed
+            ]
+            for template in changed:
+                template.pending = 0
+                template.dirty = False
+        if not rows:
+            return
+        try:
+            table = LogTemplateModel.__table__
+            async with engine.begin() as conn:
+                await conn.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("template_id"))
+                    .values(template=bindparam("template_text"), count=table.c.count + bindparam("delta"),
+                            last_seen=bindparam("seen")),
+                    rows
+                )
+        except Exception as e:
+            logger.error(f"Error flushing log templates: {str(e)}")
+
+    def _remember(self, rows, counts):
+        self.templates.clear()
+        self._tree.clear()
+        self.counts.clear()
+        for template_id, count in reversed(counts):
+            self.counts[template_id] = count
+        for template_id, template_text, count, first_seen, last_seen in reversed(rows):
+            template = LogTemplate(template_text.split())
+            template.id, template.count = template_id, count
+            template.pending, template.dirty = 0, False
+            template.first_seen, template.last_seen = first_seen, last_seen
+            template.leaf = self._leaf(template.tokens, create=True)
+            template.leaf.append(template)
+            self.templates[template_id] = template
+            self.counts.pop(template_id, None)
+        self.loaded = True
+
+    def _load_queries(self):
+        table = LogTemplateModel.__table__
+        templates = (
+            select(table.c.id, table.c.template, table.c.count, table.c.first_seen, table.c.last_seen)
+            .order_by(table.c.last_seen.desc())
+            .limit(self.max_templates)
+        )
+        counts = select(table.c.id, table.c.count).order_by(table.c.last_seen.desc()).limit(self.max_templates + self.max_counts)
+        return templates, counts, select(func.coalesce(func.sum(table.c.count), 0))
+
+    async def load(self):
+        """Load the most recently seen templates, the counts of older ones and the total event count"""
+        templates, counts, total = self._load_queries()
+        async with engine.connect() as conn:
+            rows = (await conn.execute(templates)).all()
+            count_rows = (await conn.execute(counts)).all()
+            self.total = await conn.scalar(total)
+        with self._lock:
+            self._remember(rows, count_rows)
+
+    def load_sync(self):
+        """Load templates in a process without an event loop (replay workers)"""
+        templates, counts, total = self._load_queries()
+        try:
+            with get_sync_engine().connect() as conn:
+                rows = conn.execute(templates).all()
+                count_rows = conn.execute(counts).all()
+                self.total = conn.scalar(total)
+            with self._lock:
+                self._remember(rows, count_rows)
+        except Exception as e:
+            logger.error(f"Error loading log templates: {str(e)}")
+
+    def get_templates(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Templates in memory, most frequent first"""
+        templates = sorted(self.templates.values(), key=lambda t: t.count, reverse=True)
+        return [t.to_dict() for t in templates[:limit]]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "templates": len(self.templates),
+            "max_templates": self.max_templates,
+            "evicted": self.evicted,
+            "counts_only": len(self.counts),
+            "total_events": self.total,
+        }
+
+
+# Create a singleton instance
+template_miner = TemplateMiner()
@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+import httpx
+from loguru import logger
+from sqlalchemy import select, update, delete, bindparam
+
+from models.database import SessionLocal
+from models.models import ThreatModel, EnrichmentCacheModel
+from models.schemas import Threat
+from services.metrics import metrics, QUEUE_DEPTH
+from services.serialization import loads
+from services.template_miner import template_miner
+
+GEMINI_ENDPOINT = "https://generativelanguage.googleapis.com"
+GEMINI_MODEL = "gemini-1.5-flash"
+
+# Bump when the prompt changes so cached answers to the old one are not reused
+PROMPT_VERSION = 1
+
+ENRICHMENT_REQUESTS = metrics.counter("enrichment_requests_total", "LLM enrichment requests", ["status"])
+ENRICHMENT_CACHE = metrics.counter("enrichment_cache_total", "Enrichment cache lookups", ["result"])
+ENRICHMENT_DROPPED = metrics.counter("enrichment_dropped_total", "Threats not enriched because the queue was full")
+
+_DESCRIPTION_PREFIX = "Unusual activity detected: "
+
+
+def threat_pattern(threat: Threat) -> Dict[str, Any]:
+    """
+    What the enrichment of a threat depends on: its type, source, message template and
+    the kinds of indicators it has. Concrete users, addresses and times are left out, so
+    every threat of a pattern shares one prompt (and one cached answer).
+    """
+    message = threat.description or ""
+    if message.startswith(_DESCRIPTION_PREFIX):
+        message = message[len(_DESCRIPTION_PREFIX):]
+    return {
+        "type": threat.type,
+        "source": threat.source,
+        "template": template_miner.mask(message),
+        "indicators": sorted({indicator.split(":", 1)[0] for indicator in threat.indicators or []}),
+    }
+
+
+def build_prompt(pattern: Dict[str, Any]) -> str:
+    """Deterministic prompt for a pattern, so it can be used as a cache key"""
+    return (
+        "You are a security analyst. Anomaly detection flagged events matching the pattern below "
+        "(<*> marks variable values). Explain the likely threat and what to do.\n"
+        f"Pattern: {json.dumps(pattern, sort_keys=True)}\n"
+        'Answer with a JSON object: {"summary": "<two sentences>", "tactic": "<MITRE ATT&CK tactic or none>", '
+        '"recommended_actions": ["<action>", ...], "confidence": <0 to 1>}'
+    )
+
+
+class ThreatEnricher:
+    """
+    Adds LLM (Gemini) context to detected threats without holding up detection.
+
+    `submit` only queues threats. A background worker collects what has been
+    queued within `batch_window` seconds and groups it by pattern
+    (`threat_pattern`): type, source, message template and indicator kinds. It
+    then sends one prompt per group. Answers are cached under the sha256 of
+    the model and prompt, in memory and in the `enrichment_cache` table, for
+    `ttl_hours`. A pattern seen again is answered from the cache, and
+    identical requests in flight are shared. At most `max_concurrency`
+    requests run at once, each limited to `timeout` seconds.
+
+    The answer is stored on every threat of the group as `details.enrichment`.
+    A full queue drops threats (counted) rather than slowing detection.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        max_concurrency: int = 4,
+        timeout: float = 20.0,
+        ttl_hours: Optional[float] = None,
+        batch_window: float = 1.0,
+        batch_size: int = 500,
+        max_queue: int = 10000,
+        cache_size: int = 10000
+    ):
+        """
+        Initialize the enricher; SENTINEL_GEMINI_MODEL and SENTINEL_GEMINI_ENDPOINT override
+        the model and API endpoint, SENTINEL_ENRICHMENT_TTL_HOURS the cache lifetime (default 24)
+        """
+        self.model = model or os.environ.get("SENTINEL_GEMINI_MODEL", GEMINI_MODEL)
+        self.endpoint = (endpoint or os.environ.get("SENTINEL_GEMINI_ENDPOINT", GEMINI_ENDPOINT)).rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.ttl = timedelta(hours=ttl_hours or float(os.environ.get("SENTINEL_ENRICHMENT_TTL_HOURS", "24")))
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.cache_size = cache_size
+        self.api_key: Optional[str] = None
+        self._queue = deque()
+        # key -> (expires_at, response), least recently used first
+        self._cache: "OrderedDict[str, Tuple[datetime, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"submitted": 0, "enriched": 0, "groups": 0, "requests": 0, "cache_hits": 0, "errors": 0,
+                      "unenriched": 0, "dropped": 0}
+        QUEUE_DEPTH.set_function(lambda: len(self._queue), queue="enrichment")
+
+    def cache_key(self, prompt: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{PROMPT_VERSION}\n{prompt}".encode()).hexdigest()
+
+    def submit(self, threats: List[Threat], api_key: str):
+        """Queue threats for enrichment and return immediately"""
+        if self._worker is None or self._worker.done():
+            self._wake = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._worker = asyncio.create_task(self._run())
+        self.api_key = api_key
+        for threat in threats:
+            if len(self._queue) >= self.max_queue:
+                self.stats["dropped"] += 1
+                ENRICHMENT_DROPPED.inc()
+                continue
+            self._queue.append(threat)
+        self.stats["submitted"] += len(threats)
+        self._wake.set()
+
+    async def _run(self):
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        )
+        try:
+            while True:
+                await self._wake.wait()
+                self._wake.clear()
+                # Let one detection cycle's threats gather so similar ones share a request
+                await asyncio.sleep(self.batch_window)
+                while self._queue:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                    try:
+                        await self.enrich(batch)
+                    except Exception as e:
+                        self.stats["errors"] += 1
+                        logger.error(f"Error enriching {len(batch)} threats: {str(e)}")
+        finally:
+            await self._client.aclose()
+            self._client = None
+
+    async def enrich(self, threats: List[Threat]) -> int:
+        """Enrich a batch of threats by pattern group; returns how many got an answer"""
+        groups: Dict[str, List[Threat]] = {}
+        prompts: Dict[str, str] = {}
+        for threat in threats:
+            pattern = threat_pattern(threat)
+            prompt = build_prompt(pattern)
+            key = self.cache_key(prompt)
+            groups.setdefault(key, []).append(threat)
+            prompts[key] = prompt
+        self.stats["groups"] += len(groups)
+
+        cached = await self._cached(list(groups))
+        missing = [key for key in groups if key not in cached]
+        answers = await asyncio.gather(*[self._answer(key, prompts[key]) for key in missing])
+        responses = dict(cached)
+        responses.update({key: answer for key, answer in zip(missing, answers) if answer is not None})
+        await self._save(responses, groups, cached)
+        enriched = sum(len(groups[key]) for key in responses)
+        self.stats["unenriched"] += len(threats) - enriched
+        return enriched
+
+    async def _cached(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Unexpired cached answers, from memory and then from the table"""
+        now = datetime.now()
+        found, missing = {}, []
+        for key in keys:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                found[key] = entry[1]
+            else:
+                missing.append(key)
+        if missing:
+            try:
+                async with SessionLocal() as db:
+                    result = await db.execute(
+                        select(EnrichmentCacheModel.key, EnrichmentCacheModel.response, EnrichmentCacheModel.expires_at)
+                        .where(EnrichmentCacheModel.key.in_(missing), EnrichmentCacheModel.expires_at > now)
+                    )
+                    for key, response, expires_at in result.all():
+                        self._remember(key, response, expires_at)
+                        found[key] = response
+            except Exception as e:
+                logger.error(f"Error reading the enrichment cache: {str(e)}")
+        self.stats["cache_hits"] += len(found)
+        ENRICHMENT_CACHE.inc(len(found), result="hit")
+        ENRICHMENT_CACHE.inc(len(keys) - len(found), result="miss")
+        return found
+
+    def _remember(self, key: str, response: Dict[str, Any], expires_at: datetime):
+        self._cache[key] = (expires_at, response)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _answer(self, key: str, prompt: str) -> Optional[Dict[str, Any]]:
+        """The model's answer to a prompt; concurrent callers with the same key share one request"""
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        answer = None
+        try:
+            async with self._semaphore:
+                answer = await asyncio.wait_for(self._request(prompt), self.timeout)
+            self._remember(key, answer, datetime.now() + self.ttl)
+        except Exception as e:
+            # Counted in ENRICHMENT_REQUESTS by _request, under its status or "error"
+            self.stats["errors"] += 1
+            logger.warning(f"Enrichment request failed: {str(e) or type(e).__name__}")
+        finally:
+            future.set_result(answer)
+            del self._inflight[key]
+        return answer
+
+    async def _request(self, prompt: str) -> Dict[str, Any]:
+        self.stats["requests"] += 1
+        try:
+            response = await self._client.post(
+                f"{self.endpoint}/v1beta/models/{self.model}:generateContent",
+                headers={"x-goog-api-key": self.api_key},
+                json={
+                    "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                    "generationConfig": {"temperature": 0.2, "responseMimeType": "application/json"},
+                },
+            )
+        except (Exception, asyncio.CancelledError):
+            # No response: connection error, or cancelled by the timeout
+            ENRICHMENT_REQUESTS.inc(status="error")
+            raise
+        ENRICHMENT_REQUESTS.inc(status=str(response.status_code))
+        response.raise_for_status()
+        text = loads(response.content)["candidates"][0]["content"]["parts"][0]["text"]
+        answer = loads(text)
+        if not isinstance(answer, dict):
+            raise ValueError("Answer is not a JSON object")
+        return answer
+
+    async def _save(self, responses: Dict[str, Dict[str, Any]], groups: Dict[str, List[Threat]], cached: Dict[str, Any]):
+        """Store new answers in the cache table and attach every answer to its threats"""
+        now = datetime.now()
+        rows = []
+        for key, response in responses.items():
+            for threat in groups[key]:
+                threat.details = dict(threat.details or {}, enrichment=dict(
+                    response, model=self.model, pattern_key=key[:16], group_size=len(groups[key]),
+                    cached=key in cached, enriched_at=now.isoformat(timespec="seconds")
+                ))
+                rows.append({"threat_id": threat.id, "threat_details": threat.details})
+        if not rows:
+            return
+
+        async with SessionLocal() as db:
+            # Purge expired answers first: a pattern asked again replaces its expired row
+            await db.execute(delete(EnrichmentCacheModel).where(EnrichmentCacheModel.expires_at <= now))
+            for key, response in responses.items():
+                if key not in cached:
+                    await db.merge(EnrichmentCacheModel(key=key, response=response, created_at=now, expires_at=now + self.ttl))
+            await db.execute(
+                update(ThreatModel.__table__)
+                .where(ThreatModel.__table__.c.id == bindparam("threat_id"))
+                .values(details=bindparam("threat_details")),
+                rows
+            )
+            await db.commit()
+        self.stats["enriched"] += len(rows)
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, model=self.model, queued=len(self._queue), cached_patterns=len(self._cache))
+
+
+# Create a singleton instance
+threat_enricher = ThreatEnricher()
@@ -0,0 +1,226 @@
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+from loguru import logger
+from sqlalchemy import select, update, insert, func
+
+from models.database import engine
+from models.models import ThreatModel, ThreatLogModel, ThreatIndicatorModel, LogEntryModel
+from services.cluster import cluster_coordinator, LEADER_ROLE
+from services.dictionary import dictionary
+from services.log_collector import LOG_FIELDS
+from services.storage_codec import storage_codec
+
+def parse_indicator(indicator: str) -> Tuple[str, str]:
+    """("IP address", "203.0.113.7") for "IP address: 203.0.113.7"; values may contain colons (IPv6)"""
+    kind, sep, value = indicator.partition(":")
+    if not sep:
+        return "", indicator.strip()
+    return kind.strip(), value.strip()
+
+def link_rows(threats: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """threat_logs and threat_indicators rows for threats given as dicts with id, related_logs and indicators"""
+    log_rows, indicator_rows = [], []
+    for threat in threats:
+        threat_id = threat["id"]
+        for log_id in dict.fromkeys(threat.get("related_logs") or ()):
+            log_rows.append({"threat_id": threat_id, "log_id": log_id})
+        for kind, value in dict.fromkeys(parse_indicator(i) for i in threat.get("indicators") or ()):
+            indicator_rows.append({"threat_id": threat_id, "kind": kind, "value": value})
+    return log_rows, indicator_rows
+
+def _threat_fields() -> List[str]:
+    # Imported here: the anomaly detector writes links through this module
+    from services.anomaly_detector import THREAT_FIELDS
+    return THREAT_FIELDS
+
+class ThreatLinks:
+    """
+    Threat <-> log and threat <-> indicator association tables
+
+    A threat's `related_logs` and `indicators` are JSON arrays on its row.
+    They are also written to `threat_logs` and `threat_indicators`, which
+    are indexed both ways. Finding the threats for a log or an IP address,
+    or a threat together with its logs, is then an index lookup and one
+    join instead of a scan that parses the JSON of every threat.
+
+    Threats stored before the tables existed have `links_migrated` NULL.
+    `migrate` copies their links in small batches in the background on the
+    leader, so the API stays available while a large table is migrated.
+    Until it is done, pivots can miss those older threats (`complete` tells
+    whether it is); a threat's detail falls back to its JSON.
+    """
+
+    def __init__(self, batch_size: int = 500, pause: float = 0.05):
+        self.batch_size = batch_size
+        # Seconds between batches, so the migration leaves room for other writers
+        self.pause = pause
+        self.complete = False
+        self.migrated = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def write(self, conn, threats: List[Dict[str, Any]]):
+        """Insert the link rows of threats, in the caller's transaction (a connection or session)"""
+        log_rows, indicator_rows = link_rows(threats)
+        # Re-running over the same threats (e.g. a migration batch retried) is harmless
+        if log_rows:
+            await conn.execute(insert(ThreatLogModel.__table__).prefix_with("OR IGNORE"), log_rows)
+        if indicator_rows:
+            await conn.execute(insert(ThreatIndicatorModel.__table__).prefix_with("OR IGNORE"), indicator_rows)
+
+    async def migrate_batch(self) -> int:
+        """Copy the links of one batch of unmigrated threats; returns how many threats were migrated"""
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                select(ThreatModel.id, ThreatModel.related_logs, ThreatModel.indicators)
+                .where(ThreatModel.links_migrated.is_(None))
+                .limit(self.batch_size)
+            )).all()
+            if not rows:
+                return 0
+            await self.write(conn, [{"id": r.id, "related_logs": r.related_logs, "indicators": r.indicators} for r in rows])
+            await conn.execute(
+                update(ThreatModel.__table__)
+                .where(ThreatModel.id.in_([r.id for r in rows]))
+                .values(links_migrated=True)
+            )
+        return len(rows)
+
+    async def remaining(self) -> int:
+        async with engine.connect() as conn:
+            return await conn.scalar(
+                select(func.count()).select_from(ThreatModel).where(ThreatModel.links_migrated.is_(None))
+            )
+
+    async def migrate(self):
+        """Migrate existing threats on the leader until none are left; other workers wait for it to finish"""
+        while True:
+            try:
+                if cluster_coordinator.holds(LEADER_ROLE):
+                    migrated = await self.migrate_batch()
+                    if migrated:
+                        self.migrated += migrated
+                        await asyncio.sleep(self.pause)
+                        continue
+                elif await self.remaining():
+                    await asyncio.sleep(30)
+                    continue
+                self.complete = True
+                if self.migrated:
+                    logger.info(f"Migrated the links of {self.migrated} threat(s)")
+                return
+            except Exception as e:
+                logger.error(f"Error migrating threat links: {str(e)}")
+                await asyncio.sleep(30)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.migrate())
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    @staticmethod
+    def _run_filter(query, run_id: Optional[str]):
+        if run_id:
+            return query.where(ThreatModel.run_id == run_id)
+        return query.where(ThreatModel.run_id.is_(None))
+
+    async def threat_detail(self, threat_id: str) -> Optional[Dict[str, Any]]:
+        """A threat with its logs, oldest first, from one join"""
+        threat_fields = _threat_fields()
+        threat_columns = [getattr(ThreatModel, f) for f in threat_fields] + [ThreatModel.links_migrated]
+        log_columns = [getattr(LogEntryModel, f).label(f"log_{f}") for f in LOG_FIELDS]
+        query = (
+            select(*threat_columns, *log_columns)
+            .select_from(ThreatModel)
+            .outerjoin(ThreatLogModel, ThreatLogModel.threat_id == ThreatModel.id)
+            .outerjoin(LogEntryModel, LogEntryModel.id == ThreatLogModel.log_id)
+            .where(ThreatModel.id == threat_id)
+            .order_by(LogEntryModel.timestamp)
+        )
+        n = len(threat_columns)
+        await dictionary.refresh()
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+            if not rows:
+                return None
+            threat = dict(zip(threat_fields, rows[0][:n - 1]))
+            if rows[0][n - 1]:
+                log_rows = [row[n:] for row in rows if row[n] is not None]
+            else:
+                # Not migrated yet: the JSON array still has the ids
+                log_rows = (await conn.execute(
+                    select(*[getattr(LogEntryModel, f) for f in LOG_FIELDS])
+                    .where(LogEntryModel.id.in_(threat["related_logs"] or []))
+                    .order_by(LogEntryModel.timestamp)
+                )).all()
+        threat["logs"] = [dict(zip(LOG_FIELDS, row)) for row in await storage_codec.decode_rows(LOG_FIELDS, log_rows)]
+        return threat
+
+    async def _threats(self, query, limit: int, run_id: Optional[str]) -> List[Dict[str, Any]]:
+        threat_fields = _threat_fields()
+        query = self._run_filter(query, run_id).order_by(ThreatModel.timestamp.desc()).limit(limit)
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        return [dict(zip(threat_fields, row)) for row in rows]
+
+    async def threats_for_log(self, log_id: str, limit: int = 100, run_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Threats raised on a log, newest first"""
+        query = (
+            select(*[getattr(ThreatModel, f) for f in _threat_fields()])
+            .select_from(ThreatLogModel)
+            .join(ThreatModel, ThreatModel.id == ThreatLogModel.threat_id)
+            .where(ThreatLogModel.log_id == log_id)
+        )
+        return await self._threats(query, limit, run_id)
+
+    async def threats_for_indicator(
+        self, kind: str, value: str, limit: int = 100, run_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Threats with an indicator, e.g. kind "IP address" and value "203.0.113.7", newest first"""
+        query = (
+            select(*[getattr(ThreatModel, f) for f in _threat_fields()])
+            .select_from(ThreatIndicatorModel)
+            .join(ThreatModel, ThreatModel.id == ThreatIndicatorModel.threat_id)
+            .where(ThreatIndicatorModel.kind == kind, ThreatIndicatorModel.value == value)
+        )
+        return await self._threats(query, limit, run_id)
+
+    async def logs_for_indicator(
+        self, kind: str, value: str, limit: int = 100, run_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Logs of the threats with an indicator, newest first"""
+        log_ids = self._run_filter(
+            select(ThreatLogModel.log_id)
+            .select_from(ThreatIndicatorModel)
+            .join(ThreatLogModel, ThreatLogModel.threat_id == ThreatIndicatorModel.threat_id)
+            .join(ThreatModel, ThreatModel.id == ThreatIndicatorModel.threat_id)
+            .where(ThreatIndicatorModel.kind == kind, ThreatIndicatorModel.value == value),
+            run_id
+        )
+        query = (
+            select(*[getattr(LogEntryModel, f) for f in LOG_FIELDS])
+            .where(LogEntryModel.id.in_(log_ids))
+            .order_by(LogEntryModel.timestamp.desc())
+            .limit(limit)
+        )
+        await dictionary.refresh()
+        async with engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+        return [dict(zip(LOG_FIELDS, row)) for row in await storage_codec.decode_rows(LOG_FIELDS, rows)]
+
+    async def get_status(self) -> Dict[str, Any]:
+        return {
+            "complete": self.complete,
+            "migrated": self.migrated,
+            "remaining": await self.remaining(),
+        }
+
+# Create a singleton instance
+threat_links = ThreatLinks()
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The engine is created when models.database is imported, so point it at a
+# scratch database first
+_scratch = tempfile.mkdtemp(prefix="sentinel-tests-")
+os.environ.setdefault("SENTINEL_DATABASE_URL", f"sqlite+aiosqlite:///{_scratch}/sentinel.db")
+os.environ.setdefault("SENTINEL_KEY_FILE", f"{_scratch}/db_key.key")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def db():
+    """Create the schema; the engine's connections are closed again after the test (each test has its own loop)"""
+    from models.database import engine, init_db
+    await init_db()
+    yield
+    await engine.dispose()
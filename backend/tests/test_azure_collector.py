@@ -0,0 +1,139 @@
+import random
+
+import pytest
+from sqlalchemy import select, func
+
+from scripts.azure_standin import StandIn, generate_events, start_server
+from models.database import engine
+from models.models import LogEntryModel, CollectorCheckpointModel
+from services.azure_collector import AdaptiveLimiter, AzureActivityCollector
+from services.log_collector import LogCollector
+
+pytestmark = pytest.mark.anyio
+
+def _events(subscriptions, count, hours=2, seed=7):
+    rng = random.Random(seed)
+    events = []
+    for subscription in subscriptions:
+        events.extend(generate_events(subscription, count, hours, rng))
+    return events
+
+@pytest.fixture
+def standin():
+    """Start a stand-in server in-process; tests adjust its behaviour and add events"""
+    server_standin = StandIn([], page_size=50, max_concurrent=0, throttle_rate=0.0, error_rate=0.0, latency=0.0)
+    server = start_server(server_standin, 0)
+    server_standin.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server_standin
+    server.shutdown()
+    server.server_close()
+
+def _credentials(standin, subscriptions, **extra):
+    return {
+        "tenant_id": "tenant", "client_id": "client", "client_secret": "secret",
+        "subscription_ids": list(subscriptions),
+        "login_endpoint": standin.base_url, "management_endpoint": standin.base_url,
+        **extra,
+    }
+
+async def _count(ids):
+    async with engine.connect() as conn:
+        return await conn.scalar(select(func.count()).select_from(LogEntryModel).where(LogEntryModel.id.in_(ids)))
+
+async def test_follows_continuation_tokens_to_last_page(db, standin):
+    subscription = "00000000-0000-0000-0000-00000000a001"
+    events = _events([subscription], 430)
+    standin.add(events)
+    # One slice covering the whole range, so every page after the first comes from a nextLink
+    azure = AzureActivityCollector(max_concurrency=2, slice_minutes=24 * 60, lookback_hours=3)
+
+    stored = await azure.collect(LogCollector(), _credentials(standin, [subscription]))
+
+    assert stored == len(events)
+    assert azure.last_run["pages"] == 9  # 8 full pages of 50 and the last one of 30
+    assert standin.stats["events"] == len(events)
+    assert await _count([e["eventDataId"] for e in events]) == len(events)
+
+async def test_checkpoints_survive_restart_without_duplicates(db, standin):
+    subscription = "00000000-0000-0000-0000-00000000a002"
+    events = _events([subscription], 300)
+    standin.add(events)
+    credentials = _credentials(standin, [subscription])
+
+    first = AzureActivityCollector(max_concurrency=4, slice_minutes=30, lookback_hours=3, overlap_minutes=15)
+    assert await first.collect(LogCollector(), credentials) == len(events)
+    async with engine.connect() as conn:
+        position = await conn.scalar(
+            select(CollectorCheckpointModel.position).where(CollectorCheckpointModel.source == f"azure:{subscription}")
+        )
+    assert position is not None
+
+    # Events that happened since, then a restart: new collector objects that only have the database
+    later = _events([subscription], 40, hours=0.1, seed=8)
+    standin.add(later)
+    served_before = standin.stats["events"]
+    second = AzureActivityCollector(max_concurrency=4, slice_minutes=30, lookback_hours=3, overlap_minutes=15)
+    stored = await second.collect(LogCollector(), credentials)
+
+    assert stored == len(later)
+    # Only the overlap window before the checkpoint is read again, not the whole lookback
+    assert second.last_run["duplicates"] == standin.stats["events"] - served_before - len(later)
+    assert standin.stats["events"] - served_before < len(events)
+    ids = [e["eventDataId"] for e in events + later]
+    async with engine.connect() as conn:
+        rows = await conn.scalar(select(func.count()).select_from(LogEntryModel).where(LogEntryModel.id.in_(ids)))
+        distinct = await conn.scalar(select(func.count(LogEntryModel.id.distinct())).where(LogEntryModel.id.in_(ids)))
+    assert rows == distinct == len(ids)
+
+def test_limiter_halves_on_throttle_and_grows_additively():
+    limiter = AdaptiveLimiter(8)
+    assert limiter.limit == 8
+    limiter.throttled(0)
+    assert limiter.limit == 4
+    limiter.throttled(0)
+    limiter.throttled(0)
+    limiter.throttled(0)
+    assert limiter.limit == 1  # never below one request
+    # Each success adds 1/limit, i.e. about one more request per round of successes
+    limiter.succeeded()
+    assert limiter.limit == 2
+    limiter.succeeded()
+    limiter.succeeded()
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+    for _ in range(200):
+        limiter.succeeded()
+    assert limiter.limit == 8
+
+async def test_backs_off_on_429(db, standin):
+    subscriptions = [f"00000000-0000-0000-0000-00000000b00{i}" for i in range(3)]
+    events = _events(subscriptions, 200)
+    standin.add(events)
+    # The server answers 429 (Retry-After: 1) above two concurrent requests
+    standin.max_concurrent = 2
+    standin.latency = 0.02
+    azure = AzureActivityCollector(max_concurrency=8, slice_minutes=20, lookback_hours=3)
+
+    stored = await azure.collect(LogCollector(), _credentials(standin, subscriptions))
+
+    assert standin.stats["throttled"] > 0
+    assert azure.last_run["throttled"] == standin.stats["throttled"]
+    assert azure.last_run["request_limit"] < 8
+    # Throttled requests are retried, so nothing is lost
+    assert stored == len(events)
+    assert await _count([e["eventDataId"] for e in events]) == len(events)
+
+async def test_concurrent_fetches_stay_within_bound(db, standin):
+    subscriptions = [f"00000000-0000-0000-0000-00000000c00{i}" for i in range(4)]
+    events = _events(subscriptions, 250)
+    standin.add(events)
+    standin.latency = 0.02
+    # Many slices across subscriptions, filtered to some categories, against a limit of 3
+    azure = AzureActivityCollector(max_concurrency=3, slice_minutes=10, lookback_hours=3)
+    credentials = _credentials(standin, subscriptions, categories=["Administrative", "Security"])
+
+    stored = await azure.collect(LogCollector(), credentials)
+
+    assert 1 < standin.stats["max_in_flight"] <= 3
+    assert standin.stats["throttled"] == 0
+    kept = [e for e in events if e["category"]["value"] in ("Administrative", "Security")]
+    assert stored == len(kept)
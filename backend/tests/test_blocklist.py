@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete, select
+
+from models.database import SessionLocal, engine
+from models.models import BlockedNetworkModel, LogEntryModel
+from models.schemas import LogEntry
+from services.blocklist import Blocklist, parse_address, parse_network
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def blocklist(db):
+    async with engine.begin() as conn:
+        await conn.execute(delete(BlockedNetworkModel))
+    return Blocklist()
+
+async def _expiry(network: str):
+    async with SessionLocal() as session:
+        return await session.scalar(select(BlockedNetworkModel.expires_at).where(BlockedNetworkModel.network == network))
+
+def test_ipv4_mapped_addresses_are_ipv4():
+    assert parse_address("::ffff:198.51.100.7") == parse_address("198.51.100.7")
+    assert parse_network("::ffff:198.51.100.7/120") == parse_network("198.51.100.0/24")
+    assert parse_address("2001:db8::1")[0] == 6
+    assert parse_address("not an address") is None
+
+async def test_overlapping_and_adjacent_ranges_are_merged(blocklist):
+    await blocklist.block(["10.0.0.0/25", "10.0.0.128/25", "10.0.0.64/26", "10.0.2.0/24", "2001:db8::/64"])
+    await blocklist.rebuild()
+
+    assert blocklist.get_stats()["ranges"] == {"ipv4": 2, "ipv6": 1}
+    assert blocklist.contains("10.0.0.200") and blocklist.contains("10.0.2.1")
+    assert not blocklist.contains("10.0.1.1")
+    assert blocklist.contains("::ffff:10.0.0.1") and blocklist.contains("2001:db8::5")
+    assert not blocklist.contains("2001:db8:1::5")
+
+async def test_expired_blocks_stop_matching(blocklist):
+    await blocklist.block(["192.0.2.0/24"], ttl_seconds=0.2)
+    await blocklist.block(["192.0.2.128/25"])
+    assert blocklist.contains("192.0.2.1")
+
+    await asyncio.sleep(0.3)
+    await blocklist.refresh()
+    assert not blocklist.contains("192.0.2.1")
+    assert blocklist.contains("192.0.2.200")
+    assert [row["network"] for row in await blocklist.list_blocks()] == ["192.0.2.128/25"]
+
+async def test_reblocking_keeps_the_later_expiry(blocklist):
+    await blocklist.block(["198.51.100.0/24"], ttl_seconds=3600)
+    first = await _expiry("198.51.100.0/24")
+    await blocklist.block(["198.51.100.0/24"], ttl_seconds=60)
+    assert await _expiry("198.51.100.0/24") == first
+
+    await blocklist.block(["198.51.100.0/24"])
+    assert await _expiry("198.51.100.0/24") is None
+    await blocklist.block(["198.51.100.0/24"], ttl_seconds=60)
+    assert await _expiry("198.51.100.0/24") is None
+
+async def test_drop_mode_does_not_store_blocked_events(blocklist, monkeypatch):
+    from services import log_collector as module
+    blocklist.mode = "drop"
+    monkeypatch.setattr(module, "blocklist", blocklist)
+    await blocklist.block(["203.0.113.0/24"])
+
+    collector = module.LogCollector()
+    async with SessionLocal() as session:
+        result = await collector.store_log(session, LogEntry(
+            id="blocked-drop", source="Blocklist", level="info", message="probe",
+            details={"ip_address": "::ffff:203.0.113.9"}
+        ))
+        assert result is None
+        assert await session.get(LogEntryModel, "blocked-drop") is None
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete
+
+from models.database import engine
+from models.models import LeaseModel, WorkerModel
+from services.cluster import ClusterCoordinator, INGEST_ROLE, LEADER_ROLE
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def cluster(db):
+    async with engine.begin() as conn:
+        await conn.execute(delete(LeaseModel))
+        await conn.execute(delete(WorkerModel))
+    coordinators = [ClusterCoordinator(worker_count=2, num_shards=8, lease_seconds=0.6) for _ in range(2)]
+    yield coordinators
+    for coordinator in coordinators:
+        await coordinator.shutdown()
+
+def _holders(coordinators, role):
+    return [c.worker_id for c in coordinators if c.holds(role)]
+
+async def test_roles_are_exclusive_and_shards_partitioned(cluster):
+    a, b = cluster
+    await a.heartbeat()
+    await b.heartbeat()
+    await a.heartbeat()
+
+    assert _holders(cluster, INGEST_ROLE) == [a.worker_id]
+    assert _holders(cluster, LEADER_ROLE) == [a.worker_id]
+    assert a.live_workers == b.live_workers
+    assert sorted(a.owned_shards() + b.owned_shards()) == list(range(8))
+    assert not set(a.owned_shards()) & set(b.owned_shards())
+
+async def test_heartbeat_task_keeps_the_lease_across_slow_cycles(cluster):
+    a, b = cluster
+    await a.heartbeat()
+    a.start()
+    # Several lease periods pass while the other worker keeps trying
+    for _ in range(8):
+        await asyncio.sleep(0.2)
+        await b.heartbeat()
+        assert _holders(cluster, INGEST_ROLE) == [a.worker_id]
+        assert len(b.live_workers) == 2
+
+async def test_missed_renewal_drops_the_role_before_takeover(cluster):
+    a, b = cluster
+    await a.heartbeat()
+    assert a.holds(INGEST_ROLE)
+
+    # a stops renewing: it gives the role up locally once its lease runs out,
+    # and only then can b take it over in the database
+    await asyncio.sleep(0.7)
+    assert not a.holds(INGEST_ROLE)
+    await b.heartbeat()
+    assert _holders(cluster, INGEST_ROLE) == [b.worker_id]
+
+async def test_failed_renewal_drops_roles(cluster, monkeypatch):
+    a, _ = cluster
+    await a.heartbeat()
+    assert a.holds(LEADER_ROLE)
+
+    async def fail(*args):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(a, "_acquire", fail)
+    await a.heartbeat()
+    assert not a.holds(LEADER_ROLE) and not a.holds(INGEST_ROLE)
+
+async def test_workers_starting_together_migrate_once(db):
+    from models.database import init_db
+    await asyncio.gather(init_db(), init_db(), init_db())
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from services.credentials_manager import CredentialsManager, AZURE_FILE, GEMINI_FILE
+
+pytestmark = pytest.mark.anyio
+
+AZURE = {"client_id": "id", "client_secret": "secret", "tenant_id": "tenant", "subscription_id": "sub"}
+GEMINI_KEY = "AIza" + "x" * 35
+
+def _write(directory, name, value):
+    (directory / name).write_text(value if isinstance(value, str) else json.dumps(value))
+
+@pytest.fixture
+def manager(tmp_path):
+    _write(tmp_path, AZURE_FILE, AZURE)
+    _write(tmp_path, GEMINI_FILE, GEMINI_KEY)
+    manager = CredentialsManager(str(tmp_path), poll_interval=1, validation_ttl=60)
+    manager.checks = []
+    manager.valid = {"azure": True, "gemini": True}
+    return manager
+
+def _stub_checks(manager, monkeypatch):
+    """Record network checks instead of making them; the verdict comes from manager.valid"""
+    for kind in ("azure", "gemini"):
+        async def run(client, credentials, kind=kind):
+            manager.checks.append((kind, credentials))
+            valid = manager.valid[kind]
+            return valid, None if valid else "rejected"
+        monkeypatch.setattr(manager, f"_check_{kind}", run)
+
+def test_reload_swaps_in_changed_files_only(manager, tmp_path):
+    assert manager.load_azure_credentials() == AZURE
+    assert manager.load_gemini_api_key() == GEMINI_KEY
+    version = manager.get_credentials_status()["version"]
+    assert not manager.reload()
+
+    _write(tmp_path, AZURE_FILE, {**AZURE, "client_secret": "rotated secret"})
+    assert manager.reload()
+    assert manager.load_azure_credentials()["client_secret"] == "rotated secret"
+    assert manager.get_credentials_status()["version"] == version + 1
+
+    (tmp_path / GEMINI_FILE).unlink()
+    assert manager.reload()
+    assert manager.load_gemini_api_key() is None
+    assert manager.get_credentials_status()["gemini"] == {"present": False, "valid": False}
+
+def test_half_written_file_keeps_the_previous_credentials(manager, tmp_path):
+    _write(tmp_path, AZURE_FILE, '{"client_id": "id", "client_sec')
+    assert not manager.reload()
+    assert manager.load_azure_credentials() == AZURE
+
+    _write(tmp_path, AZURE_FILE, {**AZURE, "tenant_id": "other"})
+    assert manager.reload()
+    assert manager.load_azure_credentials()["tenant_id"] == "other"
+
+async def test_network_validation_is_cached_per_credentials(manager, tmp_path, monkeypatch):
+    _stub_checks(manager, monkeypatch)
+    await manager.revalidate()
+    await manager.revalidate()
+    assert sorted(kind for kind, _ in manager.checks) == ["azure", "gemini"]
+    assert manager.validate_azure_credentials() and manager.validate_gemini_api_key()
+
+    # New credentials are checked again; the unchanged key is not
+    manager.valid["azure"] = False
+    _write(tmp_path, AZURE_FILE, {**AZURE, "client_secret": "wrong secret"})
+    manager.reload()
+    await manager.revalidate()
+    assert [kind for kind, _ in manager.checks[2:]] == ["azure"]
+    assert not manager.validate_azure_credentials()
+    assert manager.get_credentials_status()["azure"]["error"] == "rejected"
+
+    # Expired results are checked again
+    manager.validation_ttl = 0
+    await manager.revalidate()
+    assert sorted(kind for kind, _ in manager.checks[3:]) == ["azure", "gemini"]
+
+async def test_unreachable_service_keeps_the_last_verdict(manager, monkeypatch):
+    _stub_checks(manager, monkeypatch)
+    manager.valid["gemini"] = False
+    await manager.revalidate()
+    assert not manager.validate_gemini_api_key()
+
+    # A failed lookup (not a rejection) says nothing about the key
+    manager.valid["gemini"] = None
+    await manager.revalidate(force=True)
+    assert not manager.validate_gemini_api_key()
+
+def test_malformed_credentials_are_invalid_without_a_network_check(manager, tmp_path):
+    _write(tmp_path, AZURE_FILE, {"client_id": "id"})
+    _write(tmp_path, GEMINI_FILE, "short key")
+    manager.reload()
+    assert not manager.validate_azure_credentials() and not manager.validate_gemini_api_key()
+    assert not manager._needs_check("azure") and not manager._needs_check("gemini")
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from services.detectors import BaseDetector, DetectorEnsemble, ZScoreDetector
+
+FEATURES = ["a", "b"]
+
+class FailingDetector(BaseDetector):
+    name = "failing"
+    expensive = True
+
+    def __init__(self, feature_names):
+        super().__init__(feature_names)
+        self.fail = True
+
+    def fit(self, features):
+        if self.fail:
+            raise ValueError("cannot fit")
+        self.is_fitted = True
+
+    def score(self, features):
+        return np.ones(len(features)), np.ones(len(features), dtype=bool)
+
+def _batch() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    features = rng.normal(0, 1, size=(200, 2))
+    features[0] = [50, 50]
+    return features
+
+def test_score_is_abstract():
+    with pytest.raises(TypeError):
+        BaseDetector(FEATURES)
+
+def test_failed_fit_is_skipped_while_others_score():
+    failing = FailingDetector(FEATURES)
+    ensemble = DetectorEnsemble([ZScoreDetector(FEATURES), failing])
+    features = _batch()
+    ensemble.fit(features)
+
+    assert ensemble.fit_status == {"zscore": True, "failing": False}
+    assert not ensemble.is_fitted and ensemble.can_score
+    assert ensemble.get_stats()["detectors"]["failing"]["fit_error"] == "cannot fit"
+
+    # Only the z-score verdict counts; the unfitted detector would flag everything
+    scores, flags = ensemble.score(features)
+    assert flags[0] and flags.sum() < 10
+    assert failing.stats.batches == 0
+
+def test_refit_failure_unfits_a_fitted_detector():
+    failing = FailingDetector(FEATURES)
+    failing.fail = False
+    ensemble = DetectorEnsemble([ZScoreDetector(FEATURES), failing])
+    ensemble.fit(_batch())
+    assert ensemble.is_fitted
+
+    failing.fail = True
+    ensemble.fit(_batch())
+    assert ensemble.fit_status["failing"] is False
+
+    failing.fail = False
+    ensemble.fit(_batch())
+    assert ensemble.is_fitted and failing.fit_error is None
@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import text, insert, select
+from sqlalchemy.exc import StatementError
+
+from models.database import SessionLocal, engine
+from models.models import LogEntryModel
+from models.schemas import LogEntry
+from services.dictionary import dictionary
+from services.log_collector import LogCollector
+
+pytestmark = pytest.mark.anyio
+
+async def test_writing_a_value_without_a_code_raises(db):
+    async with engine.begin() as conn:
+        with pytest.raises(StatementError, match="No dictionary code"):
+            await conn.execute(insert(LogEntryModel.__table__).values(
+                id="dict-unknown", source="Never-Ensured-Source", level="info", message="m", details={}
+            ))
+
+async def test_filter_on_unknown_value_matches_nothing(db):
+    collector = LogCollector()
+    async with SessionLocal() as session:
+        await collector.store_logs(session, [LogEntry(source="Dict-Filter", level="notice", message="kept")])
+        assert [log.level for log in await collector.get_logs(session, source="Dict-Filter", level="notice")] == ["notice"]
+        assert await collector.get_logs(session, source="Dict-Filter", level="no-such-level") == []
+
+async def test_codes_from_other_workers_are_loaded_by_refresh(db):
+    # Another worker creates a code; decoding it must not query the database
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO dictionary (field, code, value) "
+            "SELECT 'source', COALESCE(MAX(code), 0) + 1, 'Other-Worker' FROM dictionary WHERE field = 'source'"
+        ))
+        code = await conn.scalar(text("SELECT code FROM dictionary WHERE field = 'source' AND value = 'Other-Worker'"))
+
+    assert dictionary.decode("source", code) == str(code)
+    await dictionary.refresh()
+    assert dictionary.decode("source", code) == "Other-Worker"
+    assert dictionary.code("source", "Other-Worker") == code
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+
+from models.schemas import LogEntry
+from services.event_buffer import EventBuffer, FEATURE_NAMES
+
+def _log(minute: int) -> LogEntry:
+    return LogEntry(
+        id=f"buffer-{minute}", timestamp=datetime(2026, 1, 1, 12) + timedelta(minutes=minute),
+        source="Buffer", level="info", message=f"event at minute {minute}"
+    )
+
+def test_recent_orders_by_timestamp_like_the_db():
+    buffer = EventBuffer(capacity=100, detail_capacity=50)
+    # Minute 30 arrives late, after newer events
+    buffer.extend([_log(minute) for minute in (10, 20, 40, 50)])
+    buffer.append(_log(30))
+
+    logs, features = buffer.recent(3)
+    assert [log.id for log in logs] == ["buffer-50", "buffer-40", "buffer-30"]
+    assert features.shape == (3, len(FEATURE_NAMES))
+    assert list(features[:, 0]) == [12, 12, 12]
+
+def test_recent_keeps_ingestion_order_for_equal_timestamps():
+    buffer = EventBuffer(capacity=100, detail_capacity=50)
+    first, second = _log(5), _log(5)
+    first.id, second.id = "first", "second"
+    buffer.extend([first, second])
+    assert [log.id for log in buffer.recent(2)[0]] == ["second", "first"]
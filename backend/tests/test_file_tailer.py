@@ -0,0 +1,73 @@
+import os
+
+from services.file_tailer import FileTailer
+
+def _append(path, *lines):
+    with open(path, "a") as f:
+        f.writelines(f"{line}\n" for line in lines)
+
+def _read(tailer, checkpoints, polls=4):
+    """Messages read over a few polls, committing each batch's checkpoints like the collector"""
+    messages = []
+    for _ in range(polls):
+        logs, positions = tailer.read_batch(checkpoints)
+        messages += [log.message for log in logs]
+        checkpoints.update(positions)
+    return messages
+
+def test_rename_rotation_reads_the_old_file_to_its_end(tmp_path):
+    path = tmp_path / "app.log"
+    _append(path, "old 1", "old 2")
+    tailer, checkpoints = FileTailer([str(path)]), {}
+    assert _read(tailer, checkpoints) == ["old 1", "old 2"]
+
+    # Written just before the rename, not read yet
+    _append(path, "old 3")
+    os.rename(path, tmp_path / "app.log.1")
+    _append(path, "new 1")
+    assert _read(tailer, checkpoints) == ["old 3", "new 1"]
+    assert tailer.resets == {"rotated": 1}
+
+def test_copytruncate_restarts_from_the_beginning(tmp_path):
+    path = tmp_path / "app.log"
+    _append(path, "first line of the old content", "second line")
+    tailer, checkpoints = FileTailer([str(path)]), {}
+    assert len(_read(tailer, checkpoints)) == 2
+
+    # Truncated and rewritten: shorter than the offset
+    with open(path, "w") as f:
+        f.write("after truncate\n")
+    assert _read(tailer, checkpoints) == ["after truncate"]
+
+    # Truncated and refilled past the old offset: the changed first bytes give it away
+    with open(path, "w") as f:
+        f.write("different start " * 10 + "\n")
+    assert _read(tailer, checkpoints) == ["different start " * 10]
+    assert tailer.resets == {"truncated": 2}
+
+def test_overlong_lines_are_cut_without_stalling(tmp_path):
+    path = tmp_path / "app.log"
+    _append(path, "x" * 100, "short")
+    tailer, checkpoints = FileTailer([str(path)], read_size=256, max_line_size=32), {}
+    assert _read(tailer, checkpoints) == ["x" * 32, "short"]
+
+    # No newline at all: consumed (cut) instead of waiting forever for the end of the line
+    with open(path, "a") as f:
+        f.write("y" * 100)
+    assert _read(tailer, checkpoints) == ["y" * 32]
+    assert checkpoints[f"file:{path}"]["position"] == os.path.getsize(path)
+
+def test_restart_resumes_after_the_committed_checkpoint(tmp_path):
+    path = tmp_path / "app.log"
+    _append(path, "one", "two")
+    checkpoints = {}
+    assert _read(FileTailer([str(path)]), checkpoints) == ["one", "two"]
+
+    _append(path, "three")
+    assert _read(FileTailer([str(path)]), dict(checkpoints)) == ["three"]
+
+    # Rotated while stopped: the old file is found by its inode and finished first
+    _append(path, "four")
+    os.rename(path, tmp_path / "app.log.1")
+    _append(path, "five")
+    assert _read(FileTailer([str(path)]), dict(checkpoints)) == ["three", "four", "five"]
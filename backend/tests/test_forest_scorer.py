@@ -0,0 +1,18 @@
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+from services.forest_scorer import CompiledIsolationForest
+
+def _fit(**options):
+    rng = np.random.default_rng(7)
+    X = np.vstack([rng.normal(0, 1, (500, 6)), rng.uniform(-6, 6, (20, 6))])
+    return IsolationForest(random_state=42, **options).fit(X), np.vstack([X, rng.normal(0, 3, (200, 6))])
+
+def test_scores_match_sklearn():
+    for options in ({}, {"max_samples": 100, "contamination": 0.05}, {"max_samples": 0.5, "max_features": 0.5}):
+        model, X = _fit(**options)
+        compiled = CompiledIsolationForest(model)
+        np.testing.assert_allclose(compiled.decision_function(X) + compiled.offset, model.score_samples(X), rtol=0, atol=1e-12)
+        labels, _ = compiled.predict_with_scores(X)
+        assert np.array_equal(labels, model.predict(X))
+        assert compiled.matches(model, X)
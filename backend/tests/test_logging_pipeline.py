@@ -0,0 +1,119 @@
+import sys
+
+from loguru import logger
+
+from services.logging_pipeline import LOG_RECORDS_DROPPED, LogRateLimiter, RateLimit, configure_logging, shutdown_logging
+
+def _capture(limiter, sinks=1):
+    outputs = [[] for _ in range(sinks)]
+    handlers = [logger.add(output.append, format="{message}", filter=limiter) for output in outputs]
+    return outputs, handlers
+
+def test_only_configured_lines_are_limited():
+    limiter = LogRateLimiter([RateLimit(__name__, "Noisy", per_second=0.001, burst=5)])
+    (output,), handlers = _capture(limiter)
+    try:
+        for i in range(300):
+            logger.info(f"Noisy line {i}")
+            logger.info(f"Ordinary line {i}")
+        logger.info("Noisy again")
+    finally:
+        for handler in handlers:
+            logger.remove(handler)
+
+    assert sum(line.startswith("Ordinary") for line in output) == 300
+    assert sum(line.startswith("Noisy") for line in output) == 5
+
+def test_suppressed_count_is_reported_once_for_every_sink():
+    limiter = LogRateLimiter([RateLimit(__name__, "Noisy", per_second=0.001, burst=1)])
+    outputs, handlers = _capture(limiter, sinks=2)
+    try:
+        for i in range(4):
+            logger.info(f"Noisy line {i}")
+        limiter._buckets[limiter.rate_limits[0]][0] = 1.0
+        logger.info("Noisy line after refill")
+    finally:
+        for handler in handlers:
+            logger.remove(handler)
+
+    for output in outputs:
+        assert [line.strip() for line in output] == [
+            "Noisy line 0", "Noisy line after refill [3 similar messages suppressed]"
+        ]
+
+def test_errors_are_never_limited():
+    limiter = LogRateLimiter([RateLimit(__name__, "Noisy", per_second=0.001, burst=1)])
+    (output,), handlers = _capture(limiter)
+    try:
+        for i in range(10):
+            logger.error(f"Noisy failure {i}")
+    finally:
+        for handler in handlers:
+            logger.remove(handler)
+    assert len(output) == 10
+
+def test_workers_write_their_own_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("SENTINEL_WORKERS", "4")
+    configure_logging(str(tmp_path / "sentinel.log"), console=None)
+    try:
+        logger.info("Written by one worker")
+    finally:
+        shutdown_logging()
+        # configure_logging removed loguru's default handler; put it back for the other tests
+        logger.add(sys.stderr)
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1 and files[0].name.startswith("sentinel.") and files[0].name != "sentinel.log"
+    assert "Written by one worker" in files[0].read_text()
+
+class _Console:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+    def flush(self):
+        pass
+
+def _dropped(reason):
+    return LOG_RECORDS_DROPPED._values.get((reason,), 0)
+
+def test_full_buffer_samples_then_drops_below_error():
+    console = _Console()
+    # The writer only wakes at shutdown, so the buffer fills up
+    pipeline = configure_logging(
+        None, console=console, buffer_size=10, batch_size=1000, flush_interval=60,
+        sample_above=0.5, sample_every=3, error_reserve=2
+    )
+    sampled, full = _dropped("sampled"), _dropped("buffer_full")
+    try:
+        for i in range(40):
+            logger.info(f"Flood line {i}")
+        for i in range(4):
+            logger.error(f"Failure {i}")
+        assert len(pipeline._buffer) == 12
+    finally:
+        shutdown_logging()
+        logger.add(sys.stderr)
+
+    lines = "".join(console.writes).splitlines()
+    flood = [line for line in lines if "Flood line" in line]
+    # 5 below the sampling mark, then 1 in 3 until the buffer is full
+    assert len(flood) == 10
+    assert flood[5].endswith("Flood line 7") and flood[6].endswith("Flood line 10")
+    # Errors use the reserve; the rest are dropped too
+    assert [line.rsplit(" - ", 1)[1] for line in lines if "Failure" in line] == ["Failure 0", "Failure 1"]
+    assert _dropped("sampled") - sampled == 10
+    assert _dropped("buffer_full") - full == 40 - 5 - 15 + 2
+    assert pipeline.dropped == 32
+
+def test_batches_are_written_with_one_write():
+    console = _Console()
+    configure_logging(None, console=console, batch_size=1000, flush_interval=60)
+    try:
+        for i in range(50):
+            logger.info(f"Batched line {i}")
+    finally:
+        shutdown_logging()
+        logger.add(sys.stderr)
+    assert len(console.writes) == 1 and console.writes[0].count("\n") == 50
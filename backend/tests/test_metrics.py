@@ -0,0 +1,23 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from services.metrics import DB_QUERY_DURATION, instrument_engine, metrics
+
+pytestmark = pytest.mark.anyio
+
+async def test_failed_statement_does_not_leak_its_start_time():
+    assert metrics.enabled
+    engine = create_async_engine("sqlite+aiosqlite://")
+    instrument_engine(engine)
+    try:
+        async with engine.connect() as conn:
+            with pytest.raises(Exception):
+                await conn.execute(text("SELECT * FROM no_such_table"))
+            assert conn.sync_connection.info.get("query_start") == []
+
+            await conn.execute(text("SELECT 1"))
+            assert conn.sync_connection.info["query_start"] == []
+    finally:
+        await engine.dispose()
+    assert DB_QUERY_DURATION._values[("select",)][2] >= 1
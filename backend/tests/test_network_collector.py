@@ -0,0 +1,59 @@
+import asyncio
+import socket
+
+import pytest
+
+from services import network_collector as network
+from services.network_collector import NetworkCollector, parse_syslog
+
+def _message(structured_data: bytes) -> bytes:
+    return b"<34>1 2024-05-01T10:00:00Z host app 1 ID47 " + structured_data + b" Login failed"
+
+def test_escaped_backslash_before_closing_bracket():
+    # The value is one escaped backslash; the "]" after it closes the element
+    log = parse_syslog(_message(b'[origin ip="10.0.0.1" path="C:\\\\"][meta seq="1"]'))
+    assert log.details["structured_data"] == '[origin ip="10.0.0.1" path="C:\\\\"][meta seq="1"]'
+    assert log.message == "Login failed"
+
+def test_escaped_bracket_and_quote_inside_value():
+    log = parse_syslog(_message(b'[x a="1\\]2" b="say \\"hi\\"]"]'))
+    assert log.details["structured_data"] == '[x a="1\\]2" b="say \\"hi\\"]"]'
+    assert log.message == "Login failed"
+
+def test_unescaped_bracket_inside_quotes():
+    # Not allowed by RFC 5424, but sent by some devices: quotes decide, not the bracket
+    log = parse_syslog(_message(b'[x a="1]2"]'))
+    assert log.details["structured_data"] == '[x a="1]2"]'
+    assert log.message == "Login failed"
+
+def test_nil_structured_data():
+    log = parse_syslog(_message(b"-"))
+    assert "structured_data" not in log.details
+    assert log.message == "Login failed"
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.mark.anyio
+async def test_listeners_follow_the_ingest_role(monkeypatch):
+    holding = {"ingest": False}
+    monkeypatch.setattr(network.cluster_coordinator, "holds", lambda role: holding.get(role, False))
+    collector = NetworkCollector(host="127.0.0.1", poll_interval=3600)
+    collector.ports = {"syslog_udp": _free_port()}
+
+    await collector.start(collector=None)
+    try:
+        assert collector.get_stats()["listening"] == []
+
+        holding["ingest"] = True
+        await collector.update_listeners()
+        assert collector.get_stats()["listening"] == ["syslog_udp"]
+
+        holding["ingest"] = False
+        await collector.update_listeners()
+        await asyncio.sleep(0)
+        assert collector.get_stats()["listening"] == []
+    finally:
+        await collector.stop()
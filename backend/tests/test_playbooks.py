@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from models.schemas import Threat
+from services.playbooks import PlaybookEngine, PlaybookError
+
+pytestmark = pytest.mark.anyio
+
+def _engine(tmp_path, playbooks) -> PlaybookEngine:
+    (tmp_path / "playbooks.json").write_text(json.dumps(playbooks))
+    return PlaybookEngine(str(tmp_path), poll_interval=1)
+
+def _threat(**fields) -> Threat:
+    return Threat(**{"title": "t", "description": "d", "severity": "high", "source": "Test", "type": "malware", **fields})
+
+def _compile(tmp_path, steps):
+    return PlaybookEngine(str(tmp_path)).compile([("test.json", {"name": "p", "steps": steps})])[0]
+
+def test_steps_are_staged_by_dependency(tmp_path):
+    playbook = _compile(tmp_path, [
+        {"id": "notify", "action": "custom", "after": ["block", "investigate"]},
+        {"id": "block", "action": "block_ip"},
+        {"id": "investigate", "action": "custom", "after": "block"},
+        {"id": "quarantine", "action": "quarantine"},
+    ])
+    assert [[step["id"] for step in stage] for stage in playbook.stages] == [
+        ["block", "quarantine"], ["investigate"], ["notify"]
+    ]
+
+@pytest.mark.parametrize("steps, error", [
+    ([{"id": "a", "action": "custom", "after": "b"}, {"id": "b", "action": "custom", "after": "a"}], "cycle"),
+    ([{"id": "a", "action": "custom", "after": "a"}], "cycle"),
+    ([{"id": "a", "action": "custom", "after": "missing"}], "unknown step"),
+    ([{"id": "a", "action": "custom"}, {"id": "a", "action": "custom"}], "duplicate step"),
+    ([{"id": "a", "action": "custom", "when": "sometimes"}], "when must be"),
+    ([{"id": "a", "action": "reboot"}], "action must be"),
+    ([], "no steps"),
+])
+def test_invalid_steps_are_rejected(tmp_path, steps, error):
+    with pytest.raises(PlaybookError, match=error):
+        _compile(tmp_path, steps)
+
+async def test_when_decides_which_steps_run(tmp_path):
+    engine = _engine(tmp_path, [{"name": "p", "steps": [
+        {"id": "block", "action": "block_ip"},
+        {"id": "investigate", "action": "custom"},
+        {"id": "on_success", "action": "custom", "after": "block"},
+        {"id": "on_failure", "action": "custom", "after": "block", "when": "failure"},
+        {"id": "after_skipped", "action": "custom", "after": "on_success", "when": "failure"},
+        {"id": "notify", "action": "custom", "after": ["on_success", "investigate"], "when": "always"},
+    ]}])
+
+    executed = []
+    async def execute(request):
+        executed.append(request.action_type)
+        if request.action_type == "block_ip":
+            raise RuntimeError("firewall unreachable")
+        return {"status": "success"}
+
+    results = await engine.run(engine.playbooks[0], _threat(), execute)
+    assert results["block"] == {"error": "firewall unreachable"}
+    assert results["on_success"]["skipped"] and not results["on_failure"].get("skipped")
+    # A skipped dependency neither succeeded nor failed; only "always" runs after it
+    assert results["after_skipped"]["skipped"] and results["notify"] == {"status": "success"}
+    assert executed.count("custom") == 3
+    assert engine.stats["p"]["failed"] == 1
+
+def test_score_bounds_are_inclusive_and_cached_per_bucket(tmp_path):
+    engine = _engine(tmp_path, [
+        {"name": "mid", "priority": 10, "match": {"score": {"min": 0.5, "max": 0.8}}, "steps": [{"action": "custom"}]},
+        {"name": "fallback", "steps": [{"action": "custom"}]},
+    ])
+
+    def route(score):
+        return engine.route(_threat(anomaly_score=score)).name
+
+    # Each score twice, so the second answer comes from the decision cache
+    for score, expected in [(0.9, "fallback"), (0.8, "mid"), (0.80001, "fallback"), (0.5, "mid"),
+                            (0.49999, "fallback"), (0.65, "mid"), (None, "fallback")] * 2:
+        assert route(score) == expected, score
+    # Below 0.5, exactly 0.5, between, exactly 0.8, above 0.8 (0.9 and 0.80001), no score
+    assert engine.get_stats()["cached_decisions"] == 6
+
+def test_failed_reload_keeps_the_previous_playbooks(tmp_path):
+    engine = _engine(tmp_path, [{"name": "p", "match": {"type": "malware"}, "steps": [{"action": "quarantine"}]}])
+    (tmp_path / "playbooks.json").write_text(json.dumps([{"name": "p", "steps": [{"id": "a", "action": "custom", "after": "a"}]}]))
+    assert not engine.reload(force=True)
+    assert "cycle" in engine.last_error
+    assert engine.route(_threat()).name == "p"
+    assert engine.route(_threat(type="brute force")) is None
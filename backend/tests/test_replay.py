@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from models.database import SessionLocal, engine
+from models.models import ThreatModel
+from models.schemas import LogEntry, Threat
+from services import replay
+from services.log_collector import LogCollector
+
+pytestmark = pytest.mark.anyio
+
+class _Executor(ThreadPoolExecutor):
+    def __init__(self, max_workers, mp_context=None):
+        super().__init__(max_workers=max_workers)
+
+@pytest.fixture
+def scored(monkeypatch):
+    """Score chunks in threads; earlier chunks finish last, and each yields one threat for its first log"""
+    scored = []
+
+    def score(rows):
+        index = int(rows[0][0].rsplit("-", 1)[1])
+        time.sleep(0.02 * (10 - index) / 2)
+        scored.append(rows[0][0])
+        return [Threat(
+            title="Replayed", description="replayed", severity="low", source="Replay", type="test",
+            related_logs=[rows[0][0]], timestamp=rows[0][1]
+        ).model_dump()]
+    monkeypatch.setattr(replay, "ProcessPoolExecutor", _Executor)
+    monkeypatch.setattr(replay, "_score_chunk", score)
+    return scored
+
+async def _range(db, day: int, prefix: str):
+    start = datetime(2030, 1, day)
+    logs = [
+        LogEntry(id=f"{prefix}-{i}", timestamp=start + timedelta(seconds=i), source="Replay", level="info", message=f"event {i}")
+        for i in range(10)
+    ]
+    async with SessionLocal() as session:
+        await LogCollector().store_logs(session, logs)
+    return start, start + timedelta(minutes=1)
+
+async def _threat_logs(run_id):
+    async with engine.connect() as conn:
+        rows = await conn.execute(select(ThreatModel.related_logs).where(ThreatModel.run_id == run_id))
+        return sorted(log_id for (related,) in rows for log_id in related)
+
+async def test_chunks_commit_in_order_whatever_order_they_finish(db, scored, monkeypatch):
+    start, end = await _range(db, 1, "order")
+    replay_engine = replay.ReplayEngine()
+    committed = []
+    commit = replay_engine._commit_chunk
+    async def record(run_id, threats, last_key, n_logs, elapsed):
+        committed.append(last_key[1])
+        await commit(run_id, threats, last_key, n_logs, elapsed)
+    monkeypatch.setattr(replay_engine, "_commit_chunk", record)
+
+    run = await replay_engine.create_run(start, end, chunk_size=2, workers=3)
+    run = await replay_engine.run(run["id"])
+
+    # Later chunks were scored first, but the checkpoint only ever moved forward
+    assert scored != sorted(scored, key=lambda log_id: int(log_id.rsplit("-", 1)[1]))
+    assert committed == [f"order-{i}" for i in (1, 3, 5, 7, 9)]
+    assert run["status"] == "completed" and run["logs_processed"] == 10 and run["threats_found"] == 5
+    assert run["checkpoint_log_id"] == "order-9"
+    assert await _threat_logs(run["id"]) == [f"order-{i}" for i in (0, 2, 4, 6, 8)]
+
+async def test_paused_run_resumes_after_its_checkpoint(db, scored, monkeypatch):
+    start, end = await _range(db, 2, "resume")
+    replay_engine = replay.ReplayEngine()
+    run = await replay_engine.create_run(start, end, chunk_size=2, workers=2)
+
+    replay_engine.stop_requested.add(run["id"])
+    run = await replay_engine.run(run["id"])
+    assert run["status"] == "paused"
+    assert run["logs_processed"] == 2 and run["checkpoint_log_id"] == "resume-1"
+
+    # Chunks scored but not committed before the pause are read again
+    fetched = []
+    fetch = replay_engine._fetch_chunk
+    async def record(run, after):
+        rows = await fetch(run, after)
+        fetched.extend(row[0] for row in rows)
+        return rows
+    monkeypatch.setattr(replay_engine, "_fetch_chunk", record)
+    run = await replay_engine.run(run["id"])
+    assert run["status"] == "completed" and run["logs_processed"] == 10
+    assert fetched == [f"resume-{i}" for i in range(2, 10)]
+    assert await _threat_logs(run["id"]) == [f"resume-{i}" for i in (0, 2, 4, 6, 8)]
@@ -0,0 +1,62 @@
+import asyncio
+import uuid
+
+import pytest
+
+from models.schemas import ActionRequest
+from services.response_manager import ResponseManager
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def manager(db):
+    manager = ResponseManager(cooldown_seconds=0.5)
+    manager.calls = []
+    manager.release = asyncio.Event()
+    manager.release.set()
+
+    async def quarantine(parameters, threat_id=None):
+        manager.calls.append(threat_id)
+        await manager.release.wait()
+        return {"status": "success", "action": "quarantine"}
+    manager.handlers["quarantine"] = quarantine
+    return manager
+
+def _action(threat_id=None, **parameters) -> ActionRequest:
+    return ActionRequest(threat_id=threat_id or str(uuid.uuid4()), action_type="quarantine", parameters=parameters)
+
+def test_unknown_target_is_keyed_by_threat():
+    manager = ResponseManager()
+    assert manager.idempotency_key(_action("t1")) == "quarantine:threat:t1"
+    assert manager.idempotency_key(_action("t1", file_path="/tmp/x")) == "quarantine:/tmp/x"
+    kill = ActionRequest(threat_id="t2", action_type="kill_process", parameters={"source": "host"})
+    assert manager.idempotency_key(kill) == "kill_process:threat:t2"
+
+async def test_unrelated_threats_without_a_target_both_run(manager):
+    first = await manager.execute_action(_action())
+    second = await manager.execute_action(_action())
+    assert len(manager.calls) == 2
+    assert not first.get("deduplicated") and not second.get("deduplicated")
+
+async def test_in_flight_request_is_coalesced(manager):
+    manager.release.clear()
+    action = _action(file_path=f"/tmp/{uuid.uuid4()}")
+    first = asyncio.create_task(manager.execute_action(action))
+    await asyncio.sleep(0.05)
+    second = asyncio.create_task(manager.execute_action(_action(file_path=action.parameters["file_path"])))
+    await asyncio.sleep(0.05)
+    manager.release.set()
+
+    results = await asyncio.gather(first, second)
+    assert len(manager.calls) == 1
+    assert results[1]["deduplicated"] and results[1]["action_id"] == results[0]["action_id"]
+
+async def test_repeat_runs_again_after_the_cooldown(manager):
+    action = _action(file_path=f"/tmp/{uuid.uuid4()}")
+    await manager.execute_action(action)
+    assert (await manager.execute_action(action))["deduplicated"]
+    assert len(manager.calls) == 1
+
+    await asyncio.sleep(0.6)
+    assert not (await manager.execute_action(action)).get("deduplicated")
+    assert len(manager.calls) == 2
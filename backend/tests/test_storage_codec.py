@@ -0,0 +1,123 @@
+import pytest
+from sqlalchemy import text
+
+from models.database import SessionLocal, engine
+from models.schemas import LogEntry
+from services.log_collector import LogCollector
+from services.storage_codec import StorageCodec, UnknownDictionaryError, storage_codec
+
+pytestmark = pytest.mark.anyio
+
+def test_encrypts_by_default_without_caching_plaintext(monkeypatch):
+    monkeypatch.delenv("SENTINEL_ENCRYPTION", raising=False)
+    monkeypatch.delenv("SENTINEL_DECRYPT_CACHE_SIZE", raising=False)
+    codec = StorageCodec(algorithm="off")
+    assert codec.encrypt
+
+    token = codec.encode("user alice logged in")
+    assert isinstance(token, bytes) and b"alice" not in token
+    assert codec.decode(token) == "user alice logged in"
+    assert not hasattr(codec._decode_token, "cache_info")
+
+def test_decrypt_cache_is_opt_in_and_bounded():
+    codec = StorageCodec(algorithm="off", encrypt=True, cache_size=2)
+    tokens = [codec.encode(f"value {i}") for i in range(4)]
+    assert [codec.decode(token) for token in tokens] == [f"value {i}" for i in range(4)]
+    assert codec._decode_token.cache_info().currsize == 2
+
+async def test_batch_encoding_round_trips():
+    codec = StorageCodec(algorithm="zlib", encrypt=True)
+    logs = [LogEntry(source="Codec", level="info", message=f"message {i}", details={"i": i}) for i in range(100)]
+    messages, details = await codec.encode_logs(logs)
+    assert [codec.decode(message) for message in messages] == [log.message for log in logs]
+    assert codec.decode(details[7]) == '{"i": 7}'
+
+async def test_single_store_log_writes_encrypted_rows(db):
+    assert storage_codec.encrypt
+    collector = LogCollector()
+    async with SessionLocal() as session:
+        await collector.store_log(session, LogEntry(
+            id="codec-single", source="Codec-Single", level="info", message="secret message", details={"user": "bob"}
+        ))
+
+    async with engine.connect() as conn:
+        message, details, encrypted = (await conn.execute(
+            text("SELECT message, details, encrypted FROM logs WHERE id = 'codec-single'")
+        )).one()
+    assert encrypted
+    assert bytes(message)[0] == 0x80 and b"secret" not in bytes(message)
+    assert storage_codec.decode(message) == "secret message"
+    assert storage_codec.decode(details) == '{"user": "bob"}'
+
+    async with SessionLocal() as session:
+        [log] = await collector.get_logs(session, source="Codec-Single")
+    assert log.message == "secret message" and log.details == {"user": "bob"}
+
+async def test_batches_are_encoded_off_the_event_loop(monkeypatch):
+    import threading
+    codec = StorageCodec(algorithm="off", encrypt=True)
+    threads = []
+    encode_chunk = codec._encode_chunk
+    def record(values):
+        threads.append(threading.current_thread())
+        return encode_chunk(values)
+    monkeypatch.setattr(codec, "_encode_chunk", record)
+
+    values = [f"value {i}" for i in range(600)]
+    encoded = await codec.encode_batch(values)
+    assert [codec.decode(value) for value in encoded] == values
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+def test_key_lives_next_to_the_database(tmp_path, monkeypatch):
+    import sqlite3
+    from models import database
+    monkeypatch.delenv("SENTINEL_KEY_FILE", raising=False)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    db_path = tmp_path / "data" / "sentinel.db"
+    monkeypatch.setattr(database, "SQLALCHEMY_DATABASE_URL", f"sqlite+aiosqlite:///{db_path}")
+
+    key = database.get_encryption_key()
+    assert (tmp_path / "data" / "db_key.key").read_bytes() == key
+    assert not (tmp_path / "db_key.key").exists()
+    assert database.get_encryption_key() == key
+
+    # Without the key, a database holding encrypted rows refuses to start with a new one
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE logs (id TEXT, encrypted BOOLEAN)")
+        conn.execute("INSERT INTO logs VALUES ('a', 1)")
+    (tmp_path / "data" / "db_key.key").unlink()
+    with pytest.raises(RuntimeError, match="encrypted rows"):
+        database.get_encryption_key()
+
+async def test_results_are_decoded_by_readers_not_result_processing(db, monkeypatch):
+    from sqlalchemy import select
+    from models.models import LogEntryModel
+    collector = LogCollector()
+    async with SessionLocal() as session:
+        await collector.store_log(session, LogEntry(
+            id="codec-lazy", source="Codec-Lazy", level="info", message="lazy message", details={"n": 1}
+        ))
+
+    decoded = []
+    decode = storage_codec.decode
+    monkeypatch.setattr(storage_codec, "decode", lambda value: decoded.append(value) or decode(value))
+    async with SessionLocal() as session:
+        [(message,)] = (await session.execute(select(LogEntryModel.message).where(LogEntryModel.id == "codec-lazy"))).all()
+        assert isinstance(message, bytes) and not decoded
+        [log] = await collector.get_logs(session, source="Codec-Lazy")
+    assert log.message == "lazy message" and log.details == {"n": 1}
+    assert len(decoded) == 2
+
+async def test_dictionaries_saved_elsewhere_are_loaded_on_demand(db):
+    writer = StorageCodec(algorithm="zlib", encrypt=True)
+    reader = StorageCodec(algorithm="zlib", encrypt=True)
+    data = b"connection from port user logged in " * 20
+    await writer.save_dictionary("zlib", data)
+
+    stored = writer.encode("user logged in connection from port 22 " * 4)
+    with pytest.raises(UnknownDictionaryError):
+        reader.decode(stored)
+    [(message,)] = await reader.decode_rows(["message"], [(stored,)])
+    assert message == "user logged in connection from port 22 " * 4
+    assert writer.active_dictionary_id in reader.dictionaries
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+from models.database import engine
+from models.models import LogTemplateModel
+from models.schemas import LogEntry
+from services.event_buffer import FEATURE_NAMES
+from services.template_miner import TemplateMiner
+
+pytestmark = pytest.mark.anyio
+
+def _log(message):
+    return LogEntry(source="Test", level="info", message=message)
+
+async def test_concurrent_batches_store_a_new_template_once(db):
+    miner = TemplateMiner()
+    batches = [[_log(f"Quota probe {i} exceeded on shard{n} zeta") for i in range(5)] for n in range(6)]
+
+    await asyncio.gather(*[miner.assign(batch) for batch in batches])
+
+    ids = {log.template_id for batch in batches for log in batch}
+    assert len(ids) == 1 and None not in ids
+    async with engine.connect() as conn:
+        stored = await conn.scalar(
+            select(func.count()).select_from(LogTemplateModel).where(LogTemplateModel.template.like("Quota probe%"))
+        )
+    assert stored == 1
+
+def test_template_id_is_not_a_detector_feature():
+    assert "template_id" not in FEATURE_NAMES
+    assert "template_rarity" in FEATURE_NAMES
+
+async def test_evicted_templates_stay_rare_and_keep_their_row(db):
+    miner = TemplateMiner(max_templates=2, warmup_events=0)
+    [one_off] = [_log("Kernel panic detected on cpu in zone omega")]
+    await miner.assign([one_off])
+    common = [_log(f"Heartbeat ok from node {i}") for i in range(500)]
+    await miner.assign(common)
+    await miner.assign([_log(f"Cache warmed in {i} ms") for i in range(500)])
+    assert one_off.template_id not in miner.templates
+
+    rarity = miner.rarity([one_off.template_id, common[0].template_id, 0, 999999])
+    assert rarity[0] == pytest.approx(3.0, rel=1e-3)
+    assert rarity[1] < 1 and rarity[2] == 0
+    # An id the miner knows nothing about is as rare as it gets
+    assert rarity[3] == pytest.approx(3.0, rel=1e-3)
+
+    again = _log("Kernel panic detected on cpu in zone omega")
+    await miner.assign([again])
+    assert again.template_id == one_off.template_id
+    assert miner.templates[again.template_id].count == 2
+    async with engine.connect() as conn:
+        stored = await conn.scalar(
+            select(func.count()).select_from(LogTemplateModel).where(LogTemplateModel.template.like("Kernel panic%"))
+        )
+    assert stored == 1
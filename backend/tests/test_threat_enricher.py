@@ -0,0 +1,125 @@
+import asyncio
+import random
+
+import pytest
+from sqlalchemy import select
+
+from scripts.gemini_stub import Stub, generate_threats, start_server
+from models.database import SessionLocal
+from models.models import ThreatModel
+from services.threat_enricher import ThreatEnricher, ENRICHMENT_REQUESTS
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Start a Gemini stub in-process and point SENTINEL_GEMINI_ENDPOINT at it"""
+    server_stub = Stub(latency=0.0, error_rate=0.0)
+    server = start_server(server_stub, 0)
+    monkeypatch.setenv("SENTINEL_GEMINI_ENDPOINT", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server_stub
+    server.shutdown()
+    server.server_close()
+
+async def _threats(count, seed, source):
+    """Stored threats of a single pattern: same message template, different users and addresses"""
+    threats = generate_threats(count, 1, random.Random(seed))
+    for threat in threats:
+        # The cache table is shared by the tests, so each one uses its own pattern
+        threat.source = source
+    async with SessionLocal() as db:
+        db.add_all([ThreatModel(**threat.model_dump()) for threat in threats])
+        await db.commit()
+    return threats
+
+async def _enrich(enricher, threats):
+    """Submit threats and wait until the worker has handled them"""
+    done = enricher.stats["enriched"] + enricher.stats["unenriched"] + len(threats)
+    enricher.submit(threats, "stub-key")
+    for _ in range(200):
+        if enricher.stats["enriched"] + enricher.stats["unenriched"] >= done:
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("threats were not handled in time")
+
+async def _enrichments(threats):
+    async with SessionLocal() as db:
+        details = (await db.execute(
+            select(ThreatModel.details).where(ThreatModel.id.in_([t.id for t in threats]))
+        )).scalars().all()
+    return [(d or {}).get("enrichment") for d in details]
+
+def _requests_counted():
+    return sum(ENRICHMENT_REQUESTS._values.values())
+
+async def test_one_request_per_pattern(db, stub):
+    enricher = ThreatEnricher(batch_window=0.05)
+    threats = await _threats(25, seed=1, source="Per-pattern")
+    try:
+        await _enrich(enricher, threats)
+    finally:
+        await enricher.stop()
+
+    assert stub.stats["requests"] == 1
+    enrichments = await _enrichments(threats)
+    assert all(e is not None and e["group_size"] == 25 and not e["cached"] for e in enrichments)
+
+async def test_repeat_is_served_from_cache_table(db, stub):
+    first = ThreatEnricher(batch_window=0.05)
+    try:
+        await _enrich(first, await _threats(5, seed=2, source="Cache-table"))
+    finally:
+        await first.stop()
+    assert stub.stats["requests"] == 1
+
+    # A new enricher has nothing in memory: the answer comes from enrichment_cache
+    second = ThreatEnricher(batch_window=0.05)
+    threats = await _threats(5, seed=3, source="Cache-table")
+    try:
+        await _enrich(second, threats)
+    finally:
+        await second.stop()
+
+    assert stub.stats["requests"] == 1
+    assert second.stats["requests"] == 0 and second.stats["cache_hits"] == 1
+    assert all(e is not None and e["cached"] for e in await _enrichments(threats))
+
+async def test_expired_answer_is_requested_again(db, stub):
+    enricher = ThreatEnricher(batch_window=0.05, ttl_hours=0.2 / 3600)
+    try:
+        await _enrich(enricher, await _threats(3, seed=4, source="Expired"))
+        await asyncio.sleep(0.3)
+        threats = await _threats(3, seed=5, source="Expired")
+        await _enrich(enricher, threats)
+    finally:
+        await enricher.stop()
+
+    assert stub.stats["requests"] == 2
+    assert all(e is not None and not e["cached"] for e in await _enrichments(threats))
+
+async def test_timeout_leaves_threats_unenriched(db, stub):
+    stub.latency = 1.0
+    enricher = ThreatEnricher(batch_window=0.05, timeout=0.2)
+    threats = await _threats(4, seed=6, source="Timeout")
+    counted = _requests_counted()
+    try:
+        await _enrich(enricher, threats)
+    finally:
+        await enricher.stop()
+
+    assert enricher.stats["unenriched"] == 4 and enricher.stats["errors"] == 1
+    assert all(e is None for e in await _enrichments(threats))
+    assert _requests_counted() - counted == 1
+    assert ENRICHMENT_REQUESTS._values.get(("error",))
+
+async def test_failed_request_is_counted_once(db, stub):
+    stub.error_rate = 1.0
+    enricher = ThreatEnricher(batch_window=0.05)
+    counted = _requests_counted()
+    try:
+        await _enrich(enricher, await _threats(2, seed=7, source="Failed"))
+    finally:
+        await enricher.stop()
+
+    assert stub.stats["errors"] == 1
+    assert _requests_counted() - counted == 1
@@ -0,0 +1,88 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, insert, select, update
+
+from models.database import SessionLocal, engine
+from models.models import ThreatModel, ThreatLogModel, ThreatIndicatorModel
+from models.schemas import LogEntry
+from services import threat_links as module
+from services.log_collector import LogCollector
+from services.threat_links import ThreatLinks, parse_indicator
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def legacy(db):
+    """Threats stored before the link tables existed (links_migrated NULL), with two logs"""
+    prefix = uuid.uuid4().hex[:8]
+    logs = [LogEntry(id=f"{prefix}-log-{i}", source="Links", level="warning", message=f"event {i}") for i in range(2)]
+    async with SessionLocal() as session:
+        await LogCollector().store_logs(session, logs)
+
+    address = f"2001:db8::{prefix[:4]}"
+    threats = [
+        {"id": f"{prefix}-threat-{i}", "title": "Legacy", "description": "legacy", "timestamp": datetime.now(),
+         "severity": "high", "status": "active", "source": "Links", "type": "anomaly",
+         "related_logs": [logs[0].id, logs[i % 2].id, logs[0].id], "indicators": [f"IP address: {address}", "User: bob"]}
+        for i in range(5)
+    ]
+    async with engine.begin() as conn:
+        await conn.execute(insert(ThreatModel.__table__), threats)
+    return {"logs": [log.id for log in logs], "threats": [t["id"] for t in threats], "address": address}
+
+async def _link_counts(threat_ids):
+    async with engine.connect() as conn:
+        logs = await conn.scalar(select(func.count()).select_from(ThreatLogModel).where(ThreatLogModel.threat_id.in_(threat_ids)))
+        indicators = await conn.scalar(
+            select(func.count()).select_from(ThreatIndicatorModel).where(ThreatIndicatorModel.threat_id.in_(threat_ids))
+        )
+    return logs, indicators
+
+def test_indicator_values_keep_their_colons():
+    assert parse_indicator("IP address: 2001:db8::1") == ("IP address", "2001:db8::1")
+    assert parse_indicator("no kind") == ("", "no kind")
+
+async def test_migration_copies_links_in_batches(legacy):
+    links = ThreatLinks(batch_size=2, pause=0)
+    log_id = legacy["logs"][1]
+
+    # Before the migration pivots miss the old threats, but their detail falls back to the JSON array
+    assert await links.threats_for_log(log_id) == []
+    detail = await links.threat_detail(legacy["threats"][1])
+    assert [log["id"] for log in detail["logs"]] == legacy["logs"]
+
+    await links.migrate()
+    assert links.complete and links.migrated >= 5
+    assert await links.remaining() == 0
+    # Duplicate ids in related_logs become one link each
+    assert await _link_counts(legacy["threats"]) == (1 + 2 + 1 + 2 + 1, 10)
+
+    assert sorted(t["id"] for t in await links.threats_for_log(log_id)) == legacy["threats"][1::2]
+    assert len(await links.threats_for_indicator("IP address", legacy["address"])) == 5
+    detail = await links.threat_detail(legacy["threats"][1])
+    assert [log["id"] for log in detail["logs"]] == legacy["logs"]
+
+async def test_retried_batch_does_not_duplicate_links(legacy):
+    links = ThreatLinks(batch_size=500, pause=0)
+    await links.migrate()
+    counts = await _link_counts(legacy["threats"])
+
+    # As if the batch had committed its links but the worker died before the flag was visible
+    async with engine.begin() as conn:
+        await conn.execute(update(ThreatModel.__table__).where(ThreatModel.id.in_(legacy["threats"])).values(links_migrated=None))
+    assert await links.migrate_batch() >= 5
+    assert await _link_counts(legacy["threats"]) == counts
+
+async def test_only_the_leader_migrates(legacy, monkeypatch):
+    monkeypatch.setattr(module.cluster_coordinator, "holds", lambda role: False)
+    links = ThreatLinks(pause=0)
+    task = asyncio.create_task(links.migrate())
+    await asyncio.sleep(0.2)
+    assert not links.complete and links.migrated == 0
+    assert await links.remaining() >= 5
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
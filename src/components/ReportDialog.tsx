@@ -7,7 +7,7 @@ import { RadioGroup, RadioGroupItem } from "@/components/ui/radio-group";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Checkbox } from "@/components/ui/checkbox";
 import { useToast } from "@/hooks/use-toast";
-import { FileText, FileSpreadsheet, Download } from "lucide-react";
+import { FileText, FileSpreadsheet, FileCode, FileJson, Download } from "lucide-react";
 import reportGenerator, { ReportOptions, defaultReportOptions } from "@/services/reportGenerator";
 import { fetchLogs, fetchThreats } from "@/services/api";
 
@@ -32,11 +32,12 @@ const ReportDialog = ({ open, onOpenChange, threats = [], logs = [] }: ReportDia
         description: "Please wait while we generate your report."
       });
       
-      // If there are no threats or logs passed, fetch them
+      // PDF is rendered in the browser; the other formats are built by the backend
       let reportThreats = threats;
       let reportLogs = logs;
       
-      if (!reportThreats.length || !reportLogs.length) {
+      // If there are no threats or logs passed, fetch them for the PDF
+      if (options.type === "pdf" && (!reportThreats.length || !reportLogs.length)) {
         try {
           toast({
             title: "Fetching data...",
@@ -100,7 +101,7 @@ const ReportDialog = ({ open, onOpenChange, threats = [], logs = [] }: ReportDia
                 <Label>Report Format</Label>
                 <RadioGroup 
                   defaultValue={options.type}
-                  onValueChange={(value) => setOptions({...options, type: value as "pdf" | "csv"})}
+                  onValueChange={(value) => setOptions({...options, type: value as ReportOptions["type"]})}
                   className="flex flex-col space-y-2"
                 >
                   <div className="flex items-center space-x-2 rounded-md border border-gray-700 p-3 hover:bg-gray-800">
@@ -118,6 +119,22 @@ const ReportDialog = ({ open, onOpenChange, threats = [], logs = [] }: ReportDia
                       CSV Spreadsheet
                     </Label>
                   </div>
+                  
+                  <div className="flex items-center space-x-2 rounded-md border border-gray-700 p-3 hover:bg-gray-800">
+                    <RadioGroupItem value="html" id="html" />
+                    <Label htmlFor="html" className="flex items-center cursor-pointer">
+                      <FileCode className="mr-2 h-5 w-5 text-blue-500" />
+                      HTML Document
+                    </Label>
+                  </div>
+                  
+                  <div className="flex items-center space-x-2 rounded-md border border-gray-700 p-3 hover:bg-gray-800">
+                    <RadioGroupItem value="json" id="json" />
+                    <Label htmlFor="json" className="flex items-center cursor-pointer">
+                      <FileJson className="mr-2 h-5 w-5 text-yellow-500" />
+                      JSON Data
+                    </Label>
+                  </div>
                 </RadioGroup>
               </div>
             </TabsContent>
@@ -3,9 +3,11 @@ import 'jspdf-autotable';
 import { saveAs } from "file-saver";
 import AzureLogSimulator from "./azureLogSimulator";
 
+const API_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
+
 // Define and export the ReportOptions interface
 export interface ReportOptions {
-  type: "pdf" | "csv";
+  type: "pdf" | "csv" | "html" | "json";
   content: "all" | "threats" | "logs";
   timeRange: "24h" | "7d" | "30d" | "all";
   includeResolvedThreats: boolean;
@@ -125,54 +127,32 @@ class ReportGenerator {
     doc.save(fileName);
   }
 
-  // Generate CSV report
-  async generateCSVReport(threats: any[], logs: any[], options: ReportOptions) {
-    let csvContent = "";
-    const now = new Date();
-
-    // Generate threats CSV
-    if (options.content === "threats" || options.content === "all") {
-      // Filter threats
-      const filteredThreats = this.filterThreats(threats, options);
-      if (filteredThreats.length > 0) {
-        csvContent += "DETECTED THREATS\n";
-        csvContent += "Timestamp,Title,Type,Severity,Status,Source\n";
-        filteredThreats.forEach(threat => {
-          csvContent += `"${this.formatTimestamp(threat.timestamp)}","${threat.title}","${threat.type || "Unknown"}","${threat.severity}","${threat.status}","${threat.source || "Unknown"}"\n`;
-        });
-        csvContent += "\n";
-      }
-    }
+  // Download a CSV, HTML or JSON report built and streamed by the backend (GET /reports)
+  async downloadServerReport(options: ReportOptions) {
+    const params = new URLSearchParams({
+      format: options.type,
+      content: options.content,
+      time_range: options.timeRange,
+      include_resolved: String(options.includeResolvedThreats)
+    });
 
-    // Generate logs CSV
-    if (options.content === "logs" || options.content === "all") {
-      // Filter logs
-      const filteredLogs = this.filterLogs(logs, options);
-      if (filteredLogs.length > 0) {
-        csvContent += "AZURE LOGS\n";
-        csvContent += "Timestamp,Level,Source,Message\n";
-        filteredLogs.forEach(log => {
-          // Escape quotes in message for CSV
-          const message = log.message?.replace(/"/g, '""') || "";
-          const source = log.source?.replace(/"/g, '""') || "Unknown";
-          csvContent += `"${this.formatTimestamp(log.timestamp)}","${log.level}","${source}","${message}"\n`;
-        });
-      }
+    const response = await fetch(`${API_URL}/reports?${params}`);
+    if (!response.ok) {
+      throw new Error(`Report request failed with status ${response.status}`);
     }
 
-    // Create and save the CSV file
-    const blob = new Blob([csvContent], { type: "text/csv;charset=utf-8" });
-    const fileName = `security_report_${now.getTime()}.csv`;
+    const blob = await response.blob();
+    const fileName = `security_report_${new Date().getTime()}.${options.type}`;
     saveAs(blob, fileName);
   }
 
-  // Generate a report based on options
+  // Generate a report based on options; only PDF is rendered in the browser
   async generateReport(threats: any[], logs: any[], options: ReportOptions = defaultReportOptions) {
     try {
       if (options.type === "pdf") {
         await this.generatePDFReport(threats, logs, options);
-      } else if (options.type === "csv") {
-        await this.generateCSVReport(threats, logs, options);
+      } else {
+        await this.downloadServerReport(options);
       }
     } catch (error) {
       console.error("Error generating report:", error);